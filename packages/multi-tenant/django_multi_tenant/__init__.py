@@ -8,6 +8,7 @@ __version__ = "0.1.0"
 
 from django_multi_tenant.middleware.tenant_context import get_current_tenant, set_current_tenant
 from django_multi_tenant.middleware.tenant_middleware import TenantMiddleware
+from django_multi_tenant.middleware.tracing import get_current_trace, outgoing_headers
 from django_multi_tenant.db.router import TenantDatabaseRouter
 from django_multi_tenant.config.loader import TenantConfigLoader
 
@@ -17,4 +18,6 @@ __all__ = [
     "TenantConfigLoader",
     "get_current_tenant",
     "set_current_tenant",
+    "get_current_trace",
+    "outgoing_headers",
 ]
@@ -1,3 +1,4 @@
 from django_multi_tenant.config.loader import TenantConfigLoader
+from django_multi_tenant.config.registry import TenantGeneration, TenantRegistry
 
-__all__ = ["TenantConfigLoader"]
+__all__ = ["TenantConfigLoader", "TenantGeneration", "TenantRegistry"]
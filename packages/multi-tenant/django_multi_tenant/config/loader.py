@@ -131,7 +131,7 @@ class TenantConfigLoader:
 
         db_config = tenant.get("database", {})
 
-        return {
+        config = {
             "ENGINE": db_config.get("engine", "django.db.backends.postgresql"),
             "NAME": db_config.get("name", f"tplanet_{tenant_id.replace('-', '_')}"),
             "USER": db_config.get("user", os.environ.get("DB_USER", "postgres")),
@@ -139,6 +139,12 @@ class TenantConfigLoader:
             "HOST": db_config.get("host", os.environ.get("DB_HOST", "localhost")),
             "PORT": db_config.get("port", os.environ.get("DB_PORT", "5432")),
         }
+        # Per-tenant pool limits, used when MULTI_TENANT["POOL"] is set
+        pool = db_config.get("pool") or {}
+        limits = {key.upper(): pool[key] for key in ("min", "max") if key in pool}
+        if limits:
+            config["POOL"] = limits
+        return config
 
     def generate_databases_config(self) -> dict[str, dict[str, Any]]:
         """
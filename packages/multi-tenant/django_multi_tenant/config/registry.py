@@ -0,0 +1,332 @@
+"""
+Hot-reloadable tenant configuration.
+
+``TenantRegistry.current`` is a ``TenantGeneration``: an immutable snapshot
+of tenants.yml with its domain resolver, shared TenantInfos, database
+configs and host cache. A reload parses and validates the file on a
+background thread, hands the database configs to ``tenant_connections``
+(which registers aliases on first use), then swaps the generation with one
+assignment. Requests read ``current`` once, so an
+in-flight request keeps the generation it started with; an invalid file is
+logged and the previous generation stays live.
+
+Reloads are triggered by:
+1. Polling the file every ``RELOAD_INTERVAL`` seconds (mtime, size, inode).
+   All workers watch the same file, so they converge within one interval.
+2. ``RELOAD_SIGNAL`` (e.g. "SIGHUP") sent to a worker process.
+3. ``manage.py reload_tenants``, which validates a file before publishing it.
+
+    MULTI_TENANT = {
+        "CONFIG_PATH": "/path/to/tenants.yml",
+        "RELOAD_INTERVAL": 5,       # seconds, 0 = no polling
+        "RELOAD_SIGNAL": "SIGHUP",  # optional
+    }
+
+With ``MULTI_TENANT["POOL"]`` set, every generation's tenant aliases use
+the pooled backend (see ``django_multi_tenant.db.pool``).
+"""
+
+import logging
+import os
+import signal
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from django_multi_tenant.config.loader import TenantConfigLoader
+from django_multi_tenant.db.manager import tenant_connections
+from django_multi_tenant.db.pool import pooled_databases, tenant_pools
+from django_multi_tenant.middleware.domain_resolver import DomainResolver
+from django_multi_tenant.middleware.tenant_context import TenantInfo
+
+logger = logging.getLogger(__name__)
+
+
+class HostCache:
+    """
+    Thread-safe LRU of raw host header -> resolved TenantInfo (or None).
+
+    Bounded so that requests with arbitrary Host headers can't grow it
+    without limit; ``maxsize`` 0 disables caching.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[tuple, TenantInfo | None] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, default: object = None) -> object:
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: tuple, value: TenantInfo | None) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def snapshot(self) -> dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+@dataclass(frozen=True)
+class TenantGeneration:
+    """One loaded version of tenants.yml; never modified once built."""
+
+    number: int
+    loader: TenantConfigLoader
+    resolver: DomainResolver
+    tenant_infos: dict[str, TenantInfo]
+    databases: dict[str, dict[str, Any]]
+    host_cache: HostCache
+    loaded_at: float
+
+    @property
+    def tenants(self) -> dict[str, dict[str, Any]]:
+        return self.loader.tenants
+
+    @classmethod
+    def build(
+        cls,
+        loader: TenantConfigLoader,
+        number: int = 1,
+        default_tenant_id: str | None = "default",
+        host_cache_size: int = 1024,
+        pool_settings: dict[str, Any] | None = None,
+    ) -> "TenantGeneration":
+        """
+        Validate a loaded configuration and build its lookup tables.
+
+        Args:
+            pool_settings: ``MULTI_TENANT["POOL"]``; None leaves databases unpooled.
+
+        Raises:
+            DomainConflictError: If two tenants claim the same domain.
+            ImproperlyConfigured: If a domain pattern is invalid.
+        """
+        tenants = loader.tenants
+        if not isinstance(tenants, dict):
+            raise ValueError("'tenants' must be a mapping of tenant ID to config")
+        databases = loader.generate_databases_config()
+        if pool_settings is not None:
+            databases = pooled_databases(databases, pool_settings)
+        return cls(
+            number=number,
+            loader=loader,
+            resolver=DomainResolver.from_tenants(tenants, default=default_tenant_id),
+            tenant_infos={
+                tenant_id: TenantInfo.from_config(tenant_id, config)
+                for tenant_id, config in tenants.items()
+            },
+            databases=databases,
+            host_cache=HostCache(host_cache_size),
+            loaded_at=time.time(),
+        )
+
+
+def load_generation(
+    path: str | Path | None,
+    number: int = 1,
+    default_tenant_id: str | None = "default",
+    host_cache_size: int = 1024,
+    pool_settings: dict[str, Any] | None = None,
+) -> TenantGeneration:
+    """
+    Load and validate a tenants.yml file (no file: no tenants).
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist.
+        yaml.YAMLError: If the YAML is invalid.
+        ImproperlyConfigured: If the tenants are inconsistent.
+    """
+    loader = TenantConfigLoader()
+    if path:
+        loader.load_from_file(path)
+    return TenantGeneration.build(loader, number, default_tenant_id, host_cache_size, pool_settings)
+
+
+class TenantRegistry:
+    """
+    Holds the live TenantGeneration and reloads it when tenants.yml changes.
+
+    Usage:
+        registry = TenantRegistry.from_settings(settings.MULTI_TENANT)
+        registry.start()
+        generation = registry.current  # read once per request
+    """
+
+    def __init__(
+        self,
+        path: str | Path | None = None,
+        default_tenant_id: str | None = "default",
+        host_cache_size: int = 1024,
+        reload_interval: float = 0.0,
+        reload_signal: str | None = None,
+        pool_settings: dict[str, Any] | None = None,
+    ):
+        self.path = path
+        self.default_tenant_id = default_tenant_id
+        self.host_cache_size = host_cache_size
+        self.reload_interval = reload_interval
+        self.reload_signal = reload_signal
+        self.pool_settings = pool_settings
+        self.reloads = 0
+        self.failures = 0
+        self.last_error: str | None = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+        self._previous_handler: Any = None
+
+        # Errors at startup are fatal; later ones keep the live generation
+        self._stamp = self._stat()
+        if pool_settings is not None:
+            tenant_pools.configure(pool_settings)
+        self.current = load_generation(path, 1, default_tenant_id, host_cache_size, pool_settings)
+        tenant_connections.configure(self.current.databases)
+
+    @classmethod
+    def from_settings(cls, multi_tenant_settings: dict[str, Any]) -> "TenantRegistry":
+        """Create a registry from ``settings.MULTI_TENANT``."""
+        return cls(
+            path=multi_tenant_settings.get("CONFIG_PATH"),
+            default_tenant_id=multi_tenant_settings.get("DEFAULT_TENANT", "default"),
+            host_cache_size=multi_tenant_settings.get("HOST_CACHE_SIZE", 1024),
+            reload_interval=float(multi_tenant_settings.get("RELOAD_INTERVAL", 0)),
+            reload_signal=multi_tenant_settings.get("RELOAD_SIGNAL"),
+            pool_settings=multi_tenant_settings.get("POOL"),
+        )
+
+    def _stat(self) -> tuple | None:
+        if not self.path:
+            return None
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino, st.st_dev)
+
+    def changed(self) -> bool:
+        """Whether the file changed since it was last loaded."""
+        return self._stat() != self._stamp
+
+    def reload(self) -> bool:
+        """
+        Load the file again and swap it in if it differs.
+
+        Returns:
+            True if a new generation is live.
+        """
+        with self._lock:
+            self._stamp = self._stat()
+            current = self.current
+            try:
+                loader = TenantConfigLoader()
+                if self.path:
+                    loader.load_from_file(self.path)
+                if not loader.tenants and current.tenants:
+                    # Most likely a file caught mid-write
+                    raise ValueError("no tenants configured")
+                if loader.tenants == current.tenants:
+                    return False
+                generation = TenantGeneration.build(
+                    loader, current.number + 1, self.default_tenant_id, self.host_cache_size,
+                    self.pool_settings,
+                )
+                # Databases first, so no TenantInfo points at an unknown alias
+                tenant_connections.configure(generation.databases)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.exception(f"Reloading {self.path} failed; keeping generation {current.number}")
+                return False
+
+            self.current = generation
+            self.reloads += 1
+            self.last_error = None
+            logger.info(
+                f"Loaded tenant generation {generation.number} "
+                f"({len(generation.tenant_infos)} tenants) from {self.path}"
+            )
+            return True
+
+    # ============ Background reloading ============
+
+    def start(self) -> None:
+        """Start polling and/or listening for the reload signal, if configured."""
+        if self._thread is not None or not self.path:
+            return
+        if not self.reload_interval and not self.reload_signal:
+            return
+        if self.reload_signal:
+            self._install_signal()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="tenant-reload", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and restore the previous signal handler."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        if self._previous_handler is not None:
+            signal.signal(getattr(signal, self.reload_signal), self._previous_handler)
+            self._previous_handler = None
+
+    def _install_signal(self) -> None:
+        signum = getattr(signal, self.reload_signal)
+        if threading.current_thread() is not threading.main_thread():
+            logger.warning(f"Not handling {self.reload_signal}: registry started outside the main thread")
+            return
+        previous = signal.getsignal(signum)
+
+        def handler(sig, frame):
+            self._wake.set()
+            if callable(previous):
+                previous(sig, frame)
+
+        self._previous_handler = previous if previous is not None else signal.SIG_DFL
+        signal.signal(signum, handler)
+
+    def _run(self) -> None:
+        while not self._stopping:
+            woken = self._wake.wait(self.reload_interval or None)
+            self._wake.clear()
+            if self._stopping:
+                break
+            if woken or self.changed():
+                self.reload()
+
+    def snapshot(self) -> dict[str, Any]:
+        """Reload state, e.g. for a health endpoint."""
+        current = self.current
+        return {
+            "generation": current.number,
+            "tenants": len(current.tenant_infos),
+            "loaded_at": current.loaded_at,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
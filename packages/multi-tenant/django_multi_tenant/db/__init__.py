@@ -1,3 +1,12 @@
+from django_multi_tenant.db.manager import TenantConnectionManager, tenant_connections
+from django_multi_tenant.db.pool import PoolManager, PoolTimeout, tenant_pools
 from django_multi_tenant.db.router import TenantDatabaseRouter
 
-__all__ = ["TenantDatabaseRouter"]
+__all__ = [
+    "PoolManager",
+    "PoolTimeout",
+    "TenantConnectionManager",
+    "TenantDatabaseRouter",
+    "tenant_connections",
+    "tenant_pools",
+]
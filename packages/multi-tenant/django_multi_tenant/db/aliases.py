@@ -0,0 +1,49 @@
+"""
+Runtime registration of tenant database aliases.
+
+``settings.DATABASES`` is normally fixed at startup. Tenant aliases are
+published at runtime by swapping in a new DATABASES dict (copy-on-write),
+so threads iterating the old one (e.g. ``close_old_connections``) are never
+disturbed. A thread's open connection whose settings were replaced is
+closed by ``close_stale_connections()`` the next time that thread starts a
+request, never mid-request.
+"""
+
+import logging
+from typing import Any
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+
+def register_databases(databases: dict[str, dict[str, Any]]) -> None:
+    """
+    Add or replace database aliases in ``settings.DATABASES``.
+
+    Args:
+        databases: alias -> config, e.g. from ``generate_databases_config()``.
+    """
+    if not databases:
+        return
+    current = connections.settings
+    # Fill in Django's per-connection defaults (ATOMIC_REQUESTS, TEST, ...)
+    configured = connections.configure_settings(
+        {DEFAULT_DB_ALIAS: current[DEFAULT_DB_ALIAS], **{a: dict(c) for a, c in databases.items()}}
+    )
+    updated = dict(current)
+    for alias in databases:
+        updated[alias] = configured[alias]
+    connections._settings = connections.settings = updated
+    settings.DATABASES = updated
+    logger.info(f"Registered databases: {', '.join(sorted(databases))}")
+
+
+def close_stale_connections() -> None:
+    """Close this thread's connections whose alias settings were replaced."""
+    current = connections.settings
+    for conn in connections.all(initialized_only=True):
+        if current.get(conn.alias) is not conn.settings_dict:
+            conn.close()
+            del connections[conn.alias]
@@ -0,0 +1,31 @@
+"""
+Database engine for pooled tenant aliases.
+
+Wraps the backend named in ``POOL["ENGINE"]`` so that it connects and
+closes through ``tenant_pools``; ``pooled_databases()`` writes these
+configs:
+
+    "nantou-gov": {
+        "ENGINE": "django_multi_tenant.db.backends.pooled",
+        "POOL": {"ENGINE": "django.db.backends.postgresql", "MIN": 0, "MAX": 10},
+        "NAME": "tplanet_nantou", ...
+    }
+"""
+
+from functools import cache
+from typing import Any
+
+from django.db.utils import load_backend
+
+from django_multi_tenant.db.pool import PooledDatabaseWrapperMixin
+
+
+@cache
+def _wrapper_class(engine: str) -> type:
+    base = load_backend(engine).DatabaseWrapper
+    return type(f"Pooled{base.__name__}", (PooledDatabaseWrapperMixin, base), {})
+
+
+def DatabaseWrapper(settings_dict: dict[str, Any], alias: str) -> Any:  # noqa: N802
+    """Called by Django's connection handler like a backend's wrapper class."""
+    return _wrapper_class(settings_dict["POOL"]["ENGINE"])(settings_dict, alias)
@@ -0,0 +1,303 @@
+"""
+Lazy registration and a per-process cap for tenant database connections.
+
+Tenant aliases from tenants.yml are not put in ``settings.DATABASES`` up
+front: ``register()`` adds one the first time a request (or the router)
+needs it. Each request checks its tenant's connection out, and it is
+handed back when the request finishes, which keeps an LRU of tenant
+connections. When opening one more would exceed ``MAX_TENANT_CONNECTIONS``,
+the least recently used idle ones are closed first, including those held
+by other threads between requests.
+
+    MULTI_TENANT = {
+        "MAX_TENANT_CONNECTIONS": 20,  # per worker process, 0 = no cap
+    }
+
+Only connections their thread has checked back in are closed, so one in
+use (including by a streaming response, or outside any request) is never
+touched: if none can be closed the cap is exceeded and counted as an
+overflow. The ``default`` alias is not managed.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from django.core.signals import request_finished
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.utils.connection import ConnectionDoesNotExist
+
+from django_multi_tenant.db.aliases import register_databases
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(eq=False)
+class _Slot:
+    """One thread's connection to a tenant alias."""
+
+    alias: str
+    wrapper: Any = None  # set once Django opens the connection
+    in_use: bool = False
+    # Handed back by its owner; only such slots may be closed by others
+    checked_in: bool = False
+    was_open: bool = False
+    evicted: bool = False
+    # Set once another thread has finished closing an evicted connection
+    closed: threading.Event | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return not self.evicted and self.wrapper is not None and self.wrapper.connection is not None
+
+
+class TenantConnectionManager:
+    """
+    Registers tenant aliases on demand and caps open tenant connections.
+
+    Usage:
+        tenant_connections.configure(loader.generate_databases_config())
+        tenant_connections.checkout("nantou-gov")  # request start
+        ...
+        tenant_connections.checkin("nantou-gov")   # request end
+    """
+
+    def __init__(self, max_connections: int = 0):
+        self.max_connections = max_connections
+        self._configs: dict[str, dict[str, Any]] = {}
+        # LRU of slots, least recently used first
+        self._slots: OrderedDict[int, _Slot] = OrderedDict()
+        # alias -> _Slot, per thread (TenantMiddleware runs a request in one thread)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.registrations = 0
+        self.connects = 0
+        self.reuses = 0
+        self.evictions = 0
+        self.overflows = 0
+        connection_created.connect(self._connected)
+        # After django.db's close_old_connections, which is connected on import
+        request_finished.connect(self._request_finished)
+
+    def configure(self, databases: dict[str, dict[str, Any]]) -> list[str]:
+        """
+        Set the known tenant database configs (on load and on every reload).
+
+        Aliases already registered whose config changed are replaced right
+        away; new ones wait for their first use.
+
+        Args:
+            databases: alias -> config from ``generate_databases_config()``.
+
+        Returns:
+            Registered aliases that were replaced.
+        """
+        with self._lock:
+            previous = self._configs
+            self._configs = dict(databases)
+            default = databases.get(DEFAULT_DB_ALIAS)
+            if default is not None and previous.get(DEFAULT_DB_ALIAS, default) != default:
+                logger.warning("Database 'default' changed in tenants.yml; restart to apply it")
+            changed = {
+                alias: config
+                for alias, config in databases.items()
+                if alias != DEFAULT_DB_ALIAS
+                and alias in previous
+                and config != previous[alias]
+                and alias in connections.settings
+            }
+            register_databases(changed)
+        return sorted(changed)
+
+    def register(self, alias: str) -> None:
+        """
+        Make sure ``alias`` is in ``settings.DATABASES``.
+
+        Raises:
+            ConnectionDoesNotExist: If no tenant database has this alias.
+        """
+        if alias in connections.settings:
+            return
+        with self._lock:
+            if alias in connections.settings:
+                return
+            config = self._configs.get(alias)
+            if config is None:
+                raise ConnectionDoesNotExist(f"No tenant database is configured as '{alias}'")
+            register_databases({alias: config})
+            self.registrations += 1
+
+    # ============ Checkout / checkin ============
+
+    def _local_slots(self) -> dict[str, _Slot]:
+        slots = getattr(self._local, "slots", None)
+        if slots is None:
+            slots = self._local.slots = {}
+        return slots
+
+    def checkout(self, alias: str) -> None:
+        """
+        Mark this thread's connection to ``alias`` busy, making room under the cap.
+
+        The connection itself is still opened lazily by the first query. It
+        is handed back by ``checkin()``, or when the request finishes.
+        """
+        if alias == DEFAULT_DB_ALIAS:
+            return
+        self.register(alias)
+        local_slots = self._local_slots()
+        victims: list[_Slot] = []
+        with self._lock:
+            slot = local_slots.get(alias)
+            if slot is None:
+                slot = local_slots[alias] = _Slot(alias)
+            evicted = slot.evicted
+            slot.was_open = slot.is_open
+            if slot.was_open:
+                self.reuses += 1
+            elif self.max_connections > 0:
+                self._slots.pop(id(slot), None)
+                victims = self._make_room()
+            slot.in_use = True
+            slot.checked_in = False
+            self._slots[id(slot)] = slot
+            self._slots.move_to_end(id(slot))
+        self._close_evicted(victims)
+        if evicted:
+            self._settle(slot)
+
+    def settle(self) -> None:
+        """Reset this thread's connections that other threads closed (between requests)."""
+        for slot in list(self._local_slots().values()):
+            if slot.evicted:
+                self._settle(slot)
+
+    def _settle(self, slot: _Slot) -> None:
+        # Another thread closes the DB connection; then drop it from the wrapper too
+        slot.closed.wait()
+        slot.wrapper.close()
+        slot.evicted = False
+        slot.closed = None
+
+    def checkin(self, alias: str) -> None:
+        """Hand back this thread's connection to ``alias`` (most recently used)."""
+        slot = self._local_slots().get(alias)
+        if slot is None:
+            return
+        with self._lock:
+            slot.in_use = False
+            slot.checked_in = True
+            if id(slot) in self._slots:
+                self._slots.move_to_end(id(slot))
+
+    def _request_finished(self, sender: Any, **kwargs: Any) -> None:
+        """
+        ``request_finished`` receiver: hand back this thread's checked-out slots.
+
+        Sent once the response (streaming ones included) has been sent and
+        after Django's own ``close_old_connections``, so nothing uses the
+        connections past this point.
+        """
+        for slot in list(self._local_slots().values()):
+            if slot.in_use:
+                self.checkin(slot.alias)
+
+    def _connected(self, sender: Any, connection: Any, **kwargs: Any) -> None:
+        """``connection_created`` receiver: count and track tenant connections."""
+        alias = connection.alias
+        if alias == DEFAULT_DB_ALIAS or alias not in self._configs:
+            return
+        local_slots = self._local_slots()
+        with self._lock:
+            slot = local_slots.get(alias)
+            if slot is None:
+                # Opened outside a request (e.g. a management command)
+                slot = local_slots[alias] = _Slot(alias)
+            slot.wrapper = connection
+            slot.evicted = False
+            self._slots[id(slot)] = slot
+            self.connects += 1
+
+    def _make_room(self) -> list[_Slot]:
+        """
+        Pick checked-in connections to close, least recently used first (lock held).
+
+        Returns:
+            Slots whose connections the caller must close via ``_close_evicted()``.
+        """
+        held = 0
+        idle = []
+        for key, slot in list(self._slots.items()):
+            if getattr(slot.wrapper, "pooled", False):
+                # Pooled connections count against the pool's own ceiling
+                continue
+            if slot.in_use:
+                held += 1
+            elif slot.is_open:
+                held += 1
+                if slot.checked_in:
+                    # Opened outside a request otherwise: its thread may still use it
+                    idle.append(slot)
+            else:
+                # Closed by its own thread (CONN_MAX_AGE) or evicted
+                del self._slots[key]
+
+        # Room for one more connection
+        excess = held + 1 - self.max_connections
+        victims = idle[:max(excess, 0)]
+        for slot in victims:
+            slot.evicted = True
+            slot.closed = threading.Event()
+            del self._slots[id(slot)]
+            self.evictions += 1
+        if excess > len(idle):
+            self.overflows += 1
+            logger.warning(
+                f"{held} tenant connections busy; exceeding MAX_TENANT_CONNECTIONS "
+                f"({self.max_connections})"
+            )
+        return victims
+
+    def _close_evicted(self, victims: list[_Slot]) -> None:
+        """Close evicted connections outside the lock; their owners wait for it."""
+        for slot in victims:
+            try:
+                slot.wrapper.connection.close()
+            except Exception as e:
+                logger.debug(f"Closing idle connection to {slot.alias}: {e}")
+            finally:
+                slot.closed.set()
+
+    def open_connections(self) -> int:
+        """Tenant connections currently open in this process."""
+        with self._lock:
+            return sum(1 for slot in self._slots.values() if slot.is_open)
+
+    def snapshot(self) -> dict[str, int]:
+        """Counters for monitoring."""
+        return {
+            "open": self.open_connections(),
+            "registered": sum(
+                1 for alias in self._configs
+                if alias != DEFAULT_DB_ALIAS and alias in connections.settings
+            ),
+            "registrations": self.registrations,
+            "connects": self.connects,
+            "reuses": self.reuses,
+            "evictions": self.evictions,
+            "overflows": self.overflows,
+        }
+
+    def clear(self) -> None:
+        """Forget all configs, slots and counters (connections stay open)."""
+        with self._lock:
+            self._configs = {}
+            self._slots.clear()
+            self._local = threading.local()
+        self.registrations = self.connects = self.reuses = self.evictions = self.overflows = 0
+
+
+tenant_connections = TenantConnectionManager()
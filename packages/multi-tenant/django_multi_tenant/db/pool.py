@@ -0,0 +1,440 @@
+"""
+Per-tenant connection pools with a per-process budget.
+
+With ``MULTI_TENANT["POOL"]`` set, every tenant alias from tenants.yml uses
+the ``django_multi_tenant.db.backends.pooled`` engine: Django's connect
+takes a connection from the tenant's pool and close hands it back, so
+worker threads share a bounded set of connections instead of each keeping
+its own per tenant.
+
+    MULTI_TENANT = {
+        "POOL": {
+            "MAX_CONNECTIONS": 40,   # all tenants, per process (0 = no ceiling)
+            "MIN_PER_TENANT": 0,     # slots reserved for each tenant
+            "MAX_PER_TENANT": 10,
+            "TIMEOUT": 10,           # seconds to wait for a connection
+            "IDLE_TIMEOUT": 300,     # close idle connections above MIN after this
+            "HEALTH_CHECK": True,    # SELECT 1 before handing out an idle connection
+        },
+    }
+
+Per-tenant limits can be overridden in tenants.yml:
+
+    database:
+      pool: {min: 2, max: 20}
+
+Budget rules:
+1. A tenant can always open up to its ``min``; those slots are reserved.
+2. Above that it borrows from the unreserved part of ``MAX_CONNECTIONS``.
+3. At the ceiling, an idle connection of another tenant above its ``min`` is
+   closed to make room (idle tenants' slots serve busy ones).
+4. A connection released while other tenants wait at the ceiling is closed
+   instead of kept idle, unless its tenant has waiters and is within its
+   fair share (the ceiling divided by the tenants in use or waiting).
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.utils import OperationalError
+
+logger = logging.getLogger(__name__)
+
+POOLED_ENGINE = "django_multi_tenant.db.backends.pooled"
+
+
+class PoolTimeout(OperationalError):
+    """No connection became available within the pool timeout."""
+
+
+class TenantPool:
+    """Connections and counters for one tenant database alias."""
+
+    def __init__(self, alias: str, min_size: int = 0, max_size: int = 10):
+        self.alias = alias
+        self.min_size = min_size
+        self.max_size = max_size
+        # (connection, released at), most recently released on the right
+        self.idle: deque[tuple[Any, float]] = deque()
+        # Open connections: idle, in use, or being opened
+        self.size = 0
+        self.waiting = 0
+        self.params: dict[str, Any] | None = None
+        self.checkouts = 0
+        self.created = 0
+        self.closed = 0
+        self.reclaimed = 0
+        self.health_check_failures = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+
+    @property
+    def in_use(self) -> int:
+        return self.size - len(self.idle)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "min": self.min_size,
+            "max": self.max_size,
+            "size": self.size,
+            "idle": len(self.idle),
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "created": self.created,
+            "closed": self.closed,
+            "reclaimed": self.reclaimed,
+            "health_check_failures": self.health_check_failures,
+            "waits": self.waits,
+            "wait_seconds_total": round(self.wait_seconds, 6),
+            "wait_seconds_max": round(self.max_wait_seconds, 6),
+            "timeouts": self.timeouts,
+        }
+
+
+class PoolManager:
+    """
+    All tenant pools of this process and their shared budget.
+
+    Usage:
+        conn = tenant_pools.acquire(alias, params, connect, min_size=0, max_size=10)
+        ...
+        tenant_pools.release(alias, conn, params)
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 0,
+        min_per_tenant: int = 0,
+        max_per_tenant: int = 10,
+        timeout: float = 10.0,
+        idle_timeout: float = 300.0,
+        health_check: bool = True,
+    ):
+        self.max_connections = max_connections
+        self.min_per_tenant = min_per_tenant
+        self.max_per_tenant = max_per_tenant
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.pools: dict[str, TenantPool] = {}
+        self.total = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+
+    def configure(self, pool_settings: dict[str, Any]) -> None:
+        """Apply ``MULTI_TENANT["POOL"]``."""
+        with self._cond:
+            self.max_connections = int(pool_settings.get("MAX_CONNECTIONS", self.max_connections))
+            self.min_per_tenant = int(pool_settings.get("MIN_PER_TENANT", self.min_per_tenant))
+            self.max_per_tenant = int(pool_settings.get("MAX_PER_TENANT", self.max_per_tenant))
+            self.timeout = float(pool_settings.get("TIMEOUT", self.timeout))
+            self.idle_timeout = float(pool_settings.get("IDLE_TIMEOUT", self.idle_timeout))
+            self.health_check = bool(pool_settings.get("HEALTH_CHECK", self.health_check))
+            self._cond.notify_all()
+
+    # ============ Checkout ============
+
+    def acquire(
+        self,
+        alias: str,
+        params: dict[str, Any],
+        connect: Callable[[], Any],
+        min_size: int | None = None,
+        max_size: int | None = None,
+    ) -> Any:
+        """
+        Take an idle connection, or open one when the budget allows; else wait.
+
+        Args:
+            alias: Database alias.
+            params: Connection parameters; idle connections made with other
+                parameters (before a reload) are discarded.
+            connect: Opens a new DB-API connection.
+            min_size: Reserved connections for this tenant.
+            max_size: Most connections this tenant may hold.
+
+        Raises:
+            PoolTimeout: If nothing became available within ``timeout``.
+        """
+        started = time.monotonic()
+        waited = False
+        to_close: list[Any] = []
+        with self._cond:
+            pool = self.pools.get(alias)
+            if pool is None:
+                pool = self.pools[alias] = TenantPool(alias)
+            pool.min_size = self.min_per_tenant if min_size is None else min_size
+            pool.max_size = self.max_per_tenant if max_size is None else max_size
+            if pool.params != params:
+                # Settings changed by a reload: drop connections to the old database
+                while pool.idle:
+                    self._forget(pool, pool.idle.pop()[0], to_close)
+                pool.params = params
+            pool.checkouts += 1
+
+            while True:
+                self._expire_idle(pool, started, to_close)
+                if pool.idle:
+                    conn = pool.idle.pop()[0]
+                    break
+                if self._can_open(pool) or self._reclaim(pool, to_close):
+                    conn = None
+                    pool.size += 1
+                    self.total += 1
+                    self.peak = max(self.peak, self.total)
+                    break
+                remaining = started + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    pool.timeouts += 1
+                    self._record_wait(pool, started)
+                    raise PoolTimeout(
+                        f"No connection to '{alias}' within {self.timeout}s "
+                        f"({pool.in_use} in use, {self.total} open in this process)"
+                    )
+                waited = True
+                pool.waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    pool.waiting -= 1
+            if waited:
+                self._record_wait(pool, started)
+        _close_all(to_close)
+
+        # The slot is ours; connect or health-check outside the lock
+        if conn is not None:
+            if not self.health_check or _is_usable(conn):
+                return conn
+            with self._cond:
+                pool.health_check_failures += 1
+            _close_all([conn])
+        try:
+            conn = connect()
+        except Exception:
+            with self._cond:
+                pool.size -= 1
+                self.total -= 1
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            pool.created += 1
+        return conn
+
+    def _can_open(self, pool: TenantPool, freed: int = 0) -> bool:
+        """
+        Whether ``pool`` may open one more connection (lock held).
+
+        ``freed`` counts connections above their pools' minimum that would
+        be closed first; it doesn't change what other pools reserve.
+        """
+        if pool.size >= pool.max_size:
+            return False
+        if self.max_connections <= 0:
+            return True
+        total = self.total - freed
+        if total >= self.max_connections:
+            return False
+        if pool.size < pool.min_size:
+            return True
+        reserved = sum(
+            max(0, other.min_size - other.size)
+            for other in self.pools.values() if other is not pool
+        )
+        return total + reserved < self.max_connections
+
+    def _reclaim(self, pool: TenantPool, to_close: list[Any]) -> bool:
+        """Close another tenant's idle connection to make room (lock held)."""
+        if self.max_connections <= 0 or not self._can_open(pool, freed=1):
+            # Closing one wouldn't let this pool open: keep the donor's connection
+            return False
+        donors = [
+            other for other in self.pools.values()
+            if other is not pool and other.idle and other.size > other.min_size
+        ]
+        if not donors:
+            return False
+        donor = max(donors, key=lambda other: (other.size - other.min_size, len(other.idle)))
+        self._forget(donor, donor.idle.popleft()[0], to_close)
+        donor.reclaimed += 1
+        return True
+
+    def _expire_idle(self, pool: TenantPool, now: float, to_close: list[Any]) -> None:
+        while pool.idle and pool.size > pool.min_size and now - pool.idle[0][1] > self.idle_timeout:
+            self._forget(pool, pool.idle.popleft()[0], to_close)
+
+    def _record_wait(self, pool: TenantPool, started: float) -> None:
+        waited = time.monotonic() - started
+        pool.waits += 1
+        pool.wait_seconds += waited
+        pool.max_wait_seconds = max(pool.max_wait_seconds, waited)
+
+    # ============ Checkin ============
+
+    def release(
+        self,
+        alias: str,
+        conn: Any,
+        params: dict[str, Any] | None = None,
+        discard: bool = False,
+    ) -> None:
+        """
+        Return a connection taken with ``acquire()``.
+
+        Args:
+            alias: Database alias.
+            conn: The connection, with no transaction open.
+            params: The parameters it was acquired with.
+            discard: Close it instead of keeping it (e.g. it's broken).
+        """
+        to_close: list[Any] = []
+        with self._cond:
+            pool = self.pools.get(alias)
+            if pool is None:
+                to_close.append(conn)
+            elif discard or pool.params != params or self._others_starving(pool):
+                self._forget(pool, conn, to_close)
+            else:
+                pool.idle.append((conn, time.monotonic()))
+            self._cond.notify_all()
+        _close_all(to_close)
+
+    def _others_starving(self, pool: TenantPool) -> bool:
+        """Whether to give this connection's budget to another tenant (lock held)."""
+        if self.max_connections <= 0 or self.total < self.max_connections:
+            return False
+        starving = any(
+            other.waiting and other.size < other.max_size
+            for other in self.pools.values() if other is not pool
+        )
+        if not starving:
+            return False
+        if not pool.waiting:
+            return True
+        active = sum(1 for other in self.pools.values() if other.in_use or other.waiting)
+        return pool.size > self.max_connections / max(active, 1)
+
+    def _forget(self, pool: TenantPool, conn: Any, to_close: list[Any]) -> None:
+        pool.size -= 1
+        pool.closed += 1
+        self.total -= 1
+        to_close.append(conn)
+
+    # ============ Monitoring ============
+
+    def snapshot(self) -> dict[str, Any]:
+        """Budget and per-tenant counters."""
+        with self._cond:
+            return {
+                "max_connections": self.max_connections,
+                "open": self.total,
+                "peak": self.peak,
+                "tenants": {alias: pool.snapshot() for alias, pool in self.pools.items()},
+            }
+
+    def close_all(self) -> None:
+        """Close idle connections and forget all pools and counters."""
+        to_close: list[Any] = []
+        with self._cond:
+            for pool in self.pools.values():
+                to_close.extend(conn for conn, _ in pool.idle)
+            self.pools = {}
+            self.total = self.peak = 0
+            self._cond.notify_all()
+        _close_all(to_close)
+
+
+def _is_usable(conn: Any) -> bool:
+    """Health check: a round trip on a DB-API connection."""
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        finally:
+            cursor.close()
+        conn.rollback()
+    except Exception as e:
+        logger.info(f"Discarding unusable pooled connection: {e}")
+        return False
+    return True
+
+
+def _close_all(conns: list[Any]) -> None:
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug(f"Closing pooled connection: {e}")
+
+
+def pooled_databases(
+    databases: dict[str, dict[str, Any]],
+    pool_settings: dict[str, Any],
+) -> dict[str, dict[str, Any]]:
+    """
+    Switch tenant database configs to the pooled engine.
+
+    Args:
+        databases: alias -> config from ``generate_databases_config()``; a
+            ``POOL`` entry with ``MIN``/``MAX`` overrides the defaults.
+        pool_settings: ``MULTI_TENANT["POOL"]``.
+
+    Returns:
+        New configs; ``default`` is left unpooled.
+    """
+    pooled = {}
+    for alias, config in databases.items():
+        if alias == DEFAULT_DB_ALIAS or config.get("ENGINE") == POOLED_ENGINE:
+            pooled[alias] = config
+            continue
+        limits = config.get("POOL") or {}
+        pooled[alias] = {
+            **config,
+            "ENGINE": POOLED_ENGINE,
+            # Hand the connection back to the pool at the end of every request
+            "CONN_MAX_AGE": 0,
+            "POOL": {
+                "ENGINE": config["ENGINE"],
+                "MIN": int(limits.get("MIN", pool_settings.get("MIN_PER_TENANT", 0))),
+                "MAX": int(limits.get("MAX", pool_settings.get("MAX_PER_TENANT", 10))),
+            },
+        }
+    return pooled
+
+
+class PooledDatabaseWrapperMixin:
+    """Makes a backend's DatabaseWrapper connect and close through ``tenant_pools``."""
+
+    pooled = True
+
+    def get_new_connection(self, conn_params: dict[str, Any]) -> Any:
+        limits = self.settings_dict["POOL"]
+        self._pool_params = conn_params
+        return tenant_pools.acquire(
+            self.alias,
+            conn_params,
+            lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params),
+            min_size=limits.get("MIN"),
+            max_size=limits.get("MAX"),
+        )
+
+    def _close(self) -> None:
+        conn = self.connection
+        if conn is None:
+            return
+        try:
+            # Never hand over an open (possibly failed) transaction
+            conn.rollback()
+            discard = False
+        except Exception:
+            discard = True
+        tenant_pools.release(self.alias, conn, self._pool_params, discard=discard)
+
+
+tenant_pools = PoolManager()
@@ -9,6 +9,7 @@ from typing import Any
 
 from django.conf import settings
 
+from django_multi_tenant.db.manager import tenant_connections
 from django_multi_tenant.middleware.tenant_context import get_current_tenant
 
 
@@ -45,12 +46,19 @@ class TenantDatabaseRouter:
         return model._meta.app_label
 
     def _get_tenant_database(self) -> str:
-        """Get the database for the current tenant."""
+        """
+        Get the database for the current tenant.
+
+        Raises:
+            ConnectionDoesNotExist: If the tenant's database isn't configured,
+                rather than sending its queries to the default database.
+        """
         tenant = get_current_tenant()
         if tenant and tenant.database:
-            # Verify the database exists in settings
-            if tenant.database in settings.DATABASES:
-                return tenant.database
+            if tenant.database not in settings.DATABASES:
+                # First use in this process, e.g. outside TenantMiddleware
+                tenant_connections.register(tenant.database)
+            return tenant.database
         return "default"
 
     def _is_shared_app(self, app_label: str) -> bool:
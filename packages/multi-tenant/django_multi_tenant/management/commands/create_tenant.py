@@ -5,6 +5,8 @@ Usage:
     python manage.py create_tenant tenant-id --name "Tenant Name" --domain example.com
 """
 
+import os
+
 import yaml
 from django.core.management.base import BaseCommand, CommandError
 
@@ -111,8 +113,11 @@ class Command(BaseCommand):
                 self.style.WARNING("Dry run mode - no changes saved")
             )
         else:
-            with open(config_path, "w", encoding="utf-8") as f:
+            # Write then rename, so hot-reloading workers never read a partial file
+            tmp_path = f"{config_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
                 f.write(yaml_output)
+            os.replace(tmp_path, config_path)
 
             self.stdout.write(
                 self.style.SUCCESS(f"Created tenant '{tenant_id}' in {config_path}")
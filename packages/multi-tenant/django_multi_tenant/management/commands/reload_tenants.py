@@ -0,0 +1,97 @@
+"""
+Management command to validate tenants.yml and have running workers reload it.
+
+Usage:
+    python manage.py reload_tenants                  # validate CONFIG_PATH, then touch it
+    python manage.py reload_tenants --from new.yml   # validate new.yml, then replace CONFIG_PATH
+    python manage.py reload_tenants --check          # validate only
+    python manage.py reload_tenants --pid 1234       # also send RELOAD_SIGNAL to a worker
+
+Workers polling the file (RELOAD_INTERVAL) pick the change up within one
+interval; ``--pid`` is for workers that only listen for RELOAD_SIGNAL, and is refused
+when RELOAD_SIGNAL is unset: the worker would have no handler and exit.
+"""
+
+import os
+import shutil
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from django_multi_tenant.config.registry import load_generation
+
+
+class Command(BaseCommand):
+    help = "Validate tenants.yml and trigger a hot reload in running workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--config",
+            type=str,
+            help="Path to tenants.yml (defaults to MULTI_TENANT['CONFIG_PATH'])",
+        )
+        parser.add_argument(
+            "--from",
+            type=str,
+            dest="source",
+            help="Validate this file and atomically replace the config with it",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only validate; don't touch the configuration",
+        )
+        parser.add_argument(
+            "--pid",
+            type=int,
+            action="append",
+            dest="pids",
+            help="Worker process to signal (can be specified multiple times)",
+        )
+
+    def handle(self, *args, **options):
+        multi_tenant_settings = getattr(settings, "MULTI_TENANT", {})
+        config_path = options["config"] or multi_tenant_settings.get("CONFIG_PATH")
+        if not config_path:
+            raise CommandError("No config path: pass --config or set MULTI_TENANT['CONFIG_PATH']")
+        source = options["source"] or config_path
+
+        try:
+            generation = load_generation(
+                source, default_tenant_id=multi_tenant_settings.get("DEFAULT_TENANT", "default"),
+            )
+        except Exception as e:
+            raise CommandError(f"Invalid tenant config {source}: {e}") from e
+        if not generation.tenant_infos:
+            raise CommandError(f"No tenants configured in {source}")
+
+        self.stdout.write(
+            f"{source}: {len(generation.tenant_infos)} tenants, "
+            f"{len(generation.resolver)} domains, {len(generation.databases)} databases"
+        )
+        if options["check"]:
+            self.stdout.write(self.style.SUCCESS("Configuration is valid"))
+            return
+
+        reload_signal = multi_tenant_settings.get("RELOAD_SIGNAL")
+        if options["pids"] and not reload_signal:
+            # Workers without a handler would die on the signal
+            raise CommandError("RELOAD_SIGNAL not configured; workers poll the file")
+
+        if source != config_path:
+            # Copy next to the target, then rename: workers never see a partial file
+            tmp_path = f"{config_path}.tmp"
+            shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, config_path)
+        else:
+            os.utime(config_path)
+
+        for pid in options["pids"] or []:
+            signum = getattr(signal, reload_signal)
+            try:
+                os.kill(pid, signum)
+            except OSError as e:
+                raise CommandError(f"Signalling worker {pid} failed: {e}") from e
+
+        self.stdout.write(self.style.SUCCESS(f"Published {config_path}"))
@@ -4,10 +4,13 @@ from django_multi_tenant.middleware.tenant_context import (
     set_current_tenant,
     TenantContext,
 )
+from django_multi_tenant.middleware.tracing import get_current_trace, outgoing_headers
 
 __all__ = [
     "TenantMiddleware",
     "get_current_tenant",
     "set_current_tenant",
     "TenantContext",
+    "get_current_trace",
+    "outgoing_headers",
 ]
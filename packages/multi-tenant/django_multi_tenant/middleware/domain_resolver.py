@@ -0,0 +1,144 @@
+"""
+Host name to tenant resolution with a reversed-label trie.
+
+Domains from tenants.yml are either exact (``cms.ntsdgs.tw``) or wildcards
+(``*.ntsdgs.tw``, matching any host with at least one more label, at any
+depth). Precedence for a host:
+
+1. Exact domain
+2. The wildcard with the longest matching suffix
+3. The default tenant
+
+Exact domains are a single dict lookup. Wildcard labels are stored right to
+left (``tw`` → ``ntsdgs`` → ...), so a wildcard lookup walks the host from
+its last label and costs O(labels) whatever the number of tenants; the only
+allocation is splitting the host, and TenantMiddleware's host cache keeps
+even that off the path of repeat hosts. Two tenants claiming the same exact
+domain or the same wildcard are rejected when the table is built, instead of
+one silently winning.
+"""
+
+from typing import Iterable
+
+from django.core.exceptions import ImproperlyConfigured
+
+# Node key holding the tenant of "*.<labels to this node>"; labels are strings
+_WILDCARD = None
+
+
+class DomainConflictError(ImproperlyConfigured):
+    """Two tenants claim the same domain or wildcard."""
+
+
+def normalize_domain(domain: str) -> str:
+    """Lowercase a host/domain and drop a trailing dot."""
+    return domain.strip().lower().rstrip(".")
+
+
+class DomainResolver:
+    """
+    Maps host names to tenant IDs.
+
+    Usage:
+        resolver = DomainResolver(default="default")
+        resolver.add("cms.ntsdgs.tw", "nantou-gov")
+        resolver.add("*.tplanet.ai", "tplanet")
+        resolver.resolve("a.b.tplanet.ai")  # "tplanet"
+    """
+
+    def __init__(self, default: str | None = None):
+        self.default = default
+        self._exact: dict[str, str] = {}
+        self._root: dict[str, dict] = {}
+        self._wildcards = 0
+
+    @classmethod
+    def from_tenants(
+        cls,
+        tenants: dict[str, dict],
+        default: str | None = None,
+    ) -> "DomainResolver":
+        """
+        Build a resolver from the loader's tenant configuration.
+
+        Args:
+            tenants: tenant_id -> config with a ``domains`` list.
+            default: Tenant for hosts nothing matches.
+
+        Raises:
+            DomainConflictError: If two tenants claim the same domain.
+            ImproperlyConfigured: If a domain pattern is invalid.
+        """
+        resolver = cls(default)
+        for tenant_id, config in tenants.items():
+            resolver.add_all(config.get("domains") or (), tenant_id)
+        return resolver
+
+    def add_all(self, domains: Iterable[str], tenant_id: str) -> None:
+        for domain in domains:
+            self.add(domain, tenant_id)
+
+    def add(self, domain: str, tenant_id: str) -> None:
+        """
+        Register an exact domain or a ``*.suffix`` wildcard.
+
+        Raises:
+            DomainConflictError: If another tenant already has it.
+            ImproperlyConfigured: If the pattern is invalid.
+        """
+        pattern = normalize_domain(domain)
+        wildcard = pattern.startswith("*.")
+        name = pattern[2:] if wildcard else pattern
+        labels = name.split(".")
+        if not name or any(not label or "*" in label for label in labels):
+            raise ImproperlyConfigured(
+                f"Invalid domain {domain!r} for tenant {tenant_id!r}: "
+                "use an exact domain or '*.suffix'"
+            )
+
+        if not wildcard:
+            self._claim(self._exact, name, tenant_id, pattern)
+            return
+
+        node = self._root
+        for label in reversed(labels):
+            node = node.setdefault(label, {})
+        if _WILDCARD not in node:
+            self._wildcards += 1
+        self._claim(node, _WILDCARD, tenant_id, pattern)
+
+    @staticmethod
+    def _claim(table: dict, key: str | None, tenant_id: str, domain: str) -> None:
+        owner = table.get(key)
+        if owner is not None and owner != tenant_id:
+            raise DomainConflictError(
+                f"Domain {domain!r} is claimed by both {owner!r} and {tenant_id!r}"
+            )
+        table[key] = tenant_id
+
+    def resolve(self, host: str) -> str | None:
+        """
+        Tenant ID for a normalized host name (no port), else the default.
+
+        Args:
+            host: Lowercase host name, e.g. from ``normalize_domain``.
+        """
+        tenant_id = self._exact.get(host)
+        if tenant_id is not None:
+            return tenant_id
+
+        best = None
+        node = self._root
+        if node:
+            for label in reversed(host.split(".")):
+                # The node's wildcard applies: there is a label left of its suffix
+                wildcard = node.get(_WILDCARD)
+                if wildcard is not None:
+                    best = wildcard
+                node = node.get(label)
+                if node is None:
+                    break
+        return best if best is not None else self.default
+
+    def __len__(self) -> int:
+        return len(self._exact) + self._wildcards
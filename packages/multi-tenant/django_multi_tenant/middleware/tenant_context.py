@@ -8,27 +8,128 @@ it through every function call.
 
 from contextvars import ContextVar
 from dataclasses import dataclass, field
-from typing import Any
+from types import MappingProxyType
+from typing import Any, Mapping
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class TenantInfo:
-    """Information about the current tenant."""
+    """
+    Information about the current tenant.
+
+    Instances are immutable and shared across requests and threads:
+    TenantMiddleware builds one per tenant whenever the configuration is
+    loaded. ``config`` is frozen into read-only mappings (lists become
+    tuples), and ``features`` / ``theme`` are precomputed from it, with
+    nested sections also reachable by dotted key (``"ai_secretary.model"``).
+
+    The frozen ``config`` is a ``MappingProxyType``, not a ``dict``, so it
+    can't go straight into ``json.dumps``; use ``to_dict()`` for a plain copy.
+    """
 
     tenant_id: str
     name: str
     database: str = "default"
-    config: dict = field(default_factory=dict)
+    config: Mapping[str, Any] = field(default_factory=dict)
+    # Plain dicts (faster lookups than a mappingproxy), never handed out
+    _features: dict[str, Any] = field(init=False, repr=False, compare=False)
+    _theme: dict[str, Any] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        config = _freeze(self.config)
+        object.__setattr__(self, "config", config)
+        object.__setattr__(self, "_features", _flatten(config.get("features")))
+        object.__setattr__(self, "_theme", _flatten(config.get("theme")))
+
+    def __hash__(self) -> int:
+        return hash((self.tenant_id, self.name, self.database))
+
+    @property
+    def features(self) -> Mapping[str, Any]:
+        """Read-only feature flags, including dotted keys for nested sections."""
+        return MappingProxyType(self._features)
+
+    @property
+    def theme(self) -> Mapping[str, Any]:
+        """Read-only theme values, including dotted keys for nested sections."""
+        return MappingProxyType(self._theme)
+
+    @classmethod
+    def from_config(cls, tenant_id: str, config: Mapping[str, Any]) -> "TenantInfo":
+        """
+        Build a tenant from its tenants.yml entry.
+
+        Args:
+            tenant_id: Tenant identifier.
+            config: The tenant's configuration section.
+
+        Returns:
+            TenantInfo using the configured database alias (default: tenant_id).
+        """
+        database_config = config.get("database") or {}
+        return cls(
+            tenant_id=tenant_id,
+            name=config.get("name", tenant_id),
+            database=database_config.get("alias", tenant_id),
+            config=config,
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Plain, JSON-serializable copy of this tenant.
+
+        Returns:
+            Dict with ``tenant_id``, ``name``, ``database`` and ``config``,
+            the config as nested dicts and lists.
+        """
+        return {
+            "tenant_id": self.tenant_id,
+            "name": self.name,
+            "database": self.database,
+            "config": _thaw(self.config),
+        }
 
     def get_feature(self, feature_name: str, default: Any = None) -> Any:
         """Get a feature flag value for this tenant."""
-        features = self.config.get("features", {})
-        return features.get(feature_name, default)
+        return self._features.get(feature_name, default)
 
     def get_theme(self, key: str, default: Any = None) -> Any:
         """Get a theme value for this tenant."""
-        theme = self.config.get("theme", {})
-        return theme.get(key, default)
+        return self._theme.get(key, default)
+
+
+def _freeze(value: Any) -> Any:
+    """Read-only copy of nested dicts/lists."""
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value: Any) -> Any:
+    """Mutable copy of a frozen value: plain dicts and lists."""
+    if isinstance(value, Mapping):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_thaw(item) for item in value]
+    return value
+
+
+def _flatten(section: Any) -> dict[str, Any]:
+    """Top-level keys of a config section plus dotted keys for nested ones."""
+    flat: dict[str, Any] = {}
+
+    def walk(prefix: str, mapping: Mapping[str, Any]) -> None:
+        for key, value in mapping.items():
+            name = f"{prefix}{key}"
+            flat[name] = value
+            if isinstance(value, Mapping):
+                walk(f"{name}.", value)
+
+    if isinstance(section, Mapping):
+        walk("", section)
+    return flat
 
 
 # Context variable for storing tenant info per-request
@@ -3,19 +3,31 @@ Tenant detection middleware for Django.
 
 Identifies the current tenant based on:
 1. X-Tenant-ID header (highest priority)
-2. Subdomain (e.g., nantou.tplanet.ai → nantou-gov)
-3. Full domain match (e.g., cms.ntsdgs.tw → nantou-gov)
+2. Exact domain match (e.g., cms.ntsdgs.tw → nantou-gov)
+3. Longest matching wildcard domain (e.g., *.ntsdgs.tw → nantou-gov)
 4. Default tenant (fallback)
+
+Domain matching is done by DomainResolver; see domain_resolver.py.
+
+It also continues (or starts) the W3C trace of the request; see tracing.py.
 """
 
 import logging
+import threading
+import time
 from typing import Callable
 
 from django.conf import settings
 from django.http import HttpRequest, HttpResponse
+from django.http.request import split_domain_port
 
 from django_multi_tenant.config.loader import TenantConfigLoader
+from django_multi_tenant.config.registry import HostCache, TenantGeneration, TenantRegistry
+from django_multi_tenant.db.aliases import close_stale_connections
+from django_multi_tenant.db.manager import tenant_connections
+from django_multi_tenant.middleware.domain_resolver import DomainResolver
 from django_multi_tenant.middleware.tenant_context import TenantInfo, set_current_tenant
+from django_multi_tenant.middleware.tracing import Tracer, set_current_trace
 
 logger = logging.getLogger(__name__)
 
@@ -29,112 +41,165 @@ class TenantMiddleware:
             "CONFIG_PATH": "/path/to/tenants.yml",
             "DEFAULT_TENANT": "default",
             "HEADER_NAME": "X-Tenant-ID",
+            "HOST_CACHE_SIZE": 1024,  # resolved hosts kept (0 = off)
+            "RELOAD_INTERVAL": 5,  # poll tenants.yml for changes (0 = off)
+            "RELOAD_SIGNAL": "SIGHUP",  # reload on this signal (optional)
+            "MAX_TENANT_CONNECTIONS": 20,  # open tenant DB connections per process (0 = no cap)
+            "TRACING": {"EXPORTER": "udp://127.0.0.1:6831", "SAMPLE_RATE": 0.1},
         }
+
+    Tenants, domains and database aliases come from the registry's current
+    generation, which is swapped atomically on reload (see config/registry.py).
     """
 
     def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
         self.get_response = get_response
-        self.config_loader = TenantConfigLoader()
+        self._thread = threading.local()
         self._load_config()
 
     def _load_config(self) -> None:
         """Load tenant configuration from settings."""
         multi_tenant_settings = getattr(settings, "MULTI_TENANT", {})
-        config_path = multi_tenant_settings.get("CONFIG_PATH")
-
-        if config_path:
-            self.config_loader.load_from_file(config_path)
 
         self.default_tenant_id = multi_tenant_settings.get("DEFAULT_TENANT", "default")
         self.header_name = multi_tenant_settings.get("HEADER_NAME", "X-Tenant-ID")
+        self._header_key = f"HTTP_{self.header_name.upper().replace('-', '_')}"
+        self.tracer = Tracer.from_settings(multi_tenant_settings.get("TRACING", {}))
+        tenant_connections.max_connections = multi_tenant_settings.get("MAX_TENANT_CONNECTIONS", 0)
 
-        # Build lookup tables for fast tenant resolution
-        self._build_lookup_tables()
+        self.registry = TenantRegistry.from_settings(multi_tenant_settings)
+        self.registry.start()
 
-    def _build_lookup_tables(self) -> None:
-        """Build domain and subdomain lookup tables."""
-        self.domain_to_tenant: dict[str, str] = {}
-        self.subdomain_to_tenant: dict[str, str] = {}
+    # The current generation's tables
+    @property
+    def config_loader(self) -> TenantConfigLoader:
+        return self.registry.current.loader
 
-        for tenant_id, config in self.config_loader.tenants.items():
-            domains = config.get("domains", [])
-            for domain in domains:
-                self.domain_to_tenant[domain.lower()] = tenant_id
+    @property
+    def resolver(self) -> DomainResolver:
+        return self.registry.current.resolver
 
-                # Extract subdomain mapping (first part before first dot)
-                parts = domain.split(".")
-                if len(parts) >= 2:
-                    subdomain = parts[0].lower()
-                    if subdomain not in ("www", "api"):
-                        self.subdomain_to_tenant[subdomain] = tenant_id
+    @property
+    def tenant_infos(self) -> dict[str, TenantInfo]:
+        return self.registry.current.tenant_infos
+
+    @property
+    def host_cache(self) -> HostCache:
+        return self.registry.current.host_cache
 
     def __call__(self, request: HttpRequest) -> HttpResponse:
-        tenant_info = self._resolve_tenant(request)
+        started = time.perf_counter()
+        trace = self.tracer.start_trace(request.META.get("HTTP_TRACEPARENT"))
+        set_current_trace(trace)
+
+        # One generation for the whole request, however long it runs
+        generation = self.registry.current
+        if getattr(self._thread, "generation", None) is not generation:
+            # Reconnect aliases a reload changed, between this thread's requests
+            tenant_connections.settle()
+            close_stale_connections()
+            self._thread.generation = generation
+
+        tenant_info = self._resolve_tenant(request, generation)
+        trace.add_span("tenant.resolve", started, time.perf_counter())
+        if tenant_info is not None:
+            trace.tenant_id = tenant_info.tenant_id
         set_current_tenant(tenant_info)
 
-        # Attach tenant to request for easy access
+        # Attach tenant and trace to request for easy access
         request.tenant = tenant_info
+        request.trace = trace
+
+        # Registers the tenant's database on first use and reserves a connection
+        # slot; it's handed back on request_finished, once the response (even a
+        # streaming one) has been sent
+        alias = tenant_info.database if tenant_info is not None else None
+        if alias:
+            tenant_connections.checkout(alias)
 
+        status = 500
         try:
             response = self.get_response(request)
+            status = response.status_code
         finally:
             # Clear tenant context after request
             set_current_tenant(None)
+            set_current_trace(None)
+            trace.add_span(
+                "django.request",
+                started,
+                time.perf_counter(),
+                root=True,
+                method=request.method,
+                path=request.path,
+                status=status,
+            )
+            self.tracer.finish(trace)
 
         return response
 
-    def _resolve_tenant(self, request: HttpRequest) -> TenantInfo | None:
+    def _resolve_tenant(
+        self,
+        request: HttpRequest,
+        generation: TenantGeneration | None = None,
+    ) -> TenantInfo | None:
         """
         Resolve tenant from request using priority order.
 
         Priority:
         1. X-Tenant-ID header
-        2. Subdomain
-        3. Full domain match
+        2. Exact domain match
+        3. Longest matching wildcard domain
         4. Default tenant
-        """
-        # 1. Check header
-        header_key = f"HTTP_{self.header_name.upper().replace('-', '_')}"
-        tenant_id = request.META.get(header_key)
 
-        if tenant_id and tenant_id in self.config_loader.tenants:
-            logger.debug(f"Tenant resolved from header: {tenant_id}")
-            return self._create_tenant_info(tenant_id)
-
-        # Get host from request
-        host = request.get_host().split(":")[0].lower()  # Remove port
-
-        # 2. Check full domain match
-        if host in self.domain_to_tenant:
-            tenant_id = self.domain_to_tenant[host]
-            logger.debug(f"Tenant resolved from domain {host}: {tenant_id}")
-            return self._create_tenant_info(tenant_id)
-
-        # 3. Check subdomain
-        subdomain = host.split(".")[0]
-        if subdomain in self.subdomain_to_tenant:
-            tenant_id = self.subdomain_to_tenant[subdomain]
-            logger.debug(f"Tenant resolved from subdomain {subdomain}: {tenant_id}")
-            return self._create_tenant_info(tenant_id)
-
-        # 4. Fall back to default tenant
-        if self.default_tenant_id and self.default_tenant_id in self.config_loader.tenants:
-            logger.debug(f"Using default tenant: {self.default_tenant_id}")
-            return self._create_tenant_info(self.default_tenant_id)
+        Host-based results are cached per raw Host header, so repeat hosts
+        skip ALLOWED_HOSTS validation and the table lookups.
+        """
+        if generation is None:
+            generation = self.registry.current
 
-        logger.warning(f"No tenant found for host: {host}")
-        return None
+        # 1. Check header
+        meta = request.META
+        tenant_id = meta.get(self._header_key)
+
+        if tenant_id:
+            tenant = generation.tenant_infos.get(tenant_id)
+            if tenant is not None:
+                logger.debug(f"Tenant resolved from header: {tenant_id}")
+                return tenant
+
+        # Everything request.get_host() depends on
+        key = (
+            meta.get("HTTP_X_FORWARDED_HOST"),
+            meta.get("HTTP_HOST"),
+            meta.get("SERVER_NAME"),
+            meta.get("SERVER_PORT"),
+        )
+        host_cache = generation.host_cache
+        tenant = host_cache.get(key, _MISSING)
+        if tenant is _MISSING:
+            # Validates against ALLOWED_HOSTS (raises DisallowedHost, not cached)
+            host, _port = split_domain_port(request.get_host())
+            tenant = self._resolve_host(host, generation)
+            host_cache.put(key, tenant)
+        return tenant
+
+    def _resolve_host(self, host: str, generation: TenantGeneration) -> TenantInfo | None:
+        """Resolve a tenant from a host name without port (steps 2-4)."""
+        tenant_id = generation.resolver.resolve(host)
+        tenant = generation.tenant_infos.get(tenant_id) if tenant_id is not None else None
+        if tenant is None:
+            logger.warning(f"No tenant found for host: {host}")
+        else:
+            logger.debug(f"Tenant resolved from host {host}: {tenant_id}")
+        return tenant
 
     def _create_tenant_info(self, tenant_id: str) -> TenantInfo:
-        """Create TenantInfo from configuration."""
-        config = self.config_loader.tenants.get(tenant_id, {})
+        """Get the shared TenantInfo of a configured tenant."""
+        tenant = self.tenant_infos.get(tenant_id)
+        if tenant is None:
+            tenant = TenantInfo.from_config(tenant_id, self.config_loader.tenants.get(tenant_id, {}))
+        return tenant
 
-        database_config = config.get("database", {})
-        database_name = database_config.get("alias", tenant_id)
 
-        return TenantInfo(
-            tenant_id=tenant_id,
-            name=config.get("name", tenant_id),
-            database=database_name,
-            config=config,
-        )
+_MISSING = object()
@@ -0,0 +1,290 @@
+"""
+W3C trace context (traceparent) for Django requests.
+
+TenantMiddleware continues the trace of an incoming ``traceparent`` header
+(e.g. from nginx) or starts a new one. Calls made on behalf of the request
+(such as the LLMTwins wrapper) should send ``outgoing_headers()`` so their
+spans join the same trace, tagged with the same tenant.
+
+Spans are only recorded when an exporter is configured:
+
+    MULTI_TENANT = {
+        "TRACING": {
+            "EXPORTER": "file:///var/log/tplanet/spans.jsonl",  # or udp://host:port
+            "SAMPLE_RATE": 0.1,
+            "SERVICE_NAME": "django",
+        },
+    }
+"""
+
+import json
+import logging
+import random
+import socket
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable
+from urllib.parse import ParseResult, urlparse
+
+from django_multi_tenant.middleware.tenant_context import get_current_tenant
+
+logger = logging.getLogger(__name__)
+
+_HEX = frozenset("0123456789abcdef")
+
+
+def parse_traceparent(value: str | None) -> tuple[str, str, int] | None:
+    """
+    Parse a traceparent header.
+
+    Args:
+        value: Header value, e.g. ``00-<trace id>-<parent id>-01``.
+
+    Returns:
+        (trace_id, parent_id, flags), or None if the header is invalid.
+    """
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4:
+        return None
+    version, trace_id, parent_id, flags = parts[:4]
+    if len(version) != 2 or version == "ff" or (version == "00" and len(parts) != 4):
+        return None
+    if len(trace_id) != 32 or len(parent_id) != 16 or len(flags) != 2:
+        return None
+    if not _HEX.issuperset(version + trace_id + parent_id + flags):
+        return None
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, int(flags, 16)
+
+
+def new_id(bits: int) -> str:
+    """Generate a random non-zero hex id (128 bits for traces, 64 for spans)."""
+    value = 0
+    while not value:
+        value = random.getrandbits(bits)
+    return f"{value:0{bits // 4}x}"
+
+
+@dataclass
+class TraceContext:
+    """This service's part of one distributed trace."""
+
+    trace_id: str
+    parent_id: str | None = None
+    sampled: bool = True
+    recording: bool = False
+    span_id: str = field(default_factory=lambda: new_id(64))
+    tenant_id: str | None = None
+    spans: list[dict[str, Any]] = field(default_factory=list)
+    _wall: float = field(default_factory=time.time, repr=False)
+    _perf: float = field(default_factory=time.perf_counter, repr=False)
+
+    def traceparent(self) -> str:
+        """Header value for calls made on behalf of this request."""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def add_span(
+        self,
+        name: str,
+        start: float,
+        end: float,
+        root: bool = False,
+        **attributes: Any,
+    ) -> None:
+        """
+        Record a span from time.perf_counter() timestamps.
+
+        Args:
+            name: Span name.
+            start: Start time (perf_counter).
+            end: End time (perf_counter).
+            root: Record this service's span itself instead of a child of it.
+            **attributes: Extra span attributes.
+        """
+        if not self.recording:
+            return
+        self.spans.append({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id if root else new_id(64),
+            "parent_id": self.parent_id if root else self.span_id,
+            "name": name,
+            "start": round(self._wall + (start - self._perf), 6),
+            "duration_ms": round(1000 * (end - start), 3),
+            "attributes": attributes,
+        })
+
+
+_current_trace: ContextVar[TraceContext | None] = ContextVar("current_trace", default=None)
+
+
+def get_current_trace() -> TraceContext | None:
+    """
+    Get the trace of the current request.
+
+    Returns:
+        TraceContext or None outside of a request.
+    """
+    return _current_trace.get()
+
+
+def set_current_trace(trace: TraceContext | None) -> None:
+    """
+    Set the trace for this request/context.
+
+    Args:
+        trace: TraceContext instance or None to clear.
+    """
+    _current_trace.set(trace)
+
+
+def outgoing_headers(tenant_header: str = "X-Tenant-ID") -> dict[str, str]:
+    """
+    Headers that carry the current trace and tenant to another service.
+
+    Usage:
+        requests.post(f"{LLMTWINS_URL}/api/chat", json=payload, headers=outgoing_headers())
+
+    Args:
+        tenant_header: Header name for the tenant ID.
+
+    Returns:
+        ``traceparent`` and tenant headers (empty outside of a request).
+    """
+    headers: dict[str, str] = {}
+    trace = get_current_trace()
+    if trace is not None:
+        headers["traceparent"] = trace.traceparent()
+    tenant = get_current_tenant()
+    if tenant is not None:
+        headers[tenant_header] = tenant.tenant_id
+    return headers
+
+
+# ============ Exporters ============
+
+
+class FileExporter:
+    """Appends spans as JSON lines to a local file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", buffering=1 << 16)
+
+    def export(self, spans: list[dict[str, Any]]) -> None:
+        self._file.write("".join(json.dumps(s, separators=(",", ":")) + "\n" for s in spans))
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class UDPExporter:
+    """Sends each span as one JSON datagram (e.g. to a local collector)."""
+
+    def __init__(self, host: str, port: int):
+        self.address = (host, port)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def export(self, spans: list[dict[str, Any]]) -> None:
+        for s in spans:
+            try:
+                self._sock.sendto(json.dumps(s, separators=(",", ":")).encode("utf-8"), self.address)
+            except OSError as e:
+                logger.debug(f"Dropping span: {e}")
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+# scheme -> factory(parsed URL); extend with register_exporter()
+_EXPORTERS: dict[str, Callable[[ParseResult], Any]] = {
+    "file": lambda url: FileExporter(url.path),
+    "udp": lambda url: UDPExporter(url.hostname or "127.0.0.1", url.port or 6831),
+}
+
+
+def register_exporter(scheme: str, factory: Callable[[ParseResult], Any]) -> None:
+    """
+    Make ``scheme://...`` usable as the TRACING EXPORTER setting.
+
+    Args:
+        scheme: URL scheme.
+        factory: Called with the parsed URL; returns an object with ``export(spans)``.
+    """
+    _EXPORTERS[scheme] = factory
+
+
+def create_exporter(spec: str | None) -> Any:
+    """
+    Create the exporter for ``file:///path``, ``udp://host:port`` or a registered scheme.
+
+    Raises:
+        ValueError: If the scheme is unknown.
+    """
+    if not spec:
+        return None
+    url = urlparse(spec)
+    factory = _EXPORTERS.get(url.scheme)
+    if factory is None:
+        raise ValueError(f"Unknown trace exporter: {spec}")
+    return factory(url)
+
+
+class Tracer:
+    """Starts traces and exports their spans (synchronously, once per request)."""
+
+    def __init__(self, exporter: Any = None, sample_rate: float = 1.0, service: str = "django"):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.service = service
+
+    @classmethod
+    def from_settings(cls, tracing_settings: dict[str, Any]) -> "Tracer":
+        """Create a tracer from ``MULTI_TENANT["TRACING"]``."""
+        return cls(
+            exporter=create_exporter(tracing_settings.get("EXPORTER")),
+            sample_rate=float(tracing_settings.get("SAMPLE_RATE", 1.0)),
+            service=tracing_settings.get("SERVICE_NAME", "django"),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def start_trace(self, traceparent: str | None) -> TraceContext:
+        """
+        Continue the incoming trace, or start a new one.
+
+        Sampling is parent-based: an incoming sampled flag is honoured,
+        otherwise SAMPLE_RATE applies.
+        """
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, flags = parent
+            sampled = bool(flags & 1)
+        else:
+            trace_id, parent_id = new_id(128), None
+            sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        return TraceContext(
+            trace_id=trace_id,
+            parent_id=parent_id,
+            sampled=sampled,
+            recording=sampled and self.enabled,
+        )
+
+    def finish(self, trace: TraceContext) -> None:
+        """Export a recorded trace's spans, tagged with service and tenant."""
+        if not trace.recording or not trace.spans:
+            return
+        for s in trace.spans:
+            s["service"] = self.service
+            if trace.tenant_id is not None:
+                s["attributes"].setdefault("tenant", trace.tenant_id)
+        try:
+            self.exporter.export(trace.spans)
+        except Exception:
+            logger.exception("Exporting spans failed")
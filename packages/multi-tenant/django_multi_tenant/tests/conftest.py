@@ -0,0 +1,29 @@
+"""Shared fixtures for django_multi_tenant tests."""
+
+import django
+import pytest
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(ALLOWED_HOSTS=["*"])
+    django.setup()
+
+from django.db import connections  # noqa: E402
+
+from django_multi_tenant.db.manager import tenant_connections  # noqa: E402
+from django_multi_tenant.db.pool import tenant_pools  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def restore_databases():
+    """Drop database aliases registered while loading tenants in a test."""
+    saved = dict(connections.settings)
+    yield
+    tenant_connections.clear()
+    connections.close_all()
+    tenant_pools.close_all()
+    for conn in connections.all(initialized_only=True):
+        if conn.alias not in saved:
+            del connections[conn.alias]
+    connections._settings = connections.settings = saved
+    settings.DATABASES = saved
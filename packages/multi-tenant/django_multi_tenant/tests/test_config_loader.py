@@ -168,6 +168,18 @@ class TestTenantConfigLoader:
         assert databases["tenant_a"]["NAME"] == "db_a"
         assert databases["tenant_b"]["NAME"] == "db_b"
 
+    def test_database_pool_limits(self):
+        loader = TenantConfigLoader()
+        loader.load_from_dict({
+            "tenants": {
+                "pooled": {"database": {"name": "db_p", "pool": {"min": 2, "max": 20}}},
+                "plain": {"database": {"name": "db_q"}},
+            }
+        })
+
+        assert loader.get_database_config("pooled")["POOL"] == {"MIN": 2, "MAX": 20}
+        assert "POOL" not in loader.get_database_config("plain")
+
     def test_reload(self, tmp_path):
         config_file = tmp_path / "tenants.yml"
         config_file.write_text(yaml.dump({
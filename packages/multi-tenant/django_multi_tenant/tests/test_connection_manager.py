@@ -0,0 +1,221 @@
+"""Tests for lazy tenant database registration and the connection cap."""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(ALLOWED_HOSTS=["*"])
+
+from django.core.signals import request_finished  # noqa: E402
+from django.db import connections  # noqa: E402
+from django.utils.connection import ConnectionDoesNotExist  # noqa: E402
+
+from django_multi_tenant.db.manager import TenantConnectionManager  # noqa: E402
+from django_multi_tenant.db.router import TenantDatabaseRouter  # noqa: E402
+from django_multi_tenant.middleware.tenant_context import (  # noqa: E402
+    TenantInfo,
+    set_current_tenant,
+)
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = TenantConnectionManager()
+    manager.configure({
+        alias: {"ENGINE": "django.db.backends.sqlite3", "NAME": str(tmp_path / f"{alias}.sqlite3")}
+        for alias in ("a", "b", "c")
+    })
+    return manager
+
+
+def request(manager, alias):
+    """What TenantMiddleware does around a view that queries the tenant DB."""
+    manager.checkout(alias)
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT 1")
+    finally:
+        manager.checkin(alias)
+
+
+def in_thread(target):
+    """Run target in a new thread and return a function to finish it."""
+    go, done = threading.Event(), threading.Event()
+
+    def run():
+        target()
+        done.set()
+        go.wait(5)
+        connections.close_all()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert done.wait(5)
+
+    def finish():
+        go.set()
+        thread.join(5)
+
+    return finish
+
+
+class TestRegistration:
+    def test_registered_on_first_use(self, manager):
+        assert "a" not in settings.DATABASES
+        manager.register("a")
+        manager.register("a")
+        assert settings.DATABASES["a"]["ENGINE"] == "django.db.backends.sqlite3"
+        assert manager.snapshot()["registered"] == 1
+        assert manager.registrations == 1
+
+    def test_unknown_alias(self, manager):
+        with pytest.raises(ConnectionDoesNotExist, match="'missing'"):
+            manager.register("missing")
+
+    def test_changed_config_is_replaced_only_if_registered(self, manager, tmp_path):
+        manager.register("a")
+        replaced = manager.configure({
+            "a": {"ENGINE": "django.db.backends.sqlite3", "NAME": str(tmp_path / "a2.sqlite3")},
+            "b": {"ENGINE": "django.db.backends.sqlite3", "NAME": str(tmp_path / "b2.sqlite3")},
+        })
+        assert replaced == ["a"]
+        assert settings.DATABASES["a"]["NAME"].endswith("a2.sqlite3")
+        assert "b" not in settings.DATABASES
+
+
+class TestRouter:
+    @pytest.fixture
+    def router(self, monkeypatch, manager):
+        monkeypatch.setattr("django_multi_tenant.db.router.tenant_connections", manager)
+        yield TenantDatabaseRouter()
+        set_current_tenant(None)
+
+    def model(self, app_label):
+        return SimpleNamespace(_meta=SimpleNamespace(app_label=app_label))
+
+    def test_registers_tenant_database(self, router):
+        set_current_tenant(TenantInfo("tenant-a", "A", database="a"))
+        assert router.db_for_read(self.model("projects")) == "a"
+        assert "a" in settings.DATABASES
+        assert router.db_for_write(self.model("auth")) == "default"
+
+    def test_unknown_database_is_an_error(self, router):
+        set_current_tenant(TenantInfo("tenant-x", "X", database="missing"))
+        with pytest.raises(ConnectionDoesNotExist):
+            router.db_for_read(self.model("projects"))
+
+    def test_no_tenant(self, router):
+        assert router.db_for_read(self.model("projects")) == "default"
+
+
+class TestCap:
+    def test_connect_and_reuse(self, manager):
+        request(manager, "a")
+        request(manager, "a")
+        snapshot = manager.snapshot()
+        assert (snapshot["connects"], snapshot["reuses"], snapshot["open"]) == (1, 1, 1)
+
+    def test_evicts_least_recently_used_idle(self, manager):
+        manager.max_connections = 2
+        request(manager, "a")
+        request(manager, "b")
+        request(manager, "a")
+        request(manager, "c")
+        assert manager.evictions == 1
+        assert manager.open_connections() == 2
+        assert connections["a"].connection is not None
+        assert connections["c"].connection is not None
+
+        # The evicted connection reopens on its next use
+        request(manager, "b")
+        assert manager.connects == 4
+        assert manager.open_connections() == 2
+
+    def test_evicts_other_threads_idle_connections(self, manager):
+        manager.max_connections = 2
+        finish = in_thread(lambda: request(manager, "a"))
+        try:
+            request(manager, "b")
+            request(manager, "c")
+            assert manager.evictions == 1
+            assert manager.open_connections() == 2
+        finally:
+            finish()
+
+    def test_busy_connections_are_never_closed(self, manager):
+        manager.max_connections = 1
+        busy = {}
+
+        def hold():
+            manager.checkout("a")
+            busy["conn"] = connections["a"]
+            with busy["conn"].cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+        finish = in_thread(hold)
+        try:
+            request(manager, "b")
+            assert manager.evictions == 0
+            assert manager.overflows == 1
+            assert busy["conn"].connection is not None
+        finally:
+            finish()
+
+    def test_connections_opened_outside_requests_are_never_closed(self, manager):
+        manager.max_connections = 1
+        conns = {}
+
+        def task():
+            # e.g. a management command or background thread: no checkout/checkin
+            manager.register("a")
+            conns["a"] = connections["a"]
+            with conns["a"].cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+        finish = in_thread(task)
+        try:
+            request(manager, "b")
+            assert manager.evictions == 0
+            assert manager.overflows == 1
+            assert conns["a"].connection is not None
+        finally:
+            finish()
+
+    def test_slot_is_held_until_the_request_finishes(self, manager):
+        manager.max_connections = 1
+        conns = {}
+        go, ready, done = threading.Event(), threading.Event(), threading.Event()
+
+        def streaming_request():
+            manager.checkout("a")
+            conns["a"] = connections["a"]
+            with conns["a"].cursor() as cursor:
+                cursor.execute("SELECT 1")
+            # Middleware returned; the streaming response is still being sent
+            ready.set()
+            go.wait(5)
+            request_finished.send(sender=None)
+            done.set()
+            go.wait(5)
+
+        thread = threading.Thread(target=streaming_request)
+        thread.start()
+        try:
+            assert ready.wait(5)
+            request(manager, "b")
+            assert manager.evictions == 0
+            assert conns["a"].connection is not None
+
+            assert manager.overflows == 1
+
+            # Handed back: no longer blocks the cap
+            go.set()
+            assert done.wait(5)
+            request(manager, "c")
+            assert manager.overflows == 1
+        finally:
+            go.set()
+            thread.join(5)
@@ -0,0 +1,220 @@
+"""Tests for the label-trie domain resolver."""
+
+import re
+import time
+from pathlib import Path
+
+import pytest
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(ALLOWED_HOSTS=["*"])
+
+from django.core.exceptions import ImproperlyConfigured  # noqa: E402
+
+from django_multi_tenant.config.loader import TenantConfigLoader  # noqa: E402
+from django_multi_tenant.middleware.domain_resolver import (  # noqa: E402
+    DomainConflictError,
+    DomainResolver,
+)
+
+PACKAGE_ROOT = Path(__file__).resolve().parents[2]
+REPO_ROOT = PACKAGE_ROOT.parents[1]
+
+
+@pytest.fixture
+def resolver():
+    resolver = DomainResolver(default="default")
+    resolver.add("cms.ntsdgs.tw", "nantou-gov")
+    resolver.add("*.ntsdgs.tw", "ntsdgs")
+    resolver.add("*.edu.ntsdgs.tw", "ntsdgs-edu")
+    resolver.add("*.tplanet.ai", "tplanet")
+    resolver.add("nantou.tplanet.ai", "nantou-gov")
+    return resolver
+
+
+class TestResolve:
+    def test_exact_beats_wildcard(self, resolver):
+        assert resolver.resolve("cms.ntsdgs.tw") == "nantou-gov"
+        assert resolver.resolve("nantou.tplanet.ai") == "nantou-gov"
+
+    def test_wildcard_matches_any_depth(self, resolver):
+        assert resolver.resolve("www.ntsdgs.tw") == "ntsdgs"
+        assert resolver.resolve("a.b.c.tplanet.ai") == "tplanet"
+
+    def test_longest_wildcard_wins(self, resolver):
+        assert resolver.resolve("school.edu.ntsdgs.tw") == "ntsdgs-edu"
+        assert resolver.resolve("a.school.edu.ntsdgs.tw") == "ntsdgs-edu"
+        assert resolver.resolve("edu.ntsdgs.tw") == "ntsdgs"
+
+    def test_wildcard_does_not_match_its_suffix(self, resolver):
+        assert resolver.resolve("ntsdgs.tw") == "default"
+        assert resolver.resolve("tplanet.ai") == "default"
+
+    def test_no_match(self, resolver):
+        assert resolver.resolve("example.com") == "default"
+        assert resolver.resolve("tw") == "default"
+        assert resolver.resolve("") == "default"
+        assert resolver.resolve("xntsdgs.tw") == "default"
+        assert resolver.resolve("a.*.ntsdgs.tw") == "ntsdgs"
+        assert DomainResolver().resolve("cms.ntsdgs.tw") is None
+
+    def test_first_label_is_not_a_tenant_key(self):
+        resolver = DomainResolver.from_tenants({
+            "a": {"domains": ["shop.a.example"]},
+            "b": {"domains": ["shop.b.example"]},
+        })
+        assert resolver.resolve("shop.a.example") == "a"
+        assert resolver.resolve("shop.b.example") == "b"
+        assert resolver.resolve("shop.c.example") is None
+
+    def test_normalizes_configured_domains(self):
+        resolver = DomainResolver()
+        resolver.add(" CMS.ntsdgs.TW. ", "nantou-gov")
+        assert resolver.resolve("cms.ntsdgs.tw") == "nantou-gov"
+
+
+class TestLoad:
+    def test_from_tenants(self):
+        resolver = DomainResolver.from_tenants(
+            {
+                "default": {"name": "Default"},
+                "nantou-gov": {"domains": ["cms.ntsdgs.tw", "*.ntsdgs.tw"]},
+            },
+            default="default",
+        )
+        assert len(resolver) == 2
+        assert resolver.resolve("x.ntsdgs.tw") == "nantou-gov"
+
+    @pytest.mark.parametrize("domain", ["cms.ntsdgs.tw", "*.ntsdgs.tw"])
+    def test_conflicts(self, resolver, domain):
+        with pytest.raises(DomainConflictError, match="'other'"):
+            resolver.add(domain.upper(), "other")
+
+    def test_same_tenant_twice_is_fine(self, resolver):
+        resolver.add("cms.ntsdgs.tw", "nantou-gov")
+        resolver.add("*.ntsdgs.tw", "ntsdgs")
+        assert len(resolver) == 5
+
+    @pytest.mark.parametrize("domain", ["", "*", "*.", "a..b", "a.*.b", "*x.b", "**.b"])
+    def test_invalid_patterns(self, domain):
+        with pytest.raises(ImproperlyConfigured, match="Invalid domain"):
+            DomainResolver().add(domain, "t")
+
+
+@pytest.fixture(scope="module")
+def shipped():
+    loader = TenantConfigLoader()
+    loader.load_from_file(PACKAGE_ROOT / "config" / "tenants.yml")
+    return DomainResolver.from_tenants(loader.tenants, default="default")
+
+
+class TestShippedConfig:
+    """The shipped tenants.yml must route every host nginx forwards."""
+
+    NGINX_CONFIGS = [
+        REPO_ROOT / "nginx" / "multi-tenant.4impact.cc",
+        PACKAGE_ROOT / "docker" / "nginx" / "multi-tenant.4impact.cc.conf",
+        PACKAGE_ROOT / "docker" / "nginx" / "nginx.conf",
+        PACKAGE_ROOT / "docker" / "nginx" / "nginx-test.conf",
+    ]
+    EXPECTED = {
+        "localhost": "default",
+        "tplanet.ai": "default",
+        "multi-tenant.4impact.cc": "default",
+        "nantou.multi-tenant.4impact.cc": "nantou-gov",
+        "cms.ntsdgs.tw": "nantou-gov",
+        # Hosts documented in docker/docker-compose.test.yml
+        "nantou.localhost": "nantou-gov",
+        "nantou.tplanet.local": "nantou-gov",
+        "test.tplanet.local": "default",
+    }
+
+    def server_names(self):
+        names = set()
+        for path in self.NGINX_CONFIGS:
+            for match in re.finditer(r"^\s*server_name\s+([^;]+);", path.read_text(), re.M):
+                names.update(match.group(1).split())
+        return names
+
+    def test_every_server_name_is_expected(self):
+        hosts = {name for name in self.server_names() if "*" not in name}
+        assert hosts - self.EXPECTED.keys() == set()
+
+    @pytest.mark.parametrize("host", sorted(EXPECTED))
+    def test_host_resolves_to_expected_tenant(self, shipped, host):
+        assert shipped.resolve(host) == self.EXPECTED[host]
+
+
+class CountingDict(dict):
+    """A trie node that counts the lookups ``resolve`` makes on it."""
+
+    def __init__(self, items, steps):
+        super().__init__(items)
+        self.steps = steps
+
+    def get(self, key, default=None):
+        self.steps[0] += 1
+        return super().get(key, default)
+
+
+def counting(node, steps):
+    return CountingDict(
+        {k: counting(v, steps) if isinstance(v, dict) else v for k, v in node.items()},
+        steps,
+    )
+
+
+class TestScaling:
+    HOSTS = [
+        "cms.t3.example.tw",          # exact
+        "a.b.t3.example.tw",          # wildcard
+        "unknown.example.tw",         # miss
+    ]
+
+    @staticmethod
+    def build(size):
+        resolver = DomainResolver(default="default")
+        for i in range(size // 2):
+            resolver.add(f"cms.t{i}.example.tw", f"t{i}")
+            resolver.add(f"*.t{i}.example.tw", f"t{i}-wild")
+        return resolver
+
+    def test_lookup_steps_are_independent_of_size(self):
+        """Each lookup visits the same number of nodes at 10 and 50k domains."""
+        visited = {}
+        for size in (10, 50000):
+            resolver = self.build(size)
+            steps = [0]
+            resolver._exact = counting(resolver._exact, steps)
+            resolver._root = counting(resolver._root, steps)
+            visited[size] = []
+            for host in self.HOSTS:
+                steps[0] = 0
+                resolver.resolve(host)
+                visited[size].append(steps[0])
+
+        # One exact probe, then at most two lookups per host label
+        assert visited[10] == visited[50000]
+        assert all(
+            steps <= 1 + 2 * len(host.split("."))
+            for host, steps in zip(self.HOSTS, visited[50000])
+        )
+
+    def test_lookup_cost(self):
+        """Prints per-lookup cost at 10, 1k and 50k domains."""
+        costs = {}
+        for size in (10, 1000, 50000):
+            resolve = self.build(size).resolve
+            hosts = self.HOSTS * 1000
+            best = float("inf")
+            for _ in range(5):
+                started = time.perf_counter()
+                for host in hosts:
+                    resolve(host)
+                best = min(best, time.perf_counter() - started)
+            costs[size] = best / len(hosts)
+
+        print("\nDomainResolver: " + ", ".join(
+            f"{size} domains {cost * 1e9:.0f} ns/lookup" for size, cost in costs.items()
+        ))
@@ -0,0 +1,311 @@
+"""Tests for per-tenant connection pools and the per-process budget."""
+
+import sqlite3
+import threading
+import time
+
+import pytest
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(ALLOWED_HOSTS=["*"])
+
+from django.db import connections  # noqa: E402
+
+from django_multi_tenant.db.aliases import register_databases  # noqa: E402
+from django_multi_tenant.db.pool import (  # noqa: E402
+    POOLED_ENGINE,
+    PoolManager,
+    PoolTimeout,
+    pooled_databases,
+    tenant_pools,
+)
+
+
+@pytest.fixture
+def pools():
+    pools = PoolManager(max_connections=0, max_per_tenant=10, timeout=2)
+    yield pools
+    pools.close_all()
+
+
+@pytest.fixture
+def db(tmp_path):
+    """alias -> (params, connect) for sqlite files standing in for tenant databases."""
+
+    def make(alias):
+        params = {"database": str(tmp_path / f"{alias}.sqlite3")}
+        return params, lambda: sqlite3.connect(params["database"], check_same_thread=False)
+
+    return make
+
+
+def hold(pools, db, alias, started, release, **limits):
+    """Thread target: take a connection, signal, and keep it until released."""
+    params, connect = db(alias)
+    conn = pools.acquire(alias, params, connect, **limits)
+    started.release()
+    release.wait(5)
+    pools.release(alias, conn, params)
+
+
+def run_threads(targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def join(threads):
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive()
+
+
+class TestCheckout:
+    def test_idle_connection_is_reused(self, pools, db):
+        params, connect = db("a")
+        first = pools.acquire("a", params, connect)
+        pools.release("a", first, params)
+        second = pools.acquire("a", params, connect)
+
+        assert second is first
+        stats = pools.snapshot()["tenants"]["a"]
+        assert stats["created"] == 1
+        assert stats["checkouts"] == 2
+        assert stats["in_use"] == 1
+
+    def test_tenant_max_makes_threads_wait(self, pools, db):
+        started, release = threading.Semaphore(0), threading.Event()
+        threads = run_threads(
+            [lambda: hold(pools, db, "a", started, release, max_size=2)] * 4
+        )
+        assert started.acquire(timeout=5) and started.acquire(timeout=5)
+        assert not started.acquire(timeout=0.2)
+        assert pools.snapshot()["tenants"]["a"]["waiting"] == 2
+
+        release.set()
+        join(threads)
+        stats = pools.snapshot()["tenants"]["a"]
+        assert stats["created"] == 2
+        assert stats["checkouts"] == 4
+        assert stats["waits"] == 2
+        assert stats["wait_seconds_max"] >= 0.2
+
+    def test_timeout(self, pools, db):
+        pools.timeout = 0.1
+        params, connect = db("a")
+        pools.acquire("a", params, connect, max_size=1)
+
+        with pytest.raises(PoolTimeout, match="'a'"):
+            pools.acquire("a", params, connect, max_size=1)
+        stats = pools.snapshot()["tenants"]["a"]
+        assert stats["timeouts"] == 1
+        assert stats["wait_seconds_total"] >= 0.1
+
+    def test_broken_idle_connection_is_replaced(self, pools, db):
+        params, connect = db("a")
+        conn = pools.acquire("a", params, connect)
+        pools.release("a", conn, params)
+        conn.close()
+
+        replacement = pools.acquire("a", params, connect)
+        assert replacement is not conn
+        replacement.execute("SELECT 1")
+        stats = pools.snapshot()["tenants"]["a"]
+        assert stats["health_check_failures"] == 1
+        assert stats["size"] == 1
+
+    def test_failed_connect_frees_the_slot(self, pools, db):
+        params, _ = db("a")
+
+        def connect():
+            raise sqlite3.OperationalError("unable to open database file")
+
+        with pytest.raises(sqlite3.OperationalError):
+            pools.acquire("a", params, connect, max_size=1)
+        assert pools.snapshot()["open"] == 0
+
+    def test_changed_params_drop_old_connections(self, pools, db, tmp_path):
+        params, connect = db("a")
+        idle, busy = pools.acquire("a", params, connect), pools.acquire("a", params, connect)
+        pools.release("a", idle, params)
+
+        moved = {"database": str(tmp_path / "moved.sqlite3")}
+        new = pools.acquire("a", moved, connect)
+        assert new is not idle
+        # Returned after the change: closed rather than pooled
+        pools.release("a", busy, params)
+        pools.release("a", new, moved)
+        stats = pools.snapshot()["tenants"]["a"]
+        assert stats["closed"] == 2
+        assert stats["size"] == stats["idle"] == 1
+
+
+class TestBudget:
+    def test_ceiling_holds_under_concurrency(self, pools, db):
+        pools.max_connections = 3
+        errors = []
+
+        def work(alias):
+            params, connect = db(alias)
+            try:
+                for _ in range(20):
+                    conn = pools.acquire(alias, params, connect)
+                    conn.execute("SELECT 1")
+                    time.sleep(0.001)
+                    pools.release(alias, conn, params)
+            except Exception as e:
+                errors.append(e)
+
+        join(run_threads([lambda alias=alias: work(alias) for alias in "abc" * 3]))
+
+        assert errors == []
+        snapshot = pools.snapshot()
+        assert snapshot["peak"] <= 3
+        assert sum(t["checkouts"] for t in snapshot["tenants"].values()) == 180
+
+    def test_busy_tenant_reclaims_idle_slots(self, pools, db):
+        pools.max_connections = 3
+        params, connect = db("a")
+        held = [pools.acquire("a", params, connect) for _ in range(3)]
+        for conn in held:
+            pools.release("a", conn, params)
+
+        params_b, connect_b = db("b")
+        started = time.monotonic()
+        pools.acquire("b", params_b, connect_b)
+
+        assert time.monotonic() - started < 1
+        snapshot = pools.snapshot()
+        assert snapshot["open"] == 3
+        assert snapshot["tenants"]["a"]["reclaimed"] == 1
+        assert snapshot["tenants"]["b"]["waits"] == 0
+
+    def test_reclaims_only_when_it_makes_room(self, pools, db):
+        pools.max_connections = 4
+        pools.timeout = 0.1
+        params, connect = db("a")
+        held = [pools.acquire("a", params, connect) for _ in range(3)]
+        for conn in held:
+            pools.release("a", conn, params)
+        params_c, connect_c = db("c")
+        pools.acquire("c", params_c, connect_c, min_size=1)
+        # Raising c's reservation takes one of a's idle connections
+        pools.acquire("c", params_c, connect_c, min_size=3)
+
+        # One more freed slot would still leave b short of c's reservation
+        params_b, connect_b = db("b")
+        with pytest.raises(PoolTimeout):
+            pools.acquire("b", params_b, connect_b)
+        stats = pools.snapshot()["tenants"]["a"]
+        assert stats["reclaimed"] == 1
+        assert stats["idle"] == 2
+
+    def test_min_is_reserved(self, pools, db):
+        pools.max_connections = 2
+        pools.timeout = 0.1
+        params_b, connect_b = db("b")
+        pools.release("b", pools.acquire("b", params_b, connect_b, min_size=1), params_b)
+        params, connect = db("a")
+        pools.acquire("a", params, connect)
+
+        # b's idle connection is within its min, so it can't be reclaimed
+        with pytest.raises(PoolTimeout):
+            pools.acquire("a", params, connect)
+        assert pools.snapshot()["tenants"]["b"]["idle"] == 1
+
+    def test_released_connection_goes_to_waiting_tenant(self, pools, db):
+        pools.max_connections = 2
+        params, connect = db("a")
+        held = [pools.acquire("a", params, connect) for _ in range(2)]
+
+        started, release = threading.Semaphore(0), threading.Event()
+        threads = run_threads([lambda: hold(pools, db, "b", started, release)])
+        assert not started.acquire(timeout=0.1)
+
+        pools.release("a", held[0], params)
+        assert started.acquire(timeout=5)
+        snapshot = pools.snapshot()
+        assert snapshot["tenants"]["a"]["idle"] == 0
+        assert snapshot["tenants"]["b"]["in_use"] == 1
+        assert snapshot["open"] == 2
+        release.set()
+        join(threads)
+
+
+class TestPooledBackend:
+    @pytest.fixture
+    def aliases(self, tmp_path):
+        databases = pooled_databases(
+            {
+                "a": {"ENGINE": "django.db.backends.sqlite3", "NAME": str(tmp_path / "a.sqlite3")},
+                "b": {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": str(tmp_path / "b.sqlite3"),
+                    "POOL": {"MAX": 1},
+                },
+            },
+            {"MAX_PER_TENANT": 2},
+        )
+        register_databases(databases)
+        tenant_pools.configure({"MAX_CONNECTIONS": 3, "TIMEOUT": 5})
+        yield databases
+        tenant_pools.configure({"MAX_CONNECTIONS": 0, "TIMEOUT": 10})
+
+    def test_configs(self, aliases):
+        assert aliases["a"]["ENGINE"] == POOLED_ENGINE
+        assert aliases["a"]["CONN_MAX_AGE"] == 0
+        assert aliases["a"]["POOL"] == {"ENGINE": "django.db.backends.sqlite3", "MIN": 0, "MAX": 2}
+        assert aliases["b"]["POOL"]["MAX"] == 1
+
+    def test_close_returns_connection_to_pool(self, aliases):
+        wrapper = connections["a"]
+        assert wrapper.vendor == "sqlite"
+        with wrapper.cursor() as cursor:
+            cursor.execute("CREATE TABLE t (x INTEGER)")
+        raw = wrapper.connection
+        wrapper.close()
+
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM t")
+            assert cursor.fetchone() == (0,)
+        assert wrapper.connection is raw
+        assert tenant_pools.snapshot()["tenants"]["a"]["created"] == 1
+
+    def test_open_transaction_is_rolled_back(self, aliases):
+        wrapper = connections["a"]
+        with wrapper.cursor() as cursor:
+            cursor.execute("CREATE TABLE t (x INTEGER)")
+        wrapper.set_autocommit(False)
+        with wrapper.cursor() as cursor:
+            cursor.execute("INSERT INTO t VALUES (1)")
+        wrapper.close()
+
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM t")
+            assert cursor.fetchone() == (0,)
+
+    def test_threads_share_the_budget(self, aliases):
+        errors = []
+
+        def work(alias):
+            try:
+                for _ in range(10):
+                    with connections[alias].cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    # What request_finished does with CONN_MAX_AGE 0
+                    connections[alias].close()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        join(run_threads([lambda alias=alias: work(alias) for alias in "ab" * 4]))
+
+        assert errors == []
+        snapshot = tenant_pools.snapshot()
+        assert snapshot["peak"] <= 3
+        assert snapshot["tenants"]["b"]["size"] <= 1
+        assert snapshot["tenants"]["a"]["checkouts"] == 40
+        assert snapshot["tenants"]["a"]["created"] <= 2
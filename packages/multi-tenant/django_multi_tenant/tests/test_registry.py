@@ -0,0 +1,208 @@
+"""Tests for hot reloading of tenants.yml."""
+
+import os
+import signal
+import time
+
+import pytest
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(ALLOWED_HOSTS=["*"])
+
+from django.core.management import call_command  # noqa: E402
+from django.core.management.base import CommandError  # noqa: E402
+from django.db import connections  # noqa: E402
+from django.http import HttpResponse  # noqa: E402
+from django.test import RequestFactory, override_settings  # noqa: E402
+
+from django_multi_tenant.config.registry import TenantRegistry  # noqa: E402
+from django_multi_tenant.db.aliases import close_stale_connections  # noqa: E402
+from django_multi_tenant.db.manager import tenant_connections  # noqa: E402
+from django_multi_tenant.management.commands.reload_tenants import (  # noqa: E402
+    Command as ReloadTenants,
+)
+from django_multi_tenant.middleware.tenant_middleware import TenantMiddleware  # noqa: E402
+
+
+def tenants_yml(tmp_path, name="Nantou", db="nantou", extra=""):
+    return f"""
+tenants:
+  default:
+    name: Default
+  nantou-gov:
+    name: {name}
+    domains: [cms.ntsdgs.tw]
+    database:
+      alias: nantou_db
+      engine: django.db.backends.sqlite3
+      name: {tmp_path / db}.sqlite3
+{extra}"""
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / "tenants.yml"
+
+    def write(**kwargs):
+        path.write_text(tenants_yml(tmp_path, **kwargs))
+        # Make the change visible to mtime polling even within one clock tick
+        stamp = time.time_ns() + next(ticks) * 1_000_000_000
+        os.utime(path, ns=(stamp, stamp))
+        return path
+
+    ticks = iter(range(1, 1000))
+    write()
+    return write
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class TestReload:
+    def test_databases_are_registered_on_first_use(self, config):
+        registry = TenantRegistry(config())
+        assert registry.current.number == 1
+        assert "nantou_db" not in settings.DATABASES
+
+        tenant_connections.register("nantou_db")
+        assert settings.DATABASES["nantou_db"]["ENGINE"] == "django.db.backends.sqlite3"
+        assert connections.settings["nantou_db"]["ATOMIC_REQUESTS"] is False
+        # The default alias stays as settings.py defines it
+        assert connections.settings["default"]["ENGINE"] == "django.db.backends.dummy"
+
+    def test_reload_swaps_generation(self, config):
+        registry = TenantRegistry(config())
+        old = registry.current
+        assert registry.reload() is False
+
+        config(extra='  tplanet:\n    name: TPlanet\n    domains: ["*.tplanet.ai"]\n')
+        assert registry.reload() is True
+        new = registry.current
+        assert new.number == 2
+        assert new.resolver.resolve("a.b.tplanet.ai") == "tplanet"
+        assert "tplanet" not in old.tenant_infos
+        assert old.resolver.resolve("a.b.tplanet.ai") == "default"
+        assert registry.snapshot()["reloads"] == 1
+
+    @pytest.mark.parametrize(
+        "content, error",
+        [
+            ("tenants: [unclosed", "ParserError"),
+            ("", "ValueError"),
+            (
+                "tenants:\n  a: {domains: [x.example]}\n  b: {domains: [x.example]}\n",
+                "DomainConflictError",
+            ),
+        ],
+    )
+    def test_invalid_config_keeps_generation(self, config, content, error):
+        path = config()
+        registry = TenantRegistry(path)
+        current = registry.current
+        path.write_text(content)
+        assert registry.reload() is False
+        assert registry.current is current
+        assert registry.failures == 1
+        assert error in registry.last_error
+
+        config(name="Fixed")
+        assert registry.reload() is True
+        assert registry.last_error is None
+
+    def test_changed_database_reconnects_between_requests(self, config):
+        registry = TenantRegistry(config())
+        tenant_connections.register("nantou_db")
+        conn = connections["nantou_db"]
+        conn.ensure_connection()
+
+        config(db="nantou2")
+        assert registry.reload() is True
+        # Open connections keep working until the thread's next request
+        assert connections["nantou_db"] is conn
+        assert conn.is_usable()
+
+        close_stale_connections()
+        assert conn.connection is None
+        assert connections["nantou_db"].settings_dict["NAME"].endswith("nantou2.sqlite3")
+
+    def test_polling(self, config):
+        registry = TenantRegistry(config(), reload_interval=0.02)
+        registry.start()
+        try:
+            config(name="Polled")
+            wait_for(lambda: registry.current.number == 2)
+            assert registry.current.tenant_infos["nantou-gov"].name == "Polled"
+        finally:
+            registry.stop()
+
+    def test_signal(self, config):
+        previous = signal.getsignal(signal.SIGUSR2)
+        path = config()
+        registry = TenantRegistry(path, reload_signal="SIGUSR2")
+        registry.start()
+        try:
+            path.write_text(tenants_yml(path.parent, name="Signalled"))
+            os.kill(os.getpid(), signal.SIGUSR2)
+            wait_for(lambda: registry.current.number == 2)
+        finally:
+            registry.stop()
+        assert signal.getsignal(signal.SIGUSR2) == previous
+
+
+class TestMiddleware:
+    def test_in_flight_request_keeps_its_generation(self, config):
+        path = config()
+        seen = {}
+
+        def view(request):
+            config(name="Nantou 2")
+            assert middleware.registry.reload()
+            seen["tenant"] = request.tenant
+            seen["live"] = middleware.tenant_infos["nantou-gov"]
+            return HttpResponse()
+
+        with override_settings(MULTI_TENANT={"CONFIG_PATH": str(path)}):
+            middleware = TenantMiddleware(view)
+        request = RequestFactory().get("/", HTTP_HOST="cms.ntsdgs.tw")
+        middleware(request)
+        assert seen["tenant"].name == "Nantou"
+        assert seen["live"].name == "Nantou 2"
+
+        middleware.get_response = lambda request: HttpResponse()
+        middleware(request)
+        assert request.tenant.name == "Nantou 2"
+
+
+class TestReloadCommand:
+    def test_check(self, config, capsys):
+        call_command(ReloadTenants(), "--check", config=str(config()))
+        assert "2 tenants, 1 domains, 2 databases" in capsys.readouterr().out
+
+    def test_from_replaces_config(self, config, tmp_path):
+        path = config()
+        new = tmp_path / "new.yml"
+        new.write_text(tenants_yml(tmp_path, name="Published"))
+        call_command(ReloadTenants(), config=str(path), source=str(new))
+        assert "Published" in path.read_text()
+
+    def test_invalid_config_is_not_published(self, config, tmp_path):
+        path = config()
+        before = path.read_text()
+        new = tmp_path / "new.yml"
+        new.write_text("tenants:\n  a: {domains: [x.example]}\n  b: {domains: [x.example]}\n")
+        with pytest.raises(CommandError, match="claimed by both"):
+            call_command(ReloadTenants(), config=str(path), source=str(new))
+        assert path.read_text() == before
+
+    def test_pid_requires_reload_signal(self, config):
+        path = config()
+        before = path.stat().st_mtime_ns
+        with override_settings(MULTI_TENANT={}):
+            with pytest.raises(CommandError, match="RELOAD_SIGNAL not configured"):
+                call_command(ReloadTenants(), config=str(path), pids=[os.getpid()])
+        assert path.stat().st_mtime_ns == before
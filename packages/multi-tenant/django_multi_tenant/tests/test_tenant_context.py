@@ -1,5 +1,8 @@
 """Tests for tenant context management."""
 
+import dataclasses
+import json
+
 import pytest
 
 from django_multi_tenant.middleware.tenant_context import (
@@ -43,6 +46,63 @@ class TestTenantInfo:
         assert tenant.get_theme("secondary_color") is None
         assert tenant.get_theme("secondary_color", "#000000") == "#000000"
 
+    def test_nested_sections_by_dotted_key(self):
+        tenant = TenantInfo(
+            tenant_id="test",
+            name="Test",
+            config={"features": {"ai_secretary": {"model": "gpt"}}},
+        )
+        assert tenant.get_feature("ai_secretary") == {"model": "gpt"}
+        assert tenant.get_feature("ai_secretary.model") == "gpt"
+
+    def test_is_immutable(self):
+        config = {"features": {"nft": False}, "domains": ["a.example.com"]}
+        tenant = TenantInfo(tenant_id="test", name="Test", config=config)
+
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            tenant.name = "Other"
+        with pytest.raises(TypeError):
+            tenant.config["features"]["nft"] = True
+        with pytest.raises(TypeError):
+            tenant.features["nft"] = True
+        assert tenant.config["domains"] == ("a.example.com",)
+
+        # The caller's dict is copied, not shared
+        config["features"]["nft"] = True
+        assert tenant.get_feature("nft") is False
+
+    def test_to_dict_is_plain(self):
+        config = {"features": {"ai_secretary": {"model": "gpt"}}, "domains": ["a.example.com"]}
+        tenant = TenantInfo("test", "Test", "test_db", config)
+
+        data = tenant.to_dict()
+        assert data == {"tenant_id": "test", "name": "Test", "database": "test_db", "config": config}
+        assert type(data["config"]["features"]) is dict
+        assert type(data["config"]["domains"]) is list
+        assert json.loads(json.dumps(data)) == data
+
+        # A copy: changing it leaves the tenant alone
+        data["config"]["domains"].append("b.example.com")
+        assert tenant.config["domains"] == ("a.example.com",)
+
+    def test_equality_and_hash(self):
+        a = TenantInfo("test", "Test", "test_db", {"features": {"x": 1}})
+        b = TenantInfo(tenant_id="test", name="Test", database="test_db", config={"features": {"x": 1}})
+        assert a == b
+        assert hash(a) == hash(b)
+        assert a != TenantInfo("test", "Test", "test_db", {"features": {"x": 2}})
+        assert TenantInfo("test", "Test").config == {}
+
+    def test_from_config(self):
+        tenant = TenantInfo.from_config("nantou-gov", {
+            "name": "Nantou",
+            "database": {"alias": "nantou_db"},
+        })
+        assert tenant == TenantInfo(
+            "nantou-gov", "Nantou", "nantou_db", {"name": "Nantou", "database": {"alias": "nantou_db"}},
+        )
+        assert TenantInfo.from_config("t", {}).database == "t"
+
 
 class TestTenantContextVar:
     def test_get_current_tenant_default(self):
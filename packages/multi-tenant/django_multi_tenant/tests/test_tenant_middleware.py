@@ -0,0 +1,179 @@
+"""Tests for tenant resolution in TenantMiddleware."""
+
+import time
+
+import pytest
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(ALLOWED_HOSTS=["*"])
+
+from django.core.exceptions import DisallowedHost  # noqa: E402
+from django.http import HttpResponse  # noqa: E402
+from django.test import RequestFactory, override_settings  # noqa: E402
+
+from django_multi_tenant.middleware.domain_resolver import DomainConflictError  # noqa: E402
+from django_multi_tenant.middleware.tenant_context import TenantInfo  # noqa: E402
+from django_multi_tenant.middleware.tenant_middleware import (  # noqa: E402
+    HostCache,
+    TenantMiddleware,
+)
+
+TENANTS = """
+tenants:
+  default:
+    name: Default
+  nantou-gov:
+    name: Nantou
+    domains: [nantou.tplanet.ai, cms.ntsdgs.tw]
+    database: {alias: nantou_db}
+    features: {ai_secretary: true}
+"""
+
+
+@pytest.fixture
+def make_middleware(tmp_path):
+    def make(tenants=TENANTS, **multi_tenant):
+        path = tmp_path / "tenants.yml"
+        path.write_text(tenants)
+        with override_settings(MULTI_TENANT={"CONFIG_PATH": str(path), **multi_tenant}):
+            return TenantMiddleware(lambda request: HttpResponse())
+
+    return make
+
+
+def get(host, **headers):
+    return RequestFactory().get("/", HTTP_HOST=host, **headers)
+
+
+class TestResolution:
+    def test_priority(self, make_middleware):
+        middleware = make_middleware()
+        resolve = middleware._resolve_tenant
+        assert resolve(get("x.example.com", HTTP_X_TENANT_ID="nantou-gov")).tenant_id == "nantou-gov"
+        assert resolve(get("cms.ntsdgs.tw")).tenant_id == "nantou-gov"
+        assert resolve(get("cms.ntsdgs.tw:8000")).tenant_id == "nantou-gov"
+        assert resolve(get("nantou.example.com")).tenant_id == "default"
+        assert resolve(get("other.example.com")).tenant_id == "default"
+        assert resolve(get("x.example.com", HTTP_X_TENANT_ID="unknown")).tenant_id == "default"
+
+    def test_wildcards(self, make_middleware):
+        middleware = make_middleware(TENANTS + """\
+  tplanet:
+    name: TPlanet
+    domains: ["*.tplanet.ai"]
+""")
+        resolve = middleware._resolve_tenant
+        assert resolve(get("nantou.tplanet.ai")).tenant_id == "nantou-gov"
+        assert resolve(get("a.b.tplanet.ai")).tenant_id == "tplanet"
+        assert resolve(get("tplanet.ai")).tenant_id == "default"
+
+    def test_domain_conflict_fails_at_load(self, make_middleware):
+        with pytest.raises(DomainConflictError, match="cms.ntsdgs.tw"):
+            make_middleware(TENANTS + """\
+  other:
+    name: Other
+    domains: [CMS.ntsdgs.tw]
+""")
+
+    def test_no_default(self, make_middleware):
+        middleware = make_middleware(DEFAULT_TENANT="")
+        assert middleware._resolve_tenant(get("other.example.com")) is None
+
+    def test_tenants_are_built_once_and_shared(self, make_middleware):
+        middleware = make_middleware()
+        first = middleware._resolve_tenant(get("cms.ntsdgs.tw"))
+        assert middleware._resolve_tenant(get("cms.ntsdgs.tw")) is first
+        assert middleware._resolve_tenant(get("a", HTTP_X_TENANT_ID="nantou-gov")) is first
+        assert first == TenantInfo(
+            "nantou-gov",
+            "Nantou",
+            "nantou_db",
+            {
+                "name": "Nantou",
+                "domains": ["nantou.tplanet.ai", "cms.ntsdgs.tw"],
+                "database": {"alias": "nantou_db"},
+                "features": {"ai_secretary": True},
+            },
+        )
+        assert first.get_feature("ai_secretary") is True
+
+    def test_request_attributes(self, make_middleware):
+        seen = {}
+
+        def view(request):
+            seen["tenant"] = request.tenant
+            return HttpResponse()
+
+        middleware = make_middleware()
+        middleware.get_response = view
+        middleware(get("nantou.tplanet.ai"))
+        assert seen["tenant"] is middleware.tenant_infos["nantou-gov"]
+
+
+    def test_tenant_database_registered_on_first_request(self, make_middleware):
+        middleware = make_middleware()
+        assert "nantou_db" not in settings.DATABASES
+        middleware(get("other.example.com"))
+        assert "nantou_db" not in settings.DATABASES
+        middleware(get("cms.ntsdgs.tw"))
+        assert settings.DATABASES["nantou_db"]["NAME"] == "tplanet_nantou_gov"
+
+
+class TestHostCache:
+    def test_caches_by_host(self, make_middleware):
+        middleware = make_middleware()
+        for _ in range(3):
+            middleware._resolve_tenant(get("cms.ntsdgs.tw"))
+        middleware._resolve_tenant(get("other.example.com"))
+        assert middleware.host_cache.snapshot() == {"size": 2, "hits": 2, "misses": 2}
+
+    def test_disallowed_hosts_are_not_cached(self, make_middleware):
+        middleware = make_middleware()
+        with override_settings(ALLOWED_HOSTS=["cms.ntsdgs.tw"]):
+            for _ in range(2):
+                with pytest.raises(DisallowedHost):
+                    middleware._resolve_tenant(get("evil.example.com"))
+        assert len(middleware.host_cache) == 0
+
+    def test_lru_eviction(self):
+        cache = HostCache(maxsize=2)
+        cache.put(("a",), None)
+        cache.put(("b",), None)
+        cache.get(("a",))
+        cache.put(("c",), None)
+        assert cache.get(("b",), "missing") == "missing"
+        assert cache.get(("a",), "missing") is None
+
+    def test_disabled(self, make_middleware):
+        middleware = make_middleware(HOST_CACHE_SIZE=0)
+        middleware._resolve_tenant(get("cms.ntsdgs.tw"))
+        assert len(middleware.host_cache) == 0
+        assert middleware._resolve_tenant(get("cms.ntsdgs.tw")).tenant_id == "nantou-gov"
+
+
+class TestOverhead:
+    def test_middleware_cost(self, make_middleware):
+        tenants = "tenants:\n  default:\n    name: Default\n" + "".join(
+            f"  t{i}:\n    name: T{i}\n    domains: [t{i}.tplanet.ai]\n"
+            "    features: {ai_secretary: true}\n"
+            for i in range(100)
+        )
+        requests = [get(f"t{i % 100}.tplanet.ai") for i in range(1000)]
+        results = {}
+        for label, size in (("uncached", 0), ("cached", 1024)):
+            middleware = make_middleware(tenants, HOST_CACHE_SIZE=size)
+            for request in requests:
+                middleware(request)
+            n = 10
+            started = time.perf_counter()
+            for _ in range(n):
+                for request in requests:
+                    middleware(request)
+            results[label] = (time.perf_counter() - started) / (n * len(requests))
+
+        print(
+            f"\nTenantMiddleware: {results['uncached'] * 1e6:.1f} µs/request uncached, "
+            f"{results['cached'] * 1e6:.1f} µs/request with the host cache"
+        )
+        assert results["cached"] < results["uncached"]
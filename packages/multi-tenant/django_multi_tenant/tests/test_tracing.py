@@ -0,0 +1,153 @@
+"""Tests for W3C trace context propagation."""
+
+import json
+
+import pytest
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(ALLOWED_HOSTS=["*"])
+
+from django.http import HttpResponse  # noqa: E402
+from django.test import RequestFactory, override_settings  # noqa: E402
+
+from django_multi_tenant.middleware.tenant_context import get_current_tenant  # noqa: E402
+from django_multi_tenant.middleware.tenant_middleware import TenantMiddleware  # noqa: E402
+from django_multi_tenant.middleware.tracing import (  # noqa: E402
+    Tracer,
+    create_exporter,
+    get_current_trace,
+    outgoing_headers,
+    parse_traceparent,
+    register_exporter,
+)
+
+PARENT = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+exported = ListExporter()
+register_exporter("memory", lambda url: exported)
+
+
+@pytest.fixture
+def tenants_file(tmp_path):
+    path = tmp_path / "tenants.yml"
+    path.write_text(
+        "tenants:\n"
+        "  default:\n"
+        "    name: Default\n"
+        "  nantou-gov:\n"
+        "    name: Nantou\n"
+        "    domains: [nantou.tplanet.ai]\n"
+    )
+    return path
+
+
+def make_middleware(tenants_file, view, **tracing):
+    multi_tenant = {"CONFIG_PATH": str(tenants_file), "TRACING": tracing}
+    with override_settings(MULTI_TENANT=multi_tenant):
+        return TenantMiddleware(view)
+
+
+class TestTraceparent:
+    def test_parse(self):
+        assert parse_traceparent(PARENT) == (
+            "0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331", 1,
+        )
+
+    @pytest.mark.parametrize("value", [
+        None,
+        "garbage",
+        "ff-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01",
+        "00-00000000000000000000000000000000-b7ad6b7169203331-01",
+        "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01-extra",
+    ])
+    def test_rejects_invalid(self, value):
+        assert parse_traceparent(value) is None
+
+    def test_sampling_is_parent_based(self):
+        tracer = Tracer(ListExporter(), sample_rate=0.0)
+        assert not tracer.start_trace(None).sampled
+        assert tracer.start_trace(PARENT).recording
+        assert not Tracer().start_trace(PARENT).recording
+
+    def test_unknown_exporter(self):
+        with pytest.raises(ValueError):
+            create_exporter("kafka://broker")
+
+
+class TestMiddleware:
+    def setup_method(self):
+        exported.spans.clear()
+
+    def test_propagates_trace_and_tenant(self, tenants_file):
+        seen = {}
+
+        def view(request):
+            seen["headers"] = outgoing_headers()
+            seen["trace"] = request.trace
+            return HttpResponse(status=201)
+
+        middleware = make_middleware(tenants_file, view, EXPORTER="memory://")
+        request = RequestFactory().get(
+            "/api/projects", HTTP_HOST="nantou.tplanet.ai", HTTP_TRACEPARENT=PARENT,
+        )
+        middleware(request)
+
+        trace = seen["trace"]
+        assert seen["headers"] == {
+            "traceparent": trace.traceparent(),
+            "X-Tenant-ID": "nantou-gov",
+        }
+        assert trace.trace_id == "0af7651916cd43dd8448eb211c80319c"
+        assert get_current_trace() is None and get_current_tenant() is None
+
+        spans = {s["name"]: s for s in exported.spans}
+        root = spans["django.request"]
+        assert root["span_id"] == trace.span_id
+        assert root["parent_id"] == "b7ad6b7169203331"
+        assert root["service"] == "django"
+        assert root["attributes"] == {
+            "method": "GET", "path": "/api/projects", "status": 201, "tenant": "nantou-gov",
+        }
+        assert spans["tenant.resolve"]["parent_id"] == trace.span_id
+
+    def test_starts_a_trace_without_a_parent(self, tenants_file):
+        middleware = make_middleware(tenants_file, lambda r: HttpResponse(), EXPORTER="memory://")
+        middleware(RequestFactory().get("/", HTTP_HOST="other.example.com"))
+
+        [root] = [s for s in exported.spans if s["name"] == "django.request"]
+        assert root["parent_id"] is None
+        assert root["attributes"]["tenant"] == "default"
+
+    def test_disabled_still_propagates(self, tenants_file):
+        seen = {}
+
+        def view(request):
+            seen["headers"] = outgoing_headers()
+            return HttpResponse()
+
+        middleware = make_middleware(tenants_file, view)
+        middleware(RequestFactory().get("/", HTTP_HOST="nantou.tplanet.ai", HTTP_TRACEPARENT=PARENT))
+
+        assert seen["headers"]["traceparent"].startswith("00-0af7651916cd43dd8448eb211c80319c-")
+        assert exported.spans == []
+
+    def test_file_exporter(self, tenants_file, tmp_path):
+        spans_file = tmp_path / "spans.jsonl"
+        middleware = make_middleware(
+            tenants_file, lambda r: HttpResponse(), EXPORTER=f"file://{spans_file}",
+        )
+        middleware(RequestFactory().get("/", HTTP_HOST="nantou.tplanet.ai"))
+        middleware.tracer.exporter.close()
+
+        names = [json.loads(line)["name"] for line in spans_file.read_text().splitlines()]
+        assert names == ["tenant.resolve", "django.request"]
@@ -0,0 +1,176 @@
+# llmtwins_wrapper/accesslog.py
+"""
+Structured access log (JSON lines), written off the event loop
+
+Request coroutines only append a tuple to a bounded in-memory queue; a
+background thread drains it in batches, formats the records as JSON and
+writes each batch with one call. When the queue is full new records are
+dropped and counted instead of blocking requests.
+
+Successful requests can be sampled per tenant (``ACCESS_LOG_SAMPLE``,
+e.g. ``*=0.1,nantou-gov=1``); 4xx/5xx responses are always logged.
+"""
+
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, TextIO
+
+from config import WrapperConfig, config
+
+logger = logging.getLogger(__name__)
+
+
+class AccessLog:
+    def __init__(
+        self,
+        target: Optional[str],
+        max_queue: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 0.5,
+        sample_rates: Optional[Dict[str, float]] = None,
+    ):
+        self.target = target
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rates = dict(sample_rates or {})
+        self.default_rate = self.sample_rates.pop("*", 1.0)
+
+        # deque append/popleft are thread-safe; only the writer pops
+        self._queue: Deque[tuple] = deque()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._stream: Optional[TextIO] = None
+
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+
+    @classmethod
+    def from_config(cls, cfg: WrapperConfig) -> "AccessLog":
+        return cls(
+            cfg.access_log or None,
+            max_queue=cfg.access_log_max_queue,
+            batch_size=cfg.access_log_batch_size,
+            flush_interval=cfg.access_log_flush_interval,
+            sample_rates=cfg.access_log_sample,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.target is not None
+
+    def record(
+        self,
+        tenant: str,
+        method: str,
+        route: str,
+        status: int,
+        duration: float,
+        ttfb: float,
+        bytes_in: int,
+        bytes_out: int,
+    ) -> None:
+        """Queue one request (called on the event loop; never blocks)"""
+        if status < 400:
+            rate = self.sample_rates.get(tenant, self.default_rate)
+            if rate < 1.0 and random.random() >= rate:
+                self.sampled_out += 1
+                return
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._queue.append(
+            (time.time(), tenant, method, route, status, duration, ttfb, bytes_in, bytes_out)
+        )
+        if len(self._queue) == self.batch_size:
+            self._wake.set()
+
+    # ---- writer ----
+
+    @staticmethod
+    def format(record: tuple) -> str:
+        ts, tenant, method, route, status, duration, ttfb, bytes_in, bytes_out = record
+        return json.dumps({
+            "ts": round(ts, 3),
+            "tenant": tenant,
+            "method": method,
+            "route": route,
+            "status": status,
+            "duration_ms": round(1000 * duration, 2),
+            "ttfb_ms": round(1000 * ttfb, 2),
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+        }, separators=(",", ":")) + "\n"
+
+    def flush(self, stream: Optional[TextIO] = None) -> int:
+        """Write everything queued so far in batches; returns the count"""
+        stream = stream or self._stream
+        total = 0
+        while self._queue:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self.format(self._queue.popleft()))
+            stream.write("".join(batch))
+            total += len(batch)
+        if total:
+            stream.flush()
+            self.written += total
+        return total
+
+    def _open(self) -> TextIO:
+        if self.target == "-":
+            return sys.stdout
+        directory = os.path.dirname(self.target)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return open(self.target, "a", buffering=1 << 16)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing the access log failed")
+            if self._stopping:
+                return
+
+    def start(self) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        self._stream = self._open()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Flush what is queued and stop the writer"""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        if self._stream is not sys.stdout:
+            self._stream.close()
+        self._stream = None
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "queued": len(self._queue),
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+        }
+
+
+access_log = AccessLog.from_config(config)
@@ -0,0 +1,138 @@
+# llmtwins_wrapper/balancer.py
+"""
+Upstream selection across several LLMTwins nodes
+
+LLMTwins keeps session state on local disk, so every request for a given
+``{tenant}__{session_id}`` must land on the same node. Sessions are placed
+on a consistent-hash ring (with virtual nodes), which keeps remapping to
+roughly 1/N of sessions when a node is added or removed. Requests without
+a session go to the node with the fewest outstanding requests.
+"""
+
+import bisect
+import hashlib
+from typing import Callable, Dict, Iterable, List, Optional
+
+from config import WrapperConfig, config
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring with ``replicas`` virtual nodes per node"""
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 160):
+        self.replicas = replicas
+        self._keys: List[int] = []
+        self._owners: List[str] = []
+        self.nodes: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            index = bisect.bisect(self._keys, point)
+            self._keys.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: str) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        kept = [(k, o) for k, o in zip(self._keys, self._owners) if o != node]
+        self._keys = [k for k, _ in kept]
+        self._owners = [o for _, o in kept]
+
+    def get(self, key: str) -> Optional[str]:
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[index]
+
+
+class UpstreamPool:
+    """
+    Picks an LLMTwins base URL per request.
+
+    Usage:
+        base_url = upstreams.acquire(session_key)
+        try:
+            ...
+        finally:
+            upstreams.release(base_url)
+    """
+
+    def __init__(self, urls: Iterable[str], replicas: int = 160):
+        self.ring = HashRing(replicas=replicas)
+        self.outstanding: Dict[str, int] = {}
+        for url in urls:
+            self.add(url)
+
+    @classmethod
+    def from_config(cls, cfg: WrapperConfig) -> "UpstreamPool":
+        return cls(cfg.llmtwins_base_urls, replicas=cfg.upstream_hash_replicas)
+
+    @property
+    def urls(self) -> List[str]:
+        return list(self.ring.nodes)
+
+    def add(self, url: str) -> None:
+        url = url.rstrip("/")
+        self.ring.add(url)
+        self.outstanding.setdefault(url, 0)
+
+    def remove(self, url: str) -> None:
+        url = url.rstrip("/")
+        self.ring.remove(url)
+        # Keep the counter until in-flight requests release it
+        if not self.outstanding.get(url):
+            self.outstanding.pop(url, None)
+
+    def pick(
+        self,
+        session_key: Optional[str] = None,
+        available: Optional[Callable[[str], bool]] = None,
+    ) -> str:
+        """
+        Session-affine node for session_key, least-outstanding otherwise.
+
+        ``available`` narrows the least-outstanding choice (e.g. to nodes
+        whose circuit is not open); session-affine picks ignore it, since
+        moving a session would lose its state.
+        """
+        if session_key:
+            node = self.ring.get(session_key)
+            if node is not None:
+                return node
+        if not self.ring.nodes:
+            raise LookupError("No LLMTwins upstreams configured")
+        candidates = self.ring.nodes
+        if available is not None:
+            candidates = [url for url in candidates if available(url)] or candidates
+        return min(candidates, key=lambda url: self.outstanding[url])
+
+    def acquire(
+        self,
+        session_key: Optional[str] = None,
+        available: Optional[Callable[[str], bool]] = None,
+    ) -> str:
+        url = self.pick(session_key, available)
+        self.outstanding[url] += 1
+        return url
+
+    def release(self, url: str) -> None:
+        self.outstanding[url] -= 1
+        if self.outstanding[url] <= 0 and url not in self.ring.nodes:
+            del self.outstanding[url]
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self.outstanding)
+
+
+upstreams = UpstreamPool.from_config(config)
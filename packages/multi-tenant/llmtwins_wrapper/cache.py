@@ -0,0 +1,175 @@
+# llmtwins_wrapper/cache.py
+"""
+Tenant-scoped in-process response cache for idempotent GETs
+
+Entries are keyed by tenant plus upstream path, query and the request
+headers that can change the body. Tenant is always part of the key: the
+``{tenant}__`` session prefix is the only thing separating tenants
+upstream, and a cached body has already had that prefix stripped.
+
+- LRU eviction bounded by total body bytes
+- TTL per route template; expired entries with an ETag are revalidated
+  upstream with If-None-Match instead of being refetched
+- writes that touch a session (mapping update/revise, uploads) invalidate
+  that session's entries, plus the tenant's session-less ones
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from config import WrapperConfig, config
+
+HIT = "HIT"
+MISS = "MISS"
+REVALIDATED = "REVALIDATED"
+
+
+@dataclass
+class CacheEntry:
+    tenant: str
+    session_id: Optional[str]
+    status_code: int
+    raw_headers: List[Tuple[bytes, bytes]]
+    body: bytes
+    etag: Optional[str]
+    expires: float
+
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_bytes: int,
+        route_ttls: Dict[str, float],
+        max_entry_bytes: Optional[int] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.route_ttls = dict(route_ttls)
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes
+
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._scopes: Dict[Tuple[str, Optional[str]], Set[Hashable]] = {}
+        # Bumped on every invalidation; fetches that started before it
+        # must not store what may be a pre-write response
+        self._generations: Dict[str, int] = {}
+        self.size = 0
+
+        self.outcomes: Dict[str, int] = {HIT: 0, MISS: 0, REVALIDATED: 0}
+        self.evictions = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_config(cls, cfg: WrapperConfig) -> "ResponseCache":
+        return cls(
+            max_bytes=cfg.cache_max_bytes,
+            route_ttls=cfg.cache_route_ttls,
+            max_entry_bytes=cfg.cache_max_entry_bytes,
+        )
+
+    def enabled(self, route: str) -> bool:
+        return self.max_bytes > 0 and route in self.route_ttls
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        """Entry for key (fresh or stale), marking it recently used"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def count(self, outcome: str) -> None:
+        self.outcomes[outcome] += 1
+
+    def generation(self, tenant: str) -> int:
+        return self._generations.get(tenant, 0)
+
+    def put(
+        self,
+        key: Hashable,
+        route: str,
+        entry: CacheEntry,
+        generation: int,
+    ) -> bool:
+        """Store a response; False if it is too big or went stale meanwhile"""
+        if generation != self.generation(entry.tenant):
+            return False
+        size = len(entry.body)
+        if size > self.max_entry_bytes:
+            return False
+
+        self._remove(key)
+        entry.expires = time.monotonic() + self.route_ttls.get(route, 0.0)
+        self._entries[key] = entry
+        self._scopes.setdefault((entry.tenant, entry.session_id), set()).add(key)
+        self.size += size
+
+        while self.size > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+        return True
+
+    def refresh(self, key: Hashable, route: str) -> None:
+        """Upstream confirmed the entry (304): restart its TTL"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.expires = time.monotonic() + self.route_ttls.get(route, 0.0)
+
+    def invalidate(self, tenant: str, session_id: Optional[str] = None) -> int:
+        """
+        Drop entries a write may have changed.
+
+        With a session: that session's entries and the tenant's session-less
+        ones. Without one (session unknown): everything for the tenant.
+        """
+        self._generations[tenant] = self.generation(tenant) + 1
+        if session_id is None:
+            scopes = [scope for scope in self._scopes if scope[0] == tenant]
+        else:
+            scopes = [(tenant, session_id), (tenant, None)]
+
+        dropped = 0
+        for scope in scopes:
+            for key in list(self._scopes.get(scope, ())):
+                self._remove(key)
+                dropped += 1
+        self.invalidations += 1
+        return dropped
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._scopes.clear()
+        self.size = 0
+
+    def snapshot(self) -> Dict[str, object]:
+        hits, misses, revalidated = (self.outcomes[o] for o in (HIT, MISS, REVALIDATED))
+        lookups = hits + misses + revalidated
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "revalidated": revalidated,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round((hits + revalidated) / lookups, 4) if lookups else 0.0,
+        }
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= len(entry.body)
+        scope = (entry.tenant, entry.session_id)
+        keys = self._scopes.get(scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._scopes[scope]
+
+
+response_cache = ResponseCache.from_config(config)
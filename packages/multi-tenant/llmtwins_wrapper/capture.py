@@ -0,0 +1,241 @@
+# llmtwins_wrapper/capture.py
+"""
+Traffic capture for load-test replay (see replay.py)
+
+``CaptureMiddleware`` records what clients send and how the response was
+paced: tenant, method, path, query, request body, status and the size and
+timing of every response body chunk (the token cadence of LLM streams).
+One compact JSON line per request:
+
+    {"ts":1760000000.123,"tenant":"nantou-gov","method":"POST","path":"/api/chat",
+     "query":"","type":"application/json","body":"{\\"session_id\\": \\"s-3f9c...\\", ...}",
+     "size":96,"status":200,"response_type":"application/x-ndjson",
+     "chunks":[[412.8,120],[35.1,64],...]}
+
+``chunks`` are ``[ms since the previous chunk (or the request), bytes]``.
+
+Nothing identifying leaves the process: session ids (path, query and body
+fields) become keyed-hash pseudonyms, so a session's requests still line
+up; every other JSON string and query value is replaced by filler of the
+same byte length, so payload sizes survive. Response bodies are never
+stored. Non-JSON bodies are kept as a size only.
+
+Like the access log, requests only append to a bounded queue; redaction,
+formatting and writing happen on a background thread.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import time
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from accesslog import AccessLog
+from config import WrapperConfig, config
+from rewrite import SESSION_FIELDS
+
+# Longer streams have their tail chunks merged into the last one
+MAX_CHUNKS = 10000
+
+_SESSION_PATH = re.compile(r"^(/api/sessions/)([^/]+)")
+_PLAIN_VALUE = re.compile(r"^(?:-?[0-9]+(?:\.[0-9]+)?|true|false|null)$")
+
+
+class Redactor:
+    """Replaces session ids with pseudonyms and free text with filler"""
+
+    def __init__(self, key: bytes):
+        self.key = key
+
+    def session(self, session_id: str) -> str:
+        digest = hmac.new(self.key, session_id.encode("utf-8"), hashlib.sha256)
+        return f"s-{digest.hexdigest()[:16]}"
+
+    def path(self, path: str) -> str:
+        return _SESSION_PATH.sub(lambda m: m.group(1) + self.session(m.group(2)), path)
+
+    def query(self, query: str) -> str:
+        pairs = []
+        for key, value in parse_qsl(query, keep_blank_values=True):
+            if key in SESSION_FIELDS:
+                value = self.session(value)
+            elif not _PLAIN_VALUE.match(value):
+                value = _filler(value)
+            pairs.append((key, value))
+        return urlencode(pairs)
+
+    def body(self, raw: bytes) -> Optional[str]:
+        """The JSON body with session ids and strings redacted, else None"""
+        try:
+            data = json.loads(raw)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return None
+        return json.dumps(self._value(data), ensure_ascii=False)
+
+    def _value(self, value, key: Optional[str] = None):
+        if isinstance(value, dict):
+            return {k: self._value(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._value(v) for v in value]
+        if isinstance(value, str):
+            if key in SESSION_FIELDS and value:
+                return self.session(value)
+            return _filler(value)
+        return value
+
+
+def _filler(text: str) -> str:
+    return "x" * len(text.encode("utf-8"))
+
+
+class TrafficRecorder(AccessLog):
+    """Queues captured requests and writes them as JSON lines"""
+
+    def __init__(
+        self,
+        target: Optional[str],
+        sample_rate: float = 1.0,
+        max_body: int = 65536,
+        redact_key: Optional[str] = None,
+        max_queue: int = 1000,
+        batch_size: int = 64,
+        flush_interval: float = 0.5,
+    ):
+        super().__init__(
+            target, max_queue=max_queue, batch_size=batch_size, flush_interval=flush_interval,
+        )
+        self.sample_rate = sample_rate
+        self.max_body = max_body
+        self.redactor = Redactor(redact_key.encode("utf-8") if redact_key else os.urandom(32))
+
+    @classmethod
+    def from_config(cls, cfg: WrapperConfig) -> "TrafficRecorder":
+        return cls(
+            cfg.capture_file or None,
+            sample_rate=cfg.capture_sample_rate,
+            max_body=cfg.capture_max_body,
+            redact_key=cfg.capture_redact_key or None,
+        )
+
+    def sample(self) -> bool:
+        """Whether to capture the next request"""
+        if self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+    def record(self, entry: tuple) -> None:
+        """Queue one captured request (called on the event loop; never blocks)"""
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._queue.append(entry)
+        if len(self._queue) == self.batch_size:
+            self._wake.set()
+
+    def format(self, entry: tuple) -> str:
+        (ts, tenant, method, path, query, content_type, body, size,
+         status, response_type, started, chunks) = entry
+        redactor = self.redactor
+        timing: List[List[float]] = []
+        previous = started
+        for at, length in chunks:
+            timing.append([round(1000 * (at - previous), 1), length])
+            previous = at
+        return json.dumps({
+            "ts": round(ts, 3),
+            "tenant": tenant,
+            "method": method,
+            "path": redactor.path(path),
+            "query": redactor.query(query) if query else "",
+            "type": content_type,
+            "body": redactor.body(body) if body else None,
+            "size": size,
+            "status": status,
+            "response_type": response_type,
+            "chunks": timing,
+        }, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+    def _open(self):
+        if self.target != "-":
+            # One file per worker process
+            self.target = self.target.replace("{pid}", str(os.getpid()))
+        return super()._open()
+
+
+class CaptureMiddleware:
+    """Tees sampled requests and response chunk timing into the recorder"""
+
+    def __init__(self, app, recorder: TrafficRecorder, header: Optional[str] = None):
+        self.app = app
+        self.recorder = recorder
+        self.header = (header or config.tenant_header).lower().encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        recorder = self.recorder
+        if scope["type"] != "http" or not recorder.enabled or not recorder.sample():
+            await self.app(scope, receive, send)
+            return
+
+        ts = time.time()
+        started = time.perf_counter()
+        max_body = recorder.max_body
+        body: List[bytes] = []
+        chunks: List[Tuple[float, int]] = []
+        # request bytes, status, response content type
+        state = [0, 500, None]
+
+        async def capturing_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                data = message.get("body", b"")
+                state[0] += len(data)
+                if data and state[0] <= max_body:
+                    body.append(data)
+            return message
+
+        async def capturing_send(message):
+            kind = message["type"]
+            if kind == "http.response.start":
+                state[1] = message["status"]
+                for key, value in message.get("headers", ()):
+                    if key.lower() == b"content-type":
+                        state[2] = value.decode("latin-1")
+            elif kind == "http.response.body":
+                data = message.get("body", b"")
+                if data:
+                    if len(chunks) < MAX_CHUNKS:
+                        chunks.append((time.perf_counter(), len(data)))
+                    else:
+                        chunks[-1] = (time.perf_counter(), chunks[-1][1] + len(data))
+            await send(message)
+
+        try:
+            await self.app(scope, capturing_receive, capturing_send)
+        finally:
+            headers = dict(scope["headers"])
+            recorder.record((
+                ts,
+                _decode(headers.get(self.header)),
+                scope["method"],
+                scope["path"],
+                scope.get("query_string", b"").decode("latin-1"),
+                _decode(headers.get(b"content-type")),
+                b"".join(body) if state[0] <= max_body else None,
+                state[0],
+                state[1],
+                state[2],
+                started,
+                chunks,
+            ))
+
+
+def _decode(value: Optional[bytes]) -> Optional[str]:
+    return value.decode("latin-1") if value is not None else None
+
+
+recorder = TrafficRecorder.from_config(config)
@@ -0,0 +1,96 @@
+# llmtwins_wrapper/coalesce.py
+"""
+Single-flight coalescing of concurrent identical reads
+
+Front-ends poll session state while a pipeline runs. Concurrent GETs with
+the same key (tenant, upstream path, query, and the few headers that can
+change the body) share one in-flight upstream call; the result, or the
+error, is fanned out to every waiter.
+
+The shared call runs in its own task, so a waiter disconnecting does not
+cancel it for the others.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, Tuple, TypeVar
+
+from config import config
+
+T = TypeVar("T")
+
+ALL_ROUTES = "*"
+
+
+@dataclass
+class _RouteStats:
+    requests: int = 0
+    upstream: int = 0
+    coalesced: int = 0
+
+
+class SingleFlight:
+    """
+    Usage:
+        result, shared = await coalescer.do(key, route, fetch)
+
+    ``shared`` is False for the caller that ran ``fetch`` and True for the
+    ones that joined it; joiners must not mutate the shared result.
+    """
+
+    def __init__(self, routes: Iterable[str] = ()):
+        self.routes = frozenset(routes)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._stats: Dict[str, _RouteStats] = {}
+
+    def enabled(self, route: str) -> bool:
+        return ALL_ROUTES in self.routes or route in self.routes
+
+    async def do(
+        self, key: Hashable, route: str, fetch: Callable[[], Awaitable[T]]
+    ) -> Tuple[T, bool]:
+        stats = self._stats.get(route)
+        if stats is None:
+            stats = self._stats[route] = _RouteStats()
+        stats.requests += 1
+
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            stats.coalesced += 1
+        else:
+            stats.upstream += 1
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+
+        return await asyncio.shield(task), shared
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    def snapshot(self) -> Dict[str, object]:
+        """Requests, upstream calls and collapse ratio per route"""
+        return {
+            "in_flight": len(self._inflight),
+            "routes": {
+                route: {
+                    "requests": stats.requests,
+                    "upstream": stats.upstream,
+                    "coalesced": stats.coalesced,
+                    "collapse_ratio": round(stats.coalesced / stats.requests, 4)
+                    if stats.requests else 0.0,
+                }
+                for route, stats in self._stats.items()
+            },
+        }
+
+    def _done(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the error as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+
+coalescer = SingleFlight(config.coalesce_routes)
@@ -4,8 +4,9 @@ Configuration for LLMTwins Tenant Wrapper
 """
 
 import os
+import tempfile
 from dataclasses import dataclass, field
-from typing import Set
+from typing import Dict, List, Optional, Set
 
 
 @dataclass
@@ -14,6 +15,11 @@ class WrapperConfig:
     llmtwins_base_url: str = field(
         default_factory=lambda: os.getenv("LLMTWINS_BASE_URL", "http://localhost:8000")
     )
+    # Several LLMTwins nodes (comma-separated); sessions stick to one node
+    llmtwins_base_urls: List[str] = field(default_factory=lambda: _load_upstreams())
+    upstream_hash_replicas: int = field(
+        default_factory=lambda: int(os.getenv("UPSTREAM_HASH_REPLICAS", "160"))
+    )
 
     # Tenant settings
     default_tenant: str = field(
@@ -31,10 +37,255 @@ class WrapperConfig:
     upstream_timeout: int = field(
         default_factory=lambda: int(os.getenv("UPSTREAM_TIMEOUT", "180"))
     )
+    # Per-phase overrides; unset phases fall back to upstream_timeout
+    upstream_connect_timeout: float = field(
+        default_factory=lambda: float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+    )
+    upstream_read_timeout: Optional[float] = field(
+        default_factory=lambda: _optional_float("UPSTREAM_READ_TIMEOUT")
+    )
+    upstream_write_timeout: Optional[float] = field(
+        default_factory=lambda: _optional_float("UPSTREAM_WRITE_TIMEOUT")
+    )
+    upstream_pool_timeout: float = field(
+        default_factory=lambda: float(os.getenv("UPSTREAM_POOL_TIMEOUT", "10"))
+    )
+
+    # Upstream connection pool (one client for the app lifetime)
+    upstream_max_connections: int = field(
+        default_factory=lambda: int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+    )
+    upstream_max_keepalive: int = field(
+        default_factory=lambda: int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+    )
+    upstream_keepalive_expiry: float = field(
+        default_factory=lambda: float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+    )
+    upstream_http2: bool = field(
+        default_factory=lambda: _env_bool("UPSTREAM_HTTP2", False)
+    )
+
+    # JSON request bodies up to this size are buffered and spliced in one go
+    # (keeping Content-Length); larger ones are spliced while streaming
+    body_buffer_limit: int = field(
+        default_factory=lambda: int(os.getenv("BODY_BUFFER_LIMIT", str(64 * 1024)))
+    )
+
+    # Streaming: longest NDJSON line buffered while waiting for its newline
+    stream_max_line_bytes: int = field(
+        default_factory=lambda: int(os.getenv("STREAM_MAX_LINE_BYTES", str(1024 * 1024)))
+    )
+
+    # Streaming: chunks read ahead of a slow client before upstream reads stall
+    stream_read_ahead: int = field(
+        default_factory=lambda: int(os.getenv("STREAM_READ_AHEAD", "8"))
+    )
+
+    # Resumable streams: per-stream ring buffer, total cap, how long a
+    # finished stream stays resumable (buffer bytes 0 = off), and how long
+    # a live one keeps reading upstream with no client attached
+    stream_resume_buffer_bytes: int = field(
+        default_factory=lambda: int(os.getenv("STREAM_RESUME_BUFFER_BYTES", str(256 * 1024)))
+    )
+    stream_resume_max_bytes: int = field(
+        default_factory=lambda: int(os.getenv("STREAM_RESUME_MAX_BYTES", str(64 * 1024 * 1024)))
+    )
+    stream_resume_ttl: float = field(
+        default_factory=lambda: float(os.getenv("STREAM_RESUME_TTL", "300"))
+    )
+    stream_resume_grace: float = field(
+        default_factory=lambda: float(os.getenv("STREAM_RESUME_GRACE", "30"))
+    )
+
+    # Uploads: bodies up to the spool threshold stream straight upstream,
+    # larger or unsized ones are spooled to a temp file first
+    upload_spool_threshold: int = field(
+        default_factory=lambda: int(os.getenv("UPLOAD_SPOOL_THRESHOLD", str(8 * 1024 * 1024)))
+    )
+    upload_spool_dir: Optional[str] = field(
+        default_factory=lambda: os.getenv("UPLOAD_SPOOL_DIR") or None
+    )
+    upload_max_bytes: int = field(
+        default_factory=lambda: int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+    )
+    upload_max_bytes_per_tenant: Dict[str, int] = field(
+        default_factory=lambda: _load_tenant_map("UPLOAD_MAX_BYTES_PER_TENANT", int)
+    )
+    upload_max_concurrent: int = field(
+        default_factory=lambda: int(os.getenv("UPLOAD_MAX_CONCURRENT", "4"))
+    )
+    upload_max_concurrent_per_tenant: Dict[str, int] = field(
+        default_factory=lambda: _load_tenant_map("UPLOAD_MAX_CONCURRENT_PER_TENANT", int)
+    )
+
+    # Upstream health: background probes, circuit breakers, retries
+    health_probe_interval: float = field(
+        default_factory=lambda: float(os.getenv("HEALTH_PROBE_INTERVAL", "5"))
+    )
+    health_probe_timeout: float = field(
+        default_factory=lambda: float(os.getenv("HEALTH_PROBE_TIMEOUT", "2"))
+    )
+    health_probe_path: str = field(
+        default_factory=lambda: os.getenv("HEALTH_PROBE_PATH", "/")
+    )
+    breaker_failure_threshold: int = field(
+        default_factory=lambda: int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+    )
+    breaker_reset_timeout: float = field(
+        default_factory=lambda: float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+    )
+    breaker_half_open_max: int = field(
+        default_factory=lambda: int(os.getenv("BREAKER_HALF_OPEN_MAX", "1"))
+    )
+    upstream_retries: int = field(
+        default_factory=lambda: int(os.getenv("UPSTREAM_RETRIES", "2"))
+    )
+    upstream_retry_backoff: float = field(
+        default_factory=lambda: float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.2"))
+    )
+    upstream_retry_backoff_max: float = field(
+        default_factory=lambda: float(os.getenv("UPSTREAM_RETRY_BACKOFF_MAX", "2"))
+    )
+
+    # Upstream scheduling: global and per-tenant concurrency, fair-share
+    # weights, and a bounded per-tenant wait queue with a deadline
+    scheduler_max_concurrent: int = field(
+        default_factory=lambda: int(os.getenv("SCHEDULER_MAX_CONCURRENT", "64"))
+    )
+    scheduler_tenant_max_concurrent: int = field(
+        default_factory=lambda: int(os.getenv("SCHEDULER_TENANT_MAX_CONCURRENT", "16"))
+    )
+    scheduler_tenant_max_concurrent_per_tenant: Dict[str, int] = field(
+        default_factory=lambda: _load_tenant_map("SCHEDULER_TENANT_MAX_CONCURRENT_PER_TENANT", int)
+    )
+    scheduler_tenant_weights: Dict[str, float] = field(
+        default_factory=lambda: _load_tenant_map("SCHEDULER_TENANT_WEIGHTS", float)
+    )
+    scheduler_batch_weight: float = field(
+        default_factory=lambda: float(os.getenv("SCHEDULER_BATCH_WEIGHT", "0.25"))
+    )
+    scheduler_max_queue: int = field(
+        default_factory=lambda: int(os.getenv("SCHEDULER_MAX_QUEUE", "100"))
+    )
+    scheduler_queue_timeout: float = field(
+        default_factory=lambda: float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", "30"))
+    )
+
+    # Single-flight: concurrent identical GETs on these route templates
+    # share one upstream call ("*" = every GET route, empty = off)
+    coalesce_routes: Set[str] = field(
+        default_factory=lambda: _load_set("COALESCE_ROUTES", "/api/sessions/{session_id}/state")
+    )
+
+    # Response cache for GETs: byte-bounded LRU, TTL per route template
+    # ("route=seconds,..."; routes not listed are not cached)
+    cache_max_bytes: int = field(
+        default_factory=lambda: int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    )
+    cache_max_entry_bytes: int = field(
+        default_factory=lambda: int(os.getenv("CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+    )
+    cache_route_ttls: Dict[str, float] = field(
+        default_factory=lambda: _load_map(
+            "CACHE_ROUTE_TTLS", float, "/api/sessions/{session_id}/state=2"
+        )
+    )
+
+    # On-disk result cache for mapping/planning/revise POSTs, opt-in per
+    # tenant ("*" = all tenants, empty = off)
+    result_cache_tenants: Set[str] = field(
+        default_factory=lambda: _load_set("RESULT_CACHE_TENANTS")
+    )
+    result_cache_dir: Optional[str] = field(
+        default_factory=lambda: os.getenv("RESULT_CACHE_DIR") or None
+    )
+    result_cache_max_bytes: int = field(
+        default_factory=lambda: int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    )
+    result_cache_ttl: float = field(
+        default_factory=lambda: float(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+    )
+    # Larger request bodies are forwarded without a lookup
+    result_cache_max_body: int = field(
+        default_factory=lambda: int(os.getenv("RESULT_CACHE_MAX_BODY", str(1024 * 1024)))
+    )
+
+    # Token-bucket rate limits: "[tenant@]route=rate:burst,..." plus an
+    # optional JSON file; state in "memory" or a shared "sqlite:///path"
+    rate_limits: str = field(default_factory=lambda: os.getenv("RATE_LIMITS", ""))
+    rate_limit_file: Optional[str] = field(
+        default_factory=lambda: os.getenv("RATE_LIMIT_FILE") or None
+    )
+    rate_limit_store: str = field(
+        default_factory=lambda: os.getenv("RATE_LIMIT_STORE", "memory")
+    )
+
+    # Prometheus /metrics; tenants past the cap are labelled "other"
+    metrics_enabled: bool = field(default_factory=lambda: _env_bool("METRICS_ENABLED", True))
+    metrics_max_tenants: int = field(
+        default_factory=lambda: int(os.getenv("METRICS_MAX_TENANTS", "100"))
+    )
+
+    # JSON-lines access log ("-" = stdout, a path, or empty = off), written
+    # in batches by a background thread; successful requests are sampled
+    # per tenant ("tenant=rate,...", "*" = everyone else)
+    access_log: str = field(default_factory=lambda: os.getenv("ACCESS_LOG", "-"))
+    access_log_max_queue: int = field(
+        default_factory=lambda: int(os.getenv("ACCESS_LOG_MAX_QUEUE", "10000"))
+    )
+    access_log_batch_size: int = field(
+        default_factory=lambda: int(os.getenv("ACCESS_LOG_BATCH_SIZE", "256"))
+    )
+    access_log_flush_interval: float = field(
+        default_factory=lambda: float(os.getenv("ACCESS_LOG_FLUSH_INTERVAL", "0.5"))
+    )
+    access_log_sample: Dict[str, float] = field(
+        default_factory=lambda: _load_map("ACCESS_LOG_SAMPLE", float)
+    )
+
+    # W3C trace context: spans go to "file:///path" or "udp://host:port"
+    # (empty = off; traceparent is then forwarded untouched)
+    trace_exporter: str = field(default_factory=lambda: os.getenv("TRACE_EXPORTER", ""))
+    trace_sample_rate: float = field(
+        default_factory=lambda: float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+    )
+    trace_service_name: str = field(
+        default_factory=lambda: os.getenv("TRACE_SERVICE_NAME", "llmtwins-wrapper")
+    )
+
+    # Traffic capture for load-test replay (replay.py): requests with
+    # redacted bodies and session ids, plus response chunk timing
+    # ("{pid}" in the path gives each worker its own file; empty = off)
+    capture_file: str = field(default_factory=lambda: os.getenv("CAPTURE_FILE", ""))
+    capture_sample_rate: float = field(
+        default_factory=lambda: float(os.getenv("CAPTURE_SAMPLE_RATE", "1.0"))
+    )
+    capture_max_body: int = field(
+        default_factory=lambda: int(os.getenv("CAPTURE_MAX_BODY", "65536"))
+    )
+    # HMAC key for session pseudonyms; set it so every worker (and every
+    # capture) maps a session to the same pseudonym
+    capture_redact_key: str = field(
+        default_factory=lambda: os.getenv("CAPTURE_REDACT_KEY", "")
+    )
+
+    # Serve the proxy routes through the raw-ASGI fast path (fastpath.py)
+    fast_path: bool = field(default_factory=lambda: _env_bool("FAST_PATH", False))
 
     # Server
     host: str = field(default_factory=lambda: os.getenv("HOST", "0.0.0.0"))
     port: int = field(default_factory=lambda: int(os.getenv("PORT", "8001")))
+    # Worker processes behind one pre-fork master, and how long each waits
+    # for in-flight requests/streams after SIGTERM
+    workers: int = field(default_factory=lambda: int(os.getenv("WORKERS", "1")))
+    drain_timeout: float = field(
+        default_factory=lambda: float(os.getenv("DRAIN_TIMEOUT", "30"))
+    )
+    # Where workers publish their snapshots for /health/workers
+    worker_metrics_dir: str = field(default_factory=lambda: _worker_metrics_dir())
+    worker_metrics_interval: float = field(
+        default_factory=lambda: float(os.getenv("WORKER_METRICS_INTERVAL", "2"))
+    )
 
 
 def _load_valid_tenants() -> Set[str]:
@@ -45,4 +296,54 @@ def _load_valid_tenants() -> Set[str]:
     return set()  # Empty = allow all
 
 
+def _load_set(name: str, default: str = "") -> Set[str]:
+    """Load a comma-separated env var as a set"""
+    return set(v.strip() for v in os.getenv(name, default).split(",") if v.strip())
+
+
+def _load_upstreams() -> List[str]:
+    """Load LLMTwins base URLs, falling back to LLMTWINS_BASE_URL"""
+    urls = [u.strip() for u in os.getenv("LLMTWINS_BASE_URLS", "").split(",") if u.strip()]
+    return urls or [os.getenv("LLMTWINS_BASE_URL", "http://localhost:8000")]
+
+
+def _load_tenant_map(name: str, cast=str) -> Dict[str, object]:
+    """Load per-tenant overrides from env, e.g. 'nantou-gov=10,default=2'"""
+    return _load_map(name, cast)
+
+
+def _load_map(name: str, cast=str, default: str = "") -> Dict[str, object]:
+    """Load 'key=value,...' pairs from env"""
+    result = {}
+    for item in os.getenv(name, default).split(","):
+        if "=" not in item:
+            continue
+        key, value = item.split("=", 1)
+        if key.strip() and value.strip():
+            result[key.strip()] = cast(value.strip())
+    return result
+
+
+def _worker_metrics_dir() -> str:
+    """WORKER_METRICS_DIR, else a per-port directory on tmpfs if there is one"""
+    if os.getenv("WORKER_METRICS_DIR"):
+        return os.environ["WORKER_METRICS_DIR"]
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"llmtwins-wrapper-{os.getenv('PORT', '8001')}")
+
+
+def _optional_float(name: str) -> Optional[float]:
+    """Read an optional float env var (empty/unset = None)"""
+    value = os.getenv(name, "").strip()
+    return float(value) if value else None
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Read a boolean env var (1/true/yes/on)"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 config = WrapperConfig()
@@ -0,0 +1,172 @@
+# llmtwins_wrapper/fastpath.py
+"""
+Optional raw-ASGI fast path for the proxy routes
+
+FastAPI routing, ``Header(...)`` dependency injection and endpoint
+signature handling cost more than the proxying itself for small calls.
+This core matches the known proxy endpoints against a precompiled route
+table, reads the tenant straight from the scope headers, rewrites the
+session path segment, and hands off to the same ``proxy_request`` the
+FastAPI routes use, so behaviour stays identical.
+
+Everything else (health, uploads, stream resume, docs, CORS preflight,
+lifespan) falls through to the FastAPI app.
+
+Run with ``FAST_PATH=true python main.py`` or ``uvicorn fastpath:app``.
+"""
+
+import re
+from typing import Callable, Dict, List, Optional, Pattern, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+
+import main
+from capture import CaptureMiddleware
+from metrics import MetricsMiddleware
+from rewrite import rewrite_session_id
+from scheduler import BATCH
+from tracing import TraceMiddleware
+
+_TENANT_HEADER = b"x-tenant-id"
+_CATCH_ALL_METHODS = frozenset(("GET", "POST", "PUT", "DELETE", "PATCH"))
+
+
+class _Route:
+    """Stands in for the matched Starlette route (``scope["route"]``)"""
+
+    __slots__ = ("path", "endpoint")
+
+    def __init__(self, path: str, endpoint: Callable):
+        self.path = path
+        self.endpoint = endpoint
+
+
+# (method, template, endpoint name, proxy_request options)
+# Session-scoped templates carry a rewritten {session_id} into the upstream
+# path and pin the request to that session's node.
+_TABLE = (
+    ("POST", "/api/sessions", "create_session", {}),
+    ("GET", "/api/sessions/{session_id}/state", "get_session_state", {}),
+    ("POST", "/api/chat", "chat", {"invalidate_cache": main.IF_SESSION}),
+    ("POST", "/api/mapping", "mapping", {"endpoint_class": BATCH, "cache_results": True}),
+    ("POST", "/api/mapping/update", "mapping_update", {"invalidate_cache": True}),
+    ("POST", "/api/mapping/revise", "mapping_revise",
+     {"endpoint_class": BATCH, "invalidate_cache": True, "cache_results": True}),
+    ("POST", "/api/sessions/{session_id}/pipeline/one_click", "pipeline_one_click",
+     {"endpoint_class": BATCH, "invalidate_cache": True}),
+    ("POST", "/api/planning", "planning", {"endpoint_class": BATCH, "cache_results": True}),
+)
+
+_CATCH_ALL = "/{path:path}"
+
+
+def _compile(template: str) -> Pattern:
+    return re.compile("^" + template.replace("{session_id}", "(?P<session_id>[^/]+)") + "$")
+
+
+class FastPathApp:
+    def __init__(self, app):
+        self.app = app
+        handled = {name for _, _, name, _ in _TABLE} | {"catch_all"}
+
+        # Exact paths first (one dict lookup), then parameterised ones
+        self._exact: Dict[Tuple[str, str], Tuple[_Route, dict]] = {}
+        self._patterns: List[Tuple[str, Pattern, _Route, dict]] = []
+        for method, template, name, options in _TABLE:
+            route = _Route(template, getattr(main, name))
+            if "{" in template:
+                self._patterns.append((method, _compile(template), route, options))
+            else:
+                self._exact[(method, template)] = (route, options)
+        self._catch_all = _Route(_CATCH_ALL, main.catch_all)
+
+        # Routes only the FastAPI app serves (health, uploads, docs, ...)
+        self._reserved_exact = set()
+        self._reserved_patterns: List[Tuple[frozenset, Pattern]] = []
+        for route in app.routes:
+            if getattr(route, "name", None) in handled or not hasattr(route, "path_regex"):
+                continue
+            methods = frozenset(getattr(route, "methods", None) or ())
+            if "{" in route.path:
+                self._reserved_patterns.append((methods, route.path_regex))
+            else:
+                for method in methods:
+                    self._reserved_exact.add((method, route.path))
+
+        # Same outer layers as the FastAPI app's middleware stack
+        self._handler = CaptureMiddleware(
+            TraceMiddleware(
+                MetricsMiddleware(
+                    CORSMiddleware(self._dispatch, **main.CORS_OPTIONS),
+                    metrics=main.metrics,
+                    access_log=main.access_log,
+                ),
+                tracer=main.tracer,
+            ),
+            recorder=main.recorder,
+        )
+
+    def match(self, method: str, path: str) -> Optional[Tuple[_Route, dict, Optional[str]]]:
+        """(route, options, session_id) for a fast-path request, else None"""
+        if (method, path) in self._reserved_exact:
+            return None
+        for methods, pattern in self._reserved_patterns:
+            if method in methods and pattern.match(path):
+                return None
+
+        hit = self._exact.get((method, path))
+        if hit is not None:
+            return hit[0], hit[1], None
+        for route_method, pattern, route, options in self._patterns:
+            if route_method == method:
+                m = pattern.match(path)
+                if m is not None:
+                    return route, options, m.group("session_id")
+        if method in _CATCH_ALL_METHODS:
+            return self._catch_all, {}, None
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        matched = self.match(scope["method"], scope["path"])
+        if matched is None:
+            await self.app(scope, receive, send)
+            return
+        scope["route"], scope["fast_path"] = matched[0], matched[1:]
+        scope["app"] = self.app
+        await self._handler(scope, receive, send)
+
+    async def _dispatch(self, scope, receive, send):
+        route = scope["route"]
+        options, session_id = scope["fast_path"]
+        request = Request(scope, receive)
+        try:
+            tenant = main.get_tenant(_header(scope, _TENANT_HEADER))
+            if session_id is not None:
+                rewritten = rewrite_session_id(session_id, tenant)
+                path = route.path.replace("{session_id}", rewritten)
+                options = dict(options, session_id=rewritten)
+            elif route is self._catch_all:
+                path = scope["path"]
+            else:
+                path = route.path
+            response = await main.proxy_request(request, tenant, path, **options)
+        except HTTPException as e:
+            response = JSONResponse({"detail": e.detail}, status_code=e.status_code,
+                                    headers=e.headers)
+        await response(scope, receive, send)
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+app = FastPathApp(main.app)
@@ -0,0 +1,198 @@
+# llmtwins_wrapper/health.py
+"""
+Upstream health: circuit breakers and a background prober
+
+Each LLMTwins node has a circuit breaker:
+- closed: requests flow; consecutive failures are counted
+- open: after ``failure_threshold`` failures requests fail fast with 503
+  until ``reset_timeout`` has passed
+- half-open: up to ``half_open_max`` trial requests are let through; a
+  success closes the breaker, a failure opens it again
+
+A background task probes every node on an interval and caches the result,
+so /health never waits on LLMTwins and recovering nodes are noticed even
+when no traffic is sent to them.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from balancer import upstreams
+from config import WrapperConfig, config
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        half_open_max: int = 1,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trials = 0
+        self._state = CLOSED
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self.trials = 0
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now (reserves a half-open trial)"""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self.trials < self.half_open_max:
+            self.trials += 1
+            return True
+        return False
+
+    def available(self) -> bool:
+        """Like allow() but without reserving anything"""
+        state = self.state
+        return state == CLOSED or (state == HALF_OPEN and self.trials < self.half_open_max)
+
+    def retry_after(self) -> float:
+        if self._state != OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.trials = 0
+        self._state = CLOSED
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._trip()
+
+    def abandon(self) -> None:
+        """Give back a half-open trial that ended without an outcome"""
+        if self._state == HALF_OPEN and self.trials > 0:
+            self.trials -= 1
+
+    def half_open(self) -> None:
+        """Let trial requests through early (e.g. a probe succeeded)"""
+        if self._state == OPEN:
+            self._state = HALF_OPEN
+            self.trials = 0
+
+    def _trip(self) -> None:
+        if self._state != OPEN:
+            logger.warning(f"Circuit opened after {self.failures} failures")
+        self._state = OPEN
+        self.opened_at = time.monotonic()
+        self.trials = 0
+
+
+class BreakerRegistry:
+    """One circuit breaker per upstream base URL"""
+
+    def __init__(self, cfg: WrapperConfig):
+        self.cfg = cfg
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, url: str) -> CircuitBreaker:
+        breaker = self._breakers.get(url)
+        if breaker is None:
+            breaker = self._breakers[url] = CircuitBreaker(
+                failure_threshold=self.cfg.breaker_failure_threshold,
+                reset_timeout=self.cfg.breaker_reset_timeout,
+                half_open_max=self.cfg.breaker_half_open_max,
+            )
+        return breaker
+
+    def available(self, url: str) -> bool:
+        return self.get(url).available()
+
+
+class HealthProber:
+    """Periodically probes each upstream and caches the result"""
+
+    def __init__(self, pool, registry: BreakerRegistry, cfg: WrapperConfig):
+        self.pool = pool
+        self.registry = registry
+        self.interval = cfg.health_probe_interval
+        self.timeout = cfg.health_probe_timeout
+        self.path = cfg.health_probe_path
+        self.results: Dict[str, Dict[str, object]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def probe(self, client: httpx.AsyncClient, url: str) -> bool:
+        started = time.monotonic()
+        error = None
+        try:
+            resp = await client.get(f"{url}{self.path}", timeout=self.timeout)
+            ok = resp.status_code == 200
+            if not ok:
+                error = f"HTTP {resp.status_code}"
+        except Exception as e:
+            ok = False
+            error = type(e).__name__
+
+        breaker = self.registry.get(url)
+        if ok:
+            breaker.half_open()
+        elif breaker.state == CLOSED:
+            breaker.record_failure()
+
+        self.results[url] = {
+            "ok": ok,
+            "checked_at": time.time(),
+            "latency_ms": round(1000 * (time.monotonic() - started), 1),
+            "error": error,
+        }
+        return ok
+
+    async def probe_all(self, client: httpx.AsyncClient) -> None:
+        await asyncio.gather(*(self.probe(client, url) for url in self.pool.urls))
+
+    async def run(self, client: httpx.AsyncClient) -> None:
+        while True:
+            try:
+                await self.probe_all(client)
+            except Exception:
+                logger.exception("Upstream health probe failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self, client: httpx.AsyncClient) -> None:
+        self._task = asyncio.create_task(self.run(client))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        outstanding = self.pool.snapshot()
+        return {
+            url: {
+                **self.results.get(url, {"ok": None}),
+                "circuit": self.registry.get(url).state,
+                "outstanding": outstanding.get(url, 0),
+            }
+            for url in self.pool.urls
+        }
+
+
+breakers = BreakerRegistry(config)
+prober = HealthProber(upstreams, breakers, config)
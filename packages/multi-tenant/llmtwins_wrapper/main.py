@@ -10,72 +10,147 @@ Features:
 - Rewrites session_id with tenant prefix
 - Proxies all requests to LLMTwins
 - Supports streaming responses
+- Reuses one pooled upstream client for the app lifetime
+- Collapses concurrent identical polls into one upstream call
+- Caches idempotent GETs per tenant, invalidated by session writes
+- Serves repeated mapping/planning requests from an on-disk result cache
+- Rate-limits each tenant per route with token buckets
+- Runs as several worker processes with graceful drain (server.py)
+- Exposes Prometheus metrics per tenant and route at /metrics
+- Writes a batched JSON-lines access log off the event loop
+- Propagates W3C traceparent and records request spans
+- Captures redacted traffic for load-test replay (replay.py)
 """
 
 import httpx
-import json
 import logging
-from typing import Optional
+import os
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Dict, Optional, Union
 from fastapi import FastAPI, Request, HTTPException, Header
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-
+from starlette.background import BackgroundTask
+
+from accesslog import access_log
+from balancer import upstreams
+from cache import HIT, MISS, REVALIDATED, CacheEntry, response_cache
+from capture import CaptureMiddleware, recorder
+from coalesce import coalescer
+from metrics import MetricsMiddleware, metrics, render
+from result_cache import (
+    BYPASS,
+    HIT as RESULT_HIT,
+    MISS as RESULT_MISS,
+    STORED,
+    CachedResult,
+    result_cache,
+)
 from config import config
+from rewrite import (
+    JSONBodyRewriter,
+    NDJSONSessionRewriter,
+    SessionFieldError,
+    rewrite_session_id,
+    rewrite_stream,
+    strip_session_prefix,
+    tenant_prefix,
+)
+from ratelimit import rate_limiter
+from relay import relay_stream, stream_stats
+from resume import (
+    RESUMABLE_HEADER,
+    STREAM_ID_HEADER,
+    follow,
+    resume_store,
+)
+from scheduler import BATCH, INTERACTIVE, scheduler
+from tracing import TraceMiddleware, current_trace, span, tracer
+from server import aggregate, worker_metrics
+from health import OPEN, prober
+from upstream import create_client, pool_stats, send_upstream
+from uploads import UploadTooLarge, close_upload, prepare_upload, upload_limiter
 
 logging.basicConfig(level=logging.INFO)
+# httpx logs every upstream call synchronously; the access log covers it
+logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled client for the app lifetime: keep-alive connections to
+    # LLMTwins are reused across requests instead of re-handshaking.
+    app.state.http_client = create_client(config)
+    prober.start(app.state.http_client)
+    worker_metrics.start(lambda: worker_snapshot(app))
+    access_log.start()
+    tracer.start()
+    recorder.start()
+    try:
+        yield
+    finally:
+        await worker_metrics.stop()
+        access_log.stop()
+        tracer.stop()
+        recorder.stop()
+        await prober.stop()
+        await resume_store.close()
+        await app.state.http_client.aclose()
+
+
 app = FastAPI(
     title="LLMTwins Tenant Wrapper",
     description="Multi-tenant proxy for LLMTwins",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
-# CORS - mirror LLMTwins settings
-app.add_middleware(
-    CORSMiddleware,
+# CORS - mirror LLMTwins settings (shared with the fast path)
+CORS_OPTIONS = dict(
     allow_origins=["*"],  # Configure as needed
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CORSMiddleware, **CORS_OPTIONS)
+# Outer layers, so they time everything including CORS handling
+app.add_middleware(MetricsMiddleware, metrics=metrics, access_log=access_log)
+app.add_middleware(TraceMiddleware, tracer=tracer)
+app.add_middleware(CaptureMiddleware, recorder=recorder)
 
 
-def get_tenant(tenant_header: Optional[str]) -> str:
-    """Extract and validate tenant ID"""
-    tenant = (tenant_header or "").strip()
-
-    if not tenant:
-        tenant = config.default_tenant
+def get_client(request: Request) -> httpx.AsyncClient:
+    """Shared upstream client created in the lifespan hook"""
+    return request.app.state.http_client
 
-    # Validate tenant if whitelist is configured
-    if config.valid_tenants and tenant not in config.valid_tenants:
-        raise HTTPException(
-            status_code=403,
-            detail=f"Invalid tenant: {tenant}"
-        )
 
-    return tenant
+def get_tenant(tenant_header: Optional[str]) -> str:
+    """Extract and validate tenant ID"""
+    with span("tenant.resolve"):
+        tenant = (tenant_header or "").strip()
 
+        if not tenant:
+            tenant = config.default_tenant
 
-def rewrite_session_id(session_id: str, tenant: str) -> str:
-    """Add tenant prefix to session_id"""
-    if not session_id:
-        return session_id
+        trace = current_trace()
+        if trace is not None:
+            trace.tenant = tenant
 
-    # Already has tenant prefix?
-    if session_id.startswith(f"{tenant}{config.tenant_separator}"):
-        return session_id
+        # Validate tenant if whitelist is configured
+        if config.valid_tenants and tenant not in config.valid_tenants:
+            raise HTTPException(
+                status_code=403,
+                detail=f"Invalid tenant: {tenant}"
+            )
 
-    return f"{tenant}{config.tenant_separator}{session_id}"
+    return tenant
 
 
-def extract_original_session_id(prefixed_session_id: str, tenant: str) -> str:
-    """Remove tenant prefix from session_id"""
-    prefix = f"{tenant}{config.tenant_separator}"
-    if prefixed_session_id.startswith(prefix):
-        return prefixed_session_id[len(prefix):]
-    return prefixed_session_id
+# ``invalidate_cache`` value for writes that only touch a named session
+IF_SESSION = "if_session"
 
 
 async def proxy_request(
@@ -84,33 +159,387 @@ async def proxy_request(
     path: str,
     rewrite_body: bool = True,
     rewrite_response: bool = True,
+    endpoint_class: str = INTERACTIVE,
+    session_id: Optional[str] = None,
+    invalidate_cache: Union[bool, str] = False,
+    cache_results: bool = False,
 ):
-    """Proxy request to LLMTwins with tenant session rewriting"""
+    """
+    Proxy request to LLMTwins with tenant session rewriting
+
+    ``session_id`` is the already-rewritten session in the path, if any; it
+    (or one found in the query/body) pins the request to one upstream node.
+    ``invalidate_cache`` marks writes that drop the session's cached GETs
+    (the whole tenant's if the session is unknown; with ``IF_SESSION``,
+    nothing unless the request names a session);
+    ``cache_results`` marks deterministic endpoints for the result cache.
+    """
+    route = _route_template(request)
+    limit = await rate_limiter.check(tenant, route) if rate_limiter.enabled else None
+
+    forward = partial(
+        _forward, request, tenant, path, rewrite_body, rewrite_response, endpoint_class,
+        session_id, invalidate_cache,
+    )
+    response = await _serve(request, tenant, path, route, forward, session_id, cache_results)
+    if limit is not None:
+        response.headers.update(limit.headers())
+    return response
+
+
+async def _serve(
+    request: Request,
+    tenant: str,
+    path: str,
+    route: str,
+    forward,
+    session_id: Optional[str],
+    cache_results: bool,
+):
+    """Answer from a cache or a shared in-flight call, else forward"""
+    if cache_results and result_cache.enabled(tenant):
+        return await _cached_result(request, tenant, path, route, forward)
+
+    cacheable = request.method == "GET" and response_cache.enabled(route)
+    coalesced = request.method == "GET" and coalescer.enabled(route)
+    if not (cacheable or coalesced):
+        return await forward()
+
+    # Tenant is always part of the key: cached bodies are already unprefixed
+    key = (
+        tenant,
+        path,
+        tuple(sorted(request.query_params.multi_items())),
+        tuple(request.headers.get(name) for name in _VARY_HEADERS),
+    )
+
+    fetch = forward
+    if cacheable:
+        entry = response_cache.get(key)
+        if entry is not None and entry.fresh():
+            response_cache.count(HIT)
+            return _cached_response(request, entry, HIT)
+        query_sid = request.query_params.get("session_id")
+        scope = session_id or (rewrite_session_id(query_sid, tenant) if query_sid else None)
+        fetch = partial(_fetch_cacheable, forward, key, route, tenant, scope)
+
+    if coalesced:
+        # Identical concurrent reads share one upstream call
+        response, shared = await coalescer.do(key, route, fetch)
+        if shared:
+            response = _clone_response(response)
+    else:
+        response = await fetch()
+
+    if cacheable and response.status_code == 200 and _not_modified(request, response):
+        return _not_modified_response(response)
+    return response
+
+
+# Request headers that can change an otherwise identical GET's response
+_VARY_HEADERS = ("accept", "accept-encoding", "authorization", "cookie")
+
+
+def _route_template(request: Request) -> str:
+    route = request.scope.get("route")
+    return getattr(route, "path", request.url.path)
+
+
+def _clone_response(response: Response) -> Response:
+    """Copy of a buffered response for another waiter"""
+    clone = Response(content=response.body, status_code=response.status_code)
+    clone.raw_headers = list(response.raw_headers)
+    return clone
+
+
+# ============ Response Cache ============
+
+async def _fetch_cacheable(forward, key, route: str, tenant: str, session_id: Optional[str]):
+    """Fetch a cacheable GET, revalidating a stale entry by ETag"""
+    entry = response_cache.get(key)
+    generation = response_cache.generation(tenant)
+
+    # The client's own validator is answered locally, never forwarded
+    etag = entry.etag if entry is not None else None
+    response = await forward(header_overrides={"if-none-match": etag})
+
+    if response.status_code == 304 and entry is not None:
+        response_cache.refresh(key, route)
+        response_cache.count(REVALIDATED)
+        return _cached_response(None, entry, REVALIDATED)
+
+    response_cache.count(MISS)
+    if response.status_code == 200 and _storable(response):
+        response_cache.put(
+            key,
+            route,
+            CacheEntry(
+                tenant=tenant,
+                session_id=session_id,
+                status_code=response.status_code,
+                raw_headers=list(response.raw_headers),
+                body=response.body,
+                etag=response.headers.get("etag"),
+                expires=0.0,
+            ),
+            generation,
+        )
+    response.headers["X-Cache"] = MISS
+    return response
+
+
+def _storable(response: Response) -> bool:
+    cache_control = response.headers.get("cache-control", "").lower()
+    return "no-store" not in cache_control and "private" not in cache_control
+
+
+def _cached_response(request: Optional[Request], entry: CacheEntry, outcome: str) -> Response:
+    response = Response(content=entry.body, status_code=entry.status_code)
+    response.raw_headers = list(entry.raw_headers)
+    response.headers["X-Cache"] = outcome
+    if request is not None and _not_modified(request, response):
+        return _not_modified_response(response)
+    return response
+
+
+def _not_modified(request: Request, response: Response) -> bool:
+    etag = response.headers.get("etag")
+    if_none_match = request.headers.get("if-none-match")
+    if not etag or not if_none_match:
+        return False
+    candidates = {tag.strip() for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates or etag.removeprefix("W/") in candidates
+
 
-    # Build upstream URL
-    upstream_url = f"{config.llmtwins_base_url}{path}"
+def _not_modified_response(response: Response) -> Response:
+    not_modified = Response(status_code=304)
+    not_modified.raw_headers = [
+        (key, value)
+        for key, value in response.raw_headers
+        if key.lower() in (b"etag", b"cache-control", b"vary", b"x-cache")
+    ]
+    return not_modified
 
+
+# ============ Result Cache ============
+
+async def _cached_result(request: Request, tenant: str, path: str, route: str, forward):
+    """Serve a deterministic POST from the on-disk result cache, or fill it"""
+    length = _content_length(request)
+    if length is None or length > config.result_cache_max_body:
+        return await forward()
+
+    body = await request.body()
+    target = f"{path}?{request.url.query}" if request.url.query else path
+    key = result_cache.key(
+        tenant, request.method, target, body, request.headers.get("accept-encoding")
+    )
+    if key is None:
+        return await forward()
+
+    if _bypass_result_cache(request):
+        result_cache.count(tenant, route, BYPASS)
+    else:
+        cached = await result_cache.get(key)
+        if cached is not None:
+            result_cache.count(tenant, route, RESULT_HIT)
+            response = Response(content=cached.body, status_code=cached.status_code)
+            response.raw_headers = cached.raw_headers
+            response.headers["X-Result-Cache"] = "HIT"
+            return response
+        result_cache.count(tenant, route, RESULT_MISS)
+
+    response = await forward()
+    if isinstance(response, StreamingResponse) or response.status_code != 200:
+        return response
+
+    stored = await result_cache.put(
+        key, CachedResult(response.status_code, list(response.raw_headers), response.body)
+    )
+    if stored:
+        result_cache.count(tenant, route, STORED)
+    response.headers["X-Result-Cache"] = "MISS"
+    return response
+
+
+def _bypass_result_cache(request: Request) -> bool:
+    cache_control = request.headers.get("cache-control", "").lower()
+    return (
+        "no-cache" in cache_control
+        or "no-store" in cache_control
+        or request.headers.get("x-result-cache", "").lower() == "bypass"
+    )
+
+
+# ============ Upstream Forwarding ============
+
+async def _forward(
+    request: Request,
+    tenant: str,
+    path: str,
+    rewrite_body: bool,
+    rewrite_response: bool,
+    endpoint_class: str,
+    session_id: Optional[str],
+    invalidate_cache: Union[bool, str] = False,
+    header_overrides: Optional[Dict[str, Optional[str]]] = None,
+):
+    """
+    Send one request upstream and relay the response
+
+    ``header_overrides`` replace (or, with None, drop) forwarded headers.
+    """
     # Get query params and rewrite session_id if present
     query_params = dict(request.query_params)
     if "session_id" in query_params:
         query_params["session_id"] = rewrite_session_id(
             query_params["session_id"], tenant
         )
+        session_id = session_id or query_params["session_id"]
+
+    headers = _upstream_headers(request, tenant)
+    trace = current_trace()
+    if rewrite_response:
+        # Prefixes can only be stripped from bodies we can read
+        headers["accept-encoding"] = "identity"
+    for key, value in (header_overrides or {}).items():
+        headers.pop(key, None)
+        if value is not None:
+            headers[key] = value
 
-    # Get body and rewrite session fields
-    body = None
+    # Body is never parsed: it is streamed upstream as-is, with session
+    # fields spliced in place when present. Every content type goes through
+    # the rewriter, since LLMTwins parses bodies as JSON whatever the label.
+    content = None
+    body_rewriter = None
+    affinity = None
     if request.method in ("POST", "PUT", "PATCH"):
+        content_length = _content_length(request)
+        if rewrite_body:
+            body_rewriter = JSONBodyRewriter(tenant, config.body_buffer_limit)
+            try:
+                if content_length is not None and content_length <= config.body_buffer_limit:
+                    raw = await request.body()
+                    content = body_rewriter.feed(raw) + body_rewriter.flush()
+                    session_id = session_id or body_rewriter.session_id
+                else:
+                    content = await _rewrite_body_stream(
+                        request, body_rewriter, config.body_buffer_limit
+                    )
+                    if body_rewriter.unchanged and content_length is not None:
+                        headers["Content-Length"] = str(content_length)
+                    session_id = session_id or body_rewriter.session_id
+                    if session_id is None and not body_rewriter.done:
+                        # The session field (if any) is further in than the
+                        # read-ahead: keep the tenant's large bodies together
+                        affinity = tenant_prefix(tenant)
+            except SessionFieldError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        else:
+            content = request.stream()
+            if content_length is not None:
+                headers["Content-Length"] = str(content_length)
+
+    # Per-request records go to the access log; this is for debugging only
+    logger.debug(f"[{tenant}] Proxying {request.method} {path}")
+
+    series = metrics.series(tenant, _route_template(request)) if metrics.enabled else None
+
+    # Wait for a fair-share upstream slot; held until the response is done
+    with span("scheduler.queue", endpoint_class=endpoint_class):
+        lease = await scheduler.acquire(tenant, endpoint_class)
+
+    if series is not None:
+        series.in_flight += 1
+        started = time.perf_counter()
+    try:
+        # Session-affine node (or the least busy healthy one), with circuit
+        # breaking and retries for idempotent requests
+        response, base_url = await send_upstream(
+            get_client(request),
+            request.method,
+            path,
+            params=query_params,
+            content=content,
+            headers=headers,
+            session_id=session_id or affinity,
+            on_pool_wait=series.pool_wait.observe if series is not None else None,
+            trace=trace if trace is not None and trace.sampled else None,
+        )
+    except SessionFieldError as e:
+        # Found while streaming the body; nothing unsafe was sent upstream
+        lease.release()
+        if series is not None:
+            series.in_flight -= 1
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        lease.release()
+        if series is not None:
+            series.in_flight -= 1
+        raise
+    if series is not None:
+        series.upstream_latency.observe(time.perf_counter() - started)
+
+    finished = False
+
+    def finish():
+        nonlocal finished
+        if not finished:
+            finished = True
+            upstreams.release(base_url)
+            lease.release()
+            if series is not None:
+                series.in_flight -= 1
+            if invalidate_cache:
+                written = session_id or (body_rewriter.session_id if body_rewriter else None)
+                if written is not None or invalidate_cache != IF_SESSION:
+                    response_cache.invalidate(tenant, written)
+
+    # Check if streaming is requested
+    is_streaming = body_rewriter is not None and body_rewriter.stream
+
+    if is_streaming:
+        # Streaming response: bounded read-ahead, and a client disconnect
+        # closes the upstream stream right away
+        chunks = response.aiter_bytes()
+        if rewrite_response:
+            # Strip session prefixes line by line; partial lines are
+            # carried over to the next chunk
+            rewriter = NDJSONSessionRewriter(tenant, config.stream_max_line_bytes)
+            chunks = rewrite_stream(chunks, rewriter)
+
+        async def close():
+            await response.aclose()
+            finish()
+
+        stream_key = session_id or body_rewriter.session_id
+        if stream_key and resume_store.enabled and _wants_resumable(request):
+            # Drain upstream into a replay buffer independently of this
+            # client, so a dropped connection can resume from its last event
+            buffer = resume_store.open(tenant, stream_key)
+            if buffer is not None:
+                resume_store.start(buffer, chunks, close)
+                return StreamingResponse(
+                    follow(buffer, 0, tenant, request.receive),
+                    media_type="application/x-ndjson",
+                    headers={STREAM_ID_HEADER: buffer.stream_id},
+                )
+
+        return StreamingResponse(
+            relay_stream(chunks, request.receive, close, tenant),
+            media_type="application/x-ndjson",
+            background=BackgroundTask(close),
+        )
+    else:
+        # Non-streaming response: forward status, headers and raw bytes
         try:
-            body = await request.json()
-            if rewrite_body and isinstance(body, dict):
-                # Rewrite common session ID fields
-                for field in ("session_id", "sessionId", "sid"):
-                    if field in body and body[field]:
-                        body[field] = rewrite_session_id(body[field], tenant)
-        except json.JSONDecodeError:
-            body = await request.body()
-
-    # Prepare headers (forward most, add tenant info)
+            return await passthrough_response(response, tenant, rewrite_response)
+        finally:
+            finish()
+
+
+def _upstream_headers(request: Request, tenant: str) -> Dict[str, str]:
+    """Forward most request headers, plus tenant and trace headers"""
     headers = {}
     for key, value in request.headers.items():
         key_lower = key.lower()
@@ -120,95 +549,106 @@ async def proxy_request(
     # Add tenant header for downstream (in case LLMTwins wants it)
     headers[config.tenant_header] = tenant
     headers["X-Tenant-Wrapper"] = "true"
+    trace = current_trace()
+    if trace is not None:
+        # LLMTwins' spans become children of this request's span
+        headers["traceparent"] = trace.traceparent()
+    return headers
+
+
+async def _rewrite_body_stream(request: Request, rewriter: JSONBodyRewriter, read_ahead: int):
+    """
+    Rewritten body chunks for a body too large (or unsized) to buffer.
+
+    Reads ahead until the rewriter knows whether the body is a JSON object,
+    so the caller can keep Content-Length for bodies that can't change, and
+    then (up to ``read_ahead`` bytes) until it has seen the session field,
+    so the request can be pinned to the session's node before it is sent.
+    """
+    chunks = request.stream().__aiter__()
+    head = []
+    read = 0
+    while rewriter.undecided or (
+        rewriter.session_id is None and not rewriter.done and read < read_ahead
+    ):
+        try:
+            chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            head.append(rewriter.flush())
+            return b"".join(head)
+        read += len(chunk)
+        head.append(rewriter.feed(chunk))
 
-    logger.info(f"[{tenant}] Proxying {request.method} {path}")
+    async def body():
+        first = b"".join(head)
+        if first:
+            yield first
+        async for out in rewrite_stream(_resume(chunks), rewriter):
+            yield out
 
-    # Check if streaming is requested
-    is_streaming = False
-    if isinstance(body, dict):
-        is_streaming = body.get("stream", False)
-
-    async with httpx.AsyncClient(timeout=config.upstream_timeout) as client:
-        if is_streaming:
-            # Streaming response
-            async def stream_generator():
-                async with client.stream(
-                    request.method,
-                    upstream_url,
-                    params=query_params,
-                    json=body if isinstance(body, dict) else None,
-                    content=body if isinstance(body, bytes) else None,
-                    headers=headers,
-                ) as response:
-                    async for chunk in response.aiter_bytes():
-                        # Optionally rewrite session_id in response chunks
-                        if rewrite_response:
-                            chunk = rewrite_response_session(chunk, tenant)
-                        yield chunk
-
-            return StreamingResponse(
-                stream_generator(),
-                media_type="application/x-ndjson",
-            )
-        else:
-            # Non-streaming response
-            response = await client.request(
-                request.method,
-                upstream_url,
-                params=query_params,
-                json=body if isinstance(body, dict) else None,
-                content=body if isinstance(body, bytes) else None,
-                headers=headers,
-            )
+    return body()
 
-            # Parse and optionally rewrite response
-            try:
-                resp_data = response.json()
-                if rewrite_response and isinstance(resp_data, dict):
-                    resp_data = rewrite_response_data(resp_data, tenant)
-                return JSONResponse(
-                    content=resp_data,
-                    status_code=response.status_code,
-                )
-            except json.JSONDecodeError:
-                return JSONResponse(
-                    content=response.text,
-                    status_code=response.status_code,
-                )
+
+async def _resume(chunks):
+    async for chunk in chunks:
+        yield chunk
 
 
-def rewrite_response_session(chunk: bytes, tenant: str) -> bytes:
-    """Rewrite session_id in streaming response chunks"""
-    # For NDJSON, try to parse and rewrite each line
+def _wants_resumable(request: Request) -> bool:
+    return request.headers.get(RESUMABLE_HEADER, "").lower() in ("1", "true", "yes")
+
+
+# Hop-by-hop headers are per connection; content-length is recomputed
+_DROP_RESPONSE_HEADERS = frozenset((
+    b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization",
+    b"te", b"trailer", b"trailers", b"transfer-encoding", b"upgrade", b"content-length",
+))
+_DROP_DECODED_HEADERS = _DROP_RESPONSE_HEADERS | {b"content-encoding"}
+
+
+async def passthrough_response(
+    response: httpx.Response, tenant: str, rewrite_response: bool = True
+) -> Response:
+    """
+    Relay a non-streaming upstream response as-is.
+
+    The raw (still encoded) body is forwarded with upstream status and
+    headers. JSON bodies are the exception: session prefixes are stripped
+    at byte level, so an encoded one (upstream ignoring the identity
+    Accept-Encoding) is decoded first and relayed uncompressed.
+    """
+    headers = response.headers
+    strip = rewrite_response and _is_json(headers.get("content-type"))
     try:
-        text = chunk.decode("utf-8")
-        lines = text.split("\n")
-        rewritten_lines = []
-        for line in lines:
-            if line.strip():
-                try:
-                    data = json.loads(line)
-                    data = rewrite_response_data(data, tenant)
-                    rewritten_lines.append(json.dumps(data, ensure_ascii=False))
-                except json.JSONDecodeError:
-                    rewritten_lines.append(line)
-            else:
-                rewritten_lines.append(line)
-        return "\n".join(rewritten_lines).encode("utf-8")
-    except Exception:
-        return chunk
-
-
-def rewrite_response_data(data: dict, tenant: str) -> dict:
-    """Remove tenant prefix from session_id in response"""
-    if not isinstance(data, dict):
-        return data
-
-    for field in ("session_id", "sessionId", "sid"):
-        if field in data and data[field]:
-            data[field] = extract_original_session_id(data[field], tenant)
-
-    return data
+        chunks = response.aiter_bytes() if strip else response.aiter_raw()
+        body = b"".join([chunk async for chunk in chunks])
+    finally:
+        await response.aclose()
+
+    drop = _DROP_RESPONSE_HEADERS
+    if strip:
+        body = strip_session_prefix(body, tenant)
+        drop = _DROP_DECODED_HEADERS
+
+    resp = Response(content=body, status_code=response.status_code)
+    resp.raw_headers = [
+        (key, value)
+        for key, value in headers.raw
+        if key.lower() not in drop
+    ] + [(b"content-length", str(len(body)).encode("latin-1"))]
+    return resp
+
+
+def _content_length(request: Request) -> Optional[int]:
+    value = request.headers.get("content-length")
+    if value is None or not value.isdigit():
+        return None
+    return int(value)
+
+
+def _is_json(content_type: Optional[str]) -> bool:
+    """JSON (or untyped) responses are candidates for prefix stripping"""
+    return not content_type or "json" in content_type.lower()
 
 
 # ============ Health Check ============
@@ -219,19 +659,65 @@ async def health():
 
 
 @app.get("/health")
-async def health_check():
-    # Check upstream
-    try:
-        async with httpx.AsyncClient(timeout=5) as client:
-            resp = await client.get(f"{config.llmtwins_base_url}/")
-            upstream_ok = resp.status_code == 200
-    except Exception:
-        upstream_ok = False
+async def health_check(request: Request):
+    # Upstream state comes from the background prober, never a live call
+    upstream_states = prober.snapshot()
+    upstream_ok = all(
+        state["ok"] is not False and state["circuit"] != OPEN
+        for state in upstream_states.values()
+    )
 
     return {
         "status": "ok" if upstream_ok else "degraded",
-        "upstream": config.llmtwins_base_url,
+        "upstream": ",".join(upstreams.urls),
         "upstream_ok": upstream_ok,
+        "upstreams": upstream_states,
+        "worker": os.getpid(),
+        **metrics_snapshot(request.app),
+    }
+
+
+@app.get("/health/workers")
+async def health_workers(request: Request):
+    # Each worker answers for itself; the others' snapshots come from the
+    # shared metrics directory and may be a few seconds old
+    snapshots = worker_metrics.collect(current=worker_snapshot(request.app))
+    return {
+        "workers": len(snapshots),
+        "pids": sorted(snapshots),
+        "totals": aggregate(s["health"] for s in snapshots.values()),
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics(request: Request):
+    if worker_metrics.enabled:
+        snapshots = worker_metrics.collect(current=worker_snapshot(request.app))
+        snapshot = aggregate(s["metrics"] for s in snapshots.values())
+    else:
+        snapshot = metrics.snapshot()
+    return PlainTextResponse(render(snapshot), media_type="text/plain; version=0.0.4")
+
+
+def worker_snapshot(app: FastAPI) -> Dict[str, object]:
+    """What each worker publishes for /health/workers and /metrics"""
+    return {"health": metrics_snapshot(app), "metrics": metrics.snapshot()}
+
+
+def metrics_snapshot(app: FastAPI) -> Dict[str, object]:
+    """This worker's counters (the part of /health that differs per worker)"""
+    return {
+        "pool": pool_stats(app.state.http_client),
+        "scheduler": scheduler.snapshot(),
+        "coalescing": coalescer.snapshot(),
+        "cache": response_cache.snapshot(),
+        "result_cache": result_cache.snapshot(),
+        "rate_limits": rate_limiter.snapshot(),
+        "streams": stream_stats.snapshot(),
+        "resumable_streams": resume_store.snapshot(),
+        "access_log": access_log.snapshot(),
+        "tracing": tracer.snapshot(),
+        "capture": recorder.snapshot(),
     }
 
 
@@ -255,7 +741,8 @@ async def get_session_state(
     tenant = get_tenant(x_tenant_id)
     rewritten_sid = rewrite_session_id(session_id, tenant)
     return await proxy_request(
-        request, tenant, f"/api/sessions/{rewritten_sid}/state"
+        request, tenant, f"/api/sessions/{rewritten_sid}/state",
+        session_id=rewritten_sid,
     )
 
 
@@ -269,35 +756,107 @@ async def upload_to_session(
     rewritten_sid = rewrite_session_id(session_id, tenant)
 
     # For file upload, we need to forward the raw request
-    upstream_url = f"{config.llmtwins_base_url}/api/sessions/{rewritten_sid}/upload"
+    upstream_path = f"/api/sessions/{rewritten_sid}/upload"
 
     # Forward query params
     query_params = dict(request.query_params)
 
-    # Get raw body for multipart
-    body = await request.body()
+    headers = _upstream_headers(request, tenant)
+    headers["accept-encoding"] = "identity"
+    trace = current_trace()
 
-    headers = {}
-    for key, value in request.headers.items():
-        key_lower = key.lower()
-        if key_lower not in ("host", "content-length"):
-            headers[key] = value
-    headers[config.tenant_header] = tenant
+    limit = None
+    if rate_limiter.enabled:
+        limit = await rate_limiter.check(tenant, _route_template(request))
+
+    if not upload_limiter.try_acquire(tenant):
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many concurrent uploads for tenant: {tenant}",
+            headers={"Retry-After": "1"},
+        )
 
-    async with httpx.AsyncClient(timeout=config.upstream_timeout) as client:
-        response = await client.post(
-            upstream_url,
+    body = None
+    lease = None
+    base_url = None
+
+    def finish():
+        # Once the response has been read (or the upload failed)
+        upload_limiter.release(tenant)
+        if lease is not None:
+            lease.release()
+        if base_url is not None:
+            upstreams.release(base_url)
+        response_cache.invalidate(tenant, rewritten_sid)
+
+    try:
+        # Stream the multipart body instead of reading it into memory
+        body, length = await prepare_upload(request, tenant)
+        headers["Content-Length"] = str(length)
+
+        lease = await scheduler.acquire(tenant, INTERACTIVE)
+        response, base_url = await send_upstream(
+            get_client(request),
+            "POST",
+            upstream_path,
             params=query_params,
             content=body,
             headers=headers,
+            session_id=rewritten_sid,
+            trace=trace if trace is not None and trace.sampled else None,
         )
+    except BaseException as e:
+        if body is not None:
+            close_upload(body)
+        finish()
+        if isinstance(e, UploadTooLarge):
+            raise HTTPException(status_code=413, detail=str(e))
+        raise
 
-        try:
-            resp_data = response.json()
-            resp_data = rewrite_response_data(resp_data, tenant)
-            return JSONResponse(content=resp_data, status_code=response.status_code)
-        except json.JSONDecodeError:
-            return JSONResponse(content=response.text, status_code=response.status_code)
+    try:
+        resp = await passthrough_response(response, tenant)
+    finally:
+        finish()
+    if limit is not None:
+        resp.headers.update(limit.headers())
+    return resp
+
+
+@app.get("/api/sessions/{session_id}/stream")
+async def resume_stream(
+    session_id: str,
+    request: Request,
+    last_event_id: Optional[int] = None,
+    stream_id: Optional[str] = None,
+    x_tenant_id: Optional[str] = Header(None, alias="X-Tenant-ID"),
+):
+    """Resume a resumable stream after ``last_event_id`` (or Last-Event-ID)"""
+    tenant = get_tenant(x_tenant_id)
+    if rate_limiter.enabled:
+        await rate_limiter.check(tenant, _route_template(request))
+
+    if last_event_id is None:
+        header = request.headers.get("last-event-id", "0").strip()
+        last_event_id = int(header) if header.isdigit() else 0
+
+    buffer = resume_store.get(
+        rewrite_session_id(session_id, tenant),
+        stream_id or request.headers.get(STREAM_ID_HEADER),
+    )
+    if buffer is None:
+        raise HTTPException(status_code=404, detail="No resumable stream for session")
+    if last_event_id + 1 < buffer.first_id:
+        raise HTTPException(
+            status_code=410,
+            detail=f"Events before {buffer.first_id} are no longer buffered",
+        )
+
+    stream_stats.count(tenant, "resumed")
+    return StreamingResponse(
+        follow(buffer, last_event_id, tenant, request.receive),
+        media_type="application/x-ndjson",
+        headers={STREAM_ID_HEADER: buffer.stream_id},
+    )
 
 
 # ============ Chat API ============
@@ -308,7 +867,8 @@ async def chat(
     x_tenant_id: Optional[str] = Header(None, alias="X-Tenant-ID"),
 ):
     tenant = get_tenant(x_tenant_id)
-    return await proxy_request(request, tenant, "/api/chat")
+    # A chat turn changes its session's state
+    return await proxy_request(request, tenant, "/api/chat", invalidate_cache=IF_SESSION)
 
 
 @app.post("/api/mapping")
@@ -317,7 +877,9 @@ async def mapping(
     x_tenant_id: Optional[str] = Header(None, alias="X-Tenant-ID"),
 ):
     tenant = get_tenant(x_tenant_id)
-    return await proxy_request(request, tenant, "/api/mapping")
+    return await proxy_request(
+        request, tenant, "/api/mapping", endpoint_class=BATCH, cache_results=True,
+    )
 
 
 @app.post("/api/mapping/update")
@@ -326,7 +888,7 @@ async def mapping_update(
     x_tenant_id: Optional[str] = Header(None, alias="X-Tenant-ID"),
 ):
     tenant = get_tenant(x_tenant_id)
-    return await proxy_request(request, tenant, "/api/mapping/update")
+    return await proxy_request(request, tenant, "/api/mapping/update", invalidate_cache=True)
 
 
 @app.post("/api/mapping/revise")
@@ -335,7 +897,10 @@ async def mapping_revise(
     x_tenant_id: Optional[str] = Header(None, alias="X-Tenant-ID"),
 ):
     tenant = get_tenant(x_tenant_id)
-    return await proxy_request(request, tenant, "/api/mapping/revise")
+    return await proxy_request(
+        request, tenant, "/api/mapping/revise", endpoint_class=BATCH,
+        invalidate_cache=True, cache_results=True,
+    )
 
 
 # ============ Pipeline API ============
@@ -349,7 +914,8 @@ async def pipeline_one_click(
     tenant = get_tenant(x_tenant_id)
     rewritten_sid = rewrite_session_id(session_id, tenant)
     return await proxy_request(
-        request, tenant, f"/api/sessions/{rewritten_sid}/pipeline/one_click"
+        request, tenant, f"/api/sessions/{rewritten_sid}/pipeline/one_click",
+        endpoint_class=BATCH, session_id=rewritten_sid, invalidate_cache=True,
     )
 
 
@@ -361,7 +927,9 @@ async def planning(
     x_tenant_id: Optional[str] = Header(None, alias="X-Tenant-ID"),
 ):
     tenant = get_tenant(x_tenant_id)
-    return await proxy_request(request, tenant, "/api/planning")
+    return await proxy_request(
+        request, tenant, "/api/planning", endpoint_class=BATCH, cache_results=True,
+    )
 
 
 # ============ Catch-all for other endpoints ============
@@ -377,5 +945,5 @@ async def catch_all(
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host=config.host, port=config.port)
+    from server import run
+    run(config)
@@ -0,0 +1,296 @@
+# llmtwins_wrapper/metrics.py
+"""
+Prometheus metrics per tenant and route
+
+Labels are the tenant and the route template (``/api/sessions/{session_id}/state``,
+never the concrete path), so raw session ids never become label values.
+Tenants are capped at ``METRICS_MAX_TENANTS``; tenants beyond the cap, and
+ones rejected by the whitelist, are reported as ``other``.
+
+Recording is a dict lookup for the (tenant, route) series plus integer
+increments on preallocated counters; the text exposition is only built
+when /metrics is scraped.
+
+- ``MetricsMiddleware`` wraps the ASGI app: status counts, time to first
+  byte, total duration and bytes in/out for every request (also fed to
+  the access log)
+- ``_forward`` records upstream latency, in-flight upstream calls and the
+  connection-pool wait reported by httpx's trace extension
+"""
+
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from accesslog import AccessLog
+from config import WrapperConfig, config
+
+PREFIX = "llmtwins_wrapper"
+OTHER = "other"
+UNMATCHED = "unmatched"
+
+# Seconds; LLM calls run up to UPSTREAM_TIMEOUT (180s by default)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# snapshot key, metric name, type, help text
+SCALARS = (
+    ("bytes_in", "request_bytes_total", "counter", "Request body bytes received"),
+    ("bytes_out", "response_bytes_total", "counter", "Response body bytes sent"),
+    ("in_flight", "upstream_in_flight", "gauge", "Upstream calls in progress"),
+)
+
+# snapshot key (exported as {key}_seconds), help text
+HISTOGRAMS = (
+    ("upstream_latency", "Time until LLMTwins returned response headers"),
+    ("ttfb", "Time until the first response body byte was sent"),
+    ("duration", "Time until the response was complete"),
+    ("pool_wait", "Time spent waiting for an upstream pool connection"),
+)
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...] = BUCKETS):
+        self.bounds = bounds
+        # One slot per bucket plus +Inf; cumulated only when rendering
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def snapshot(self) -> Dict[str, object]:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            buckets[_format(bound)] = cumulative
+        return {"buckets": buckets, "sum": self.sum, "count": cumulative}
+
+
+class Series:
+    """All metrics of one (tenant, route) pair"""
+
+    __slots__ = (
+        "statuses", "upstream_latency", "ttfb", "duration", "pool_wait",
+        "bytes_in", "bytes_out", "in_flight",
+    )
+
+    def __init__(self, bounds: Tuple[float, ...] = BUCKETS):
+        self.statuses: Dict[int, int] = {}
+        self.upstream_latency = Histogram(bounds)
+        self.ttfb = Histogram(bounds)
+        self.duration = Histogram(bounds)
+        self.pool_wait = Histogram(bounds)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.in_flight = 0
+
+    def count(self, status: int) -> None:
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "requests": {str(status): n for status, n in self.statuses.items()},
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "in_flight": self.in_flight,
+            **{name: getattr(self, name).snapshot() for name, _ in HISTOGRAMS},
+        }
+
+
+class Metrics:
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_tenants: int = 100,
+        valid_tenants: Iterable[str] = (),
+        default_tenant: str = "default",
+        bounds: Tuple[float, ...] = BUCKETS,
+    ):
+        self.enabled = enabled
+        self.max_tenants = max_tenants
+        self.valid_tenants = set(valid_tenants)
+        self.default_tenant = default_tenant
+        self.bounds = bounds
+        self._series: Dict[Tuple[str, str], Series] = {}
+        self._tenants = set()
+
+    @classmethod
+    def from_config(cls, cfg: WrapperConfig) -> "Metrics":
+        return cls(
+            enabled=cfg.metrics_enabled,
+            max_tenants=cfg.metrics_max_tenants,
+            valid_tenants=cfg.valid_tenants,
+            default_tenant=cfg.default_tenant,
+        )
+
+    def tenant_label(self, tenant: Optional[str]) -> str:
+        """The tenant itself, or ``other`` once past the whitelist/cap"""
+        tenant = tenant or self.default_tenant
+        if tenant in self._tenants:
+            return tenant
+        if self.valid_tenants and tenant not in self.valid_tenants:
+            return OTHER
+        if len(self._tenants) >= self.max_tenants:
+            return OTHER
+        self._tenants.add(tenant)
+        return tenant
+
+    def series(self, tenant: Optional[str], route: str) -> Series:
+        series = self._series.get((tenant, route))
+        if series is None:
+            key = (self.tenant_label(tenant), route)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = Series(self.bounds)
+        return series
+
+    def clear(self) -> None:
+        self._series.clear()
+        self._tenants.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, object]]]:
+        """{tenant: {route: series}}; sums across workers (server.aggregate)"""
+        result: Dict[str, Dict[str, Dict[str, object]]] = {}
+        for (tenant, route), series in self._series.items():
+            result.setdefault(tenant, {})[route] = series.snapshot()
+        return result
+
+
+# ============ Exposition ============
+
+def _format(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def render(snapshot: Dict[str, Dict[str, Dict[str, object]]]) -> str:
+    """Prometheus text format (0.0.4) for a Metrics.snapshot()"""
+    series = [
+        (_labels(tenant=tenant, route=route), data)
+        for tenant, routes in sorted(snapshot.items())
+        for route, data in sorted(routes.items())
+    ]
+    lines: List[str] = []
+
+    def header(name: str, kind: str, text: str) -> str:
+        lines.append(f"# HELP {PREFIX}_{name} {text}")
+        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        return f"{PREFIX}_{name}"
+
+    name = header("requests_total", "counter", "Requests by tenant, route and status")
+    for labels, data in series:
+        for status, count in sorted(data["requests"].items()):
+            lines.append(f'{name}{{{labels},status="{status}"}} {count}')
+
+    for key, metric, kind, text in SCALARS:
+        name = header(metric, kind, text)
+        for labels, data in series:
+            lines.append(f"{name}{{{labels}}} {data[key]}")
+
+    for key, text in HISTOGRAMS:
+        name = header(f"{key}_seconds", "histogram", text)
+        for labels, data in series:
+            histogram = data[key]
+            if not histogram["count"]:
+                continue
+            for bound, count in histogram["buckets"].items():
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram['sum']}")
+            lines.append(f"{name}_count{{{labels}}} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+# ============ ASGI Middleware ============
+
+class MetricsMiddleware:
+    """
+    Records status, TTFB, duration and bytes for every HTTP request, into
+    the metrics and (when given) the access log.
+
+    The route label is read from ``scope["route"]`` once the app has routed
+    the request (the FastAPI router and the fast path both set it).
+    """
+
+    def __init__(
+        self,
+        app,
+        metrics: Metrics,
+        access_log: Optional[AccessLog] = None,
+        header: Optional[str] = None,
+    ):
+        self.app = app
+        self.metrics = metrics
+        self.access_log = access_log
+        self.header = (header or config.tenant_header).lower().encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        metrics = self.metrics
+        access_log = self.access_log
+        if access_log is not None and not access_log.enabled:
+            access_log = None
+        if scope["type"] != "http" or not (metrics.enabled or access_log):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        # status, first byte time, bytes in, bytes out
+        state = [500, 0.0, 0, 0]
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state[2] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            kind = message["type"]
+            if kind == "http.response.start":
+                state[0] = message["status"]
+            elif kind == "http.response.body":
+                body = message.get("body", b"")
+                if body and not state[1]:
+                    state[1] = time.perf_counter()
+                state[3] += len(body)
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            ended = time.perf_counter()
+            tenant = _header(scope, self.header) or metrics.default_tenant
+            route = getattr(scope.get("route"), "path", UNMATCHED)
+            ttfb = (state[1] or ended) - started
+            if metrics.enabled:
+                series = metrics.series(tenant, route)
+                series.count(state[0])
+                series.bytes_in += state[2]
+                series.bytes_out += state[3]
+                series.ttfb.observe(ttfb)
+                series.duration.observe(ended - started)
+            if access_log is not None:
+                access_log.record(
+                    tenant, scope["method"], route, state[0],
+                    ended - started, ttfb, state[2], state[3],
+                )
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1").strip() or None
+    return None
+
+
+metrics = Metrics.from_config(config)
@@ -0,0 +1,324 @@
+# llmtwins_wrapper/ratelimit.py
+"""
+Per-tenant and per-route token-bucket rate limiting
+
+Rules come from ``RATE_LIMITS`` and/or a JSON file (``RATE_LIMIT_FILE``).
+A rule is ``rate`` tokens per second with a bucket of ``burst`` tokens,
+for a tenant (or ``*``) and a route template (or ``*`` = all routes).
+
+Every request takes one token from its route bucket and from the tenant's
+all-routes bucket; tenant-specific rules win over ``*`` defaults. Denied
+requests get 429 with Retry-After and X-RateLimit-* headers.
+
+Bucket state lives in a pluggable store:
+- ``memory`` (default): a dict sharded by tenant, no locks needed on the
+  single-threaded event loop; buckets that have refilled are swept out,
+  since a missing bucket starts full anyway
+- ``sqlite:///path``: a file several wrapper replicas on one host can
+  share, a local stand-in for a networked store
+"""
+
+import asyncio
+import json
+import math
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from config import WrapperConfig, config
+
+ANY = "*"
+OTHER = "other"
+
+# Seconds between sweeps of refilled buckets out of the memory store
+SWEEP_INTERVAL = 60.0
+
+
+@dataclass(frozen=True)
+class RateRule:
+    rate: float  # tokens per second
+    burst: int   # bucket size
+
+    def __post_init__(self):
+        if not self.rate > 0 or self.burst < 1:
+            raise ValueError(
+                f"Rate limit needs rate > 0 and burst >= 1, got {self.rate}:{self.burst}"
+            )
+
+
+@dataclass
+class RateDecision:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset: float        # seconds until the tightest bucket is full again
+    retry_after: float  # seconds until the request would be allowed
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+Bucket = Tuple[str, RateRule]
+
+
+def _refill(tokens: float, updated: float, rule: RateRule, now: float) -> float:
+    return min(float(rule.burst), tokens + max(0.0, now - updated) * rule.rate)
+
+
+def _decide(levels: List[Tuple[float, RateRule]], cost: float) -> RateDecision:
+    """Decision from the refilled token levels of every applicable bucket"""
+    allowed = all(tokens >= cost for tokens, _ in levels)
+    tightest_tokens, tightest = min(levels, key=lambda level: level[0] / level[1].burst)
+    remaining = tightest_tokens - cost if allowed else tightest_tokens
+    retry_after = 0.0 if allowed else max(
+        (cost - tokens) / rule.rate for tokens, rule in levels if tokens < cost
+    )
+    return RateDecision(
+        allowed=allowed,
+        limit=tightest.burst,
+        remaining=max(0, int(remaining)),
+        reset=(tightest.burst - remaining) / tightest.rate,
+        retry_after=retry_after,
+    )
+
+
+class MemoryStore:
+    """In-process buckets, sharded by tenant"""
+
+    def __init__(self, sweep_interval: float = SWEEP_INTERVAL):
+        # tenant -> bucket name -> [tokens, updated, full again at]
+        self._shards: Dict[str, Dict[str, List[float]]] = {}
+        self.sweep_interval = sweep_interval
+        self._next_sweep: Optional[float] = None
+
+    async def consume(self, tenant: str, buckets: List[Bucket], cost: float = 1.0) -> RateDecision:
+        return self.consume_now(tenant, buckets, cost, time.monotonic())
+
+    def consume_now(
+        self, tenant: str, buckets: List[Bucket], cost: float, now: float
+    ) -> RateDecision:
+        if self._next_sweep is None or now >= self._next_sweep:
+            self._sweep(now)
+            self._next_sweep = now + self.sweep_interval
+
+        shard = self._shards.get(tenant)
+        if shard is None:
+            shard = self._shards[tenant] = {}
+
+        states = []
+        for name, rule in buckets:
+            state = shard.get(name)
+            if state is None:
+                state = shard[name] = [float(rule.burst), now, now]
+            state[0] = _refill(state[0], state[1], rule, now)
+            state[1] = now
+            states.append(state)
+
+        decision = _decide([(state[0], rule) for state, (_, rule) in zip(states, buckets)], cost)
+        if decision.allowed:
+            for state, (_, rule) in zip(states, buckets):
+                state[0] -= cost
+                state[2] = now + (rule.burst - state[0]) / rule.rate
+        return decision
+
+    def _sweep(self, now: float) -> None:
+        """Drop buckets that are full again, and tenants left without any"""
+        for tenant, shard in list(self._shards.items()):
+            for name, state in list(shard.items()):
+                if state[2] <= now:
+                    del shard[name]
+            if not shard:
+                del self._shards[tenant]
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards.values())
+
+
+class SQLiteStore:
+    """Buckets in a SQLite file shared by wrapper replicas on one host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    async def consume(self, tenant: str, buckets: List[Bucket], cost: float = 1.0) -> RateDecision:
+        return await asyncio.to_thread(self.consume_now, tenant, buckets, cost, time.time())
+
+    def consume_now(
+        self, tenant: str, buckets: List[Bucket], cost: float, now: float
+    ) -> RateDecision:
+        conn = self._connect()
+        keys = [f"{tenant}\0{name}" for name, _ in buckets]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            for key, (_, rule) in zip(keys, buckets):
+                row = conn.execute(
+                    "SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens = float(rule.burst) if row is None else _refill(row[0], row[1], rule, now)
+                levels.append((tokens, rule))
+
+            decision = _decide(levels, cost)
+            spend = cost if decision.allowed else 0.0
+            conn.executemany(
+                "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                [(key, tokens - spend, now) for key, (tokens, _) in zip(keys, levels)],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return decision
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def create_store(spec: str):
+    if spec.startswith("sqlite://"):
+        return SQLiteStore(spec[len("sqlite://"):] or "ratelimit.sqlite3")
+    if spec in ("", "memory"):
+        return MemoryStore()
+    raise ValueError(f"Unknown rate limit store: {spec}")
+
+
+def parse_rules(spec: str) -> Dict[Tuple[str, str], RateRule]:
+    """
+    Parse ``[tenant@]route=rate:burst`` entries, comma-separated.
+
+    e.g. ``/api/chat=5:10,nantou-gov@/api/chat=20:40,*=50:100``
+    """
+    rules = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        target, _, limit = item.rpartition("=")
+        tenant, _, route = target.rpartition("@")
+        rate, _, burst = limit.partition(":")
+        rate = float(rate)
+        burst = int(burst) if burst else max(1, math.ceil(rate))
+        rules[(tenant or ANY, route or ANY)] = RateRule(rate, burst)
+    return rules
+
+
+def load_rules_file(path: str) -> Dict[Tuple[str, str], RateRule]:
+    """
+    Load rules from JSON::
+
+        {"*": {"/api/chat": {"rate": 5, "burst": 10}},
+         "nantou-gov": {"*": {"rate": 100, "burst": 200}}}
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return {
+        (tenant, route): RateRule(float(rule["rate"]), int(rule.get("burst", rule["rate"])))
+        for tenant, routes in data.items()
+        for route, rule in routes.items()
+    }
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        rules: Dict[Tuple[str, str], RateRule],
+        store=None,
+        max_tenants: int = 100,
+    ):
+        self.rules = dict(rules)
+        self.store = store if store is not None else MemoryStore()
+        self.max_tenants = max_tenants
+        # Only tenants and routes named by a rule can resolve differently
+        self._rule_tenants = frozenset(tenant for tenant, _ in self.rules)
+        self._rule_routes = frozenset(route for _, route in self.rules)
+        self._resolved: Dict[Tuple[str, Optional[str]], List[Bucket]] = {}
+        # Tenants past ``max_tenants`` are counted as "other"
+        self.rejected: Dict[str, int] = {}
+
+    @classmethod
+    def from_config(cls, cfg: WrapperConfig) -> "RateLimiter":
+        rules = parse_rules(cfg.rate_limits)
+        if cfg.rate_limit_file and os.path.exists(cfg.rate_limit_file):
+            rules.update(load_rules_file(cfg.rate_limit_file))
+        return cls(rules, create_store(cfg.rate_limit_store), max_tenants=cfg.metrics_max_tenants)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rules)
+
+    def buckets(self, tenant: str, route: str) -> List[Bucket]:
+        """Applicable (bucket name, rule) pairs; tenant rules beat defaults"""
+        key = (
+            tenant if tenant in self._rule_tenants else ANY,
+            route if route in self._rule_routes else None,
+        )
+        resolved = self._resolved.get(key)
+        if resolved is None:
+            resolved = []
+            if route != ANY:
+                rule = self.rules.get((tenant, route)) or self.rules.get((ANY, route))
+                if rule is not None:
+                    resolved.append((route, rule))
+            rule = self.rules.get((tenant, ANY)) or self.rules.get((ANY, ANY))
+            if rule is not None:
+                resolved.append((ANY, rule))
+            self._resolved[key] = resolved
+        return resolved
+
+    async def check(self, tenant: str, route: str) -> Optional[RateDecision]:
+        """
+        Take a token for the request; None when no rule applies.
+
+        Raises HTTPException 429 when a bucket is empty.
+        """
+        buckets = self.buckets(tenant, route)
+        if not buckets:
+            return None
+        decision = await self.store.consume(tenant, buckets)
+        if not decision.allowed:
+            label = tenant
+            if tenant not in self.rejected and len(self.rejected) >= self.max_tenants:
+                label = OTHER
+            self.rejected[label] = self.rejected.get(label, 0) + 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"Rate limit exceeded for tenant: {tenant}",
+                headers=decision.headers(),
+            )
+        return decision
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "rules": {f"{tenant}@{route}": [rule.rate, rule.burst]
+                      for (tenant, route), rule in self.rules.items()},
+            "rejected": dict(self.rejected),
+        }
+
+
+rate_limiter = RateLimiter.from_config(config)
@@ -0,0 +1,149 @@
+# llmtwins_wrapper/relay.py
+"""
+Relaying streamed upstream responses to the client
+
+Upstream chunks are pumped through a bounded queue, so a slow client
+stalls reads from LLMTwins (and TCP backpressure reaches it) instead of
+growing buffers in the wrapper.
+
+A watcher listens on the ASGI receive channel for ``http.disconnect``.
+When the client goes away mid-stream the pump is cancelled and the
+upstream response is closed right away, which drops the connection
+LLMTwins is generating into rather than leaving it to garbage collection.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+_DISCONNECTED = object()
+
+
+class _Failure:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class StreamStats:
+    """Started / completed / abandoned (and resumable) streams per tenant"""
+
+    OUTCOMES = ("started", "completed", "abandoned", "detached", "resumed", "not_resumable")
+
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: dict.fromkeys(self.OUTCOMES, 0)
+        )
+
+    def count(self, tenant: str, outcome: str) -> None:
+        self._counts[tenant][outcome] += 1
+
+    def abandoned(self, tenant: str) -> int:
+        return self._counts[tenant]["abandoned"] if tenant in self._counts else 0
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        return {tenant: dict(counts) for tenant, counts in self._counts.items()}
+
+
+stream_stats = StreamStats()
+
+
+async def relay_stream(
+    chunks: AsyncIterator[bytes],
+    receive: Callable[[], Awaitable[dict]],
+    close: Callable[[], Awaitable[None]],
+    tenant: str,
+    read_ahead: Optional[int] = None,
+    stats: Optional[StreamStats] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Yield ``chunks`` to the client with bounded read-ahead.
+
+    ``close`` releases the upstream response; it is called exactly once,
+    as soon as the stream ends, fails or the client disconnects.
+    """
+    stats = stats if stats is not None else stream_stats
+    queue: asyncio.Queue = asyncio.Queue(
+        maxsize=read_ahead if read_ahead is not None else config.stream_read_ahead
+    )
+    closed = False
+    completed = False
+    failed = False
+    abandoned = False
+
+    async def release() -> None:
+        nonlocal closed
+        if not closed:
+            closed = True
+            await close()
+
+    def abandon() -> None:
+        nonlocal abandoned
+        abandoned = True
+        stats.count(tenant, "abandoned")
+
+    async def pump() -> None:
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+            await queue.put(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(_Failure(e))
+
+    async def watch() -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+        # Client is gone: stop reading and drop the upstream connection
+        abandon()
+        logger.info(f"[{tenant}] Client disconnected, cancelling upstream stream")
+        pump_task.cancel()
+        await asyncio.gather(pump_task, return_exceptions=True)
+        await release()
+        # Wake the consumer if it is waiting for the next chunk
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(_DISCONNECTED)
+
+    stats.count(tenant, "started")
+    pump_task = asyncio.create_task(pump())
+    watch_task = asyncio.create_task(watch())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _END:
+                completed = True
+                stats.count(tenant, "completed")
+                return
+            if item is _DISCONNECTED:
+                return
+            if isinstance(item, _Failure):
+                failed = True
+                raise item.error
+            yield item
+    finally:
+        if abandoned:
+            # The watcher is already cleaning up; let it finish
+            await asyncio.gather(watch_task, return_exceptions=True)
+        else:
+            # Once the response completes the server reports
+            # http.disconnect too, which is not an abandoned stream
+            watch_task.cancel()
+            await asyncio.gather(watch_task, return_exceptions=True)
+        pump_task.cancel()
+        await asyncio.gather(pump_task, return_exceptions=True)
+        if not (completed or failed or abandoned):
+            # Closed early without a disconnect message (e.g. the server
+            # cancelled the response)
+            abandon()
+        await release()
@@ -0,0 +1,619 @@
+# llmtwins_wrapper/replay.py
+"""
+Load-test harness: replay captured traffic against wrapper builds
+
+Traffic captured with ``CAPTURE_FILE`` (capture.py) is replayed with its
+original arrival pattern, sped up ``--speed`` times, against each wrapper
+build in turn. Every build talks to the same stub LLMTwins, which answers
+each replayed request with the recorded status and paces its body with the
+recorded chunk sizes and gaps (the streaming token cadence), echoing the
+upstream session id so the session rewriters do their usual work.
+
+Reported per build: throughput, p50/p99 latency and time to first byte,
+the wrapper's own share of TTFB (measured minus what the stub was told to
+wait), and the wrapper process's CPU time and peak RSS (from /proc).
+``--baseline`` compares against an earlier report (or another build of the
+same run) and exits non-zero on regressions, so a slower ``proxy_request``
+or stream rewriter is caught before it ships.
+
+Usage:
+    # Capture on a live deployment
+    CAPTURE_FILE=/var/log/llmtwins/capture-{pid}.jsonl CAPTURE_REDACT_KEY=... python main.py
+
+    # Replay at 4x: the main branch vs this checkout, with and without the fast path
+    python replay.py capture-*.jsonl --speed 4 \\
+        --build main=../wrapper-main --build head=. --build head-fast=.,FAST_PATH=true \\
+        --baseline main --output report.json
+"""
+
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import math
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import httpx
+
+REPLAY_ID_HEADER = "X-Replay-Id"
+_REPLAY_ID = REPLAY_ID_HEADER.lower().encode("latin-1")
+# Same fields (and prefix separator) the wrapper rewrites
+_SESSION_FIELDS = ("session_id", "sessionId", "sid")
+_SESSION_PATH_PREFIX = "/api/sessions/"
+
+
+# ============ Capture files ============
+
+def load_capture(paths: Iterable[str]) -> List[dict]:
+    """All records of the given capture files (.jsonl or .jsonl.gz), by time"""
+    records = []
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def is_stream(record: dict) -> bool:
+    return "ndjson" in (record.get("response_type") or "")
+
+
+def stub_delay(record: dict, cadence: float = 1.0) -> float:
+    """Seconds the stub waits before the first body byte of this record"""
+    chunks = record["chunks"]
+    if not chunks:
+        return 0.0
+    if is_stream(record):
+        return chunks[0][0] / 1000 * cadence
+    return sum(gap for gap, _ in chunks) / 1000 * cadence
+
+
+def request_body(record: dict) -> Tuple[Optional[bytes], Optional[dict]]:
+    """(content, files) that reproduce the captured request body"""
+    if record.get("body") is not None:
+        return record["body"].encode("utf-8"), None
+    size = record.get("size") or 0
+    if not size:
+        return None, None
+    content_type = record.get("type") or ""
+    if content_type.startswith("multipart/form-data"):
+        return None, {"file": ("upload.bin", b"x" * size)}
+    if "json" in content_type:
+        # Body was over CAPTURE_MAX_BODY: same size, no session fields
+        return json.dumps({"pad": "x" * max(0, size - 11)}).encode("utf-8"), None
+    return b"x" * size, None
+
+
+# ============ Stub LLMTwins ============
+
+class StubLLMTwins:
+    """
+    ASGI stand-in for LLMTwins that replays recorded response pacing.
+
+    Requests carrying ``X-Replay-Id`` (forwarded by the wrapper) get that
+    record's status and chunk cadence, scaled by ``cadence`` (0 = no
+    waiting); anything else (health probes) gets an immediate ``{}``.
+    """
+
+    def __init__(self, records: List[dict], cadence: float = 1.0):
+        self.records = records
+        self.cadence = cadence
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await receive()
+            await send({"type": "lifespan.startup.complete"})
+            await receive()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        record = None
+        for key, value in scope["headers"]:
+            if key == _REPLAY_ID:
+                index = int(value)
+                if 0 <= index < len(self.records):
+                    record = self.records[index]
+        session_id = _session_id(scope["path"], body)
+
+        if record is None:
+            await _respond(send, 200, b"application/json", [_padded(session_id, 0)])
+            return
+
+        status = record["status"]
+        chunks = record["chunks"] if status not in (204, 304) else []
+        if is_stream(record):
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"application/x-ndjson")],
+            })
+            for gap, size in chunks:
+                await self._wait(gap)
+                await send({
+                    "type": "http.response.body",
+                    "body": _padded(session_id, size, "\n"),
+                    "more_body": True,
+                })
+            await send({"type": "http.response.body", "body": b""})
+        else:
+            await self._wait(sum(gap for gap, _ in chunks))
+            size = sum(size for _, size in chunks)
+            await _respond(
+                send, status, b"application/json", [_padded(session_id, size)] if chunks else [],
+            )
+
+    async def _wait(self, ms: float) -> None:
+        if ms > 0 and self.cadence > 0:
+            await asyncio.sleep(ms / 1000 * self.cadence)
+
+
+async def _respond(send, status: int, content_type: bytes, chunks: List[bytes]) -> None:
+    body = b"".join(chunks)
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _session_id(path: str, body: bytes) -> Optional[str]:
+    if path.startswith(_SESSION_PATH_PREFIX):
+        return path[len(_SESSION_PATH_PREFIX):].split("/", 1)[0]
+    try:
+        data = json.loads(body) if body else None
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    if isinstance(data, dict):
+        for field in _SESSION_FIELDS:
+            if isinstance(data.get(field), str):
+                return data[field]
+    return None
+
+
+def _padded(session_id: Optional[str], size: int, ending: str = "") -> bytes:
+    """A JSON object carrying the session id, padded to about ``size`` bytes"""
+    head = json.dumps({"session_id": session_id, "content": ""}) + ending
+    pad = max(0, size - len(head.encode("utf-8")))
+    return (json.dumps({"session_id": session_id, "content": "x" * pad}) + ending).encode("utf-8")
+
+
+# ============ Replay ============
+
+class Result(NamedTuple):
+    index: int
+    status: int  # 0 = transport error
+    latency: float
+    ttfb: float
+    bytes: int
+    error: Optional[str] = None
+
+
+async def replay(
+    records: List[dict],
+    client: httpx.AsyncClient,
+    speed: float = 1.0,
+    concurrency: int = 1000,
+    tenant_header: str = "X-Tenant-ID",
+) -> Tuple[List[Result], float]:
+    """
+    Send every record at its captured offset divided by ``speed``.
+
+    Arrivals are open-loop (a slow wrapper does not slow the schedule);
+    ``concurrency`` only caps requests in flight. Returns the results and
+    the wall time from the first send to the last completion.
+    """
+    if not records:
+        return [], 0.0
+    limit = asyncio.Semaphore(concurrency)
+    first = records[0]["ts"]
+    started = time.perf_counter()
+    results: List[Result] = []
+
+    async def one(index: int, record: dict) -> None:
+        delay = (record["ts"] - first) / speed - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with limit:
+            results.append(await _send(client, index, record, tenant_header))
+
+    await asyncio.gather(*(one(i, r) for i, r in enumerate(records)))
+    return results, time.perf_counter() - started
+
+
+async def _send(client: httpx.AsyncClient, index: int, record: dict, tenant_header: str) -> Result:
+    headers = {REPLAY_ID_HEADER: str(index)}
+    if record.get("tenant"):
+        headers[tenant_header] = record["tenant"]
+    content, files = request_body(record)
+    if content is not None and record.get("type"):
+        headers["Content-Type"] = record["type"]
+    url = record["path"] + (f"?{record['query']}" if record.get("query") else "")
+
+    started = time.perf_counter()
+    first = None
+    received = 0
+    error = None
+    try:
+        request = client.build_request(
+            record["method"], url, headers=headers, content=content, files=files,
+        )
+        response = await client.send(request, stream=True)
+        try:
+            async for chunk in response.aiter_raw():
+                if first is None:
+                    first = time.perf_counter()
+                received += len(chunk)
+        finally:
+            await response.aclose()
+        status = response.status_code
+    except httpx.HTTPError as e:
+        status, error = 0, type(e).__name__
+    ended = time.perf_counter()
+    return Result(index, status, ended - started, (first or ended) - started, received, error)
+
+
+# ============ Report ============
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100); 0.0 for no values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _ms(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50": round(1000 * percentile(values, 50), 2),
+        "p99": round(1000 * percentile(values, 99), 2),
+    }
+
+
+def summarize(
+    records: List[dict],
+    results: List[Result],
+    wall: float,
+    cadence: float = 1.0,
+    usage: Optional[Dict[str, float]] = None,
+) -> Dict[str, object]:
+    statuses: Dict[str, int] = {}
+    transport_errors: Dict[str, int] = {}
+    for r in results:
+        statuses[str(r.status)] = statuses.get(str(r.status), 0) + 1
+        if r.error:
+            transport_errors[r.error] = transport_errors.get(r.error, 0) + 1
+    ok = [r for r in results if r.status]
+    return {
+        "requests": len(results),
+        "errors": sum(1 for r in results if r.status == 0 or r.status >= 500),
+        "statuses": dict(sorted(statuses.items())),
+        "transport_errors": transport_errors,
+        "duration_s": round(wall, 3),
+        "throughput_rps": round(len(results) / wall, 2) if wall else 0.0,
+        "latency_ms": _ms([r.latency for r in ok]),
+        "ttfb_ms": _ms([r.ttfb for r in ok]),
+        # The wrapper's (and the network's) share of TTFB
+        "ttfb_overhead_ms": _ms([
+            max(0.0, r.ttfb - stub_delay(records[r.index], cadence)) for r in ok
+        ]),
+        **(usage or {}),
+    }
+
+
+# metric path, higher is better, smallest change that counts
+REGRESSION_CHECKS = (
+    (("throughput_rps",), True, 1.0),
+    (("latency_ms", "p50"), False, 1.0),
+    (("latency_ms", "p99"), False, 5.0),
+    (("ttfb_ms", "p50"), False, 1.0),
+    (("ttfb_ms", "p99"), False, 5.0),
+    (("ttfb_overhead_ms", "p50"), False, 1.0),
+    (("ttfb_overhead_ms", "p99"), False, 5.0),
+    (("cpu_seconds",), False, 0.1),
+    (("peak_rss_mb",), False, 5.0),
+)
+
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.1) -> List[str]:
+    """Regressions of ``report`` against ``baseline`` beyond ``tolerance``"""
+    regressions = []
+    for path, higher_is_better, floor in REGRESSION_CHECKS:
+        new, old = report, baseline
+        for key in path:
+            new = new.get(key) if isinstance(new, dict) else None
+            old = old.get(key) if isinstance(old, dict) else None
+        if new is None or old is None:
+            continue
+        change = (old - new) if higher_is_better else (new - old)
+        if change > floor and change > tolerance * old:
+            regressions.append(f"{'.'.join(path)}: {old} -> {new}")
+    if report.get("errors", 0) > baseline.get("errors", 0):
+        regressions.append(f"errors: {baseline.get('errors', 0)} -> {report['errors']}")
+    return regressions
+
+
+def format_table(reports: Dict[str, dict]) -> str:
+    columns = (
+        ("build", None), ("rps", ("throughput_rps",)), ("errors", ("errors",)),
+        ("p50 ms", ("latency_ms", "p50")), ("p99 ms", ("latency_ms", "p99")),
+        ("ttfb p50", ("ttfb_ms", "p50")), ("ttfb p99", ("ttfb_ms", "p99")),
+        ("ovh p50", ("ttfb_overhead_ms", "p50")), ("ovh p99", ("ttfb_overhead_ms", "p99")),
+        ("cpu s", ("cpu_seconds",)), ("cpu %", ("cpu_percent",)), ("rss MB", ("peak_rss_mb",)),
+    )
+    rows = [[name for name, _ in columns]]
+    for build, report in reports.items():
+        row = [build]
+        for _, path in columns[1:]:
+            value = report
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            row.append("-" if value is None else str(value))
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join("  ".join(cell.rjust(w) for cell, w in zip(row, widths)) for row in rows)
+
+
+# ============ Process usage ============
+
+_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def _process_tree(pid: int) -> List[int]:
+    """pid and all its descendants (Linux /proc)"""
+    pids, todo = [], [pid]
+    while todo:
+        current = todo.pop()
+        pids.append(current)
+        try:
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                todo.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+class ProcessUsage:
+    """CPU time and peak RSS of a process tree (e.g. a multi-worker wrapper)"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peak_rss = 0
+        self._cpu_start = self.cpu_seconds()
+
+    @staticmethod
+    def available() -> bool:
+        return os.path.exists("/proc/self/stat")
+
+    def cpu_seconds(self) -> float:
+        total = 0
+        for pid in _process_tree(self.pid):
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    # Fields after the parenthesised command name
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            total += int(fields[11]) + int(fields[12])  # utime + stime
+        return total / _TICKS
+
+    def rss_bytes(self) -> int:
+        total = 0
+        for pid in _process_tree(self.pid):
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            except OSError:
+                continue
+        return total
+
+    def sample(self) -> None:
+        self.peak_rss = max(self.peak_rss, self.rss_bytes())
+
+    async def watch(self, interval: float = 0.1) -> None:
+        """Sample RSS until cancelled"""
+        while True:
+            self.sample()
+            await asyncio.sleep(interval)
+
+    def report(self, wall: float) -> Dict[str, float]:
+        self.sample()
+        cpu = self.cpu_seconds() - self._cpu_start
+        return {
+            "cpu_seconds": round(cpu, 3),
+            "cpu_percent": round(100 * cpu / wall, 1) if wall else 0.0,
+            "peak_rss_mb": round(self.peak_rss / 2**20, 1),
+        }
+
+
+# ============ Harness ============
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start(command: List[str], cwd: str, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(command, cwd=cwd, env={**os.environ, **env})
+
+
+async def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with {process.returncode}")
+            try:
+                await client.get(url, timeout=1.0)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+
+def _stop(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def parse_build(spec: str) -> Tuple[str, str, Dict[str, str]]:
+    """``label=dir[,KEY=VALUE...]`` -> (label, dir, env)"""
+    label, _, rest = spec.partition("=")
+    directory, *settings = (rest or ".").split(",")
+    env = dict(item.split("=", 1) for item in settings if "=" in item)
+    return label, os.path.abspath(directory or "."), env
+
+
+async def run_build(
+    label: str,
+    directory: str,
+    env: Dict[str, str],
+    records: List[dict],
+    stub_url: str,
+    args: argparse.Namespace,
+) -> Dict[str, object]:
+    port = _free_port()
+    wrapper = _start([sys.executable, "main.py"], directory, {
+        "HOST": "127.0.0.1",
+        "PORT": str(port),
+        "LLMTWINS_BASE_URL": stub_url,
+        "LLMTWINS_BASE_URLS": "",
+        "ACCESS_LOG": "",
+        "CAPTURE_FILE": "",
+        "TRACE_EXPORTER": "",
+        **env,
+    })
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        await _wait_ready(f"{base_url}/", wrapper)
+        usage = ProcessUsage(wrapper.pid) if ProcessUsage.available() else None
+        watcher = asyncio.create_task(usage.watch()) if usage else None
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=100)
+        async with httpx.AsyncClient(
+            base_url=base_url, limits=limits, timeout=args.timeout,
+        ) as client:
+            results, wall = await replay(records, client, args.speed, args.concurrency)
+        if watcher:
+            watcher.cancel()
+        return summarize(
+            records, results, wall, args.cadence, usage.report(wall) if usage else None,
+        )
+    finally:
+        _stop(wrapper)
+
+
+async def run(args: argparse.Namespace) -> int:
+    records = load_capture(args.captures)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print("No records to replay", file=sys.stderr)
+        return 2
+
+    stub_port = _free_port()
+    stub = _start([
+        sys.executable, os.path.abspath(__file__), "stub",
+        "--port", str(stub_port), "--cadence", str(args.cadence), *args.captures,
+    ] + (["--limit", str(args.limit)] if args.limit else []), os.getcwd(), {})
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    reports: Dict[str, dict] = {}
+    try:
+        await _wait_ready(stub_url, stub)
+        for spec in args.build or ["current=."]:
+            label, directory, env = parse_build(spec)
+            print(f"Replaying {len(records)} requests at {args.speed}x against {label}...",
+                  file=sys.stderr)
+            reports[label] = await run_build(label, directory, env, records, stub_url, args)
+    finally:
+        _stop(stub)
+
+    print(format_table(reports))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+
+    if not args.baseline:
+        return 0
+    if args.baseline in reports:
+        baselines = {label: reports[args.baseline] for label in reports if label != args.baseline}
+    else:
+        with open(args.baseline) as f:
+            previous = json.load(f)
+        baselines = {label: previous[label] for label in reports if label in previous}
+    failed = False
+    for label, baseline in baselines.items():
+        for regression in compare(reports[label], baseline, args.tolerance):
+            print(f"REGRESSION {label}: {regression}")
+            failed = True
+    return 1 if failed else 0
+
+
+def serve_stub(args: argparse.Namespace) -> None:
+    import uvicorn
+
+    records = load_capture(args.captures)
+    if args.limit:
+        records = records[:args.limit]
+    uvicorn.run(
+        StubLLMTwins(records, args.cadence),
+        host="127.0.0.1", port=args.port, log_level="warning", access_log=False,
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["stub"]:
+        parser = argparse.ArgumentParser(prog="replay.py stub", description="Run the stub LLMTwins")
+        parser.add_argument("captures", nargs="+")
+        parser.add_argument("--port", type=int, default=8000)
+        parser.add_argument("--cadence", type=float, default=1.0)
+        parser.add_argument("--limit", type=int, default=0)
+        serve_stub(parser.parse_args(argv[1:]))
+        return 0
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("captures", nargs="+", help="capture files (globs allowed)")
+    parser.add_argument("--build", action="append",
+                        help="label=wrapper_dir[,ENV=VALUE...]; repeatable (default: current=.)")
+    parser.add_argument("--speed", type=float, default=1.0, help="arrival rate multiplier")
+    parser.add_argument("--cadence", type=float, default=1.0,
+                        help="scale of the stub's recorded waits (0 = answer at once)")
+    parser.add_argument("--concurrency", type=int, default=1000, help="max requests in flight")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N requests")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="build label or earlier --output report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative change that counts as a regression")
+    args = parser.parse_args(argv)
+    args.captures = [p for pattern in args.captures for p in sorted(glob.glob(pattern)) or [pattern]]
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,326 @@
+# llmtwins_wrapper/result_cache.py
+"""
+Content-addressed on-disk cache for deterministic LLM endpoints
+
+/api/mapping, /api/planning and /api/mapping/revise take seconds of LLM
+time. When a tenant resubmits a byte-identical request (e.g. a re-opened
+project re-running its SDG mapping), the stored result is served instead.
+
+- opt-in per tenant (``RESULT_CACHE_TENANTS``)
+- key: SHA-256 of tenant, method, path/query, the accepted content
+  codings and the canonical JSON body (sorted keys, no insignificant
+  whitespace)
+- one file per result under ``result_cache_dir``, shared by all workers;
+  total size capped with LRU eviction (mtime is the last access), entries
+  expire after ``result_cache_ttl``
+- per-caller headers (Set-Cookie, Date, hop-by-hop) are never stored
+- ``Cache-Control: no-cache`` or ``X-Result-Cache: bypass`` skips the
+  lookup (the fresh result is still stored)
+- only complete, non-streaming 200 responses are stored
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from config import WrapperConfig, config
+
+logger = logging.getLogger(__name__)
+
+HIT = "hit"
+MISS = "miss"
+BYPASS = "bypass"
+STORED = "stored"
+
+ALL_TENANTS = "*"
+
+# Belong to one response or connection, not to the result
+_UNSTORED_HEADERS = frozenset((
+    b"set-cookie", b"date", b"connection", b"keep-alive", b"proxy-authenticate",
+    b"proxy-authorization", b"te", b"trailer", b"trailers", b"transfer-encoding", b"upgrade",
+))
+
+
+@dataclass
+class CachedResult:
+    status_code: int
+    raw_headers: List[Tuple[bytes, bytes]]
+    body: bytes
+
+
+def canonical_body(body: bytes) -> Tuple[bytes, bool]:
+    """
+    Return ``(normalized_body, streaming)``.
+
+    JSON bodies are re-serialized with sorted keys and no insignificant
+    whitespace; anything else is used as-is.
+    """
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return body, False
+    streaming = isinstance(data, dict) and data.get("stream") is True
+    normalized = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return normalized.encode("utf-8"), streaming
+
+
+def normalized_encoding(accept_encoding: Optional[str]) -> str:
+    """Accepted content codings, sorted, without q-values ("" = identity only)"""
+    codings = set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding or coding == "identity":
+            continue
+        quality = params.strip().lower()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        codings.add(coding)
+    return ",".join(sorted(codings))
+
+
+class ResultCache:
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        ttl: float,
+        tenants: Set[str],
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.tenants = frozenset(tenants)
+
+        # Totals as of this worker's last scan of the shared directory
+        self._loaded = False
+        self.entries = 0
+        self.size = 0
+        self.evictions = 0
+        self._counts: Dict[str, Dict[str, Dict[str, int]]] = {}
+
+    @classmethod
+    def from_config(cls, cfg: WrapperConfig) -> "ResultCache":
+        return cls(
+            directory=cfg.result_cache_dir
+            or os.path.join(tempfile.gettempdir(), "llmtwins-result-cache"),
+            max_bytes=cfg.result_cache_max_bytes,
+            ttl=cfg.result_cache_ttl,
+            tenants=cfg.result_cache_tenants,
+        )
+
+    def enabled(self, tenant: str) -> bool:
+        return self.max_bytes > 0 and (ALL_TENANTS in self.tenants or tenant in self.tenants)
+
+    def key(
+        self,
+        tenant: str,
+        method: str,
+        path: str,
+        body: bytes,
+        accept_encoding: Optional[str] = None,
+    ) -> Optional[str]:
+        """Content hash for a request, or None if it asks for a stream"""
+        normalized, streaming = canonical_body(body)
+        if streaming:
+            return None
+        digest = hashlib.sha256()
+        for part in (tenant, method.upper(), path, normalized_encoding(accept_encoding)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        digest.update(normalized)
+        return digest.hexdigest()
+
+    # ---- lookups ----
+
+    async def get(self, key: str) -> Optional[CachedResult]:
+        await self._ensure_loaded()
+        # Straight from disk: any worker may have stored it
+        result, removed = await asyncio.to_thread(self._fetch, key)
+        if result is None:
+            if removed is not None:
+                self.entries = max(self.entries - 1, 0)
+                self.size = max(self.size - removed, 0)
+        return result
+
+    async def put(self, key: str, result: CachedResult) -> bool:
+        await self._ensure_loaded()
+        stored, victims = await asyncio.to_thread(self._store, key, result)
+        self.evictions += victims
+        return stored
+
+    # ---- metrics ----
+
+    def count(self, tenant: str, route: str, outcome: str) -> None:
+        routes = self._counts.setdefault(tenant, {})
+        counts = routes.get(route)
+        if counts is None:
+            counts = routes[route] = {HIT: 0, MISS: 0, BYPASS: 0, STORED: 0}
+        counts[outcome] += 1
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "entries": self.entries,
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "tenants": {
+                tenant: {route: dict(counts) for route, counts in routes.items()}
+                for tenant, routes in self._counts.items()
+            },
+        }
+
+    # ---- disk ----
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    async def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self._loaded = True
+            entries = await asyncio.to_thread(self._scan)
+            self.entries = len(entries)
+            self.size = sum(size for _, size in entries)
+
+    @contextmanager
+    def _locked(self):
+        """Serializes stores and evictions across workers"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _store(self, key: str, result: CachedResult) -> Tuple[bool, int]:
+        """Write an entry and evict down to the cap; returns ``(stored, evictions)``"""
+        with self._locked():
+            size = self._write(key, result)
+            if size > self.max_bytes:
+                self._unlink(key)
+                return False, 0
+
+            # Every worker's entries count towards the one cap
+            entries = self._scan()
+            total = sum(entry_size for _, entry_size in entries)
+            evicted = 0
+            for victim, victim_size in entries:
+                if total <= self.max_bytes:
+                    break
+                if victim == key:
+                    continue
+                self._unlink(victim)
+                total -= victim_size
+                evicted += 1
+            self.entries = len(entries) - evicted
+            self.size = total
+        return True, evicted
+
+    def _scan(self) -> List[Tuple[str, int]]:
+        """Existing entries, oldest access first"""
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith("."):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                found.append((stat.st_mtime_ns, name, stat.st_size))
+        found.sort()
+        return [(name, size) for _, name, size in found]
+
+    def _read(self, key: str) -> Optional[CachedResult]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                meta = json.loads(f.readline())
+                if time.time() - meta["created"] > self.ttl:
+                    return None
+                body = f.read()
+            # mtime doubles as last access for LRU order across workers
+            _touch(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return CachedResult(
+            status_code=meta["status"],
+            raw_headers=[(k.encode("latin-1"), v.encode("latin-1")) for k, v in meta["headers"]],
+            body=body,
+        )
+
+    def _write(self, key: str, result: CachedResult) -> int:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        meta = json.dumps({
+            "status": result.status_code,
+            "headers": [
+                (k.decode("latin-1"), v.decode("latin-1"))
+                for k, v in result.raw_headers
+                if k.lower() not in _UNSTORED_HEADERS
+            ],
+            "created": time.time(),
+        }).encode() + b"\n"
+
+        # Write then rename so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(meta)
+                f.write(result.body)
+            _touch(tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            self._unlink_path(tmp)
+            raise
+        return len(meta) + len(result.body)
+
+    def _fetch(self, key: str) -> Tuple[Optional[CachedResult], Optional[int]]:
+        result = self._read(key)
+        if result is None:
+            return None, self._discard(key)
+        return result, None
+
+    def _discard(self, key: str) -> Optional[int]:
+        """Remove an unusable entry; its size, or None if it was already gone"""
+        path = self._path(key)
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return None
+        self._unlink_path(path)
+        return size
+
+    def _unlink(self, key: str) -> None:
+        self._unlink_path(self._path(key))
+
+    @staticmethod
+    def _unlink_path(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove cached result {path}: {e}")
+
+
+def _touch(path: str) -> None:
+    # Explicit nanoseconds: the filesystem clock is too coarse to order
+    # accesses a few milliseconds apart
+    now = time.time_ns()
+    os.utime(path, ns=(now, now))
+
+
+result_cache = ResultCache.from_config(config)
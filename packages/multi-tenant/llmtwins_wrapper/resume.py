@@ -0,0 +1,381 @@
+# llmtwins_wrapper/resume.py
+"""
+Resumable NDJSON streams
+
+A client that asks for a resumable stream (``X-Stream-Resumable: 1``) gets
+an ``X-Stream-Id`` header; every NDJSON line it receives is an event,
+numbered from 1. The upstream stream is drained into a bounded ring
+buffer kept per ``{tenant}__{session_id}``, independently of the client,
+so after a dropped connection the client can call
+
+    GET /api/sessions/{session_id}/stream?last_event_id=N
+
+(or send ``Last-Event-ID: N``) and continue from event N + 1 without
+re-invoking the LLM.
+
+Buffers are capped in bytes (per stream and in total) and expire
+``stream_resume_ttl`` seconds after the stream ends. Every live stream
+reserves a full per-stream buffer of the total; when live streams alone
+would go over it, new streams are not made resumable. A live stream that
+nobody reattaches to within ``stream_resume_grace`` seconds stops reading
+upstream (what it buffered stays resumable).
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from config import WrapperConfig, config
+from relay import stream_stats
+
+logger = logging.getLogger(__name__)
+
+RESUMABLE_HEADER = "X-Stream-Resumable"
+STREAM_ID_HEADER = "X-Stream-Id"
+
+
+class EventsExpired(Exception):
+    """The requested events were already evicted from the buffer"""
+
+
+class StreamBuffer:
+    """
+    Ring buffer of numbered NDJSON events for one upstream stream.
+
+    While a client is attached it pins the events it has not been sent
+    yet: the drain waits (up to ``stall_timeout``) instead of evicting
+    them, so a slow client applies backpressure. Once it detaches the drain
+    runs freely and old events are evicted past ``max_bytes``, for at most
+    ``grace`` seconds unless a client attaches again.
+    """
+
+    def __init__(
+        self,
+        stream_id: str,
+        tenant: str,
+        session_key: str,
+        max_bytes: int,
+        stall_timeout: float = 30.0,
+        grace: Optional[float] = None,
+    ):
+        self.stream_id = stream_id
+        self.tenant = tenant
+        self.session_key = session_key
+        self.max_bytes = max_bytes
+        self.stall_timeout = stall_timeout
+        self.grace = grace
+        self.events: Deque[Tuple[int, bytes]] = deque()
+        self.size = 0
+        self.next_id = 1
+        self.done = False
+        self.error: Optional[str] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.pinned: Optional[int] = None
+        self._pin_owner: Optional[object] = None
+        self._changed = asyncio.Event()
+        self._abandon_timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def first_id(self) -> int:
+        return self.events[0][0] if self.events else self.next_id
+
+    async def put(self, line: bytes) -> None:
+        """Append an event, waiting while it would evict pinned events"""
+        while self.pinned is not None and self.size + len(line) > self.max_bytes:
+            self._evict(len(line), below=self.pinned)
+            if self.size + len(line) <= self.max_bytes or not self.events:
+                break
+            try:
+                await asyncio.wait_for(self._changed.wait(), self.stall_timeout)
+            except asyncio.TimeoutError:
+                # The attached client stopped reading; stop waiting for it
+                self._pin_owner = None
+                self.pinned = None
+                self._detached()
+        self.append(line)
+
+    def append(self, line: bytes) -> None:
+        self.events.append((self.next_id, line))
+        self.next_id += 1
+        self.size += len(line)
+        self._evict(0)
+        self._notify()
+
+    def finish(self, error: Optional[str] = None) -> None:
+        self.done = True
+        self.error = error
+        self.finished_at = time.monotonic()
+        self._cancel_abandon()
+        self._notify()
+
+    def pin(self, owner: object, next_id: int) -> None:
+        """Make ``owner`` the attached client; the latest one wins"""
+        self._pin_owner = owner
+        self.pinned = next_id
+        self._cancel_abandon()
+
+    def unpin(self, owner: object) -> None:
+        if self._pin_owner is owner:
+            self._pin_owner = None
+            self.pinned = None
+            self._notify()
+            self._detached()
+
+    def _detached(self) -> None:
+        """Stop the drain unless a client attaches within ``grace``"""
+        if self.grace is None or self.done or self.task is None:
+            return
+        self._cancel_abandon()
+        self._abandon_timer = asyncio.get_running_loop().call_later(self.grace, self._abandon)
+
+    def _abandon(self) -> None:
+        self._abandon_timer = None
+        if self._pin_owner is None and not self.done and self.task is not None:
+            stream_stats.count(self.tenant, "abandoned")
+            self.task.cancel()
+
+    def _cancel_abandon(self) -> None:
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+            self._abandon_timer = None
+
+    async def replay(
+        self, last_event_id: int = 0, owner: Optional[object] = None
+    ) -> AsyncIterator[bytes]:
+        """Events after ``last_event_id``, then live ones until the end"""
+        next_id = last_event_id + 1
+        while True:
+            if next_id < self.first_id:
+                raise EventsExpired(f"Events before {self.first_id} are no longer buffered")
+            if self.events and next_id < self.next_id:
+                offset = next_id - self.first_id
+                batch = [line for _, line in islice(self.events, offset, None)]
+                next_id = self.next_id
+                yield b"".join(batch)
+                if owner is not None and self._pin_owner is owner:
+                    self.pinned = next_id
+                    self._notify()
+                continue
+            if self.done:
+                return
+            changed = self._changed
+            await changed.wait()
+
+    def _evict(self, incoming: int, below: Optional[int] = None) -> None:
+        # Always keep the newest event, even if it alone is over the cap
+        while self.events and self.size + incoming > self.max_bytes:
+            if len(self.events) == 1 and not incoming:
+                break
+            if below is not None and self.events[0][0] >= below:
+                break
+            _, dropped = self.events.popleft()
+            self.size -= len(dropped)
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+def follow(
+    buffer: StreamBuffer,
+    last_event_id: int,
+    tenant: str,
+    receive: Optional[Callable[[], Awaitable[dict]]] = None,
+    stats=None,
+) -> AsyncIterator[bytes]:
+    """
+    Send a buffer's events to one client.
+
+    The client pins the buffer from now on (before the drain can run
+    ahead); ``receive`` is watched for http.disconnect so a dropped client
+    unpins right away. Leaving before the end counts as a detach.
+    """
+    owner = object()
+    buffer.pin(owner, last_event_id + 1)
+    return _follow(buffer, owner, last_event_id, tenant, receive,
+                   stats if stats is not None else stream_stats)
+
+
+async def _follow(buffer, owner, last_event_id, tenant, receive, stats) -> AsyncIterator[bytes]:
+    detached = False
+    finished = False
+
+    def detach() -> None:
+        nonlocal detached
+        if not detached:
+            detached = True
+            buffer.unpin(owner)
+            stats.count(tenant, "detached")
+
+    async def watch() -> None:
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        detach()
+
+    watcher = asyncio.create_task(watch()) if receive is not None else None
+    try:
+        async for data in buffer.replay(last_event_id, owner):
+            yield data
+        finished = True
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
+        if finished:
+            buffer.unpin(owner)
+        else:
+            detach()
+
+
+class ResumeStore:
+    def __init__(
+        self,
+        buffer_bytes: int,
+        max_bytes: int,
+        ttl: float,
+        grace: Optional[float] = None,
+    ):
+        self.buffer_bytes = buffer_bytes
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.grace = grace  # None: keep reading until the stream ends
+        self._streams: "OrderedDict[str, StreamBuffer]" = OrderedDict()
+        self._sessions: Dict[str, str] = {}
+
+    @classmethod
+    def from_config(cls, cfg: WrapperConfig) -> "ResumeStore":
+        return cls(
+            buffer_bytes=cfg.stream_resume_buffer_bytes,
+            max_bytes=cfg.stream_resume_max_bytes,
+            ttl=cfg.stream_resume_ttl,
+            grace=cfg.stream_resume_grace,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.buffer_bytes > 0
+
+    def open(self, tenant: str, session_key: str) -> Optional[StreamBuffer]:
+        """
+        Start a new buffer; it replaces the session's previous stream.
+
+        Returns None when live streams leave no room for another buffer
+        within ``max_bytes``; the caller relays the stream without one.
+        """
+        self.purge()
+        previous = self._sessions.get(session_key)
+        if previous is not None and self._streams[previous].done:
+            self._drop(previous)
+        if not self._enforce_total(reserve=self.buffer_bytes):
+            stream_stats.count(tenant, "not_resumable")
+            return None
+
+        buffer = StreamBuffer(
+            uuid.uuid4().hex, tenant, session_key, self.buffer_bytes, grace=self.grace
+        )
+        self._streams[buffer.stream_id] = buffer
+        self._sessions[session_key] = buffer.stream_id
+        return buffer
+
+    def get(self, session_key: str, stream_id: Optional[str] = None) -> Optional[StreamBuffer]:
+        """Buffer for the session (its latest stream unless stream_id is given)"""
+        self.purge()
+        stream_id = stream_id or self._sessions.get(session_key)
+        buffer = self._streams.get(stream_id) if stream_id else None
+        # A stream id only resolves within its own tenant's session
+        if buffer is None or buffer.session_key != session_key:
+            return None
+        return buffer
+
+    def start(
+        self,
+        buffer: StreamBuffer,
+        chunks: AsyncIterator[bytes],
+        close: Callable[[], Awaitable[None]],
+    ) -> None:
+        """Drain ``chunks`` into ``buffer`` in the background"""
+        stream_stats.count(buffer.tenant, "started")
+        buffer.task = asyncio.create_task(self._drain(buffer, chunks, close))
+
+    async def _drain(self, buffer, chunks, close) -> None:
+        carry = b""
+        error = None
+        try:
+            async for chunk in chunks:
+                data = carry + chunk if carry else chunk
+                lines = data.split(b"\n")
+                carry = lines.pop()
+                for line in lines:
+                    await buffer.put(line + b"\n")
+            if carry:
+                await buffer.put(carry)
+            stream_stats.count(buffer.tenant, "completed")
+        except asyncio.CancelledError:
+            error = "cancelled"
+            raise
+        except Exception as e:
+            error = type(e).__name__
+            logger.warning(f"Resumable stream {buffer.stream_id} failed: {error}")
+        finally:
+            buffer.finish(error)
+            self._enforce_total()
+            await close()
+
+    def purge(self) -> None:
+        """Drop finished buffers older than the TTL"""
+        now = time.monotonic()
+        for stream_id, buffer in list(self._streams.items()):
+            if buffer.done and now - buffer.finished_at > self.ttl:
+                self._drop(stream_id)
+
+    def total_bytes(self) -> int:
+        return sum(buffer.size for buffer in self._streams.values())
+
+    async def close(self) -> None:
+        tasks = [b.task for b in self._streams.values() if b.task and not b.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "streams": len(self._streams),
+            "live": sum(1 for b in self._streams.values() if not b.done),
+            "bytes": self.total_bytes(),
+            "max_bytes": self.max_bytes,
+        }
+
+    def _committed_bytes(self) -> int:
+        """Finished buffers' size plus a full buffer for every live one"""
+        return sum(
+            buffer.size if buffer.done else max(buffer.size, self.buffer_bytes)
+            for buffer in self._streams.values()
+        )
+
+    def _enforce_total(self, reserve: int = 0) -> bool:
+        """
+        Evict the oldest finished buffers until ``reserve`` more bytes fit.
+
+        Live buffers are never evicted; False if they alone leave no room.
+        """
+        if self._committed_bytes() + reserve <= self.max_bytes:
+            return True
+        for stream_id, buffer in list(self._streams.items()):
+            if buffer.done:
+                self._drop(stream_id)
+                if self._committed_bytes() + reserve <= self.max_bytes:
+                    return True
+        return False
+
+    def _drop(self, stream_id: str) -> None:
+        buffer = self._streams.pop(stream_id)
+        if self._sessions.get(buffer.session_key) == stream_id:
+            del self._sessions[buffer.session_key]
+
+
+resume_store = ResumeStore.from_config(config)
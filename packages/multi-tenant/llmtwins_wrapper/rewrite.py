@@ -0,0 +1,455 @@
+# llmtwins_wrapper/rewrite.py
+"""
+Session ID rewriting between clients and LLMTwins
+
+Clients see their own session ids; LLMTwins sees ``{tenant}__{session_id}``.
+Requests get the prefix added, responses get it stripped.
+"""
+
+import json
+import re
+from typing import AsyncIterable, AsyncIterator, Optional
+
+from config import config
+
+# Body/response fields that carry a session id
+SESSION_FIELDS = ("session_id", "sessionId", "sid")
+
+# Matches the opening of a session field's string value, e.g. `"sid": "`
+# (used to strip prefixes from responses; anything it misses is parsed)
+_SESSION_KEY = rb'"(?:session_id|sessionId|sid)"\s{0,32}:\s{0,32}"'
+
+def tenant_prefix(tenant: str) -> str:
+    return f"{tenant}{config.tenant_separator}"
+
+
+def rewrite_session_id(session_id: str, tenant: str) -> str:
+    """Add tenant prefix to session_id"""
+    if not session_id:
+        return session_id
+
+    # Already has tenant prefix?
+    if session_id.startswith(tenant_prefix(tenant)):
+        return session_id
+
+    return f"{tenant_prefix(tenant)}{session_id}"
+
+
+def extract_original_session_id(prefixed_session_id: str, tenant: str) -> str:
+    """Remove tenant prefix from session_id"""
+    prefix = tenant_prefix(tenant)
+    if prefixed_session_id.startswith(prefix):
+        return prefixed_session_id[len(prefix):]
+    return prefixed_session_id
+
+
+def rewrite_response_data(data: dict, tenant: str) -> dict:
+    """Remove tenant prefix from session_id in response"""
+    if not isinstance(data, dict):
+        return data
+
+    for field in SESSION_FIELDS:
+        if field in data and data[field]:
+            data[field] = extract_original_session_id(data[field], tenant)
+
+    return data
+
+
+class NDJSONSessionRewriter:
+    """
+    Incremental, line-buffered session prefix stripper for NDJSON streams.
+
+    Upstream chunks do not respect line (or UTF-8 character) boundaries, so
+    the trailing partial line of each chunk is carried over to the next one
+    and only complete lines are rewritten. Lines are handled as raw bytes:
+
+    - no ``"{tenant}__`` in the block: passed through untouched
+    - ``"sid": "{tenant}__...`` style fields: prefix cut out with one regex
+    - a prefixed string left over the regex can't explain (escaped keys,
+      unusual spacing): that line alone is parsed with ``json``
+
+    Usage:
+        rewriter = NDJSONSessionRewriter(tenant)
+        for chunk in upstream:
+            yield rewriter.feed(chunk)
+        yield rewriter.flush()
+    """
+
+    def __init__(self, tenant: str, max_line_bytes: int = 1024 * 1024):
+        self.tenant = tenant
+        self.max_line_bytes = max_line_bytes
+        prefix = tenant_prefix(tenant).encode("utf-8")
+        self._needle = b'"' + prefix
+        self._pattern = re.compile(b"(" + _SESSION_KEY + b")" + re.escape(prefix))
+        self._pending = b""
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Consume a chunk, returning the rewritten complete lines (maybe b"")"""
+        data = self._pending + chunk if self._pending else chunk
+
+        end = data.rfind(b"\n")
+        if end == -1:
+            if len(data) > self.max_line_bytes:
+                # Runaway line: stop buffering rather than grow without bound
+                self._pending = b""
+                return self.rewrite(data)
+            self._pending = data
+            return b""
+
+        self._pending = data[end + 1:]
+        return self.rewrite(data[:end + 1])
+
+    def flush(self) -> bytes:
+        """Rewrite and return whatever is left of an unterminated last line"""
+        data, self._pending = self._pending, b""
+        return self.rewrite(data) if data else b""
+
+    def rewrite(self, block: bytes) -> bytes:
+        """Strip the tenant prefix from a block of complete lines"""
+        if self._needle not in block:
+            return block
+
+        block = self._pattern.sub(rb"\1", block)
+        if self._needle not in block:
+            return block
+
+        # Fast path couldn't decide; fall back to parsing the affected lines
+        return b"".join(
+            self._rewrite_line(line) if self._needle in line else line
+            for line in block.splitlines(keepends=True)
+        )
+
+    def _rewrite_line(self, line: bytes) -> bytes:
+        body = line.rstrip(b"\r\n")
+        try:
+            data = json.loads(body)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return line
+
+        if not isinstance(data, dict):
+            return line
+
+        prefix = tenant_prefix(self.tenant)
+        if not any(
+            isinstance(data.get(field), str) and data[field].startswith(prefix)
+            for field in SESSION_FIELDS
+        ):
+            return line
+
+        data = rewrite_response_data(data, self.tenant)
+        ending = line[len(body):]
+        return json.dumps(data, ensure_ascii=False).encode("utf-8") + ending
+
+
+def strip_session_prefix(body: bytes, tenant: str) -> bytes:
+    """Strip the tenant prefix from session fields in a complete JSON body"""
+    return NDJSONSessionRewriter(tenant).rewrite(body)
+
+
+class SessionFieldError(ValueError):
+    """A request body's session field can't be rewritten safely"""
+
+
+# JSON whitespace (exactly what ``json.loads`` skips)
+_WS = re.compile(rb"[ \t\n\r]*")
+# Rest of a string after its opening quote: stops at the closing quote, or
+# at a trailing backslash whose escaped character is still to come
+_STRING_REST = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*', re.S)
+_STRUCTURAL = re.compile(rb'["{}\[\],]')
+_NESTED = re.compile(rb'["{}\[\]]')
+_QUOTE, _BACKSLASH, _COLON = b'"'[0], b"\\"[0], b":"[0]
+_OPEN, _CLOSE = frozenset(b"{["), frozenset(b"}]")
+
+# Top-level keys the rewriter acts on
+_STREAM_FIELD = "stream"
+# Longest key token that can still decode to one of them: all \uXXXX escapes
+_MAX_KEY_BYTES = 2 + 6 * max(len(name) for name in SESSION_FIELDS + (_STREAM_FIELD,))
+_MAX_SESSION_BYTES = 4096
+
+# Scanner states
+_START, _TOP, _KEY, _AFTER_KEY, _VALUE, _SKIP, _STRING, _DONE, _BUFFER = range(9)
+
+
+class JSONBodyRewriter:
+    """
+    Incremental tenant prefix splicer for JSON request bodies.
+
+    Adds ``{tenant}__`` to the top-level session_id/sessionId/sid string
+    values without building the document: a scanner tracks just enough JSON
+    structure (strings, nesting, top-level keys) to find them, so bodies
+    without session fields come out byte-identical and memory stays bounded
+    however large the body is. Escaped keys and values are decoded like
+    ``json.loads`` would, so nothing the upstream parser reads as a session
+    field gets past unprefixed:
+
+    - non-string session values (other than null) and values over
+      ``_MAX_SESSION_BYTES`` raise SessionFieldError
+    - UTF-16/32 bodies (which ``json.loads`` accepts) are buffered up to
+      ``max_buffer`` bytes, parsed and re-serialized as UTF-8
+    - anything that isn't a JSON object passes through untouched, as does
+      the rest of a body that stops being valid JSON
+
+    While splicing it also notes whether the body asks for ``"stream": true``
+    and remembers the first (rewritten) session id it saw.
+    """
+
+    def __init__(self, tenant: str, max_buffer: int = 1024 * 1024):
+        self.tenant = tenant
+        self.prefix = tenant_prefix(tenant).encode("utf-8")
+        self.max_buffer = max_buffer
+        self.stream = False
+        self.session_id: Optional[str] = None
+        self.rewritten = 0
+        self._carry = b""
+        self._state = _START
+        self._depth = 0
+        self._field: Optional[str] = None
+        self._after_string = _SKIP
+
+    @property
+    def undecided(self) -> bool:
+        """Whether it's still unknown if the body is a JSON object"""
+        return self._state in (_START, _TOP, _BUFFER)
+
+    @property
+    def unchanged(self) -> bool:
+        """Whether the whole body is sure to come out byte-identical"""
+        return self._state == _DONE and self.rewritten == 0
+
+    @property
+    def done(self) -> bool:
+        """Whether the rest of the body passes through untouched"""
+        return self._state == _DONE
+
+    def feed(self, chunk: bytes) -> bytes:
+        data = self._carry + chunk if self._carry else chunk
+        self._carry = b""
+        return self._scan(data, final=False)
+
+    def flush(self) -> bytes:
+        data, self._carry = self._carry, b""
+        return self._scan(data, final=True)
+
+    def _scan(self, data: bytes, final: bool) -> bytes:
+        if self._state == _DONE:
+            return data
+        if self._state == _BUFFER:
+            return self._buffer(data, final)
+
+        out = []
+        emit = 0
+        hold = None
+        i = 0
+        n = len(data)
+        while i < n:
+            state = self._state
+            if state == _DONE:
+                # Nothing more to rewrite; the rest passes through
+                break
+            if state == _STRING:
+                j = _STRING_REST.match(data, i).end()
+                if j == n:
+                    i = n
+                elif data[j] == _QUOTE:
+                    i = j + 1
+                    self._state = self._after_string
+                else:
+                    # Trailing backslash: keep it with the character it escapes
+                    hold = j
+                    break
+                continue
+
+            if state == _SKIP:
+                # Below the top level only strings and nesting matter
+                match = (_STRUCTURAL if self._depth == 1 else _NESTED).search(data, i)
+                if match is None:
+                    i = n
+                    continue
+                c = data[match.start()]
+                i = match.end()
+                if c == _QUOTE:
+                    j = _STRING_REST.match(data, i).end()
+                    if j < n and data[j] == _QUOTE:
+                        i = j + 1
+                    else:
+                        self._state = _STRING
+                        self._after_string = _SKIP
+                elif c in _OPEN:
+                    self._depth += 1
+                elif c in _CLOSE:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._state = _DONE
+                elif self._depth == 1:
+                    self._state = _KEY
+                continue
+
+            if state == _START:
+                if n < 4 and not final:
+                    hold = 0
+                    break
+                encoding = json.detect_encoding(data[:4])
+                if encoding == "utf-8-sig":
+                    i = 3
+                elif encoding != "utf-8":
+                    self._state = _BUFFER
+                    return self._buffer(data, final)
+                self._state = _TOP
+                continue
+
+            i = _WS.match(data, i).end()
+            if i == n:
+                break
+            c = data[i]
+
+            if state == _TOP:
+                if c == b"{"[0]:
+                    self._depth = 1
+                    self._state = _KEY
+                    i += 1
+                else:
+                    self._state = _DONE
+            elif state == _KEY:
+                if c != _QUOTE:
+                    # "}" closes the object; anything else is invalid JSON
+                    self._state = _DONE
+                    continue
+                j = _STRING_REST.match(data, i + 1).end()
+                if j < n and data[j] == _QUOTE:
+                    self._field = _field_name(data[i:j + 1])
+                    self._state = _AFTER_KEY
+                    i = j + 1
+                elif j - i > _MAX_KEY_BYTES:
+                    # Too long to be a field we act on; skip it as a string
+                    self._field = None
+                    self._state = _STRING
+                    self._after_string = _AFTER_KEY
+                    i += 1
+                elif final:
+                    self._state = _DONE
+                else:
+                    hold = i
+                    break
+            elif state == _AFTER_KEY:
+                if c != _COLON:
+                    self._state = _DONE
+                    continue
+                i += 1
+                self._state = _VALUE if self._field else _SKIP
+            elif state == _VALUE:
+                if self._field == _STREAM_FIELD:
+                    if data.startswith(b"true", i):
+                        self.stream = True
+                    elif n - i < 4 and not final and b"true".startswith(data[i:]):
+                        hold = i
+                        break
+                    self._state = _SKIP
+                elif c == _QUOTE:
+                    j = _STRING_REST.match(data, i + 1).end()
+                    if j - i > _MAX_SESSION_BYTES:
+                        raise SessionFieldError(
+                            f"'{self._field}' is longer than {_MAX_SESSION_BYTES} bytes"
+                        )
+                    if j < n and data[j] == _QUOTE:
+                        out.append(data[emit:i])
+                        out.append(self._prefixed(data[i:j + 1]))
+                        emit = i = j + 1
+                        self._state = _SKIP
+                    elif final:
+                        self._state = _DONE
+                    else:
+                        hold = i
+                        break
+                elif data.startswith(b"null", i) or (not final and b"null".startswith(data[i:])):
+                    self._state = _SKIP
+                else:
+                    raise SessionFieldError(f"'{self._field}' must be a string")
+
+        if hold is None:
+            out.append(data[emit:])
+        else:
+            out.append(data[emit:hold])
+            self._carry = data[hold:]
+        return b"".join(out)
+
+    def _prefixed(self, token: bytes) -> bytes:
+        """A session value's string token (quotes included), prefixed"""
+        raw = token[1:-1]
+        if _BACKSLASH not in raw:
+            if not raw:
+                return token
+            if not raw.startswith(self.prefix):
+                raw = self.prefix + raw
+                self.rewritten += 1
+            if self.session_id is None:
+                self.session_id = raw.decode("utf-8", "replace")
+            return b'"' + raw + b'"'
+
+        try:
+            value = json.loads(token)
+        except ValueError:
+            raise SessionFieldError(f"'{self._field}' is not a valid JSON string")
+        if not value:
+            return token
+        rewritten = rewrite_session_id(value, self.tenant)
+        if rewritten != value:
+            self.rewritten += 1
+        if self.session_id is None:
+            self.session_id = rewritten
+        return json.dumps(rewritten).encode("ascii")
+
+    def _buffer(self, data: bytes, final: bool) -> bytes:
+        """Collect a non-UTF-8 body, then parse and rewrite it as a whole"""
+        self._carry += data
+        if len(self._carry) > self.max_buffer:
+            raise SessionFieldError(
+                f"Non-UTF-8 JSON bodies are limited to {self.max_buffer} bytes"
+            )
+        if not final:
+            return b""
+
+        body, self._carry = self._carry, b""
+        self._state = _DONE
+        try:
+            document = json.loads(body)
+        except ValueError:
+            return body
+        if not isinstance(document, dict):
+            return body
+
+        for field in SESSION_FIELDS:
+            value = document.get(field)
+            if value is None or value == "":
+                continue
+            if not isinstance(value, str):
+                raise SessionFieldError(f"'{field}' must be a string")
+            document[field] = rewrite_session_id(value, self.tenant)
+            self.rewritten += 1
+            if self.session_id is None:
+                self.session_id = document[field]
+        self.stream = document.get(_STREAM_FIELD) is True
+        return json.dumps(document, ensure_ascii=False).encode("utf-8")
+
+
+def _field_name(token: bytes) -> Optional[str]:
+    """The top-level field a key token (quotes included) names, if we act on it"""
+    if len(token) > _MAX_KEY_BYTES:
+        return None
+    try:
+        name = json.loads(token) if _BACKSLASH in token else token[1:-1].decode("utf-8")
+    except ValueError:
+        return None
+    if name in SESSION_FIELDS or name == _STREAM_FIELD:
+        return name
+    return None
+
+
+async def rewrite_stream(chunks: AsyncIterable[bytes], rewriter) -> AsyncIterator[bytes]:
+    """Pipe chunks through a feed()/flush() rewriter, skipping empty output"""
+    async for chunk in chunks:
+        out = rewriter.feed(chunk)
+        if out:
+            yield out
+    tail = rewriter.flush()
+    if tail:
+        yield tail
@@ -0,0 +1,301 @@
+# llmtwins_wrapper/scheduler.py
+"""
+Per-tenant weighted fair scheduling of upstream LLM calls
+
+Every proxied call takes a slot before it reaches LLMTwins. Slots are
+limited globally and per tenant; when they run out, callers wait in a
+bounded per-tenant queue and are granted slots by stride scheduling:
+
+- each grant advances the tenant's pass by 1 / (tenant weight * class weight)
+- the waiting tenant with the lowest pass goes next
+- within a tenant, interactive calls go before batch calls
+
+So a tenant flooding batch pipelines pays more per slot than others'
+interactive chat and cannot starve them.
+
+Only tenants with queued or running calls have scheduling state; tenants
+that can be granted a slot now sit in a heap ordered by pass, so a
+dispatch costs O(log n) in the number of busy tenants.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from config import WrapperConfig, config
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+OTHER = "other"
+
+
+@dataclass
+class _Waiter:
+    future: asyncio.Future
+    enqueued: float
+
+
+@dataclass
+class _TenantStats:
+    granted: int = 0
+    rejected: int = 0
+    timed_out: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+
+
+@dataclass
+class _TenantState:
+    """A tenant with queued or running calls; dropped once it has neither"""
+
+    stats: _TenantStats
+    pass_value: float = 0.0
+    running: int = 0
+    queues: Dict[str, Deque[_Waiter]] = field(
+        default_factory=lambda: {INTERACTIVE: deque(), BATCH: deque()}
+    )
+    scheduled: bool = False  # has an entry in the runnable heap
+
+    def queued(self) -> int:
+        return len(self.queues[INTERACTIVE]) + len(self.queues[BATCH])
+
+
+class Lease:
+    """A granted slot; release() is idempotent"""
+
+    __slots__ = ("_scheduler", "tenant", "wait", "_released")
+
+    def __init__(self, scheduler: "TenantScheduler", tenant: str, wait: float):
+        self._scheduler = scheduler
+        self.tenant = tenant
+        self.wait = wait
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._scheduler._release(self.tenant)
+
+
+class TenantScheduler:
+    def __init__(
+        self,
+        max_concurrent: int,
+        tenant_max_concurrent: int,
+        tenant_caps: Optional[Dict[str, int]] = None,
+        tenant_weights: Optional[Dict[str, float]] = None,
+        batch_weight: float = 0.25,
+        max_queue: int = 100,
+        queue_timeout: float = 30.0,
+        max_tenants: int = 100,
+    ):
+        self.max_concurrent = max_concurrent
+        self.tenant_max_concurrent = tenant_max_concurrent
+        self.tenant_caps = tenant_caps or {}
+        self.tenant_weights = tenant_weights or {}
+        self.class_weights = {INTERACTIVE: 1.0, BATCH: batch_weight}
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_tenants = max_tenants
+
+        self._tenants: Dict[str, _TenantState] = {}
+        # (pass, tiebreak, tenant, state) of tenants with waiters and room
+        self._runnable: List[Tuple[float, int, str, _TenantState]] = []
+        self._order = itertools.count()
+        # Tenants past ``max_tenants`` are counted as "other"
+        self._stats: Dict[str, _TenantStats] = {}
+        self._running = 0
+        self._waiting = 0
+        self._virtual_time = 0.0
+
+    @classmethod
+    def from_config(cls, cfg: WrapperConfig) -> "TenantScheduler":
+        return cls(
+            max_concurrent=cfg.scheduler_max_concurrent,
+            tenant_max_concurrent=cfg.scheduler_tenant_max_concurrent,
+            tenant_caps=cfg.scheduler_tenant_max_concurrent_per_tenant,
+            tenant_weights=cfg.scheduler_tenant_weights,
+            batch_weight=cfg.scheduler_batch_weight,
+            max_queue=cfg.scheduler_max_queue,
+            queue_timeout=cfg.scheduler_queue_timeout,
+            max_tenants=cfg.metrics_max_tenants,
+        )
+
+    # ---- public API ----
+
+    async def acquire(self, tenant: str, endpoint_class: str = INTERACTIVE) -> Lease:
+        """
+        Wait for an upstream slot.
+
+        Raises HTTPException 429 when the tenant's queue is full and 503
+        when the queue-time deadline passes.
+        """
+        state = self._state(tenant)
+
+        # Fast path: free capacity and nobody queued ahead of us
+        if self._waiting == 0 and self._has_capacity(tenant, state):
+            self._grant(tenant, state, endpoint_class)
+            state.stats.granted += 1
+            return Lease(self, tenant, 0.0)
+
+        if state.queued() >= self.max_queue:
+            state.stats.rejected += 1
+            self._prune(tenant, state)
+            raise HTTPException(
+                status_code=429,
+                detail=f"Upstream queue full for tenant: {tenant}",
+                headers={"Retry-After": "1"},
+            )
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), time.monotonic())
+        state.queues[endpoint_class].append(waiter)
+        self._waiting += 1
+        self._schedule(tenant, state)
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(tenant, state, endpoint_class, waiter):
+                return self._lease(tenant, state, waiter)
+            state.stats.timed_out += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"Upstream busy for tenant: {tenant}",
+                headers={"Retry-After": str(max(1, int(self.queue_timeout)))},
+            )
+        except asyncio.CancelledError:
+            if not self._abandon(tenant, state, endpoint_class, waiter):
+                self._release(tenant)
+            raise
+
+        return self._lease(tenant, state, waiter)
+
+    def snapshot(self) -> Dict[str, object]:
+        """Queue depth, running calls and wait times per tenant"""
+        tenants = {}
+        for tenant, stats in self._stats.items():
+            tenants[tenant] = {
+                "running": 0,
+                "queued_interactive": 0,
+                "queued_batch": 0,
+                "granted": stats.granted,
+                "rejected": stats.rejected,
+                "timed_out": stats.timed_out,
+                "wait_avg_ms": round(1000 * stats.wait_total / stats.granted, 2)
+                if stats.granted else 0.0,
+                "wait_max_ms": round(1000 * stats.wait_max, 2),
+            }
+        for tenant, state in self._tenants.items():
+            counts = tenants[self._label(tenant)]
+            counts["running"] += state.running
+            counts["queued_interactive"] += len(state.queues[INTERACTIVE])
+            counts["queued_batch"] += len(state.queues[BATCH])
+        return {
+            "running": self._running,
+            "waiting": self._waiting,
+            "max_concurrent": self.max_concurrent,
+            "tenants": tenants,
+        }
+
+    # ---- internals ----
+
+    def _state(self, tenant: str) -> _TenantState:
+        state = self._tenants.get(tenant)
+        if state is None:
+            # Returning from idle: no credit for the time spent away
+            stats = self._stats.get(self._label(tenant))
+            if stats is None:
+                stats = self._stats[self._label(tenant)] = _TenantStats()
+            state = self._tenants[tenant] = _TenantState(stats, pass_value=self._virtual_time)
+        return state
+
+    def _label(self, tenant: str) -> str:
+        if tenant in self._stats or len(self._stats) < self.max_tenants:
+            return tenant
+        return OTHER
+
+    def _prune(self, tenant: str, state: _TenantState) -> None:
+        if state.running == 0 and not state.queued():
+            del self._tenants[tenant]
+
+    def _schedule(self, tenant: str, state: _TenantState) -> None:
+        """Put a tenant with waiters and room under its cap in the heap"""
+        if not state.scheduled and state.queued() and state.running < self._cap(tenant):
+            state.scheduled = True
+            heapq.heappush(self._runnable, (state.pass_value, next(self._order), tenant, state))
+
+    def _cap(self, tenant: str) -> int:
+        return self.tenant_caps.get(tenant, self.tenant_max_concurrent)
+
+    def _has_capacity(self, tenant: str, state: _TenantState) -> bool:
+        return self._running < self.max_concurrent and state.running < self._cap(tenant)
+
+    def _grant(self, tenant: str, state: _TenantState, endpoint_class: str) -> None:
+        self._running += 1
+        state.running += 1
+        weight = self.tenant_weights.get(tenant, 1.0) * self.class_weights[endpoint_class]
+        self._virtual_time = state.pass_value
+        state.pass_value += 1.0 / max(weight, 1e-6)
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiters, lowest pass first"""
+        while self._waiting and self._running < self.max_concurrent and self._runnable:
+            pass_value, _, tenant, state = heapq.heappop(self._runnable)
+            state.scheduled = False
+            if self._tenants.get(tenant) is not state:
+                continue
+            if pass_value != state.pass_value:
+                # Granted on the fast path since it was pushed
+                self._schedule(tenant, state)
+                continue
+            if not state.queued() or state.running >= self._cap(tenant):
+                continue
+
+            endpoint_class = INTERACTIVE if state.queues[INTERACTIVE] else BATCH
+            waiter = state.queues[endpoint_class].popleft()
+            self._waiting -= 1
+            self._grant(tenant, state, endpoint_class)
+            waiter.future.set_result(None)
+            self._schedule(tenant, state)
+
+        if not self._waiting and self._runnable:
+            # Only entries of tenants whose waiters gave up are left
+            for entry in self._runnable:
+                entry[3].scheduled = False
+            self._runnable.clear()
+
+    def _abandon(self, tenant, state, endpoint_class, waiter) -> bool:
+        """Drop a waiter that gave up; False if it was granted meanwhile"""
+        if waiter.future.done():
+            return False
+        state.queues[endpoint_class].remove(waiter)
+        self._waiting -= 1
+        waiter.future.cancel()
+        self._prune(tenant, state)
+        return True
+
+    def _lease(self, tenant: str, state: _TenantState, waiter: _Waiter) -> Lease:
+        wait = time.monotonic() - waiter.enqueued
+        stats = state.stats
+        stats.granted += 1
+        stats.wait_total += wait
+        stats.wait_max = max(stats.wait_max, wait)
+        return Lease(self, tenant, wait)
+
+    def _release(self, tenant: str) -> None:
+        state = self._tenants[tenant]
+        state.running -= 1
+        self._running -= 1
+        self._prune(tenant, state)
+        self._schedule(tenant, state)
+        self._dispatch()
+
+
+scheduler = TenantScheduler.from_config(config)
@@ -0,0 +1,209 @@
+# llmtwins_wrapper/server.py
+"""
+Production launcher and cross-worker metrics
+
+``python main.py`` (or ``python server.py``) runs uvicorn with
+``WORKERS`` processes. uvicorn's supervisor is a pre-fork master: it
+binds the port once, spawns the workers onto the shared socket and
+restarts any that die. uvloop and httptools are used when installed.
+
+On SIGTERM each worker stops accepting connections and waits up to
+``DRAIN_TIMEOUT`` seconds for in-flight requests (including LLM streams)
+to finish before shutting down.
+
+Every worker's counters live in its own process, so with several workers
+each one publishes a JSON snapshot to a shared directory (tmpfs under
+/dev/shm when available) every ``WORKER_METRICS_INTERVAL`` seconds;
+/health/workers reads them all back and adds them up.
+"""
+
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Callable, Dict, FrozenSet, Iterable, Optional
+
+from config import WrapperConfig, config
+
+logger = logging.getLogger(__name__)
+
+# Numbers that describe storage shared by every worker (the on-disk
+# result cache and its one size cap): each worker reports the same
+# totals, so they are not added up. Its other counters are per worker.
+SHARED_KEYS = {"result_cache": frozenset(("entries", "bytes", "max_bytes"))}
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(values: list, key: str, shared: bool):
+    numbers = [v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)]
+    if len(numbers) != len(values):
+        return values[0]
+    if shared or key.endswith("_max_ms"):
+        return max(numbers)
+    return sum(numbers)
+
+
+def aggregate(snapshots: Iterable[dict], shared: FrozenSet[str] = frozenset()) -> dict:
+    """
+    Combine per-worker snapshots into one.
+
+    Numbers are summed (counters, queue depths and capacities add up
+    across workers), ``*_max_ms`` keeps the maximum, and ratios and
+    averages are dropped since they can't be combined without weights.
+    Other values are taken from the first worker that has them.
+    Keys in ``shared`` keep the maximum instead.
+    """
+    snapshots = list(snapshots)
+    result = {}
+    keys = []
+    for snapshot in snapshots:
+        keys.extend(k for k in snapshot if k not in keys)
+
+    for key in keys:
+        if key.endswith("_ratio") or key.endswith("_avg_ms"):
+            continue
+        values = [s[key] for s in snapshots if key in s]
+        if all(isinstance(v, dict) for v in values):
+            # Nested counters (per tenant, per route) are always per worker
+            result[key] = aggregate(values, shared=SHARED_KEYS.get(key, frozenset()))
+        else:
+            result[key] = _merge(values, key, key in shared)
+    return result
+
+
+class WorkerMetrics:
+    """Publishes this worker's snapshot and collects everyone's"""
+
+    def __init__(self, directory: Optional[str], interval: float = 2.0):
+        self.directory = directory
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, cfg: WrapperConfig) -> "WorkerMetrics":
+        directory = cfg.worker_metrics_dir if cfg.workers > 1 else None
+        return cls(directory, interval=cfg.worker_metrics_interval)
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def reset(self) -> None:
+        """Clear snapshots left by a previous run (called by the master)"""
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                os.unlink(os.path.join(self.directory, name))
+
+    def publish(self, snapshot: dict) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, self._path(os.getpid()))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def collect(self, current: Optional[dict] = None) -> Dict[int, dict]:
+        """
+        Snapshots of all live workers, keyed by pid.
+
+        ``current`` replaces this worker's (possibly stale) published copy.
+        Files of dead workers, or ones not refreshed for three intervals,
+        are skipped.
+        """
+        snapshots: Dict[int, dict] = {}
+        if self.enabled and os.path.isdir(self.directory):
+            cutoff = time.time() - 3 * self.interval
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    pid = int(name[:-5])
+                    if not _alive(pid) or os.path.getmtime(path) < cutoff:
+                        continue
+                    with open(path) as f:
+                        snapshots[pid] = json.load(f)
+                except (ValueError, OSError):
+                    continue
+        if current is not None:
+            snapshots[os.getpid()] = current
+        return snapshots
+
+    async def run(self, snapshot: Callable[[], dict]) -> None:
+        while True:
+            try:
+                self.publish(snapshot())
+            except Exception:
+                logger.exception("Publishing worker metrics failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self, snapshot: Callable[[], dict]) -> None:
+        if self.enabled:
+            self._task = asyncio.create_task(self.run(snapshot))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            try:
+                os.unlink(self._path(os.getpid()))
+            except FileNotFoundError:
+                pass
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def uvicorn_options(cfg: WrapperConfig) -> Dict[str, object]:
+    return dict(
+        host=cfg.host,
+        port=cfg.port,
+        workers=cfg.workers,
+        loop="uvloop" if _installed("uvloop") else "asyncio",
+        http="httptools" if _installed("httptools") else "h11",
+        timeout_graceful_shutdown=cfg.drain_timeout or None,
+    )
+
+
+def run(cfg: WrapperConfig = config) -> None:
+    import uvicorn
+
+    options = uvicorn_options(cfg)
+    if worker_metrics.enabled:
+        worker_metrics.reset()
+    logger.info(
+        f"Starting {options['workers']} worker(s) on {cfg.host}:{cfg.port} "
+        f"(loop={options['loop']}, http={options['http']}, drain={cfg.drain_timeout}s)"
+    )
+    # By import string, so workers import the app themselves and the fast
+    # path wraps main's app rather than a second copy of __main__
+    uvicorn.run("fastpath:app" if cfg.fast_path else "main:app", **options)
+
+
+worker_metrics = WorkerMetrics.from_config(config)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run(config)
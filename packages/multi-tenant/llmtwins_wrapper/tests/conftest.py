@@ -0,0 +1,86 @@
+"""Shared fixtures for the LLMTwins wrapper tests."""
+
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+# The wrapper is a flat app (``from config import config``), not a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fastpath  # noqa: E402
+import main  # noqa: E402
+from cache import ResponseCache  # noqa: E402
+from config import config  # noqa: E402
+from metrics import metrics  # noqa: E402
+
+
+def as_network_response(response: httpx.Response) -> httpx.Response:
+    """
+    Give a canned response an unread body stream, like a real transport.
+
+    httpx eagerly reads responses built with ``content=``/``json=``, which
+    would make them look already consumed to the wrapper.
+    """
+    if not response.is_stream_consumed:
+        return response
+    return httpx.Response(
+        response.status_code,
+        headers=response.headers,
+        stream=httpx.ByteStream(response.content),
+    )
+
+
+@pytest.fixture(autouse=True)
+def response_cache(monkeypatch):
+    """A fresh response cache per test, so cached GETs don't leak across"""
+    cache = ResponseCache.from_config(config)
+    monkeypatch.setattr(main, "response_cache", cache)
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    """Start every test with empty /metrics series"""
+    metrics.clear()
+    yield metrics
+    metrics.clear()
+
+
+@pytest.fixture
+def upstream_calls():
+    return []
+
+
+@pytest.fixture(params=["fastapi", "fastpath"])
+def wrapper(request, upstream_calls):
+    """
+    Return a factory that wires the wrapper app to a fake LLMTwins.
+
+    ``handler`` receives the upstream httpx.Request and returns an
+    httpx.Response; every upstream request is also appended to
+    ``upstream_calls``.
+
+    Every test using it runs against both the FastAPI routes and the
+    raw-ASGI fast path, which must behave the same.
+    """
+    app = main.app if request.param == "fastapi" else fastpath.app
+    clients = []
+
+    def make(handler):
+        def record(request: httpx.Request) -> httpx.Response:
+            upstream_calls.append(request)
+            return as_network_response(handler(request))
+
+        main.app.state.http_client = httpx.AsyncClient(transport=httpx.MockTransport(record))
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://wrapper",
+        )
+        clients.append(client)
+        return client
+
+    yield make
+
+    main.app.state.http_client = None
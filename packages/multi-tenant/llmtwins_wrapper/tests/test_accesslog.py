@@ -0,0 +1,104 @@
+"""Tests for the batched JSON-lines access log."""
+
+import asyncio
+import io
+import json
+import time
+
+import httpx
+
+from accesslog import AccessLog, access_log
+
+
+def record(log, tenant="t1", status=200):
+    log.record(tenant, "POST", "/api/chat", status, 0.25, 0.01, 12, 34)
+
+
+def lines(log):
+    out = io.StringIO()
+    log.flush(out)
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+class TestAccessLog:
+    def test_records_are_json_lines(self):
+        log = AccessLog("-")
+        record(log)
+        [entry] = lines(log)
+        assert entry.pop("ts") > 0
+        assert entry == {
+            "tenant": "t1", "method": "POST", "route": "/api/chat", "status": 200,
+            "duration_ms": 250.0, "ttfb_ms": 10.0, "bytes_in": 12, "bytes_out": 34,
+        }
+        assert log.snapshot()["written"] == 1
+
+    def test_writes_in_batches(self):
+        log = AccessLog("-", batch_size=2)
+        for _ in range(5):
+            record(log)
+        out = io.StringIO()
+        writes = []
+        out.write = lambda data: writes.append(data.count("\n"))
+        assert log.flush(out) == 5
+        assert writes == [2, 2, 1]
+
+    def test_full_queue_drops_and_counts(self):
+        log = AccessLog("-", max_queue=3)
+        for _ in range(5):
+            record(log)
+        assert log.snapshot() == {"queued": 3, "written": 0, "dropped": 2, "sampled_out": 0}
+
+    def test_sampling_per_tenant_keeps_errors(self):
+        log = AccessLog("-", sample_rates={"*": 0.0, "vip": 1.0})
+        record(log, "t1")
+        record(log, "t1", status=502)
+        record(log, "vip")
+        assert [(e["tenant"], e["status"]) for e in lines(log)] == [("t1", 502), ("vip", 200)]
+        assert log.snapshot()["sampled_out"] == 1
+
+    def test_background_writer(self, tmp_path):
+        path = tmp_path / "logs" / "access.jsonl"
+        log = AccessLog(str(path), batch_size=2, flush_interval=10)
+        log.start()
+        try:
+            record(log)
+            record(log)  # a full batch wakes the writer early
+            deadline = time.monotonic() + 2
+            while log.snapshot()["written"] < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert log.snapshot()["written"] == 2
+            record(log)
+        finally:
+            log.stop()  # flushes the rest
+        assert len(path.read_text().splitlines()) == 3
+
+    def test_disabled(self):
+        assert not AccessLog(None).enabled
+        AccessLog(None).start()
+
+
+class TestRequests:
+    def test_requests_are_logged(self, wrapper):
+        lines(access_log)
+        client = wrapper(lambda r: httpx.Response(200, content=b"ok"))
+        asyncio.run(client.get("/api/sessions/s1/state", headers={"X-Tenant-ID": "t1"}))
+        asyncio.run(client.get("/nope", headers={"X-Tenant-ID": "t2"}))
+
+        entries = lines(access_log)
+        assert [(e["tenant"], e["method"], e["route"], e["status"]) for e in entries] == [
+            ("t1", "GET", "/api/sessions/{session_id}/state", 200),
+            ("t2", "GET", "/{path:path}", 200),
+        ]
+        assert entries[0]["bytes_out"] == 2
+
+
+class TestOverhead:
+    def test_record_cost(self):
+        log = AccessLog("-", max_queue=200_000)
+        n = 100_000
+        started = time.perf_counter()
+        for _ in range(n):
+            record(log)
+        per_record = (time.perf_counter() - started) / n
+        print(f"\naccess log record: {per_record * 1e6:.2f} µs")
+        assert per_record < 10e-6
@@ -0,0 +1,217 @@
+"""Tests for the tenant-scoped GET response cache."""
+
+import asyncio
+
+import httpx
+
+from cache import CacheEntry, ResponseCache
+
+STATE_ROUTE = "/api/sessions/{session_id}/state"
+
+
+def entry(tenant="t1", session_id="t1__s1", body=b"x" * 10, etag=None):
+    return CacheEntry(
+        tenant=tenant, session_id=session_id, status_code=200,
+        raw_headers=[], body=body, etag=etag, expires=0.0,
+    )
+
+
+def state_upstream(etag='"v1"', step=1):
+    def handler(request):
+        if etag and request.headers.get("if-none-match") == etag:
+            return httpx.Response(304, headers={"etag": etag})
+        sid = request.url.path.split("/")[3]
+        return httpx.Response(
+            200,
+            json={"session_id": sid, "step": step},
+            headers={"etag": etag} if etag else {},
+        )
+
+    return handler
+
+
+def get_state(client, tenant="t1", session="s1", **headers):
+    return asyncio.run(client.get(
+        f"/api/sessions/{session}/state", headers={"X-Tenant-ID": tenant, **headers}
+    ))
+
+
+class TestResponseCache:
+    def test_lru_is_bounded_by_bytes(self):
+        cache = ResponseCache(max_bytes=25, route_ttls={"/r": 60})
+        for key in ("a", "b"):
+            cache.put(key, "/r", entry(), cache.generation("t1"))
+        cache.get("a")
+        cache.put("c", "/r", entry(), cache.generation("t1"))
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.size == 20
+        assert cache.evictions == 1
+
+    def test_ttl_per_route(self):
+        cache = ResponseCache(max_bytes=100, route_ttls={"/fresh": 60, "/stale": 0})
+        cache.put("a", "/fresh", entry(), 0)
+        cache.put("b", "/stale", entry(), 0)
+        assert cache.get("a").fresh()
+        assert not cache.get("b").fresh()
+        assert cache.enabled("/fresh")
+        assert not cache.enabled("/other")
+
+    def test_oversized_entry_is_not_stored(self):
+        cache = ResponseCache(max_bytes=100, route_ttls={"/r": 60}, max_entry_bytes=5)
+        assert not cache.put("a", "/r", entry(), 0)
+        assert cache.size == 0
+
+    def test_invalidate_session_scope(self):
+        cache = ResponseCache(max_bytes=1000, route_ttls={"/r": 60})
+        cache.put("s1", "/r", entry(session_id="t1__s1"), 0)
+        cache.put("s2", "/r", entry(session_id="t1__s2"), 0)
+        cache.put("list", "/r", entry(session_id=None), 0)
+        cache.put("other", "/r", entry(tenant="t2", session_id="t2__s1"), 0)
+
+        assert cache.invalidate("t1", "t1__s1") == 2
+        assert cache.get("s1") is None and cache.get("list") is None
+        assert cache.get("s2") is not None
+        assert cache.get("other") is not None
+
+        assert cache.invalidate("t1") == 1
+        assert cache.get("s2") is None
+        assert cache.get("other") is not None
+
+    def test_put_after_invalidation_is_dropped(self):
+        cache = ResponseCache(max_bytes=1000, route_ttls={"/r": 60})
+        generation = cache.generation("t1")
+        cache.invalidate("t1", "t1__s1")
+        assert not cache.put("a", "/r", entry(), generation)
+        assert cache.put("a", "/r", entry(tenant="t2"), cache.generation("t2"))
+
+
+class TestWrapperCache:
+    def test_repeat_get_is_served_from_cache(self, wrapper, upstream_calls, response_cache):
+        client = wrapper(state_upstream())
+        first = get_state(client)
+        second = get_state(client)
+
+        assert len(upstream_calls) == 1
+        assert first.headers["x-cache"] == "MISS"
+        assert second.headers["x-cache"] == "HIT"
+        assert second.json() == first.json() == {"session_id": "s1", "step": 1}
+        assert response_cache.snapshot()["hits"] == 1
+
+    def test_tenants_never_share_entries(self, wrapper, upstream_calls):
+        client = wrapper(state_upstream())
+        get_state(client, tenant="t1")
+        resp = get_state(client, tenant="t2")
+
+        assert resp.headers["x-cache"] == "MISS"
+        assert [c.url.path for c in upstream_calls] == [
+            "/api/sessions/t1__s1/state", "/api/sessions/t2__s1/state",
+        ]
+
+    def test_stale_entry_is_revalidated_by_etag(self, wrapper, upstream_calls, response_cache):
+        response_cache.route_ttls[STATE_ROUTE] = 0
+        client = wrapper(state_upstream())
+        get_state(client)
+        resp = get_state(client)
+
+        assert upstream_calls[1].headers["if-none-match"] == '"v1"'
+        assert resp.status_code == 200
+        assert resp.headers["x-cache"] == "REVALIDATED"
+        assert resp.json() == {"session_id": "s1", "step": 1}
+
+    def test_client_etag_gets_304(self, wrapper, upstream_calls):
+        client = wrapper(state_upstream())
+        get_state(client)
+        resp = get_state(client, **{"If-None-Match": '"v1"'})
+
+        assert resp.status_code == 304
+        assert resp.headers["etag"] == '"v1"'
+        assert resp.content == b""
+        assert len(upstream_calls) == 1
+
+    def test_client_etag_is_not_forwarded_on_miss(self, wrapper, upstream_calls):
+        client = wrapper(state_upstream())
+        resp = get_state(client, **{"If-None-Match": '"v1"'})
+
+        assert "if-none-match" not in upstream_calls[0].headers
+        assert resp.status_code == 304
+
+    def test_session_write_invalidates(self, wrapper, upstream_calls):
+        client = wrapper(state_upstream())
+        get_state(client, session="s1")
+        get_state(client, session="s2")
+
+        asyncio.run(client.post(
+            "/api/mapping/update", json={"session_id": "s1"}, headers={"X-Tenant-ID": "t1"},
+        ))
+        assert get_state(client, session="s1").headers["x-cache"] == "MISS"
+        assert get_state(client, session="s2").headers["x-cache"] == "HIT"
+
+    def test_pipeline_invalidates(self, wrapper, upstream_calls):
+        client = wrapper(state_upstream())
+        get_state(client)
+        asyncio.run(client.post(
+            "/api/sessions/s1/pipeline/one_click", json={}, headers={"X-Tenant-ID": "t1"},
+        ))
+        assert get_state(client).headers["x-cache"] == "MISS"
+        assert [c.url.path for c in upstream_calls] == [
+            "/api/sessions/t1__s1/state",
+            "/api/sessions/t1__s1/pipeline/one_click",
+            "/api/sessions/t1__s1/state",
+        ]
+
+    @staticmethod
+    def chat_upstream():
+        state = state_upstream()
+        return lambda r: (
+            httpx.Response(200, json={"reply": "ok"}) if r.url.path == "/api/chat" else state(r)
+        )
+
+    def test_chat_invalidates_its_session(self, wrapper):
+        client = wrapper(self.chat_upstream())
+        get_state(client, session="s1")
+        get_state(client, session="s2")
+
+        asyncio.run(client.post(
+            "/api/chat", json={"session_id": "s1", "message": "hi"},
+            headers={"X-Tenant-ID": "t1"},
+        ))
+        assert get_state(client, session="s1").headers["x-cache"] == "MISS"
+        assert get_state(client, session="s2").headers["x-cache"] == "HIT"
+
+    def test_chat_without_session_keeps_cache(self, wrapper):
+        client = wrapper(self.chat_upstream())
+        get_state(client)
+        asyncio.run(client.post(
+            "/api/chat", json={"message": "hi"}, headers={"X-Tenant-ID": "t1"},
+        ))
+        assert get_state(client).headers["x-cache"] == "HIT"
+
+    def test_upload_invalidates(self, wrapper):
+        client = wrapper(state_upstream())
+        get_state(client)
+        asyncio.run(client.post(
+            "/api/sessions/s1/upload", files={"file": ("a.txt", b"hello")},
+            headers={"X-Tenant-ID": "t1"},
+        ))
+        assert get_state(client).headers["x-cache"] == "MISS"
+
+    def test_no_store_is_not_cached(self, wrapper, upstream_calls):
+        client = wrapper(lambda r: httpx.Response(
+            200, json={"step": 1}, headers={"cache-control": "no-store"},
+        ))
+        get_state(client)
+        get_state(client)
+        assert len(upstream_calls) == 2
+
+    def test_catch_all_gets_are_opt_in(self, wrapper, upstream_calls, response_cache):
+        client = wrapper(lambda r: httpx.Response(200, json={"ok": True}))
+        for _ in range(2):
+            asyncio.run(client.get("/api/models"))
+        assert len(upstream_calls) == 2
+
+        response_cache.route_ttls["/{path:path}"] = 60
+        for _ in range(2):
+            asyncio.run(client.get("/api/models"))
+        assert len(upstream_calls) == 3
@@ -0,0 +1,138 @@
+"""Tests for traffic capture (redaction and chunk timing)."""
+
+import asyncio
+import io
+import json
+
+import httpx
+import pytest
+
+import main
+from capture import Redactor, TrafficRecorder
+
+
+@pytest.fixture
+def captured(monkeypatch):
+    """Turn on the shared recorder; returns a function reading its records"""
+    monkeypatch.setattr(main.recorder, "target", "-")
+    monkeypatch.setattr(main.recorder, "redactor", Redactor(b"key"))
+
+    def read():
+        out = io.StringIO()
+        main.recorder.flush(out)
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    yield read
+    read()
+
+
+class TestRedactor:
+    redactor = Redactor(b"key")
+
+    def test_sessions_get_stable_pseudonyms(self):
+        pseudonym = self.redactor.session("abc")
+        assert pseudonym == self.redactor.session("abc")
+        assert pseudonym != self.redactor.session("abd")
+        assert pseudonym != Redactor(b"other").session("abc")
+        assert "abc" not in pseudonym
+
+    def test_path(self):
+        assert self.redactor.path("/api/sessions/abc/state") == (
+            f"/api/sessions/{self.redactor.session('abc')}/state"
+        )
+        assert self.redactor.path("/api/chat") == "/api/chat"
+
+    def test_query(self):
+        assert self.redactor.query("session_id=abc&limit=10&q=secret") == (
+            f"session_id={self.redactor.session('abc')}&limit=10&q=xxxxxx"
+        )
+
+    def test_body_keeps_structure_and_size(self):
+        raw = json.dumps(
+            {"session_id": "abc", "message": "南投", "stream": True, "n": 3, "items": ["ab"]},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        assert json.loads(self.redactor.body(raw)) == {
+            "session_id": self.redactor.session("abc"),
+            "message": "x" * 6,
+            "stream": True,
+            "n": 3,
+            "items": ["xx"],
+        }
+
+    def test_non_json_body(self):
+        assert self.redactor.body(b"--boundary\r\n") is None
+
+
+class TestCapture:
+    def test_records_redacted_requests(self, wrapper, captured):
+        client = wrapper(lambda r: httpx.Response(200, json={"session_id": "t1__abc"}))
+        asyncio.run(client.post(
+            "/api/chat", json={"session_id": "abc", "message": "hello"},
+            headers={"X-Tenant-ID": "t1"},
+        ))
+        asyncio.run(client.get("/api/sessions/abc/state", headers={"X-Tenant-ID": "t1"}))
+
+        chat, state = captured()
+        pseudonym = main.recorder.redactor.session("abc")
+        assert chat["tenant"] == "t1"
+        assert chat["method"] == "POST"
+        assert json.loads(chat["body"]) == {"session_id": pseudonym, "message": "xxxxx"}
+        assert chat["size"] == len(b'{"session_id":"abc","message":"hello"}')
+        assert chat["status"] == 200
+        assert chat["response_type"] == "application/json"
+        assert [size for _, size in chat["chunks"]] == [len(b'{"session_id":"abc"}')]
+        assert state["path"] == f"/api/sessions/{pseudonym}/state"
+        assert "abc" not in json.dumps([chat, state])
+
+    def test_records_stream_chunk_timing(self, wrapper, captured):
+        async def body():
+            yield b'{"session_id": "t1__abc", "i": 0}\n'
+            await asyncio.sleep(0.05)
+            yield b'{"session_id": "t1__abc", "i": 1}\n'
+
+        client = wrapper(lambda r: httpx.Response(200, content=body()))
+        asyncio.run(client.post(
+            "/api/chat", json={"session_id": "abc", "stream": True}, headers={"X-Tenant-ID": "t1"},
+        ))
+
+        [record] = captured()
+        assert record["response_type"] == "application/x-ndjson"
+        assert json.loads(record["body"])["stream"] is True
+        assert len(record["chunks"]) == 2
+        assert record["chunks"][1][0] >= 40
+
+    def test_large_bodies_keep_only_their_size(self, wrapper, captured, monkeypatch):
+        monkeypatch.setattr(main.recorder, "max_body", 10)
+        client = wrapper(lambda r: httpx.Response(200))
+        asyncio.run(client.post("/api/chat", json={"message": "x" * 100}))
+
+        [record] = captured()
+        assert record["body"] is None
+        assert record["size"] > 100
+
+    def test_off_by_default(self, wrapper):
+        assert not main.recorder.enabled
+        client = wrapper(lambda r: httpx.Response(200))
+        asyncio.run(client.post("/api/chat", json={}))
+        assert main.recorder.snapshot()["queued"] == 0
+
+
+class TestTrafficRecorder:
+    def test_sampling(self):
+        recorder = TrafficRecorder("-", sample_rate=0.0)
+        assert not recorder.sample()
+        assert recorder.snapshot()["sampled_out"] == 1
+
+    def test_queue_is_bounded(self):
+        recorder = TrafficRecorder("-", max_queue=1)
+        for _ in range(3):
+            recorder.record(())
+        assert recorder.snapshot()["dropped"] == 2
+
+    def test_one_file_per_worker(self, tmp_path):
+        recorder = TrafficRecorder(str(tmp_path / "capture-{pid}.jsonl"))
+        recorder.start()
+        recorder.stop()
+        assert "{pid}" not in recorder.target
+        assert (tmp_path / recorder.target).exists()
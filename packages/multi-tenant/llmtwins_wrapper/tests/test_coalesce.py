@@ -0,0 +1,174 @@
+"""Tests for single-flight coalescing of identical GETs."""
+
+import asyncio
+
+import httpx
+import pytest
+
+import main
+from coalesce import SingleFlight
+
+STATE_ROUTE = "/api/sessions/{session_id}/state"
+
+
+@pytest.fixture
+def coalescer(monkeypatch):
+    coalescer = SingleFlight([STATE_ROUTE])
+    monkeypatch.setattr(main, "coalescer", coalescer)
+    return coalescer
+
+
+def slow_upstream(release: asyncio.Event, body=b'{"session_id": "t1__s1", "step": 2}'):
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await release.wait()
+        return httpx.Response(
+            200,
+            headers={"content-type": "application/json", "etag": '"v2"'},
+            stream=httpx.ByteStream(body),
+        )
+
+    return handler, calls
+
+
+def wrapper_client(handler):
+    main.app.state.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://wrapper")
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_share_one_fetch(self):
+        flight = SingleFlight(["/r"])
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def run():
+            return await asyncio.gather(*(flight.do("k", "/r", fetch) for _ in range(5)))
+
+        results = asyncio.run(run())
+        assert calls == [1]
+        assert [shared for _, shared in results] == [False, True, True, True, True]
+        assert {result for result, _ in results} == {"result"}
+
+        stats = flight.snapshot()
+        assert stats["in_flight"] == 0
+        assert stats["routes"]["/r"] == {
+            "requests": 5, "upstream": 1, "coalesced": 4, "collapse_ratio": 0.8,
+        }
+
+    def test_sequential_calls_are_not_coalesced(self):
+        flight = SingleFlight(["/r"])
+
+        async def fetch():
+            return 1
+
+        async def run():
+            await flight.do("k", "/r", fetch)
+            await flight.do("k", "/r", fetch)
+
+        asyncio.run(run())
+        assert flight.snapshot()["routes"]["/r"]["upstream"] == 2
+
+    def test_errors_fan_out(self):
+        flight = SingleFlight(["/r"])
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+
+        async def run():
+            return await asyncio.gather(
+                *(flight.do("k", "/r", fetch) for _ in range(3)), return_exceptions=True
+            )
+
+        results = asyncio.run(run())
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert flight.in_flight() == 0
+
+    def test_cancelled_waiter_does_not_cancel_others(self):
+        flight = SingleFlight(["/r"])
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            return "ok"
+
+        async def run():
+            first = asyncio.ensure_future(flight.do("k", "/r", fetch))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(flight.do("k", "/r", fetch))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        assert asyncio.run(run()) == ("ok", True)
+
+    def test_route_selection(self):
+        assert SingleFlight(["/a"]).enabled("/a")
+        assert not SingleFlight(["/a"]).enabled("/b")
+        assert SingleFlight(["*"]).enabled("/b")
+        assert not SingleFlight().enabled("/a")
+
+
+class TestWrapperCoalescing:
+    def test_concurrent_state_polls_hit_upstream_once(self, coalescer):
+        async def run():
+            release = asyncio.Event()
+            handler, calls = slow_upstream(release)
+            client = wrapper_client(handler)
+            polls = [
+                asyncio.ensure_future(
+                    client.get("/api/sessions/s1/state", headers={"X-Tenant-ID": "t1"})
+                )
+                for _ in range(10)
+            ]
+            await asyncio.sleep(0.05)
+            release.set()
+            return calls, await asyncio.gather(*polls)
+
+        calls, responses = asyncio.run(run())
+
+        assert len(calls) == 1
+        assert all(r.status_code == 200 for r in responses)
+        assert all(r.json() == {"session_id": "s1", "step": 2} for r in responses)
+        assert all(r.headers["etag"] == '"v2"' for r in responses)
+        assert coalescer.snapshot()["routes"][STATE_ROUTE]["coalesced"] == 9
+
+    def test_tenants_are_not_coalesced_together(self, coalescer):
+        async def run():
+            release = asyncio.Event()
+            handler, calls = slow_upstream(release)
+            client = wrapper_client(handler)
+            polls = [
+                asyncio.ensure_future(
+                    client.get("/api/sessions/s1/state", headers={"X-Tenant-ID": tenant})
+                )
+                for tenant in ("t1", "t2", "t1")
+            ]
+            await asyncio.sleep(0.05)
+            release.set()
+            await asyncio.gather(*polls)
+            return calls
+
+        calls = asyncio.run(run())
+        assert sorted(c.url.path for c in calls) == [
+            "/api/sessions/t1__s1/state", "/api/sessions/t2__s1/state",
+        ]
+
+    def test_other_routes_are_not_coalesced(self, coalescer):
+        async def run():
+            release = asyncio.Event()
+            handler, calls = slow_upstream(release)
+            client = wrapper_client(handler)
+            polls = [asyncio.ensure_future(client.get("/api/other")) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            release.set()
+            await asyncio.gather(*polls)
+            return calls
+
+        assert len(asyncio.run(run())) == 3
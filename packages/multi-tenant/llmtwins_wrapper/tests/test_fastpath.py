@@ -0,0 +1,134 @@
+"""Tests for the raw-ASGI fast path (parity cases beyond the shared suite)."""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import fastpath
+import main
+from config import config
+from conftest import as_network_response
+
+APPS = {"fastapi": main.app, "fastpath": fastpath.app}
+
+
+def client_for(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://wrapper")
+
+
+@pytest.fixture
+def upstream():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return as_network_response(httpx.Response(200, json={"session_id": "t1__s1", "ok": True}))
+
+    main.app.state.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    yield calls
+    main.app.state.http_client = None
+
+
+class TestRouteTable:
+    @pytest.mark.parametrize("method, path, expected", [
+        ("POST", "/api/chat", "/api/chat"),
+        ("POST", "/api/sessions", "/api/sessions"),
+        ("GET", "/api/sessions/s1/state", "/api/sessions/{session_id}/state"),
+        ("POST", "/api/sessions/s1/pipeline/one_click", "/api/sessions/{session_id}/pipeline/one_click"),
+        ("GET", "/api/chat", "/{path:path}"),
+        ("POST", "/health", "/{path:path}"),
+        ("DELETE", "/api/sessions/s1", "/{path:path}"),
+    ])
+    def test_fast_routes(self, method, path, expected):
+        route, _, _ = fastpath.app.match(method, path)
+        assert route.path == expected
+
+    @pytest.mark.parametrize("method, path", [
+        ("GET", "/"),
+        ("GET", "/health"),
+        ("POST", "/api/sessions/s1/upload"),
+        ("GET", "/api/sessions/s1/stream"),
+        ("GET", "/docs"),
+        ("GET", "/openapi.json"),
+        ("OPTIONS", "/api/chat"),
+        ("HEAD", "/api/sessions/s1/state"),
+    ])
+    def test_fallback_routes(self, method, path):
+        assert fastpath.app.match(method, path) is None
+
+
+class TestParity:
+    @pytest.fixture(autouse=True)
+    def cache(self, response_cache):
+        self.response_cache = response_cache
+
+    def compare(self, upstream, method, path, **kwargs):
+        results = {}
+        for name, app in APPS.items():
+            upstream.clear()
+            self.response_cache.clear()
+            resp = asyncio.run(client_for(app).request(method, path, **kwargs))
+            results[name] = (
+                resp.status_code,
+                resp.content,
+                {k: v for k, v in resp.headers.items() if k != "date"},
+                [(c.method, str(c.url), c.content) for c in upstream],
+            )
+        assert results["fastapi"] == results["fastpath"]
+        return results["fastpath"]
+
+    def test_session_route(self, upstream):
+        status, body, _, calls = self.compare(
+            upstream, "GET", "/api/sessions/s1/state?verbose=1", headers={"X-Tenant-ID": "t1"},
+        )
+        assert status == 200
+        assert calls[0][1] == "http://localhost:8000/api/sessions/t1__s1/state?verbose=1"
+
+    def test_body_rewrite(self, upstream):
+        _, _, _, calls = self.compare(
+            upstream, "POST", "/api/chat", json={"session_id": "s1"}, headers={"X-Tenant-ID": "t1"},
+        )
+        assert calls[0][2] == b'{"session_id":"t1__s1"}'
+
+    def test_invalid_tenant(self, upstream, monkeypatch):
+        monkeypatch.setattr(config, "valid_tenants", {"t1"})
+        status, body, _, calls = self.compare(
+            upstream, "POST", "/api/chat", json={}, headers={"X-Tenant-ID": "evil"},
+        )
+        assert status == 403
+        assert body == b'{"detail":"Invalid tenant: evil"}'
+        assert calls == []
+
+    def test_cors(self, upstream):
+        _, _, headers, _ = self.compare(
+            upstream, "POST", "/api/chat", json={},
+            headers={"X-Tenant-ID": "t1", "Origin": "http://app.example"},
+        )
+        assert headers["access-control-allow-origin"] == "http://app.example"
+
+    def test_fallback_is_served_by_fastapi(self, upstream):
+        resp = asyncio.run(client_for(fastpath.app).get("/"))
+        assert resp.json() == {"status": "ok", "service": "llmtwins-tenant-wrapper"}
+
+
+class TestThroughput:
+    def test_requests_per_second(self, upstream):
+        """Prints in-process rps of the two cores on a trivial proxied call"""
+        n = 1500
+
+        async def bench(app):
+            client = client_for(app)
+            for _ in range(50):
+                await client.post("/api/chat", json={"session_id": "s1"})
+            started = time.perf_counter()
+            for _ in range(n):
+                await client.post("/api/chat", json={"session_id": "s1"})
+            return n / (time.perf_counter() - started)
+
+        rps = {name: asyncio.run(bench(app)) for name, app in APPS.items()}
+        print(
+            f"\nrps: fastapi {rps['fastapi']:,.0f}, fastpath {rps['fastpath']:,.0f} "
+            f"({rps['fastpath'] / rps['fastapi']:.2f}x)"
+        )
@@ -0,0 +1,195 @@
+"""Tests for circuit breaking, health probing and retries."""
+
+import asyncio
+from dataclasses import replace
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import upstream
+from balancer import UpstreamPool
+from config import config
+from health import CLOSED, HALF_OPEN, OPEN, BreakerRegistry, CircuitBreaker, HealthProber
+
+NODE = "http://llm-a:8000"
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    cfg = replace(config, breaker_failure_threshold=2, breaker_reset_timeout=30)
+    registry = BreakerRegistry(cfg)
+    monkeypatch.setattr(upstream, "breakers", registry)
+    monkeypatch.setattr(upstream, "upstreams", UpstreamPool([NODE]))
+    monkeypatch.setattr(config, "upstream_retry_backoff", 0)
+    return registry
+
+
+def send(handler, method="GET", content=None):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return asyncio.run(upstream.send_upstream(client, method, "/api/x", content=content))
+
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        assert not breaker.allow()
+        assert 0 < breaker.retry_after() <= 30
+
+    def test_success_resets_count(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+
+    def test_half_open_limits_trials(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0, half_open_max=1)
+        breaker.record_failure()
+        assert breaker.state == HALF_OPEN
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.abandon()
+        assert breaker.allow()
+
+    def test_half_open_failure_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=5, reset_timeout=0.05)
+        for _ in range(5):
+            breaker.record_failure()
+        breaker.half_open()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker._state == OPEN
+
+    def test_half_open_success_closes(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == CLOSED
+
+
+class TestHealthProber:
+    def test_caches_results_and_trips_breaker(self):
+        registry = BreakerRegistry(replace(config, breaker_failure_threshold=1))
+        pool = UpstreamPool([NODE, "http://llm-b:8000"])
+        prober = HealthProber(pool, registry, config)
+
+        def handler(request):
+            return httpx.Response(200 if request.url.host == "llm-a" else 500)
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        asyncio.run(prober.probe_all(client))
+        snapshot = prober.snapshot()
+
+        assert snapshot[NODE]["ok"] is True
+        assert snapshot[NODE]["circuit"] == CLOSED
+        assert snapshot["http://llm-b:8000"]["ok"] is False
+        assert snapshot["http://llm-b:8000"]["error"] == "HTTP 500"
+        assert snapshot["http://llm-b:8000"]["circuit"] == OPEN
+
+    def test_successful_probe_half_opens(self):
+        registry = BreakerRegistry(config)
+        registry.get(NODE)._trip()
+        prober = HealthProber(UpstreamPool([NODE]), registry, config)
+        client = httpx.AsyncClient(transport=httpx.MockTransport(lambda r: httpx.Response(200)))
+        asyncio.run(prober.probe(client, NODE))
+        assert registry.get(NODE).state == HALF_OPEN
+
+    def test_health_endpoint_uses_cache(self, wrapper, upstream_calls):
+        client = wrapper(lambda r: httpx.Response(200))
+        body = asyncio.run(client.get("/health")).json()
+        assert upstream_calls == []
+        assert "circuit" in next(iter(body["upstreams"].values()))
+
+
+class TestSendUpstream:
+    def test_idempotent_request_is_retried(self, registry):
+        registry.get(NODE).failure_threshold = 5
+        statuses = iter([503, 502, 200])
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(next(statuses))
+
+        response, base_url = send(handler)
+        assert response.status_code == 200
+        assert base_url == NODE
+        assert len(calls) == 3
+        assert upstream.upstreams.snapshot()[NODE] == 1
+        assert registry.get(NODE).failures == 0
+
+    def test_post_is_not_retried(self, registry):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(503)
+
+        response, _ = send(handler, method="POST", content=b"{}")
+        assert response.status_code == 503
+        assert len(calls) == 1
+
+    def test_streamed_body_is_not_retried(self, registry):
+        calls = []
+
+        async def body():
+            yield b"x"
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(503)
+
+        send(handler, method="PUT", content=body())
+        assert len(calls) == 1
+
+    def test_connection_error_is_502_and_opens_circuit(self, registry):
+        def handler(request):
+            raise httpx.ConnectError("refused")
+
+        with pytest.raises(HTTPException) as exc:
+            send(handler, method="POST", content=b"{}")
+        assert exc.value.status_code == 502
+        with pytest.raises(HTTPException):
+            send(handler, method="POST", content=b"{}")
+
+        assert registry.get(NODE).state == OPEN
+        assert upstream.upstreams.snapshot()[NODE] == 0
+
+    @pytest.mark.parametrize("error", [httpx.ReadTimeout, httpx.ConnectTimeout, httpx.PoolTimeout])
+    def test_timeout_is_504_and_opens_circuit(self, registry, error):
+        def handler(request):
+            raise error("timed out")
+
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc:
+                send(handler, method="POST", content=b"{}")
+            assert exc.value.status_code == 504
+            assert exc.value.detail == f"Upstream timeout: {error.__name__}"
+
+        assert registry.get(NODE).state == OPEN
+        assert upstream.upstreams.snapshot()[NODE] == 0
+
+    def test_open_circuit_fails_fast(self, registry):
+        registry.get(NODE)._trip()
+        calls = []
+
+        with pytest.raises(HTTPException) as exc:
+            send(lambda r: calls.append(r) or httpx.Response(200))
+        assert exc.value.status_code == 503
+        assert int(exc.value.headers["Retry-After"]) >= 1
+        assert calls == []
+
+    def test_sessionless_request_avoids_open_node(self, registry, monkeypatch):
+        pool = UpstreamPool([NODE, "http://llm-b:8000"])
+        monkeypatch.setattr(upstream, "upstreams", pool)
+        registry.get(NODE)._trip()
+
+        for _ in range(3):
+            _, base_url = send(lambda r: httpx.Response(200))
+            assert base_url == "http://llm-b:8000"
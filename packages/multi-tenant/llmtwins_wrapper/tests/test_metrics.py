@@ -0,0 +1,185 @@
+"""Tests for Prometheus metrics per tenant and route."""
+
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+import main
+import upstream
+from balancer import UpstreamPool
+from health import BreakerRegistry
+from metrics import OTHER, Histogram, Metrics, render
+from server import WorkerMetrics
+from upstream import UpstreamTrace
+
+
+def scrape(client) -> str:
+    resp = asyncio.run(client.get("/metrics"))
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    return resp.text
+
+
+class TestHistogram:
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+        assert histogram.snapshot() == {
+            "buckets": {"0.1": 2, "1.0": 3, "+Inf": 4},
+            "sum": 3.65,
+            "count": 4,
+        }
+
+
+class TestLabels:
+    def test_tenants_past_the_cap_are_other(self):
+        metrics = Metrics(max_tenants=2)
+        for tenant in ("a", "b", "c", "d"):
+            metrics.series(tenant, "/api/chat").count(200)
+        assert metrics.snapshot().keys() == {"a", "b", OTHER}
+        assert metrics.snapshot()[OTHER]["/api/chat"]["requests"] == {"200": 2}
+
+    def test_unknown_tenants_are_other_with_a_whitelist(self):
+        metrics = Metrics(valid_tenants={"a"})
+        metrics.series("evil", "/api/chat").count(403)
+        metrics.series(None, "/api/chat").count(403)
+        assert metrics.snapshot().keys() == {OTHER}
+
+    def test_missing_tenant_is_the_default(self):
+        metrics = Metrics(default_tenant="default")
+        assert metrics.series(None, "/") is metrics.series("default", "/")
+
+    def test_render_escapes_labels(self):
+        metrics = Metrics()
+        metrics.series('a"b', "/x").count(200)
+        assert 'llmtwins_wrapper_requests_total{tenant="a\\"b",route="/x",status="200"} 1' in (
+            render(metrics.snapshot())
+        )
+
+
+class TestEndpoint:
+    def test_counts_by_tenant_route_and_status(self, wrapper):
+        client = wrapper(lambda r: httpx.Response(200, json={"ok": True}))
+        headers = {"X-Tenant-ID": "t1"}
+        asyncio.run(client.post("/api/chat", json={"session_id": "s1"}, headers=headers))
+        asyncio.run(client.get("/api/sessions/s1/state", headers=headers))
+        asyncio.run(client.get("/api/sessions/s2/state", headers=headers))
+
+        text = scrape(client)
+        assert (
+            'llmtwins_wrapper_requests_total{tenant="t1",route="/api/chat",status="200"} 1'
+        ) in text
+        assert (
+            'llmtwins_wrapper_requests_total{tenant="t1",'
+            'route="/api/sessions/{session_id}/state",status="200"} 2'
+        ) in text
+        # Session ids never become label values
+        assert "s1" not in text and "s2" not in text
+        assert (
+            'llmtwins_wrapper_upstream_latency_seconds_count{tenant="t1",route="/api/chat"} 1'
+        ) in text
+        assert 'llmtwins_wrapper_ttfb_seconds_count{tenant="t1",route="/api/chat"} 1' in text
+        assert 'llmtwins_wrapper_upstream_in_flight{tenant="t1",route="/api/chat"} 0' in text
+
+    def test_bytes_in_and_out(self, wrapper, reset_metrics):
+        client = wrapper(lambda r: httpx.Response(200, content=b"x" * 100))
+        asyncio.run(client.post("/api/chat", content=b'{"a": 1}', headers={"X-Tenant-ID": "t1"}))
+
+        series = reset_metrics.snapshot()["t1"]["/api/chat"]
+        assert series["bytes_in"] == 8
+        assert series["bytes_out"] == 100
+
+    def test_errors_are_counted(self, wrapper, reset_metrics, monkeypatch):
+        monkeypatch.setattr(main.config, "valid_tenants", {"t1"})
+        client = wrapper(lambda r: httpx.Response(200))
+        asyncio.run(client.post("/api/chat", json={}, headers={"X-Tenant-ID": "evil"}))
+
+        assert reset_metrics.snapshot()["evil"]["/api/chat"]["requests"] == {"403": 1}
+
+    def test_stream_ttfb_and_duration(self, wrapper, reset_metrics):
+        async def body():
+            yield b'{"i": 0}\n'
+            await asyncio.sleep(0.05)
+            yield b'{"i": 1}\n'
+
+        client = wrapper(lambda r: httpx.Response(200, content=body()))
+        resp = asyncio.run(client.post(
+            "/api/chat", json={"session_id": "s1", "stream": True}, headers={"X-Tenant-ID": "t1"},
+        ))
+        assert resp.status_code == 200
+
+        series = reset_metrics.snapshot()["t1"]["/api/chat"]
+        assert series["in_flight"] == 0
+        assert series["duration"]["sum"] >= 0.05
+        assert series["ttfb"]["sum"] < series["duration"]["sum"]
+
+    def test_aggregates_workers(self, wrapper, monkeypatch, tmp_path):
+        monkeypatch.setattr(main, "worker_metrics", WorkerMetrics(str(tmp_path)))
+        client = wrapper(lambda r: httpx.Response(200))
+        asyncio.run(client.post("/api/chat", json={}, headers={"X-Tenant-ID": "t1"}))
+
+        other = main.worker_snapshot(main.app)
+        (tmp_path / f"{os.getppid()}.json").write_text(json.dumps(other))
+
+        text = scrape(client)
+        assert 'llmtwins_wrapper_requests_total{tenant="t1",route="/api/chat",status="200"} 2' in text
+
+
+class TestPoolWait:
+    def test_first_connection_event_ends_the_wait(self):
+        waits = []
+        trace = UpstreamTrace(waits.append)
+
+        async def go():
+            await asyncio.sleep(0.01)
+            await trace("connection.connect_tcp.started", {})
+            await trace("connection.connect_tcp.complete", {})
+            await trace("http11.send_request_headers.started", {})
+
+        asyncio.run(go())
+        assert len(waits) == 1
+        assert waits[0] >= 0.01
+
+    def test_recorded_through_the_client(self, reset_metrics, monkeypatch):
+        monkeypatch.setattr(main.config, "upstream_retries", 0)
+        monkeypatch.setattr(upstream, "breakers", BreakerRegistry(main.config))
+        monkeypatch.setattr(upstream, "upstreams", UpstreamPool(["http://127.0.0.1:9"]))
+
+        async def go():
+            # A real pool: nothing listens on the port, but the connect
+            # attempt still ends the wait
+            async with httpx.AsyncClient() as client:
+                main.app.state.http_client = client
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://w") as c:
+                    return await c.post("/api/chat", json={}, headers={"X-Tenant-ID": "t1"})
+
+        try:
+            resp = asyncio.run(go())
+        finally:
+            main.app.state.http_client = None
+        assert resp.status_code == 502
+        series = reset_metrics.snapshot()["t1"]["/api/chat"]
+        assert series["pool_wait"]["count"] == 1
+        assert series["upstream_latency"]["count"] == 0
+        assert series["in_flight"] == 0
+
+
+class TestOverhead:
+    def test_recording_cost(self):
+        metrics = Metrics()
+        n = 100_000
+        started = time.perf_counter()
+        for i in range(n):
+            series = metrics.series("t1", "/api/chat")
+            series.count(200)
+            series.ttfb.observe(0.01)
+            series.duration.observe(0.2)
+            series.bytes_out += 100
+        per_request = (time.perf_counter() - started) / n
+        print(f"\nmetrics recording: {per_request * 1e6:.2f} µs/request")
+        assert per_request < 20e-6
@@ -0,0 +1,202 @@
+"""Tests for per-tenant token-bucket rate limiting."""
+
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import main
+from ratelimit import (
+    MemoryStore,
+    RateLimiter,
+    RateRule,
+    SQLiteStore,
+    create_store,
+    load_rules_file,
+    parse_rules,
+)
+
+
+def limiter(spec, store=None):
+    return RateLimiter(parse_rules(spec), store)
+
+
+class TestRules:
+    def test_parse(self):
+        rules = parse_rules("/api/chat=5:10, nantou-gov@/api/chat=20:40, *=50:100, t@*=2")
+        assert rules[("*", "/api/chat")] == RateRule(5.0, 10)
+        assert rules[("nantou-gov", "/api/chat")] == RateRule(20.0, 40)
+        assert rules[("*", "*")] == RateRule(50.0, 100)
+        assert rules[("t", "*")] == RateRule(2.0, 2)
+
+    def test_load_file(self, tmp_path):
+        path = tmp_path / "limits.json"
+        path.write_text(json.dumps({"*": {"/api/chat": {"rate": 1, "burst": 3}}}))
+        assert load_rules_file(str(path)) == {("*", "/api/chat"): RateRule(1.0, 3)}
+
+    def test_tenant_rule_beats_default(self):
+        rl = limiter("/api/chat=1:1,vip@/api/chat=10:10,*=100:100")
+        assert rl.buckets("vip", "/api/chat") == [
+            ("/api/chat", RateRule(10.0, 10)), ("*", RateRule(100.0, 100)),
+        ]
+        assert rl.buckets("t", "/api/chat")[0] == ("/api/chat", RateRule(1.0, 1))
+        assert rl.buckets("t", "/other") == [("*", RateRule(100.0, 100))]
+
+    def test_zero_rate_is_rejected_on_load(self, tmp_path):
+        with pytest.raises(ValueError, match="rate > 0"):
+            parse_rules("/api/chat=0:5")
+        path = tmp_path / "limits.json"
+        path.write_text(json.dumps({"*": {"*": {"rate": 0, "burst": 3}}}))
+        with pytest.raises(ValueError, match="rate > 0"):
+            load_rules_file(str(path))
+
+    def test_resolved_rules_are_bounded(self):
+        rl = limiter("/api/chat=1:1,vip@*=10:10,*=100:100")
+        for i in range(1000):
+            rl.buckets(f"t{i}", f"/unknown/{i}")
+            rl.buckets(f"t{i}", "/api/chat")
+        assert rl.buckets("vip", "/api/chat") == [
+            ("/api/chat", RateRule(1.0, 1)), ("*", RateRule(10.0, 10)),
+        ]
+        assert len(rl._resolved) == 3
+
+    def test_store_spec(self, tmp_path):
+        assert isinstance(create_store("memory"), MemoryStore)
+        assert isinstance(create_store(f"sqlite://{tmp_path}/rl.db"), SQLiteStore)
+        with pytest.raises(ValueError):
+            create_store("redis://x")
+
+
+class TestMemoryStore:
+    def test_burst_then_retry_after(self):
+        store = MemoryStore()
+        buckets = [("/api/chat", RateRule(rate=2, burst=3))]
+        decisions = [store.consume_now("t", buckets, 1, now=100.0) for _ in range(4)]
+
+        assert [d.allowed for d in decisions] == [True, True, True, False]
+        assert [d.remaining for d in decisions] == [2, 1, 0, 0]
+        assert decisions[3].retry_after == pytest.approx(0.5)
+        assert decisions[3].headers()["Retry-After"] == "1"
+        assert decisions[3].headers()["X-RateLimit-Limit"] == "3"
+
+        assert store.consume_now("t", buckets, 1, now=100.5).allowed
+
+    def test_denied_request_spends_nothing(self):
+        store = MemoryStore()
+        route = ("/api/chat", RateRule(rate=1, burst=1))
+        tenant_wide = ("*", RateRule(rate=1, burst=5))
+        store.consume_now("t", [route, tenant_wide], 1, now=0.0)
+        denied = store.consume_now("t", [route, tenant_wide], 1, now=0.0)
+
+        assert not denied.allowed
+        assert store.consume_now("t", [tenant_wide], 1, now=0.0).remaining == 3
+
+    def test_tenants_have_separate_buckets(self):
+        store = MemoryStore()
+        buckets = [("*", RateRule(rate=1, burst=1))]
+        assert store.consume_now("a", buckets, 1, now=0.0).allowed
+        assert store.consume_now("b", buckets, 1, now=0.0).allowed
+        assert not store.consume_now("a", buckets, 1, now=0.0).allowed
+
+
+    def test_refilled_buckets_are_swept(self):
+        store = MemoryStore(sweep_interval=10)
+        buckets = [("*", RateRule(rate=1, burst=5))]
+        for i in range(1000):
+            store.consume_now(f"t{i}", buckets, 1, now=0.0)
+        store.consume_now("busy", [("*", RateRule(rate=0.01, burst=5))], 1, now=0.0)
+        assert len(store) == 1001
+
+        # Full again after one second; swept once the interval has passed
+        store.consume_now("t0", buckets, 1, now=10.0)
+        assert len(store) == 2
+        assert sorted(store._shards) == ["busy", "t0"]
+        # A swept bucket comes back full, as if it had been kept
+        assert store.consume_now("t1", buckets, 1, now=10.0).remaining == 4
+
+
+class TestSQLiteStore:
+    def test_replicas_share_buckets(self, tmp_path):
+        path = str(tmp_path / "rl.db")
+        first, second = SQLiteStore(path), SQLiteStore(path)
+        buckets = [("/api/chat", RateRule(rate=1, burst=2))]
+        try:
+            assert first.consume_now("t", buckets, 1, now=10.0).allowed
+            assert second.consume_now("t", buckets, 1, now=10.0).allowed
+            denied = first.consume_now("t", buckets, 1, now=10.0)
+            assert not denied.allowed
+            assert denied.retry_after == pytest.approx(1.0)
+            assert second.consume_now("t", buckets, 1, now=11.0).allowed
+        finally:
+            first.close()
+            second.close()
+
+
+class TestWrapperRateLimit:
+    @pytest.fixture
+    def rate_limiter(self, monkeypatch):
+        rl = limiter("/api/chat=1:2")
+        monkeypatch.setattr(main, "rate_limiter", rl)
+        return rl
+
+    def chat(self, client, tenant="t1"):
+        return asyncio.run(client.post(
+            "/api/chat", json={"messages": []}, headers={"X-Tenant-ID": tenant},
+        ))
+
+    def test_429_with_headers(self, wrapper, upstream_calls, rate_limiter):
+        client = wrapper(lambda r: httpx.Response(200, json={}))
+        ok = [self.chat(client) for _ in range(2)]
+        denied = self.chat(client)
+
+        assert [r.status_code for r in ok] == [200, 200]
+        assert ok[0].headers["x-ratelimit-remaining"] == "1"
+        assert ok[1].headers["x-ratelimit-remaining"] == "0"
+        assert denied.status_code == 429
+        assert denied.headers["retry-after"] == "1"
+        assert denied.headers["x-ratelimit-limit"] == "2"
+        assert len(upstream_calls) == 2
+        assert rate_limiter.snapshot()["rejected"] == {"t1": 1}
+
+    def test_rejections_are_counted_for_a_bounded_set_of_tenants(self):
+        rl = RateLimiter(parse_rules("*=1:1"), max_tenants=2)
+
+        async def run():
+            for tenant in ("a", "b", "c", "d", "a"):
+                for _ in range(2):
+                    try:
+                        await rl.check(tenant, "/api/chat")
+                    except HTTPException:
+                        pass
+
+        asyncio.run(run())
+        assert rl.snapshot()["rejected"] == {"a": 3, "b": 1, "other": 2}
+
+    def test_other_tenants_and_routes_unaffected(self, wrapper, rate_limiter):
+        client = wrapper(lambda r: httpx.Response(200, json={}))
+        for _ in range(3):
+            self.chat(client)
+        assert self.chat(client, tenant="t2").status_code == 200
+        resp = asyncio.run(client.post("/api/planning", json={}, headers={"X-Tenant-ID": "t1"}))
+        assert resp.status_code == 200
+        assert "x-ratelimit-limit" not in resp.headers
+
+
+class TestOverhead:
+    def test_memory_store_check_cost(self):
+        """Prints the per-check cost of the memory store (a benchmark, not a gate)"""
+        rl = limiter("/api/chat=1000000:1000000,*=1000000:1000000")
+        n = 50_000
+
+        async def run():
+            started = time.perf_counter()
+            for i in range(n):
+                await rl.check(f"tenant-{i % 100}", "/api/chat")
+            return time.perf_counter() - started
+
+        elapsed = asyncio.run(run())
+        per_check_us = 1e6 * elapsed / n
+        print(f"\nrate limit check: {per_check_us:.2f} us ({n / elapsed:,.0f} checks/s)")
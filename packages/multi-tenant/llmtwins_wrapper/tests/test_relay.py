@@ -0,0 +1,196 @@
+"""Tests for streamed response relaying, backpressure and disconnects."""
+
+import asyncio
+import json
+
+import httpx
+
+import main
+from relay import StreamStats, relay_stream
+
+
+class FakeClient:
+    """ASGI receive channel that disconnects when told to"""
+
+    def __init__(self):
+        self.gone = asyncio.Event()
+
+    async def receive(self):
+        await self.gone.wait()
+        return {"type": "http.disconnect"}
+
+
+class Upstream:
+    def __init__(self, chunks=None, delay=0.0, fail_after=None):
+        self.chunks = chunks
+        self.delay = delay
+        self.fail_after = fail_after
+        self.produced = 0
+        self.cancelled = False
+        self.closed = 0
+
+    async def stream(self):
+        try:
+            i = 0
+            while self.chunks is None or i < len(self.chunks):
+                if self.fail_after is not None and i == self.fail_after:
+                    raise httpx.ReadError("upstream reset")
+                await asyncio.sleep(self.delay)
+                self.produced += 1
+                yield self.chunks[i] if self.chunks else b"x" * 1024
+                i += 1
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+    async def close(self):
+        self.closed += 1
+
+
+class TestRelayStream:
+    def test_complete_stream(self):
+        upstream, stats = Upstream([b"a\n", b"b\n"]), StreamStats()
+
+        async def run():
+            client = FakeClient()
+            out = [c async for c in relay_stream(
+                upstream.stream(), client.receive, upstream.close, "t1", stats=stats,
+            )]
+            client.gone.set()
+            await asyncio.sleep(0)
+            return out
+
+        assert asyncio.run(run()) == [b"a\n", b"b\n"]
+        assert upstream.closed == 1
+        counts = stats.snapshot()["t1"]
+        assert (counts["started"], counts["completed"], counts["abandoned"]) == (1, 1, 0)
+
+    def test_disconnect_cancels_upstream_promptly(self):
+        upstream, stats = Upstream(delay=0.01), StreamStats()
+
+        async def run():
+            client = FakeClient()
+            stream = relay_stream(upstream.stream(), client.receive, upstream.close, "t1", stats=stats)
+            received = [await stream.__anext__(), await stream.__anext__()]
+            client.gone.set()
+            # The consumer is woken and the generator ends
+            received += [c async for c in stream]
+            return received
+
+        received = asyncio.run(run())
+        assert len(received) >= 2
+        assert upstream.cancelled
+        assert upstream.closed == 1
+        assert stats.abandoned("t1") == 1
+
+    def test_disconnect_closes_upstream_while_consumer_is_stuck(self):
+        """A client stalled in send() must not keep the upstream stream open"""
+        upstream, stats = Upstream(delay=0.001), StreamStats()
+
+        async def run():
+            client = FakeClient()
+            stream = relay_stream(upstream.stream(), client.receive, upstream.close, "t1", stats=stats)
+            await stream.__anext__()
+            client.gone.set()
+            for _ in range(5):
+                await asyncio.sleep(0.005)
+            closed = upstream.closed
+            await stream.aclose()
+            return closed
+
+        assert asyncio.run(run()) == 1
+        assert upstream.closed == 1
+        assert stats.abandoned("t1") == 1
+
+    def test_read_ahead_is_bounded(self):
+        upstream = Upstream()
+
+        async def run():
+            stream = relay_stream(
+                upstream.stream(), FakeClient().receive, upstream.close, "t1",
+                read_ahead=4, stats=StreamStats(),
+            )
+            await stream.__anext__()
+            await asyncio.sleep(0.05)  # slow client: nothing consumed
+            produced = upstream.produced
+            await stream.aclose()
+            return produced
+
+        # one delivered, four queued, one blocked in put()
+        assert asyncio.run(run()) <= 6
+
+    def test_upstream_error_propagates(self):
+        upstream, stats = Upstream([b"a", b"b"], fail_after=1), StreamStats()
+
+        async def run():
+            out = []
+            try:
+                async for chunk in relay_stream(
+                    upstream.stream(), FakeClient().receive, upstream.close, "t1", stats=stats,
+                ):
+                    out.append(chunk)
+            except httpx.ReadError:
+                return out, True
+            return out, False
+
+        assert asyncio.run(run()) == ([b"a"], True)
+        assert upstream.closed == 1
+        assert stats.abandoned("t1") == 0
+
+
+class TestWrapperDisconnect:
+    def test_chat_stream_closed_on_client_disconnect(self, monkeypatch):
+        stats = StreamStats()
+        monkeypatch.setattr("relay.stream_stats", stats)
+        upstream_closed = asyncio.Event()
+
+        class SlowNDJSON(httpx.AsyncByteStream):
+            async def __aiter__(self):
+                while True:
+                    yield b'{"session_id": "t1__s1", "token": "x"}\n'
+                    await asyncio.sleep(0.01)
+
+            async def aclose(self):
+                upstream_closed.set()
+
+        main.app.state.http_client = httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda r: httpx.Response(200, stream=SlowNDJSON()))
+        )
+
+        async def run():
+            body = json.dumps({"session_id": "s1", "stream": True}).encode()
+            messages = [{"type": "http.request", "body": body, "more_body": False}]
+            gone = asyncio.Event()
+            sent = []
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                await gone.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+                if message["type"] == "http.response.body" and len(sent) >= 4:
+                    gone.set()
+
+            scope = {
+                "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"},
+                "http_version": "1.1", "method": "POST", "scheme": "http",
+                "path": "/api/chat", "raw_path": b"/api/chat", "query_string": b"",
+                "root_path": "", "server": ("wrapper", 80), "client": ("127.0.0.1", 1),
+                "headers": [
+                    (b"host", b"wrapper"), (b"x-tenant-id", b"t1"),
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            }
+            await asyncio.wait_for(main.app(scope, receive, send), 2)
+            await asyncio.wait_for(upstream_closed.wait(), 1)
+            return sent
+
+        sent = asyncio.run(run())
+        assert sent[0]["status"] == 200
+        assert b"t1__" not in sent[1]["body"]
+        assert stats.abandoned("t1") == 1
+        main.app.state.http_client = None
@@ -0,0 +1,237 @@
+"""Tests for the capture replay load-test harness."""
+
+import asyncio
+import gzip
+import io
+import json
+import os
+import time
+
+import httpx
+import pytest
+
+import main
+from capture import Redactor
+from replay import (
+    REPLAY_ID_HEADER,
+    ProcessUsage,
+    Result,
+    StubLLMTwins,
+    compare,
+    format_table,
+    load_capture,
+    parse_build,
+    percentile,
+    replay,
+    request_body,
+    stub_delay,
+    summarize,
+)
+
+
+def record(ts=0.0, stream=False, chunks=((10, 50),), status=200, **fields):
+    body = {"session_id": "s-1", "stream": stream}
+    return {
+        "ts": ts,
+        "tenant": "t1",
+        "method": "POST",
+        "path": "/api/chat",
+        "query": "",
+        "type": "application/json",
+        "body": json.dumps(body),
+        "size": len(json.dumps(body)),
+        "status": status,
+        "response_type": "application/x-ndjson" if stream else "application/json",
+        "chunks": [list(c) for c in chunks],
+        **fields,
+    }
+
+
+def stub_client(records, cadence=0.0):
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=StubLLMTwins(records, cadence)), base_url="http://stub",
+    )
+
+
+class TestCaptureFiles:
+    def test_loads_plain_and_gzip_files_in_time_order(self, tmp_path):
+        (tmp_path / "a.jsonl").write_text(json.dumps(record(ts=2)) + "\n\n")
+        with gzip.open(tmp_path / "b.jsonl.gz", "wt") as f:
+            f.write(json.dumps(record(ts=1)) + "\n")
+        records = load_capture([str(tmp_path / "a.jsonl"), str(tmp_path / "b.jsonl.gz")])
+        assert [r["ts"] for r in records] == [1, 2]
+
+    def test_stub_delay(self):
+        assert stub_delay(record(stream=True, chunks=[(100, 1), (50, 1)])) == 0.1
+        assert stub_delay(record(chunks=[(100, 1), (50, 1)]), cadence=2) == 0.3
+        assert stub_delay(record(chunks=[])) == 0.0
+
+    def test_request_bodies(self):
+        assert request_body(record()) == (record()["body"].encode(), None)
+        assert request_body(record(body=None, size=0)) == (None, None)
+        content, _ = request_body(record(body=None, size=100))
+        assert len(content) == 100 and json.loads(content)
+        _, files = request_body(record(body=None, size=10, type="multipart/form-data; b=x"))
+        assert files["file"][1] == b"x" * 10
+
+
+class TestStub:
+    def test_replays_status_and_chunks(self):
+        records = [record(stream=True, chunks=[(0, 60), (0, 80)]), record(status=503)]
+
+        async def go():
+            async with stub_client(records) as client:
+                stream = await client.post(
+                    "/api/chat", json={"session_id": "t1__s-1"}, headers={REPLAY_ID_HEADER: "0"},
+                )
+                error = await client.post("/api/chat", json={}, headers={REPLAY_ID_HEADER: "1"})
+                probe = await client.get("/health")
+            return stream, error, probe
+
+        stream, error, probe = asyncio.run(go())
+        lines = stream.content.splitlines(keepends=True)
+        assert [len(line) for line in lines] == [60, 80]
+        assert all(json.loads(line)["session_id"] == "t1__s-1" for line in lines)
+        assert stream.headers["content-type"] == "application/x-ndjson"
+        assert error.status_code == 503
+        assert probe.status_code == 200
+
+    def test_session_from_the_path(self):
+        records = [record(method="GET", path="/api/sessions/x/state", chunks=[(0, 100)])]
+
+        async def go():
+            async with stub_client(records) as client:
+                return await client.get(
+                    "/api/sessions/t1__s-1/state", headers={REPLAY_ID_HEADER: "0"},
+                )
+
+        resp = asyncio.run(go())
+        assert resp.json()["session_id"] == "t1__s-1"
+        assert len(resp.content) == 100
+
+    def test_paces_the_stream(self):
+        records = [record(stream=True, chunks=[(20, 10), (30, 10)])]
+
+        async def go():
+            async with stub_client(records, cadence=1.0) as client:
+                started = time.perf_counter()
+                await client.post("/api/chat", json={}, headers={REPLAY_ID_HEADER: "0"})
+                return time.perf_counter() - started
+
+        assert asyncio.run(go()) >= 0.05
+
+
+class TestReplay:
+    def test_round_trip_through_the_wrapper(self, monkeypatch):
+        """Capture through the wrapper, then replay the capture through it again"""
+        out = io.StringIO()
+        monkeypatch.setattr(main.recorder, "target", "-")
+        monkeypatch.setattr(main.recorder, "redactor", Redactor(b"key"))
+        transport = httpx.ASGITransport(app=main.app)
+
+        async def capture():
+            async def body():
+                yield b'{"session_id": "t1__abc", "delta": "hi"}\n'
+                yield b'{"session_id": "t1__abc", "delta": "there"}\n'
+
+            main.app.state.http_client = httpx.AsyncClient(transport=httpx.MockTransport(
+                lambda r: httpx.Response(200, content=body())
+            ))
+            async with httpx.AsyncClient(transport=transport, base_url="http://w") as client:
+                for _ in range(3):
+                    await client.post(
+                        "/api/chat", json={"session_id": "abc", "stream": True},
+                        headers={"X-Tenant-ID": "t1"},
+                    )
+
+        async def replay_capture(records):
+            main.app.state.http_client = stub_client(records)
+            async with httpx.AsyncClient(transport=transport, base_url="http://w") as client:
+                return await replay(records, client, speed=10)
+
+        try:
+            asyncio.run(capture())
+            main.recorder.flush(out)
+            monkeypatch.setattr(main.recorder, "target", None)
+            records = [json.loads(line) for line in out.getvalue().splitlines()]
+            results, wall = asyncio.run(replay_capture(records))
+        finally:
+            main.app.state.http_client = None
+
+        assert len(records) == 3
+        assert sorted(r.status for r in results) == [200, 200, 200]
+        assert all(r.bytes > 0 for r in results)
+        report = summarize(records, results, wall)
+        assert report["requests"] == 3 and report["errors"] == 0
+
+    def test_keeps_the_arrival_schedule(self):
+        records = [record(ts=0.0), record(ts=0.2), record(ts=0.4)]
+
+        async def go(speed):
+            async with stub_client(records) as client:
+                return await replay(records, client, speed=speed)
+
+        _, wall = asyncio.run(go(1))
+        assert wall >= 0.4
+        _, wall = asyncio.run(go(4))
+        assert 0.1 <= wall < 0.3
+
+
+class TestReport:
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 99) == 99
+        assert percentile([], 50) == 0.0
+
+    def test_summarize(self):
+        records = [record(chunks=[(100, 10)]), record(chunks=[(100, 10)])]
+        results = [
+            Result(0, 200, 0.15, 0.12, 10),
+            Result(1, 0, 1.0, 1.0, 0, "ReadTimeout"),
+        ]
+        report = summarize(records, results, 2.0, usage={"cpu_seconds": 0.5})
+        assert report["requests"] == 2
+        assert report["errors"] == 1
+        assert report["statuses"] == {"0": 1, "200": 1}
+        assert report["transport_errors"] == {"ReadTimeout": 1}
+        assert report["throughput_rps"] == 1.0
+        assert report["ttfb_overhead_ms"]["p50"] == pytest.approx(20.0)
+        assert report["cpu_seconds"] == 0.5
+        header, row = format_table({"a": report}).splitlines()
+        assert header.split()[:2] == ["build", "rps"]
+        assert row.split()[:3] == ["a", "1.0", "1"]
+
+    def test_compare_flags_regressions_beyond_tolerance(self):
+        baseline = {
+            "throughput_rps": 100.0, "errors": 0,
+            "ttfb_overhead_ms": {"p50": 10.0, "p99": 50.0}, "cpu_seconds": 2.0,
+        }
+        same = dict(baseline, ttfb_overhead_ms={"p50": 10.5, "p99": 52.0})
+        assert compare(same, baseline) == []
+
+        slower = dict(baseline, ttfb_overhead_ms={"p50": 20.0, "p99": 50.0}, cpu_seconds=3.0)
+        assert compare(slower, baseline) == [
+            "ttfb_overhead_ms.p50: 10.0 -> 20.0",
+            "cpu_seconds: 2.0 -> 3.0",
+        ]
+        assert compare(dict(baseline, throughput_rps=50.0, errors=2), baseline) == [
+            "throughput_rps: 100.0 -> 50.0",
+            "errors: 0 -> 2",
+        ]
+
+    def test_parse_build(self):
+        assert parse_build("head=.,FAST_PATH=true,WORKERS=2") == (
+            "head", os.path.abspath("."), {"FAST_PATH": "true", "WORKERS": "2"},
+        )
+        assert parse_build("current")[1] == os.path.abspath(".")
+
+
+@pytest.mark.skipif(not ProcessUsage.available(), reason="needs /proc")
+class TestProcessUsage:
+    def test_measures_this_process(self):
+        usage = ProcessUsage(os.getpid())
+        sum(i * i for i in range(200_000))
+        report = usage.report(1.0)
+        assert report["cpu_seconds"] > 0
+        assert report["peak_rss_mb"] > 10
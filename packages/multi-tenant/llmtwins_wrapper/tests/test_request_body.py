@@ -0,0 +1,202 @@
+"""Tests for request body passthrough and session splicing."""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from config import config
+from rewrite import JSONBodyRewriter, SessionFieldError
+
+
+def splice(chunks, tenant="acme"):
+    rewriter = JSONBodyRewriter(tenant)
+    out = b"".join(rewriter.feed(chunk) for chunk in chunks) + rewriter.flush()
+    return out, rewriter
+
+
+class TestJSONBodyRewriter:
+    def test_body_without_session_is_identical(self):
+        body = json.dumps({"items": ["x" * 50] * 200, "stream": False}).encode()
+        out, rewriter = splice([body[i:i + 97] for i in range(0, len(body), 97)])
+        assert out == body
+        assert rewriter.rewritten == 0
+        assert rewriter.stream is False
+
+    def test_session_fields_are_prefixed(self):
+        body = b'{"session_id": "s1", "sessionId":"acme__s2", "sid" :"s3", "x": "s4"}'
+        out, rewriter = splice([body])
+        assert json.loads(out) == {
+            "session_id": "acme__s1", "sessionId": "acme__s2", "sid": "acme__s3", "x": "s4",
+        }
+        assert rewriter.rewritten == 2
+        assert rewriter.session_id == "acme__s1"
+
+    def test_empty_session_is_left_alone(self):
+        out, _ = splice([b'{"session_id": ""}'])
+        assert out == b'{"session_id": ""}'
+
+    def test_every_split_point(self):
+        body = ('{"messages": ["' + "字" * 400 + '"], "session_id": "s1", "stream": true}').encode()
+        expected = body.replace(b'"s1"', b'"acme__s1"')
+        for i in range(0, len(body) + 1, 7):
+            out, rewriter = splice([body[:i], body[i:]])
+            assert out == expected
+            assert rewriter.stream is True
+
+    def test_stream_flag_split_across_chunks(self):
+        body = b'{"a": "' + b"x" * 1000 + b'", "stream":  true}'
+        cut = body.index(b"true") + 2
+        _, rewriter = splice([body[:cut], body[cut:]])
+        assert rewriter.stream is True
+
+
+class TestSessionIsolation:
+    """Whatever LLMTwins' json.loads reads as a session field must be prefixed"""
+
+    def upstream_sees(self, body, chunk=None):
+        chunks = [body] if chunk is None else [body[i:i + chunk] for i in range(0, len(body), chunk)]
+        out, _ = splice(chunks)
+        return json.loads(out)
+
+    def test_escaped_value(self):
+        body = b'{"session_id": "victim\\u005f_abc"}'
+        assert self.upstream_sees(body) == {"session_id": "acme__victim__abc"}
+
+    def test_escaped_key(self):
+        body = b'{"session\\u005fid": "victim__abc", "s\\u0069d": "x"}'
+        assert self.upstream_sees(body) == {"session_id": "acme__victim__abc", "sid": "acme__x"}
+
+    def test_long_value(self):
+        value = "victim__" + "a" * 300
+        body = json.dumps({"session_id": value}).encode()
+        assert self.upstream_sees(body, chunk=7) == {"session_id": "acme__" + value}
+
+    def test_too_long_value_is_rejected(self):
+        body = json.dumps({"session_id": "a" * 5000}).encode()
+        with pytest.raises(SessionFieldError, match="longer than"):
+            splice([body])
+
+    def test_wide_whitespace_around_colon(self):
+        body = b'{"session_id"' + b" \n" * 40 + b":" + b"\t" * 40 + b'"victim__abc"}'
+        assert self.upstream_sees(body, chunk=5) == {"session_id": "acme__victim__abc"}
+
+    def test_non_string_value_is_rejected(self):
+        with pytest.raises(SessionFieldError, match="must be a string"):
+            splice([b'{"sid": 42}'])
+        out, _ = splice([b'{"sid": null}'])
+        assert out == b'{"sid": null}'
+
+    def test_only_top_level_fields_are_rewritten(self):
+        body = b'{"meta": {"sid": "s1", "list": [{"session_id": "s2"}]}, "sid": "s3"}'
+        assert self.upstream_sees(body) == {
+            "meta": {"sid": "s1", "list": [{"session_id": "s2"}]}, "sid": "acme__s3",
+        }
+
+    def test_strings_hide_structure(self):
+        body = b'{"text": "}{\\" \\"sid\\": \\"s0", "sid": "s1"}'
+        assert self.upstream_sees(body, chunk=3) == {"text": '}{" "sid": "s0', "sid": "acme__s1"}
+
+    def test_top_level_array_is_untouched(self):
+        body = b'[{"session_id": "s1"}]'
+        out, rewriter = splice([body])
+        assert out == body
+        assert rewriter.unchanged
+
+    @pytest.mark.parametrize("encoding", ["utf-16", "utf-32-le", "utf-8-sig"])
+    def test_other_encodings(self, encoding):
+        body = '{"session_id": "victim__abc", "stream": true}'.encode(encoding)
+        out, rewriter = splice([body[:3], body[3:]])
+        assert json.loads(out) == {"session_id": "acme__victim__abc", "stream": True}
+        assert rewriter.stream is True
+
+    def test_every_split_point_with_escapes(self):
+        body = '{"a": ["\\"sid\\""], "s\\u0069d" : "v\\u005f_x", "stream": true}'.encode()
+        for i in range(len(body) + 1):
+            out, rewriter = splice([body[:i], body[i:]])
+            assert json.loads(out)["sid"] == "acme__v__x"
+            assert rewriter.stream is True
+            assert rewriter.session_id == "acme__v__x"
+
+
+class TestBodyPassthrough:
+    def test_small_json_body_is_spliced_with_length(self, wrapper, upstream_calls):
+        client = wrapper(lambda r: httpx.Response(200, json={}))
+        body = b'{"session_id": "s1", "stream": false}'
+        asyncio.run(client.post(
+            "/api/mapping", content=body,
+            headers={"X-Tenant-ID": "acme", "Content-Type": "application/json"},
+        ))
+        sent = upstream_calls[0]
+        assert sent.content == b'{"session_id": "acme__s1", "stream": false}'
+        assert sent.headers["content-length"] == str(len(sent.content))
+
+    def test_large_body_is_streamed_unchanged(self, wrapper, upstream_calls, monkeypatch):
+        monkeypatch.setattr(config, "body_buffer_limit", 1024)
+        client = wrapper(lambda r: httpx.Response(200, json={}))
+        body = json.dumps({"plan": "y" * 100_000}).encode()
+        asyncio.run(client.post(
+            "/api/planning", content=body, headers={"Content-Type": "application/json"},
+        ))
+        sent = upstream_calls[0]
+        assert sent.read() == body
+
+    def test_non_json_body_passthrough_keeps_length(self, wrapper, upstream_calls):
+        client = wrapper(lambda r: httpx.Response(200, json={}))
+        asyncio.run(client.post("/api/other", data={"session_id": "s1"}))
+        sent = upstream_calls[0]
+        assert sent.read() == b"session_id=s1"
+        assert sent.headers["content-length"] == "13"
+
+    def test_stream_flag_in_streamed_body_selects_streaming(self, wrapper, monkeypatch):
+        monkeypatch.setattr(config, "body_buffer_limit", 16)
+        client = wrapper(lambda r: httpx.Response(
+            200, content=b'{"session_id": "acme__s1"}\n', headers={"Content-Type": "application/x-ndjson"},
+        ))
+
+        async def body():
+            yield b'{"session_id": "s1", '
+            yield b'"stream": true}'
+
+        resp = asyncio.run(client.post(
+            "/api/chat", content=body(),
+            headers={"X-Tenant-ID": "acme", "Content-Type": "application/json"},
+        ))
+        assert resp.headers["content-type"] == "application/x-ndjson"
+        assert resp.content == b'{"session_id": "s1"}\n'
+
+    def test_json_labelled_as_text_is_spliced(self, wrapper, upstream_calls):
+        client = wrapper(lambda r: httpx.Response(200, json={}))
+        asyncio.run(client.post(
+            "/api/mapping", content=b'{"session_id": "victim__abc"}',
+            headers={"X-Tenant-ID": "acme", "Content-Type": "text/plain"},
+        ))
+        assert json.loads(upstream_calls[0].content) == {"session_id": "acme__victim__abc"}
+
+    def test_unsafe_session_field_is_a_400(self, wrapper, upstream_calls, monkeypatch):
+        client = wrapper(lambda r: httpx.Response(200, json={}))
+        resp = asyncio.run(client.post(
+            "/api/mapping", content=b'{"session_id": 1}', headers={"X-Tenant-ID": "acme"},
+        ))
+        assert resp.status_code == 400
+        assert upstream_calls == []
+
+        monkeypatch.setattr(config, "body_buffer_limit", 16)
+        body = b'{"pad": "' + b"x" * 100 + b'", "session_id": 1}'
+        resp = asyncio.run(client.post(
+            "/api/mapping", content=body, headers={"X-Tenant-ID": "acme"},
+        ))
+        assert resp.status_code == 400
+
+    def test_large_non_json_body_keeps_length(self, wrapper, upstream_calls, monkeypatch):
+        monkeypatch.setattr(config, "body_buffer_limit", 16)
+        client = wrapper(lambda r: httpx.Response(200, json={}))
+        body = b"session_id=s1&" + b"x" * 1000
+        asyncio.run(client.post(
+            "/api/other", content=body,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        ))
+        sent = upstream_calls[0]
+        assert sent.read() == body
+        assert sent.headers["content-length"] == str(len(body))
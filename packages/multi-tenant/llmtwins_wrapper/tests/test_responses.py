@@ -0,0 +1,85 @@
+"""Tests for raw non-streaming response passthrough."""
+
+import asyncio
+import gzip
+
+import httpx
+
+
+def fetch(client, path="/api/planning", **kwargs):
+    kwargs.setdefault("headers", {"X-Tenant-ID": "acme"})
+    return asyncio.run(client.post(path, json={"session_id": "s1"}, **kwargs))
+
+
+class TestResponsePassthrough:
+    def test_status_headers_and_bytes_are_forwarded(self, wrapper):
+        body = b'{"result":  [1, 2],\n "note": "kept as-is"}'
+        client = wrapper(lambda r: httpx.Response(
+            202,
+            content=body,
+            headers={
+                "Content-Type": "application/json; charset=utf-8",
+                "ETag": '"abc"',
+                "Cache-Control": "max-age=60",
+            },
+        ))
+        resp = fetch(client)
+        assert resp.status_code == 202
+        assert resp.content == body
+        assert resp.headers["etag"] == '"abc"'
+        assert resp.headers["cache-control"] == "max-age=60"
+        assert resp.headers["content-type"] == "application/json; charset=utf-8"
+
+    def test_session_prefix_is_stripped(self, wrapper):
+        client = wrapper(lambda r: httpx.Response(
+            200, content=b'{"session_id":"acme__s1","data":{}}',
+            headers={"Content-Type": "application/json"},
+        ))
+        resp = fetch(client)
+        assert resp.content == b'{"session_id":"s1","data":{}}'
+        assert resp.headers["content-length"] == str(len(resp.content))
+
+    def test_non_json_body_is_not_mangled(self, wrapper):
+        client = wrapper(lambda r: httpx.Response(
+            500, content=b"Internal Server Error", headers={"Content-Type": "text/plain"},
+        ))
+        resp = fetch(client)
+        assert resp.status_code == 500
+        assert resp.content == b"Internal Server Error"
+        assert resp.headers["content-type"] == "text/plain"
+
+    def test_encoded_non_json_body_is_not_decompressed(self, wrapper):
+        compressed = gzip.compress(b"acme__s1")
+        client = wrapper(lambda r: httpx.Response(
+            200, stream=httpx.ByteStream(compressed),
+            headers={"Content-Type": "application/octet-stream", "Content-Encoding": "gzip"},
+        ))
+        resp = fetch(client)
+        assert resp.headers["content-encoding"] == "gzip"
+        assert resp.headers["content-length"] == str(len(compressed))
+        assert resp.content == b"acme__s1"
+
+    def test_encoded_json_is_decoded_and_stripped(self, wrapper, upstream_calls):
+        compressed = gzip.compress(b'{"session_id": "acme__s1"}')
+        client = wrapper(lambda r: httpx.Response(
+            200, stream=httpx.ByteStream(compressed),
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        ))
+        resp = fetch(client, headers={"X-Tenant-ID": "acme", "Accept-Encoding": "gzip, br"})
+        assert upstream_calls[0].headers["accept-encoding"] == "identity"
+        assert "content-encoding" not in resp.headers
+        assert resp.json() == {"session_id": "s1"}
+
+    def test_hop_by_hop_dropped_and_repeated_headers_kept(self, wrapper):
+        client = wrapper(lambda r: httpx.Response(
+            200, content=b"{}",
+            headers=[
+                ("Content-Type", "application/json"),
+                ("Connection", "close"),
+                ("Set-Cookie", "a=1"),
+                ("Set-Cookie", "b=2"),
+            ],
+        ))
+        resp = fetch(client)
+        assert "connection" not in resp.headers
+        assert resp.headers.get_list("set-cookie") == ["a=1", "b=2"]
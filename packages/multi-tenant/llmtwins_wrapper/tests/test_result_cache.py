@@ -0,0 +1,174 @@
+"""Tests for the on-disk result cache of deterministic LLM endpoints."""
+
+import asyncio
+import os
+import time
+
+import httpx
+import pytest
+
+import main
+from result_cache import CachedResult, ResultCache, canonical_body
+
+
+@pytest.fixture
+def result_cache(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path), max_bytes=1024 * 1024, ttl=3600, tenants={"t1"})
+    monkeypatch.setattr(main, "result_cache", cache)
+    return cache
+
+
+def mapping_upstream(request):
+    return httpx.Response(
+        200, json={"session_id": "t1__s1", "sdgs": [3, 11]},
+        headers={"content-type": "application/json"},
+    )
+
+
+def post(client, body, tenant="t1", path="/api/mapping", **headers):
+    return asyncio.run(client.post(
+        path, content=body,
+        headers={"X-Tenant-ID": tenant, "Content-Type": "application/json", **headers},
+    ))
+
+
+def result(body=b"x" * 100):
+    return CachedResult(200, [(b"content-type", b"application/json")], body)
+
+
+class TestCanonicalBody:
+    def test_key_order_and_whitespace_do_not_matter(self):
+        a, _ = canonical_body(b'{"b": 1, "a": [1, 2]}')
+        b, _ = canonical_body(b'{"a":[1,2],"b":1}')
+        assert a == b
+
+    def test_stream_requests_are_flagged(self):
+        assert canonical_body(b'{"stream": true}')[1] is True
+        assert canonical_body(b'{"stream": false}')[1] is False
+
+    def test_non_json_is_kept(self):
+        assert canonical_body(b"not json") == (b"not json", False)
+
+
+class TestResultCache:
+    def test_key_is_tenant_scoped(self, result_cache):
+        body = b'{"session_id": "s1"}'
+        assert result_cache.key("t1", "POST", "/api/mapping", body) != result_cache.key(
+            "t2", "POST", "/api/mapping", body
+        )
+        assert result_cache.key("t1", "POST", "/api/mapping", body) != result_cache.key(
+            "t1", "POST", "/api/planning", body
+        )
+        assert result_cache.key("t1", "POST", "/api/mapping", b'{"stream": true}') is None
+
+    def test_key_varies_by_accepted_encoding(self, result_cache):
+        def key(accept_encoding):
+            return result_cache.key("t1", "POST", "/api/mapping", b"{}", accept_encoding)
+
+        assert key("gzip, br") == key("BR,gzip;q=0.5") != key("gzip")
+        assert key(None) == key("identity") == key("gzip;q=0") != key("gzip")
+
+    def test_per_caller_headers_are_not_stored(self, result_cache):
+        headers = [
+            (b"content-type", b"application/json"), (b"set-cookie", b"sid=secret"),
+            (b"Date", b"Mon, 01 Jan 2024 00:00:00 GMT"), (b"connection", b"keep-alive"),
+        ]
+        asyncio.run(result_cache.put("ab" * 32, CachedResult(200, headers, b"{}")))
+        cached = asyncio.run(result_cache.get("ab" * 32))
+        assert cached.raw_headers == [(b"content-type", b"application/json")]
+
+    def test_round_trip_and_reload_from_disk(self, result_cache, tmp_path):
+        asyncio.run(result_cache.put("ab" * 32, result(b"payload")))
+        fresh = ResultCache(str(tmp_path), max_bytes=1024 * 1024, ttl=3600, tenants={"t1"})
+        cached = asyncio.run(fresh.get("ab" * 32))
+        assert cached.body == b"payload"
+        assert cached.raw_headers == [(b"content-type", b"application/json")]
+        assert fresh.size == result_cache.size
+
+    def test_size_cap_evicts_least_recently_used(self, tmp_path):
+        cache = ResultCache(str(tmp_path), max_bytes=400, ttl=3600, tenants={"t1"})
+
+        async def run():
+            await cache.put("a" * 64, result())
+            await cache.put("b" * 64, result())
+            await cache.get("a" * 64)
+            await cache.put("c" * 64, result())
+            return [await cache.get(k * 64) is not None for k in "abc"]
+
+        assert asyncio.run(run()) == [True, False, True]
+        assert cache.evictions == 1
+        assert not os.path.exists(cache._path("b" * 64))
+
+    def test_workers_share_entries_and_cap(self, tmp_path):
+        workers = [ResultCache(str(tmp_path), max_bytes=400, ttl=3600, tenants={"t1"}) for _ in range(2)]
+
+        async def run():
+            await workers[0].put("a" * 64, result())
+            await workers[1].put("b" * 64, result())
+            hit = await workers[1].get("a" * 64)
+            await workers[1].put("c" * 64, result())
+            return hit, [await workers[0].get(k * 64) is not None for k in "abc"]
+
+        hit, present = asyncio.run(run())
+        assert hit is not None
+        assert present == [True, False, True]
+        assert workers[1].evictions == 1
+        assert workers[1].entries == 2
+
+    def test_expired_entries_are_dropped(self, tmp_path):
+        cache = ResultCache(str(tmp_path), max_bytes=4096, ttl=0.01, tenants={"t1"})
+        asyncio.run(cache.put("a" * 64, result()))
+        time.sleep(0.02)
+        assert asyncio.run(cache.get("a" * 64)) is None
+        assert cache.size == 0
+
+    def test_opt_in_per_tenant(self, tmp_path):
+        assert ResultCache(str(tmp_path), 1, 1, {"t1"}).enabled("t1")
+        assert not ResultCache(str(tmp_path), 1, 1, {"t1"}).enabled("t2")
+        assert ResultCache(str(tmp_path), 1, 1, {"*"}).enabled("t2")
+        assert not ResultCache(str(tmp_path), 1, 1, set()).enabled("t1")
+
+
+class TestWrapperResultCache:
+    def test_identical_resubmission_is_served_from_disk(
+        self, wrapper, upstream_calls, result_cache
+    ):
+        client = wrapper(mapping_upstream)
+        first = post(client, b'{"session_id": "s1", "text": "river cleanup"}')
+        second = post(client, b'{"text":"river cleanup","session_id":"s1"}')
+
+        assert len(upstream_calls) == 1
+        assert first.headers["x-result-cache"] == "MISS"
+        assert second.headers["x-result-cache"] == "HIT"
+        assert second.json() == first.json() == {"session_id": "s1", "sdgs": [3, 11]}
+
+        counts = result_cache.snapshot()["tenants"]["t1"]["/api/mapping"]
+        assert counts == {"hit": 1, "miss": 1, "bypass": 0, "stored": 1}
+
+    def test_other_tenants_are_not_cached(self, wrapper, upstream_calls, result_cache):
+        client = wrapper(mapping_upstream)
+        post(client, b'{"session_id": "s1"}', tenant="t2")
+        resp = post(client, b'{"session_id": "s1"}', tenant="t2")
+        assert len(upstream_calls) == 2
+        assert "x-result-cache" not in resp.headers
+
+    def test_bypass_header(self, wrapper, upstream_calls, result_cache):
+        client = wrapper(mapping_upstream)
+        post(client, b'{"session_id": "s1"}')
+        post(client, b'{"session_id": "s1"}', **{"X-Result-Cache": "bypass"})
+        post(client, b'{"session_id": "s1"}', **{"Cache-Control": "no-cache"})
+        assert len(upstream_calls) == 3
+        assert result_cache.snapshot()["tenants"]["t1"]["/api/mapping"]["bypass"] == 2
+
+    def test_errors_are_not_stored(self, wrapper, upstream_calls, result_cache):
+        client = wrapper(lambda r: httpx.Response(500, json={"error": "boom"}))
+        post(client, b'{"session_id": "s1"}', path="/api/planning")
+        post(client, b'{"session_id": "s1"}', path="/api/planning")
+        assert len(upstream_calls) == 2
+
+    def test_streaming_requests_are_forwarded(self, wrapper, upstream_calls, result_cache):
+        client = wrapper(lambda r: httpx.Response(200, content=b'{"done": true}\n'))
+        for _ in range(2):
+            post(client, b'{"session_id": "s1", "stream": true}')
+        assert len(upstream_calls) == 2
+        assert result_cache.snapshot()["entries"] == 0
@@ -0,0 +1,302 @@
+"""Tests for resumable NDJSON streams."""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import main
+from relay import StreamStats
+from resume import EventsExpired, ResumeStore, StreamBuffer, follow
+
+
+def lines(n, size=10):
+    return [(b"%d" % i).ljust(size - 1, b".") + b"\n" for i in range(1, n + 1)]
+
+
+async def collect(iterator):
+    return b"".join([chunk async for chunk in iterator])
+
+
+class TestStreamBuffer:
+    def test_replay_after_last_event(self):
+        buffer = StreamBuffer("s", "t1", "t1__s1", max_bytes=1000)
+        for line in lines(5):
+            buffer.append(line)
+        buffer.finish()
+
+        assert asyncio.run(collect(buffer.replay(0))) == b"".join(lines(5))
+        assert asyncio.run(collect(buffer.replay(3))) == b"".join(lines(5)[3:])
+        assert asyncio.run(collect(buffer.replay(5))) == b""
+
+    def test_ring_buffer_is_byte_capped(self):
+        buffer = StreamBuffer("s", "t1", "t1__s1", max_bytes=30)
+        for line in lines(10):
+            buffer.append(line)
+        buffer.finish()
+
+        assert buffer.size == 30
+        assert buffer.first_id == 8
+        assert asyncio.run(collect(buffer.replay(7))) == b"".join(lines(10)[7:])
+        with pytest.raises(EventsExpired):
+            asyncio.run(collect(buffer.replay(2)))
+
+    def test_live_follow(self):
+        buffer = StreamBuffer("s", "t1", "t1__s1", max_bytes=1000)
+
+        async def produce():
+            for line in lines(3):
+                await asyncio.sleep(0.005)
+                buffer.append(line)
+            buffer.finish()
+
+        async def run():
+            producer = asyncio.create_task(produce())
+            out = await collect(buffer.replay(0))
+            await producer
+            return out
+
+        assert asyncio.run(run()) == b"".join(lines(3))
+
+    def test_leaving_early_counts_as_detached(self):
+        buffer = StreamBuffer("s", "t1", "t1__s1", max_bytes=1000)
+        buffer.append(b"a\n")
+        stats = StreamStats()
+
+        async def run():
+            stream = follow(buffer, 0, "t1", stats=stats)
+            await stream.__anext__()
+            await stream.aclose()
+
+        asyncio.run(run())
+        assert stats.snapshot()["t1"]["detached"] == 1
+
+
+    def test_attached_client_applies_backpressure(self):
+        buffer = StreamBuffer("s", "t1", "t1__s1", max_bytes=30)
+
+        async def run():
+            stream = follow(buffer, 0, "t1", stats=StreamStats())
+
+            async def drain():
+                for line in lines(10):
+                    await buffer.put(line)
+                buffer.finish()
+
+            producer = asyncio.create_task(drain())
+            await asyncio.sleep(0.01)
+            queued = buffer.next_id - 1
+            out = await collect(stream)
+            await producer
+            return queued, out
+
+        queued, out = asyncio.run(run())
+        assert queued == 3
+        assert out == b"".join(lines(10))
+
+    def test_disconnect_unpins_and_drain_continues(self):
+        buffer = StreamBuffer("s", "t1", "t1__s1", max_bytes=30)
+        stats = StreamStats()
+
+        async def run():
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+
+            stream = follow(buffer, 0, "t1", receive, stats=stats)
+            await buffer.put(lines(1)[0])
+            await stream.__anext__()
+            disconnected.set()
+            await asyncio.sleep(0)
+            for line in lines(10)[1:]:
+                await asyncio.wait_for(buffer.put(line), 1)
+            buffer.finish()
+
+        asyncio.run(run())
+        assert buffer.pinned is None
+        assert buffer.first_id == 8
+        assert stats.snapshot()["t1"]["detached"] == 1
+
+
+class TestResumeStore:
+    def test_drain_numbers_lines_across_chunks(self):
+        store = ResumeStore(buffer_bytes=1000, max_bytes=10_000, ttl=60)
+        closed = []
+
+        async def chunks():
+            for chunk in (b'{"a":1}\n{"b"', b':2}\n', b'{"c":3}'):
+                yield chunk
+
+        async def close():
+            closed.append(True)
+
+        async def run():
+            buffer = store.open("t1", "t1__s1")
+            store.start(buffer, chunks(), close)
+            await buffer.task
+            return buffer
+
+        buffer = asyncio.run(run())
+        assert [event_id for event_id, _ in buffer.events] == [1, 2, 3]
+        assert buffer.events[1][1] == b'{"b":2}\n'
+        assert buffer.done and closed == [True]
+
+    def test_lookup_is_scoped_to_the_session(self):
+        store = ResumeStore(buffer_bytes=1000, max_bytes=10_000, ttl=60)
+        buffer = store.open("t1", "t1__s1")
+
+        assert store.get("t1__s1") is buffer
+        assert store.get("t1__s1", buffer.stream_id) is buffer
+        assert store.get("t2__s1") is None
+        assert store.get("t2__s1", buffer.stream_id) is None
+
+    def test_finished_buffers_expire(self):
+        store = ResumeStore(buffer_bytes=1000, max_bytes=10_000, ttl=0.01)
+        buffer = store.open("t1", "t1__s1")
+        buffer.finish()
+        time.sleep(0.02)
+        assert store.get("t1__s1") is None
+
+    def test_total_cap_evicts_oldest_finished(self):
+        store = ResumeStore(buffer_bytes=100, max_bytes=150, ttl=60)
+        first = store.open("t1", "t1__s1")
+        for line in lines(10):
+            first.append(line)
+        first.finish()
+        second = store.open("t1", "t1__s2")
+        for line in lines(10):
+            second.append(line)
+        store._enforce_total()
+
+        assert store.get("t1__s1") is None
+        assert store.get("t1__s2") is second
+
+
+    def test_live_streams_are_capped_in_total(self):
+        store = ResumeStore(buffer_bytes=100, max_bytes=250, ttl=60)
+        first = store.open("t1", "t1__s1")
+        assert store.open("t1", "t1__s2") is not None
+        # Two live buffers reserve 200 bytes; a third would go over
+        assert store.open("t1", "t1__s3") is None
+
+        first.append(lines(1)[0])
+        first.finish()
+        assert store.open("t1", "t1__s3") is not None
+        assert store.get("t1__s1") is first
+        assert store.open("t1", "t1__s4") is None
+
+    def test_detached_stream_stops_after_grace(self):
+        store = ResumeStore(buffer_bytes=1000, max_bytes=10_000, ttl=60, grace=0.05)
+        closed = []
+
+        async def endless():
+            while True:
+                yield b'{"token": 1}\n'
+                await asyncio.sleep(0.005)
+
+        async def close():
+            closed.append(True)
+
+        async def receive():
+            await asyncio.sleep(0.02)
+            return {"type": "http.disconnect"}
+
+        async def never():
+            await asyncio.Event().wait()
+
+        async def run():
+            buffer = store.open("t1", "t1__s1")
+            store.start(buffer, endless(), close)
+            first = follow(buffer, 0, "t1", receive, stats=StreamStats())
+            await first.__anext__()
+            await asyncio.sleep(0.04)
+            # Reattached within the grace period: keeps reading
+            second = follow(buffer, buffer.next_id - 1, "t1", never, stats=StreamStats())
+            await second.__anext__()
+            await asyncio.sleep(0.1)
+            assert not buffer.done
+            await first.aclose()
+            await second.aclose()
+            await asyncio.gather(buffer.task, return_exceptions=True)
+            return buffer
+
+        buffer = asyncio.run(asyncio.wait_for(run(), 5))
+        assert buffer.done and buffer.error == "cancelled"
+        assert closed == [True]
+        assert store.get("t1__s1") is buffer
+
+
+class TestWrapperResume:
+    @pytest.fixture
+    def store(self, monkeypatch):
+        store = ResumeStore(buffer_bytes=64 * 1024, max_bytes=1024 * 1024, ttl=60)
+        monkeypatch.setattr(main, "resume_store", store)
+        return store
+
+    def test_resume_after_last_event(self, wrapper, store, upstream_calls):
+        upstream_body = b"".join(
+            b'{"session_id": "t1__s1", "token": "%d"}\n' % i for i in range(1, 6)
+        )
+        client = wrapper(lambda r: httpx.Response(200, content=upstream_body))
+        headers = {"X-Tenant-ID": "t1", "X-Stream-Resumable": "1"}
+
+        async def run():
+            first = await client.post(
+                "/api/chat", json={"session_id": "s1", "stream": True}, headers=headers,
+            )
+            resumed = await client.get(
+                "/api/sessions/s1/stream", params={"last_event_id": 3}, headers=headers,
+            )
+            by_header = await client.get(
+                "/api/sessions/s1/stream",
+                headers={**headers, "Last-Event-ID": "4"},
+            )
+            other = await client.get(
+                "/api/sessions/s1/stream", headers={"X-Tenant-ID": "t2"},
+            )
+            return first, resumed, by_header, other
+
+        first, resumed, by_header, other = asyncio.run(run())
+
+        events = first.content.splitlines()
+        assert len(events) == 5
+        assert events[0] == b'{"session_id": "s1", "token": "1"}'
+        assert first.headers["x-stream-id"] == resumed.headers["x-stream-id"]
+        assert resumed.content.splitlines() == events[3:]
+        assert by_header.content.splitlines() == events[4:]
+        assert other.status_code == 404
+        assert len(upstream_calls) == 1
+
+    def test_expired_events_are_gone(self, wrapper, store):
+        store.buffer_bytes = 40
+        body = b"".join(b'{"token": "%d"}\n' % i for i in range(10))
+        client = wrapper(lambda r: httpx.Response(200, content=body))
+        headers = {"X-Tenant-ID": "t1", "X-Stream-Resumable": "true"}
+
+        async def run():
+            await client.post("/api/chat", json={"session_id": "s1", "stream": True}, headers=headers)
+            return await client.get("/api/sessions/s1/stream?last_event_id=1", headers=headers)
+
+        assert asyncio.run(run()).status_code == 410
+
+    def test_falls_back_to_plain_stream_when_full(self, wrapper, store):
+        store.max_bytes = store.buffer_bytes - 1
+        client = wrapper(lambda r: httpx.Response(200, content=b'{"token": "1"}\n'))
+        resp = asyncio.run(client.post(
+            "/api/chat", json={"session_id": "s1", "stream": True},
+            headers={"X-Tenant-ID": "t1", "X-Stream-Resumable": "1"},
+        ))
+        assert resp.content == b'{"token": "1"}\n'
+        assert "x-stream-id" not in resp.headers
+        assert store.snapshot()["streams"] == 0
+
+    def test_not_resumable_without_header(self, wrapper, store):
+        client = wrapper(lambda r: httpx.Response(200, content=b'{"token": "1"}\n'))
+        resp = asyncio.run(client.post(
+            "/api/chat", json={"session_id": "s1", "stream": True}, headers={"X-Tenant-ID": "t1"},
+        ))
+        assert "x-stream-id" not in resp.headers
+        assert store.snapshot()["streams"] == 0
@@ -0,0 +1,107 @@
+"""Tests for session id rewriting."""
+
+import asyncio
+import json
+
+import httpx
+
+from rewrite import (
+    NDJSONSessionRewriter,
+    extract_original_session_id,
+    rewrite_response_data,
+    rewrite_session_id,
+)
+
+
+def run_stream(chunks, tenant="acme"):
+    rewriter = NDJSONSessionRewriter(tenant)
+    out = b"".join(rewriter.feed(chunk) for chunk in chunks)
+    return out + rewriter.flush()
+
+
+class TestSessionIds:
+    def test_rewrite_adds_prefix_once(self):
+        assert rewrite_session_id("s1", "acme") == "acme__s1"
+        assert rewrite_session_id("acme__s1", "acme") == "acme__s1"
+        assert rewrite_session_id("", "acme") == ""
+
+    def test_extract_strips_own_prefix_only(self):
+        assert extract_original_session_id("acme__s1", "acme") == "s1"
+        assert extract_original_session_id("other__s1", "acme") == "other__s1"
+
+    def test_rewrite_response_data(self):
+        data = {"session_id": "acme__a", "sessionId": "acme__b", "sid": "acme__c", "x": "acme__d"}
+        assert rewrite_response_data(data, "acme") == {
+            "session_id": "a", "sessionId": "b", "sid": "c", "x": "acme__d",
+        }
+
+
+class TestNDJSONSessionRewriter:
+    def test_passthrough_without_prefix_is_untouched(self):
+        chunk = b'{"token": "hi",  "n": 1}\n{"token": "there"}\n'
+        rewriter = NDJSONSessionRewriter("acme")
+        assert rewriter.feed(chunk) is chunk
+
+    def test_strips_session_fields_preserving_bytes(self):
+        line = b'{"session_id":"acme__s1", "sid" : "acme__s2", "token":"\xe4\xbd\xa0"}\n'
+        assert run_stream([line]) == b'{"session_id":"s1", "sid" : "s2", "token":"\xe4\xbd\xa0"}\n'
+
+    def test_other_tenants_prefix_is_kept(self):
+        line = b'{"session_id": "other__s1"}\n'
+        assert run_stream([line]) == line
+
+    def test_non_session_values_are_kept(self):
+        line = b'{"session_id": "acme__s1", "text": "acme__s1"}\n'
+        out = run_stream([line])
+        assert json.loads(out) == {"session_id": "s1", "text": "acme__s1"}
+
+    def test_every_split_point(self):
+        stream = (
+            '{"session_id": "acme__s1", "token": "你好"}\n'
+            '{"sessionId": "acme__s1", "token": "世界"}\n'
+            '{"done": true}'
+        ).encode("utf-8")
+        expected = stream.replace(b"acme__", b"")
+
+        for i in range(len(stream) + 1):
+            for j in range(i, len(stream) + 1):
+                assert run_stream([stream[:i], stream[i:j], stream[j:]]) == expected
+
+    def test_lines_are_emitted_only_when_complete(self):
+        rewriter = NDJSONSessionRewriter("acme")
+        assert rewriter.feed(b'{"session_id": "ac') == b""
+        assert rewriter.feed(b'me__s1"}\n{"a"') == b'{"session_id": "s1"}\n'
+        assert rewriter.flush() == b'{"a"'
+
+    def test_escaped_key_falls_back_to_json(self):
+        line = b'{"s\\u0069d": "acme__s1", "token": "x"}\n'
+        out = run_stream([line])
+        assert json.loads(out) == {"sid": "s1", "token": "x"}
+        assert out.endswith(b"\n")
+
+    def test_invalid_json_with_prefix_is_passed_through(self):
+        line = b'not json "acme__s1"\n'
+        assert run_stream([line]) == line
+
+    def test_runaway_line_is_not_buffered_forever(self):
+        rewriter = NDJSONSessionRewriter("acme", max_line_bytes=8)
+        assert rewriter.feed(b"0123456789") == b"0123456789"
+        assert rewriter.flush() == b""
+
+
+class TestStreamingProxy:
+    def test_streamed_chat_is_rewritten_across_chunks(self, wrapper):
+        payload = b'{"session_id": "acme__s1", "token": "\xe4\xbd\xa0"}\n{"done": true}\n'
+        chunks = [payload[:20], payload[20:31], payload[31:]]
+
+        class Upstream(httpx.AsyncByteStream):
+            async def __aiter__(self):
+                for chunk in chunks:
+                    yield chunk
+
+        client = wrapper(lambda r: httpx.Response(200, stream=Upstream()))
+        resp = asyncio.run(client.post(
+            "/api/chat", json={"stream": True, "session_id": "s1"},
+            headers={"X-Tenant-ID": "acme"},
+        ))
+        assert resp.content == payload.replace(b"acme__", b"")
@@ -0,0 +1,147 @@
+"""Tests for the multi-worker launcher and cross-worker metrics."""
+
+import asyncio
+import json
+import os
+import time
+from dataclasses import replace
+
+import httpx
+import pytest
+
+import main
+import server
+from config import config
+from server import WorkerMetrics, aggregate, uvicorn_options
+
+
+class TestAggregate:
+    def test_sums_counters_and_capacities(self):
+        totals = aggregate([
+            {"scheduler": {"running": 2, "max_concurrent": 64}},
+            {"scheduler": {"running": 1, "max_concurrent": 64}},
+        ])
+        assert totals == {"scheduler": {"running": 3, "max_concurrent": 128}}
+
+    def test_nested_and_missing_keys(self):
+        totals = aggregate([
+            {"streams": {"t1": {"started": 2}}},
+            {"streams": {"t1": {"started": 1, "abandoned": 1}, "t2": {"started": 4}}},
+        ])
+        assert totals == {
+            "streams": {"t1": {"started": 3, "abandoned": 1}, "t2": {"started": 4}},
+        }
+
+    def test_max_and_dropped_keys(self):
+        totals = aggregate([
+            {"cache": {"hits": 3, "hit_ratio": 0.75}, "t": {"wait_max_ms": 5.0, "wait_avg_ms": 1.0}},
+            {"cache": {"hits": 1, "hit_ratio": 0.5}, "t": {"wait_max_ms": 9.0, "wait_avg_ms": 2.0}},
+        ])
+        assert totals == {"cache": {"hits": 4}, "t": {"wait_max_ms": 9.0}}
+
+    def test_shared_sections_are_not_double_counted(self):
+        snapshot = {"result_cache": {
+            "entries": 10, "bytes": 500, "evictions": 3, "tenants": {"t1": {"hit": 2}},
+        }}
+        totals = aggregate([snapshot, snapshot])
+        assert totals == {"result_cache": {
+            "entries": 10, "bytes": 500, "evictions": 6, "tenants": {"t1": {"hit": 4}},
+        }}
+
+    def test_non_numbers_come_from_first_worker(self):
+        totals = aggregate([{"rules": {"*": "5/s"}, "ok": True}, {"rules": {"*": "5/s"}, "ok": False}])
+        assert totals == {"rules": {"*": "5/s"}, "ok": True}
+
+
+class TestWorkerMetrics:
+    def test_disabled_for_one_worker(self, tmp_path):
+        cfg = replace(config, workers=1, worker_metrics_dir=str(tmp_path))
+        assert not WorkerMetrics.from_config(cfg).enabled
+        assert WorkerMetrics.from_config(replace(cfg, workers=4)).enabled
+
+    def test_publish_and_collect(self, tmp_path):
+        metrics = WorkerMetrics(str(tmp_path))
+        metrics.publish({"streams": {"t1": {"started": 1}}})
+        assert metrics.collect() == {os.getpid(): {"streams": {"t1": {"started": 1}}}}
+        # The live snapshot replaces this worker's published copy
+        assert metrics.collect(current={"x": 2}) == {os.getpid(): {"x": 2}}
+
+    def test_skips_dead_and_stale_workers(self, tmp_path):
+        metrics = WorkerMetrics(str(tmp_path), interval=1)
+        dead = tmp_path / "999999999.json"
+        dead.write_text(json.dumps({"x": 1}))
+        stale = tmp_path / f"{os.getppid()}.json"
+        stale.write_text(json.dumps({"x": 1}))
+        old = time.time() - 10
+        os.utime(stale, (old, old))
+        (tmp_path / "garbage.json").write_text("{")
+
+        assert metrics.collect() == {}
+
+    def test_reset_clears_previous_run(self, tmp_path):
+        (tmp_path / "123.json").write_text("{}")
+        WorkerMetrics(str(tmp_path)).reset()
+        assert list(tmp_path.iterdir()) == []
+
+    def test_task_publishes_and_cleans_up(self, tmp_path):
+        metrics = WorkerMetrics(str(tmp_path), interval=0.01)
+        path = tmp_path / f"{os.getpid()}.json"
+
+        async def go():
+            metrics.start(lambda: {"n": 1})
+            await asyncio.sleep(0.05)
+            assert json.loads(path.read_text()) == {"n": 1}
+            await metrics.stop()
+
+        asyncio.run(go())
+        assert not path.exists()
+
+
+class TestLauncher:
+    def test_options_come_from_config(self):
+        cfg = replace(config, workers=4, drain_timeout=45, host="127.0.0.1", port=9000)
+        options = uvicorn_options(cfg)
+        assert options["workers"] == 4
+        assert options["timeout_graceful_shutdown"] == 45
+        assert (options["host"], options["port"]) == ("127.0.0.1", 9000)
+        assert options["loop"] in ("uvloop", "asyncio")
+        assert options["http"] in ("httptools", "h11")
+
+    def test_zero_drain_waits_indefinitely(self):
+        assert uvicorn_options(replace(config, drain_timeout=0))["timeout_graceful_shutdown"] is None
+
+    @pytest.mark.parametrize("fast_path, target", [(False, "main:app"), (True, "fastpath:app")])
+    def test_run(self, monkeypatch, tmp_path, fast_path, target):
+        import uvicorn
+
+        calls = []
+        monkeypatch.setattr(uvicorn, "run", lambda app, **options: calls.append((app, options)))
+        monkeypatch.setattr(server, "worker_metrics", WorkerMetrics(str(tmp_path)))
+        (tmp_path / "1.json").write_text("{}")
+
+        server.run(replace(config, workers=2, fast_path=fast_path))
+
+        assert calls[0][0] == target
+        assert calls[0][1]["workers"] == 2
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestWorkersEndpoint:
+    def test_includes_other_workers(self, wrapper, monkeypatch, tmp_path):
+        metrics = WorkerMetrics(str(tmp_path))
+        monkeypatch.setattr(main, "worker_metrics", metrics)
+        client = wrapper(lambda r: httpx.Response(200))
+        other = main.worker_snapshot(main.app)
+        other["health"]["scheduler"]["running"] = 3
+        (tmp_path / f"{os.getppid()}.json").write_text(json.dumps(other))
+
+        body = asyncio.run(client.get("/health/workers")).json()
+
+        assert body["workers"] == 2
+        assert body["pids"] == sorted([os.getpid(), os.getppid()])
+        assert body["totals"]["scheduler"]["running"] == 3
+        assert body["totals"]["scheduler"]["max_concurrent"] == 2 * config.scheduler_max_concurrent
+
+    def test_health_names_the_worker(self, wrapper):
+        client = wrapper(lambda r: httpx.Response(200))
+        assert asyncio.run(client.get("/health")).json()["worker"] == os.getpid()
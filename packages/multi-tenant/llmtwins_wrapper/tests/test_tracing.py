@@ -0,0 +1,205 @@
+"""Tests for W3C trace context propagation and spans."""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import main
+from tracing import FileExporter, Tracer, create_exporter, parse_traceparent, register_exporter
+from upstream import UpstreamTrace
+
+PARENT = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    """Turn on the shared tracer with an in-memory exporter"""
+    exporter = ListExporter()
+    monkeypatch.setattr(main.tracer, "exporter", exporter)
+    yield exporter
+    main.tracer.flush()
+
+
+def spans_of(exporter):
+    main.tracer.flush()
+    return {s["name"]: s for s in exporter.spans}
+
+
+class TestTraceparent:
+    def test_parses_valid_headers(self):
+        assert parse_traceparent(PARENT) == (
+            "0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331", 1,
+        )
+
+    @pytest.mark.parametrize("value", [
+        None,
+        "",
+        "garbage",
+        "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331",
+        "ff-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01",
+        "00-00000000000000000000000000000000-b7ad6b7169203331-01",
+        "00-0af7651916cd43dd8448eb211c80319c-0000000000000000-01",
+        "00-0AF7651916CD43DD8448EB211C80319C-b7ad6b7169203331-01",
+        "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01-extra",
+    ])
+    def test_rejects_invalid_headers(self, value):
+        assert parse_traceparent(value) is None
+
+    def test_future_versions_may_append_fields(self):
+        assert parse_traceparent(
+            "01-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01-extra"
+        ) is not None
+
+    def test_continues_an_incoming_trace(self):
+        trace = Tracer(ListExporter()).start_trace(PARENT)
+        trace_id, span_id, flags = parse_traceparent(trace.traceparent())
+        assert trace_id == "0af7651916cd43dd8448eb211c80319c"
+        assert span_id != "b7ad6b7169203331"
+        assert flags == 1
+
+    def test_sampling_is_parent_based(self):
+        tracer = Tracer(ListExporter(), sample_rate=0.0)
+        assert not tracer.start_trace(None).sampled
+        assert tracer.start_trace(PARENT).sampled
+        assert not Tracer(ListExporter()).start_trace(PARENT[:-2] + "00").sampled
+
+
+class TestExporters:
+    def test_file_exporter(self, tmp_path):
+        exporter = create_exporter(f"file://{tmp_path}/spans.jsonl")
+        assert isinstance(exporter, FileExporter)
+        exporter.export([{"name": "a"}, {"name": "b"}])
+        exporter.close()
+        lines = (tmp_path / "spans.jsonl").read_text().splitlines()
+        assert [json.loads(line)["name"] for line in lines] == ["a", "b"]
+
+    def test_registered_scheme(self):
+        register_exporter("memory", lambda url: ListExporter())
+        assert isinstance(create_exporter("memory://"), ListExporter)
+
+    def test_unknown_scheme(self):
+        with pytest.raises(ValueError):
+            create_exporter("kafka://broker:9092")
+
+    def test_queue_is_bounded(self):
+        tracer = Tracer(ListExporter(), max_queue=1)
+        for _ in range(3):
+            trace = tracer.start_trace(None)
+            trace.add("x", 0.0, 1.0)
+            tracer.finish(trace)
+        assert tracer.snapshot()["dropped"] == 2
+
+
+class TestPropagation:
+    def test_forwards_a_child_of_the_incoming_parent(self, wrapper, upstream_calls, exporter):
+        client = wrapper(lambda r: httpx.Response(200, json={"ok": True}))
+        resp = asyncio.run(client.post(
+            "/api/chat", json={}, headers={"X-Tenant-ID": "t1", "traceparent": PARENT},
+        ))
+        assert resp.status_code == 200
+
+        trace_id, parent_id, flags = parse_traceparent(upstream_calls[0].headers["traceparent"])
+        assert trace_id == "0af7651916cd43dd8448eb211c80319c"
+        assert flags == 1
+
+        spans = spans_of(exporter)
+        root = spans["wrapper.request"]
+        assert root["span_id"] == parent_id
+        assert root["parent_id"] == "b7ad6b7169203331"
+        assert root["attributes"] == {
+            "method": "POST", "route": "/api/chat", "status": 200, "tenant": "t1",
+        }
+        for name in ("tenant.resolve", "scheduler.queue"):
+            assert spans[name]["parent_id"] == parent_id
+            assert spans[name]["attributes"]["tenant"] == "t1"
+            assert spans[name]["service"] == "llmtwins-wrapper"
+
+    def test_starts_a_trace_without_a_parent(self, wrapper, upstream_calls, exporter):
+        client = wrapper(lambda r: httpx.Response(200))
+        asyncio.run(client.post("/api/chat", json={}, headers={"X-Tenant-ID": "t1"}))
+
+        assert parse_traceparent(upstream_calls[0].headers["traceparent"]) is not None
+        assert spans_of(exporter)["wrapper.request"]["parent_id"] is None
+
+    def test_unsampled_requests_export_nothing(self, wrapper, upstream_calls, exporter):
+        client = wrapper(lambda r: httpx.Response(200))
+        asyncio.run(client.post(
+            "/api/chat", json={}, headers={"X-Tenant-ID": "t1", "traceparent": PARENT[:-2] + "00"},
+        ))
+        assert upstream_calls[0].headers["traceparent"].endswith("-00")
+        assert spans_of(exporter) == {}
+
+    def test_rejected_tenant_span_has_the_error(self, wrapper, exporter, monkeypatch):
+        monkeypatch.setattr(main.config, "valid_tenants", {"t1"})
+        client = wrapper(lambda r: httpx.Response(200))
+        asyncio.run(client.post("/api/chat", json={}, headers={"X-Tenant-ID": "evil"}))
+
+        spans = spans_of(exporter)
+        assert spans["tenant.resolve"]["attributes"]["error"] == "HTTPException"
+        assert spans["wrapper.request"]["attributes"]["status"] == 403
+
+    def test_disabled_passes_the_header_through(self, wrapper, upstream_calls):
+        assert not main.tracer.enabled
+        client = wrapper(lambda r: httpx.Response(200))
+        asyncio.run(client.post(
+            "/api/chat", json={}, headers={"X-Tenant-ID": "t1", "traceparent": PARENT},
+        ))
+        assert upstream_calls[0].headers["traceparent"] == PARENT
+
+
+class TestUpstreamTrace:
+    def test_connect_and_first_byte_spans(self):
+        trace = Tracer(ListExporter()).start_trace(None)
+        events = UpstreamTrace(trace=trace)
+
+        async def go():
+            for event in (
+                "connection.connect_tcp.started",
+                "connection.connect_tcp.complete",
+                "connection.start_tls.started",
+                "connection.start_tls.complete",
+                "http11.send_request_headers.started",
+                "http11.send_request_headers.complete",
+                "http11.receive_response_headers.started",
+                "http11.receive_response_headers.complete",
+            ):
+                await events(event, {})
+
+        asyncio.run(go())
+        assert [(s["name"], s["attributes"]) for s in trace.spans] == [
+            ("upstream.connect", {"tls": True}),
+            ("upstream.first_byte", {}),
+        ]
+
+    def test_reused_connection_has_no_connect_span(self):
+        trace = Tracer(ListExporter()).start_trace(None)
+        events = UpstreamTrace(trace=trace)
+
+        async def go():
+            await events("http11.send_request_headers.started", {})
+            await events("http11.receive_response_headers.complete", {})
+
+        asyncio.run(go())
+        assert [s["name"] for s in trace.spans] == ["upstream.first_byte"]
+
+    def test_failed_connect(self):
+        trace = Tracer(ListExporter()).start_trace(None)
+        events = UpstreamTrace(trace=trace)
+
+        async def go():
+            await events("connection.connect_tcp.started", {})
+            await events("connection.connect_tcp.failed", {})
+
+        asyncio.run(go())
+        [connect] = trace.spans
+        assert connect["attributes"] == {"error": "connection.connect_tcp.failed"}
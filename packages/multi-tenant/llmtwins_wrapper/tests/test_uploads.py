@@ -0,0 +1,199 @@
+"""Tests for bounded-memory upload forwarding."""
+
+import asyncio
+import resource
+import time
+import tracemalloc
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import main
+import uploads
+from conftest import as_network_response
+from config import config
+from tracing import parse_traceparent
+from uploads import UploadLimiter, upload_limiter
+
+CHUNK = 64 * 1024
+
+
+class CountingUpstream(httpx.AsyncBaseTransport):
+    """Fake LLMTwins that consumes upload bodies chunk by chunk"""
+
+    def __init__(self):
+        self.received = []
+
+    async def handle_async_request(self, request):
+        size = 0
+        async for chunk in request.stream:
+            size += len(chunk)
+        self.received.append((request, size))
+        return as_network_response(
+            httpx.Response(200, json={"session_id": "acme__s1", "bytes": size})
+        )
+
+
+class HeldResponse(httpx.AsyncByteStream):
+    """Response body that records what is still held while it is read"""
+
+    def __init__(self):
+        self.held = []
+
+    async def __aiter__(self):
+        self.held.append((upload_limiter.active("acme"), sum(main.upstreams.snapshot().values())))
+        yield b'{"session_id": "acme__s1"}'
+
+
+class HeldUpstream(CountingUpstream):
+    def __init__(self):
+        super().__init__()
+        self.body = HeldResponse()
+
+    async def handle_async_request(self, request):
+        async for _ in request.stream:
+            pass
+        self.received.append((request, None))
+        return httpx.Response(200, headers={"content-type": "application/json"}, stream=self.body)
+
+
+class NullExporter:
+    def export(self, spans):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    transport = CountingUpstream()
+    main.app.state.http_client = httpx.AsyncClient(transport=transport)
+    yield transport
+    main.app.state.http_client = None
+
+
+def wrapper_client():
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://wrapper")
+
+
+async def body(size):
+    sent = 0
+    while sent < size:
+        n = min(CHUNK, size - sent)
+        sent += n
+        yield b"x" * n
+
+
+async def upload(client, size, declare=True, tenant="acme"):
+    headers = {"X-Tenant-ID": tenant, "Content-Type": "multipart/form-data; boundary=b"}
+    if declare:
+        headers["Content-Length"] = str(size)
+    return await client.post("/api/sessions/s1/upload", content=body(size), headers=headers)
+
+
+class TestUploadLimiter:
+    def test_per_tenant_limit(self, monkeypatch):
+        monkeypatch.setattr(config, "upload_max_concurrent", 1)
+        monkeypatch.setattr(config, "upload_max_concurrent_per_tenant", {"big": 2})
+        limiter = UploadLimiter()
+        assert limiter.try_acquire("acme")
+        assert not limiter.try_acquire("acme")
+        assert limiter.try_acquire("big") and limiter.try_acquire("big")
+        limiter.release("acme")
+        assert limiter.active("acme") == 0
+        assert limiter.try_acquire("acme")
+
+
+class TestUploadProxy:
+    def test_sized_upload_streams_straight_through(self, upstream):
+        resp = asyncio.run(upload(wrapper_client(), 1_000_000))
+        assert resp.status_code == 200
+        assert resp.json()["session_id"] == "s1"
+        request, size = upstream.received[0]
+        assert size == 1_000_000
+        assert request.headers["content-length"] == "1000000"
+        assert request.url.path == "/api/sessions/acme__s1/upload"
+
+    def test_unsized_upload_is_spooled_with_length(self, upstream, monkeypatch, tmp_path):
+        monkeypatch.setattr(config, "upload_spool_threshold", 100_000)
+        monkeypatch.setattr(config, "upload_spool_dir", str(tmp_path))
+        resp = asyncio.run(upload(wrapper_client(), 500_000, declare=False))
+        assert resp.status_code == 200
+        request, size = upstream.received[0]
+        assert size == 500_000
+        assert request.headers["content-length"] == "500000"
+        assert list(tmp_path.iterdir()) == []
+
+    def test_declared_size_over_limit_is_rejected(self, upstream, monkeypatch):
+        monkeypatch.setattr(config, "upload_max_bytes_per_tenant", {"acme": 1000})
+        resp = asyncio.run(upload(wrapper_client(), 5000))
+        assert resp.status_code == 413
+        assert upstream.received == []
+
+    def test_unsized_body_over_limit_is_rejected(self, upstream, monkeypatch):
+        monkeypatch.setattr(config, "upload_max_bytes", 100_000)
+        resp = asyncio.run(upload(wrapper_client(), 300_000, declare=False))
+        assert resp.status_code == 413
+        assert upstream.received == []
+
+    def test_concurrent_upload_limit(self, upstream, monkeypatch):
+        monkeypatch.setattr(config, "upload_max_concurrent", 0)
+        resp = asyncio.run(upload(wrapper_client(), 10))
+        assert resp.status_code == 429
+        assert resp.headers["retry-after"] == "1"
+
+    def test_slots_are_held_until_the_response_is_read(self, monkeypatch):
+        transport = HeldUpstream()
+        monkeypatch.setattr(main.app.state, "http_client", httpx.AsyncClient(transport=transport))
+        monkeypatch.setattr(main.tracer, "exporter", NullExporter())
+
+        resp = asyncio.run(upload(wrapper_client(), 1000))
+        assert resp.json() == {"session_id": "s1"}
+        assert transport.body.held == [(1, 1)]
+        assert upload_limiter.active("acme") == 0
+        assert sum(main.upstreams.snapshot().values()) == 0
+
+        request, _ = transport.received[0]
+        assert request.headers["x-tenant-wrapper"] == "true"
+        assert parse_traceparent(request.headers["traceparent"]) is not None
+
+    def test_spool_is_closed_when_the_upload_fails_first(self, upstream, monkeypatch, tmp_path):
+        monkeypatch.setattr(config, "upload_spool_threshold", 100)
+        monkeypatch.setattr(config, "upload_spool_dir", str(tmp_path))
+        closed = []
+        monkeypatch.setattr(uploads._SpooledBody, "close", lambda self: closed.append(self))
+
+        async def refuse(tenant, endpoint_class):
+            raise HTTPException(status_code=503, detail="queue full")
+
+        monkeypatch.setattr(main.scheduler, "acquire", refuse)
+        resp = asyncio.run(upload(wrapper_client(), 5000, declare=False))
+        assert resp.status_code == 503
+        assert len(closed) == 1
+        assert upstream.received == []
+        assert upload_limiter.active("acme") == 0
+
+    def test_parallel_upload_throughput_and_memory(self, upstream, monkeypatch):
+        """Ten parallel 8 MiB uploads must not hold their bodies in memory"""
+        monkeypatch.setattr(config, "upload_max_concurrent", 10)
+        uploads, size = 10, 8 * 1024 * 1024
+
+        async def run():
+            client = wrapper_client()
+            return await asyncio.gather(*(upload(client, size) for _ in range(uploads)))
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        responses = asyncio.run(run())
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        assert all(r.status_code == 200 for r in responses)
+        total = uploads * size
+        print(
+            f"\n{uploads} x {size // 2**20} MiB uploads: "
+            f"{total / elapsed / 2**20:.1f} MiB/s, "
+            f"traced peak {peak / 2**20:.1f} MiB, "
+            f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB"
+        )
+        assert peak < total / 8
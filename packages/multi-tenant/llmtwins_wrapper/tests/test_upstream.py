@@ -0,0 +1,82 @@
+"""Tests for the shared upstream client."""
+
+import asyncio
+from dataclasses import replace
+
+import httpx
+
+import main
+from config import config
+from upstream import build_limits, build_timeout, create_client, pool_stats
+
+
+class TestClientSettings:
+    def test_timeout_defaults_to_upstream_timeout(self):
+        cfg = replace(config, upstream_timeout=42, upstream_read_timeout=None,
+                      upstream_write_timeout=None, upstream_connect_timeout=3)
+        timeout = build_timeout(cfg)
+        assert timeout.read == 42
+        assert timeout.write == 42
+        assert timeout.connect == 3
+
+    def test_timeout_per_phase_override(self):
+        cfg = replace(config, upstream_read_timeout=7.5)
+        assert build_timeout(cfg).read == 7.5
+
+    def test_limits(self):
+        cfg = replace(config, upstream_max_connections=8, upstream_max_keepalive=4)
+        limits = build_limits(cfg)
+        assert limits.max_connections == 8
+        assert limits.max_keepalive_connections == 4
+
+    def test_http2_falls_back_without_h2(self, monkeypatch):
+        monkeypatch.setattr("upstream._http2_available", lambda: False)
+        client = create_client(replace(config, upstream_http2=True))
+        try:
+            assert pool_stats(client)["in_use"] == 0
+        finally:
+            asyncio.run(client.aclose())
+
+
+class TestPoolStats:
+    def test_fresh_client_is_empty(self):
+        client = create_client(replace(config, upstream_max_connections=5))
+        stats = pool_stats(client)
+        asyncio.run(client.aclose())
+        assert stats == {"in_use": 0, "idle": 0, "waiting": 0, "max_connections": 5}
+
+    def test_unknown_transport_reports_zeros(self):
+        client = httpx.AsyncClient(transport=httpx.MockTransport(lambda r: httpx.Response(200)))
+        assert pool_stats(client)["in_use"] == 0
+
+
+class TestSharedClient:
+    def test_lifespan_creates_and_closes_client(self):
+        async def run():
+            async with main.app.router.lifespan_context(main.app):
+                client = main.app.state.http_client
+                assert not client.is_closed
+            return client
+
+        client = asyncio.run(run())
+        assert client.is_closed
+
+    def test_requests_reuse_one_client(self, wrapper, upstream_calls):
+        client = wrapper(lambda r: httpx.Response(200, json={"ok": True}))
+        shared = main.app.state.http_client
+
+        async def run():
+            for _ in range(3):
+                resp = await client.post("/api/chat", json={"stream": False})
+                assert resp.status_code == 200
+            return main.app.state.http_client
+
+        assert asyncio.run(run()) is shared
+        assert len(upstream_calls) == 3
+
+    def test_health_reports_pool(self, wrapper):
+        client = wrapper(lambda r: httpx.Response(200))
+        resp = asyncio.run(client.get("/health"))
+        body = resp.json()
+        assert body["upstream_ok"] is True
+        assert set(body["pool"]) == {"in_use", "idle", "waiting", "max_connections"}
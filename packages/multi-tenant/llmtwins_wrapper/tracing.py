@@ -0,0 +1,361 @@
+# llmtwins_wrapper/tracing.py
+"""
+W3C trace context (``traceparent``) and lightweight spans
+
+The wrapper continues the trace of an incoming ``traceparent`` (from nginx
+or Django) or starts a new one, and forwards its own ``traceparent`` to
+LLMTwins. Spans recorded per request, all tagged with the tenant:
+
+- ``wrapper.request``: the whole request, as seen by the wrapper
+- ``tenant.resolve``: tenant header validation
+- ``scheduler.queue``: waiting for a fair-share upstream slot
+- ``upstream.connect``: TCP (+TLS) connect to LLMTwins, new connections only
+- ``upstream.first_byte``: request sent until LLMTwins' response headers
+
+Sampling is parent-based: an incoming sampled flag is honoured, otherwise
+``TRACE_SAMPLE_RATE`` applies. Finished traces are queued and handed to
+the exporter by a background thread.
+
+With no ``TRACE_EXPORTER`` tracing is off: the middleware is a single
+attribute check and the incoming ``traceparent`` is forwarded as-is.
+"""
+
+import json
+import logging
+import random
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from config import WrapperConfig, config
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = b"traceparent"
+_HEX = frozenset("0123456789abcdef")
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, int]]:
+    """(trace_id, parent_id, flags) of a valid traceparent, else None"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4:
+        return None
+    version, trace_id, parent_id, flags = parts[:4]
+    if len(version) != 2 or version == "ff" or (version == "00" and len(parts) != 4):
+        return None
+    if len(trace_id) != 32 or len(parent_id) != 16 or len(flags) != 2:
+        return None
+    if not _HEX.issuperset(version + trace_id + parent_id + flags):
+        return None
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, int(flags, 16)
+
+
+def _new_id(bits: int) -> str:
+    value = 0
+    while not value:
+        value = random.getrandbits(bits)
+    return f"{value:0{bits // 4}x}"
+
+
+class Trace:
+    """The wrapper's part of one distributed trace"""
+
+    __slots__ = (
+        "trace_id", "parent_id", "span_id", "sampled", "tenant",
+        "_wall", "_perf", "spans",
+    )
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], sampled: bool):
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.span_id = _new_id(64)
+        self.sampled = sampled
+        self.tenant: Optional[str] = None
+        self._wall = time.time()
+        self._perf = time.perf_counter()
+        self.spans: List[Dict[str, object]] = []
+
+    def traceparent(self) -> str:
+        """Header value for calls made on behalf of this request"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def add(
+        self,
+        name: str,
+        start: float,
+        end: float,
+        root: bool = False,
+        **attributes,
+    ) -> None:
+        """
+        Record a span from perf_counter() timestamps.
+
+        Spans are children of the wrapper's span; ``root`` records the
+        wrapper's span itself (child of the incoming parent, if any).
+        """
+        if not self.sampled:
+            return
+        self.spans.append({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id if root else _new_id(64),
+            "parent_id": self.parent_id if root else self.span_id,
+            "name": name,
+            "start": round(self._wall + (start - self._perf), 6),
+            "duration_ms": round(1000 * (end - start), 3),
+            "attributes": attributes,
+        })
+
+
+class _NoSpan:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+_current: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def _timed(trace: Trace, name: str, attributes: dict) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        trace.add(name, started, time.perf_counter(), **attributes)
+
+
+def span(name: str, **attributes):
+    """Time a block as a child span of the current request (no-op if untraced)"""
+    trace = _current.get()
+    if trace is None or not trace.sampled:
+        return _NO_SPAN
+    return _timed(trace, name, attributes)
+
+
+# ============ Exporters ============
+
+class FileExporter:
+    """Appends spans as JSON lines to a local file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", buffering=1 << 16)
+
+    def export(self, spans: List[dict]) -> None:
+        self._file.write("".join(json.dumps(s, separators=(",", ":")) + "\n" for s in spans))
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class UDPExporter:
+    """Sends each span as one JSON datagram (e.g. to a local collector)"""
+
+    def __init__(self, host: str, port: int):
+        self.address = (host, port)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def export(self, spans: List[dict]) -> None:
+        for s in spans:
+            try:
+                self._sock.sendto(json.dumps(s, separators=(",", ":")).encode("utf-8"), self.address)
+            except OSError as e:
+                logger.debug(f"Dropping span: {e}")
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+# scheme -> factory(parsed URL); extend with register_exporter()
+_EXPORTERS: Dict[str, Callable] = {
+    "file": lambda url: FileExporter(url.path),
+    "udp": lambda url: UDPExporter(url.hostname or "127.0.0.1", url.port or 6831),
+}
+
+
+def register_exporter(scheme: str, factory: Callable) -> None:
+    """Make ``scheme://...`` usable in TRACE_EXPORTER; factory gets the parsed URL"""
+    _EXPORTERS[scheme] = factory
+
+
+def create_exporter(spec: str):
+    """Exporter for ``file:///path``, ``udp://host:port`` or a registered scheme"""
+    if not spec:
+        return None
+    url = urlparse(spec)
+    factory = _EXPORTERS.get(url.scheme)
+    if factory is None:
+        raise ValueError(f"Unknown trace exporter: {spec}")
+    return factory(url)
+
+
+# ============ Tracer ============
+
+class Tracer:
+    def __init__(
+        self,
+        exporter=None,
+        sample_rate: float = 1.0,
+        service: str = "llmtwins-wrapper",
+        max_queue: int = 10000,
+        flush_interval: float = 1.0,
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.service = service
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+
+        self._queue: Deque[List[dict]] = deque()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.exported = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_config(cls, cfg: WrapperConfig) -> "Tracer":
+        return cls(
+            exporter=create_exporter(cfg.trace_exporter),
+            sample_rate=cfg.trace_sample_rate,
+            service=cfg.trace_service_name,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def start_trace(self, traceparent: Optional[str]) -> Trace:
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, flags = parent
+            return Trace(trace_id, parent_id, bool(flags & 1))
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        return Trace(_new_id(128), None, sampled)
+
+    def finish(self, trace: Trace) -> None:
+        """Queue a sampled trace's spans for export (never blocks)"""
+        if not trace.sampled or not trace.spans:
+            return
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        for s in trace.spans:
+            s["service"] = self.service
+            if trace.tenant is not None:
+                s["attributes"].setdefault("tenant", trace.tenant)
+        self._queue.append(trace.spans)
+
+    def flush(self) -> int:
+        total = 0
+        while self._queue:
+            spans = self._queue.popleft()
+            try:
+                self.exporter.export(spans)
+            except Exception:
+                logger.exception("Exporting spans failed")
+                continue
+            total += len(spans)
+        self.exported += total
+        return total
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            if self._stopping:
+                return
+
+    def start(self) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "queued": len(self._queue),
+            "exported": self.exported,
+            "dropped": self.dropped,
+        }
+
+
+class TraceMiddleware:
+    """Starts/continues the trace and records ``wrapper.request``"""
+
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        tracer = self.tracer
+        if not tracer.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = tracer.start_trace(_header(scope, TRACEPARENT))
+        token = _current.set(trace)
+        started = time.perf_counter()
+        status = [500]
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            _current.reset(token)
+            trace.add(
+                "wrapper.request",
+                started,
+                time.perf_counter(),
+                root=True,
+                method=scope["method"],
+                route=getattr(scope.get("route"), "path", "unmatched"),
+                status=status[0],
+            )
+            tracer.finish(trace)
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+tracer = Tracer.from_config(config)
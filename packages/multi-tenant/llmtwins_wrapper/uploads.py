@@ -0,0 +1,147 @@
+# llmtwins_wrapper/uploads.py
+"""
+Bounded-memory upload forwarding
+
+Multipart uploads are never read into memory as a whole:
+- sized bodies up to ``upload_spool_threshold`` stream straight from the
+  ASGI receive channel to LLMTwins
+- larger or unsized bodies are spooled to a temp file, then sent with an
+  exact Content-Length
+
+Per-tenant size and concurrency limits are enforced on the way in.
+"""
+
+import asyncio
+import tempfile
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from config import config
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload body exceeds the tenant's size limit"""
+
+
+def max_upload_bytes(tenant: str) -> int:
+    return config.upload_max_bytes_per_tenant.get(tenant, config.upload_max_bytes)
+
+
+def max_concurrent_uploads(tenant: str) -> int:
+    return config.upload_max_concurrent_per_tenant.get(tenant, config.upload_max_concurrent)
+
+
+class UploadLimiter:
+    """Per-tenant concurrent upload counter (non-blocking)"""
+
+    def __init__(self):
+        self._active: Dict[str, int] = defaultdict(int)
+
+    def try_acquire(self, tenant: str) -> bool:
+        if self._active[tenant] >= max_concurrent_uploads(tenant):
+            return False
+        self._active[tenant] += 1
+        return True
+
+    def release(self, tenant: str) -> None:
+        self._active[tenant] -= 1
+        if self._active[tenant] <= 0:
+            del self._active[tenant]
+
+    def active(self, tenant: str) -> int:
+        return self._active.get(tenant, 0)
+
+
+upload_limiter = UploadLimiter()
+
+
+async def _limited(chunks: AsyncIterator[bytes], limit: int) -> AsyncIterator[bytes]:
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        if received > limit:
+            raise UploadTooLarge(f"Upload exceeds {limit} bytes")
+        yield chunk
+
+
+class _SpooledBody:
+    """A spooled upload; the file is removed once read or closed"""
+
+    def __init__(self, spool: tempfile.SpooledTemporaryFile):
+        self._spool = spool
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                chunk = await asyncio.to_thread(self._spool.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._spool.close()
+
+
+def close_upload(content) -> None:
+    """Release an upload body that may never be sent (e.g. the request failed first)"""
+    if isinstance(content, _SpooledBody):
+        content.close()
+
+
+async def _spool(chunks: AsyncIterator[bytes]) -> Tuple[tempfile.SpooledTemporaryFile, int]:
+    spool = tempfile.SpooledTemporaryFile(
+        max_size=config.upload_spool_threshold,
+        dir=config.upload_spool_dir,
+    )
+    size = 0
+    try:
+        async for chunk in chunks:
+            if spool._rolled:
+                await asyncio.to_thread(spool.write, chunk)
+            else:
+                spool.write(chunk)
+            size += len(chunk)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool, size
+
+
+async def prepare_upload(
+    request: Request, tenant: str
+) -> Tuple[AsyncIterator[bytes], int]:
+    """
+    Return ``(content, content_length)`` for forwarding an upload body.
+
+    A spooled body must be passed to ``close_upload`` if it isn't sent.
+
+    Raises HTTPException(413) if the declared size is over the tenant limit
+    and UploadTooLarge if the body turns out to be larger while reading.
+    """
+    limit = max_upload_bytes(tenant)
+    declared = _declared_length(request)
+
+    if declared is not None and declared > limit:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {limit} bytes")
+
+    chunks = _limited(request.stream(), limit)
+
+    if declared is not None and declared <= config.upload_spool_threshold:
+        return chunks, declared
+
+    spool, size = await _spool(chunks)
+    return _SpooledBody(spool), size
+
+
+def _declared_length(request: Request) -> Optional[int]:
+    value = request.headers.get("content-length")
+    if value is None or not value.isdigit():
+        return None
+    return int(value)
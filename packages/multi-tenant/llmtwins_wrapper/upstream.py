@@ -0,0 +1,239 @@
+# llmtwins_wrapper/upstream.py
+"""
+Shared upstream HTTP client for LLMTwins
+
+One pooled httpx.AsyncClient is created for the lifetime of the app so
+proxied calls reuse keep-alive connections instead of paying a new
+TCP/TLS handshake per request.
+
+send_upstream() picks the node, honours its circuit breaker and retries
+idempotent requests with jittered backoff.
+"""
+
+import asyncio
+import logging
+import math
+import random
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+from balancer import upstreams
+from config import WrapperConfig, config
+from health import breakers
+
+logger = logging.getLogger(__name__)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def build_timeout(cfg: WrapperConfig) -> httpx.Timeout:
+    """Per-phase timeouts; read/write default to upstream_timeout"""
+    default = float(cfg.upstream_timeout)
+    return httpx.Timeout(
+        connect=cfg.upstream_connect_timeout,
+        read=cfg.upstream_read_timeout if cfg.upstream_read_timeout is not None else default,
+        write=cfg.upstream_write_timeout if cfg.upstream_write_timeout is not None else default,
+        pool=cfg.upstream_pool_timeout,
+    )
+
+
+def build_limits(cfg: WrapperConfig) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=cfg.upstream_max_connections,
+        max_keepalive_connections=cfg.upstream_max_keepalive,
+        keepalive_expiry=cfg.upstream_keepalive_expiry,
+    )
+
+
+def create_client(cfg: WrapperConfig, **kwargs) -> httpx.AsyncClient:
+    """Create the app-lifetime upstream client"""
+    http2 = cfg.upstream_http2
+    if http2 and not _http2_available():
+        logger.warning("UPSTREAM_HTTP2 requested but 'h2' is not installed, using HTTP/1.1")
+        http2 = False
+
+    return httpx.AsyncClient(
+        timeout=build_timeout(cfg),
+        limits=build_limits(cfg),
+        http2=http2,
+        **kwargs,
+    )
+
+
+def pool_stats(client: httpx.AsyncClient) -> Dict[str, int]:
+    """
+    Report connection pool saturation (in_use / idle / waiting).
+
+    httpx does not expose pool state publicly, so this reads the httpcore
+    pool defensively; unknown transports report zeros.
+    """
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    requests = list(getattr(pool, "_requests", []) or [])
+
+    idle = 0
+    in_use = 0
+    for conn in connections:
+        if conn.is_closed():
+            continue
+        if conn.is_idle():
+            idle += 1
+        else:
+            in_use += 1
+
+    waiting = sum(1 for req in requests if req.is_queued())
+
+    return {
+        "in_use": in_use,
+        "idle": idle,
+        "waiting": waiting,
+        "max_connections": getattr(pool, "_max_connections", 0) or 0,
+    }
+
+
+class UpstreamTrace:
+    """
+    httpx ``trace`` extension timing one upstream attempt.
+
+    - pool wait: until the first connection-level event (connect for a new
+      connection, sending headers on a reused one), reported to
+      ``on_pool_wait``
+    - ``upstream.connect`` / ``upstream.first_byte`` spans on ``trace``
+      (tracing.Trace): TCP/TLS connect, and request headers sent until the
+      response headers arrived
+    """
+
+    __slots__ = ("started", "on_pool_wait", "trace", "_marks")
+
+    def __init__(self, on_pool_wait: Optional[Callable[[float], None]] = None, trace=None):
+        self.started = time.perf_counter()
+        self.on_pool_wait = on_pool_wait
+        self.trace = trace
+        self._marks: Dict[str, float] = {}
+
+    async def __call__(self, event: str, info: dict) -> None:
+        now = time.perf_counter()
+        if self.on_pool_wait is not None and event.endswith(".started"):
+            callback, self.on_pool_wait = self.on_pool_wait, None
+            callback(now - self.started)
+        if self.trace is None:
+            return
+        marks = self._marks
+        if event == "connection.connect_tcp.started":
+            marks["connect"] = now
+        elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            marks["connected"] = now
+            marks["tls"] = event == "connection.start_tls.complete"
+        elif event in ("connection.connect_tcp.failed", "connection.start_tls.failed"):
+            if "connect" in marks:
+                self.trace.add("upstream.connect", marks["connect"], now, error=event)
+        elif event.endswith(".send_request_headers.started"):
+            # Connection setup is over (TLS or not) once the request goes out
+            if "connected" in marks:
+                self.trace.add("upstream.connect", marks["connect"], marks["connected"],
+                               tls=marks["tls"])
+            marks["sent"] = now
+        elif event.endswith(".receive_response_headers.complete") and "sent" in marks:
+            self.trace.add("upstream.first_byte", marks["sent"], now)
+
+
+# Safe to resend: no side effects beyond the first successful attempt
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+RETRY_STATUSES = frozenset((502, 503, 504))
+
+
+async def _backoff(attempt: int) -> None:
+    """Full-jitter exponential backoff"""
+    ceiling = min(config.upstream_retry_backoff_max, config.upstream_retry_backoff * 2 ** attempt)
+    await asyncio.sleep(random.uniform(0, ceiling))
+
+
+async def send_upstream(
+    client: httpx.AsyncClient,
+    method: str,
+    path: str,
+    *,
+    params=None,
+    content=None,
+    headers=None,
+    session_id: Optional[str] = None,
+    on_pool_wait: Optional[Callable[[float], None]] = None,
+    trace=None,
+) -> Tuple[httpx.Response, str]:
+    """
+    Send a request to an LLMTwins node and return ``(response, base_url)``.
+
+    The response is opened in streaming mode; the caller must close it and
+    call ``upstreams.release(base_url)`` when done. Fails fast with 503 when
+    the node's circuit is open, with 502 when the node can't be reached, and
+    with 504 when it times out.
+    Idempotent requests with a replayable body are retried on connection
+    errors and 502/503/504. ``on_pool_wait`` receives each attempt's wait
+    for a pool connection, in seconds; a sampled ``trace`` (tracing.Trace)
+    gets each attempt's connect/first-byte spans.
+    """
+    replayable = content is None or isinstance(content, bytes)
+    attempts = 1
+    if method in IDEMPOTENT_METHODS and replayable:
+        attempts += config.upstream_retries
+
+    for attempt in range(attempts):
+        base_url = upstreams.acquire(session_id, available=breakers.available)
+        breaker = breakers.get(base_url)
+        if not breaker.allow():
+            upstreams.release(base_url)
+            raise HTTPException(
+                status_code=503,
+                detail="Upstream unavailable",
+                headers={"Retry-After": str(max(1, math.ceil(breaker.retry_after())))},
+            )
+
+        request = client.build_request(
+            method, f"{base_url}{path}", params=params, content=content, headers=headers,
+            extensions=(
+                {"trace": UpstreamTrace(on_pool_wait, trace)}
+                if on_pool_wait is not None or trace is not None else None
+            ),
+        )
+        last = attempt + 1 == attempts
+        try:
+            response = await client.send(request, stream=True)
+        except httpx.TransportError as e:
+            breaker.record_failure()
+            upstreams.release(base_url)
+            if not last:
+                logger.warning(f"Retrying {method} {path} after {type(e).__name__}")
+                await _backoff(attempt)
+                continue
+            # A stalled node (504) and an unreachable one (502) look different to clients
+            if isinstance(e, httpx.TimeoutException):
+                raise HTTPException(status_code=504, detail=f"Upstream timeout: {type(e).__name__}")
+            raise HTTPException(status_code=502, detail=f"Upstream error: {type(e).__name__}")
+        except BaseException:
+            breaker.abandon()
+            upstreams.release(base_url)
+            raise
+
+        if response.status_code not in RETRY_STATUSES:
+            breaker.record_success()
+            return response, base_url
+
+        breaker.record_failure()
+        if last:
+            return response, base_url
+
+        await response.aclose()
+        upstreams.release(base_url)
+        logger.warning(f"Retrying {method} {path} after HTTP {response.status_code}")
+        await _backoff(attempt)
+
+    raise AssertionError("unreachable")